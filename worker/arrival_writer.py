@@ -0,0 +1,186 @@
+import configparser
+import logging
+import os.path as path
+import queue
+import threading
+import time
+
+from django import db
+
+import how_late_is_muni.settings as settings
+from worker.libs import arrival, metrics
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+FLUSH_SECONDS = metrics.get_registry().histogram(
+    'muni_arrival_writer_flush_seconds',
+    'Seconds taken to save a batch of arrivals to the database')
+
+class ArrivalWriter(threading.Thread):
+    """Class to save arrivals to the database from a dedicated thread, so that the time it takes to
+    save arrivals does not delay getting predictions.
+
+    Arrivals from all routes are added to a bounded queue, and saved to the database in batches when
+    either the batch size is reached or the flush interval has elapsed since the first arrival in
+    the batch was queued.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='arrival writer')
+
+        self.running = False
+
+        self.duplicate_arrival_threshold = int(config.get('worker', 'duplicate_arrival_threshold'))
+        self.batch_size = int(config.get('worker', 'arrival_batch_size'))
+        self.flush_seconds = float(config.get('worker', 'arrival_flush_seconds'))
+
+        self.queue = queue.Queue(maxsize=int(config.get('worker', 'arrival_queue_size')))
+
+        self.stats_lock = threading.Lock()
+        self.queued_arrivals = 0
+        self.dropped_arrivals = 0
+        self.saved_arrivals = 0
+        self.failed_arrivals = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0
+        self.max_flush_seconds = 0
+
+    def get_stats(self):
+        """Get statistics about the arrivals that have been queued and saved.
+
+        Returns:
+            Dictionary with the following keys:
+                queue_depth: Integer, number of arrivals currently waiting to be saved.
+                queued_arrivals: Integer, total number of arrivals that have been queued.
+                dropped_arrivals: Integer, total number of arrivals that could not be queued
+                    because the queue was full.
+                saved_arrivals: Integer, total number of arrivals that have been saved.
+                failed_arrivals: Integer, total number of arrivals that could not be saved due to
+                    an error.
+                flushes: Integer, total number of batches that have been saved.
+                last_flush_seconds: Float, number of seconds it took to save the most recent batch.
+                max_flush_seconds: Float, longest number of seconds it took to save a batch.
+        """
+
+        with self.stats_lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queued_arrivals': self.queued_arrivals,
+                'dropped_arrivals': self.dropped_arrivals,
+                'saved_arrivals': self.saved_arrivals,
+                'failed_arrivals': self.failed_arrivals,
+                'flushes': self.flushes,
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds
+            }
+
+    def put(self, arrivals):
+        """Queue arrivals to be saved to the database. This never blocks; if the queue is full, the
+        arrivals that do not fit are dropped.
+
+        Arguments:
+            arrivals: (List of dictionaries) The arrivals to save, in the format accepted by
+                worker.libs.arrival.bulk_save_arrivals.
+        """
+
+        for arrival_row in arrivals:
+            try:
+                self.queue.put_nowait(arrival_row)
+            except queue.Full:
+                LOG.error('Arrival queue is full, dropping arrival %s', arrival_row)
+                with self.stats_lock:
+                    self.dropped_arrivals += 1
+            else:
+                with self.stats_lock:
+                    self.queued_arrivals += 1
+
+    def run(self):
+        """Run the writer, which saves batches of queued arrivals until the writer is stopped."""
+
+        self.running = True
+
+        while self.running:
+            batch = self.get_batch()
+            if batch:
+                self.flush(batch)
+
+        LOG.info('Stopping arrival writer')
+
+    def get_batch(self):
+        """Get a batch of arrivals from the queue, waiting until either the batch size is reached
+        or the flush interval has elapsed since the first arrival in the batch was received.
+
+        Returns:
+            List of the arrivals in the batch, which is empty if no arrivals were queued within the
+            flush interval.
+        """
+
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+            # Start the flush interval from the first arrival in the batch
+            if len(batch) == 1:
+                deadline = time.monotonic() + self.flush_seconds
+
+        return batch
+
+    def flush(self, batch):
+        """Save a batch of arrivals to the database.
+
+        Arguments:
+            batch: (List of dictionaries) The arrivals to save.
+        """
+
+        start_time = time.monotonic()
+        try:
+            arrival.bulk_save_arrivals(arrivals=batch,
+                                       duplicate_arrival_threshold=self.duplicate_arrival_threshold)
+        except Exception:
+            LOG.exception('Failed to save %d arrivals due to exception', len(batch))
+            with self.stats_lock:
+                self.failed_arrivals += len(batch)
+
+            # Discard the connection if it is no longer usable, so that the next batch is saved
+            # with a new connection
+            db.close_old_connections()
+            return
+
+        flush_seconds = time.monotonic() - start_time
+        FLUSH_SECONDS.observe(flush_seconds)
+        LOG.debug('Saved %d arrivals in %.3f seconds', len(batch), flush_seconds)
+
+        with self.stats_lock:
+            self.saved_arrivals += len(batch)
+            self.flushes += 1
+            self.last_flush_seconds = flush_seconds
+            self.max_flush_seconds = max(self.max_flush_seconds, flush_seconds)
+
+    def stop(self):
+        """Stop the writer, and save any arrivals that are still queued."""
+
+        self.running = False
+        if self.is_alive():
+            self.join()
+
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if batch:
+            LOG.info('Saving %d queued arrivals before stopping', len(batch))
+            self.flush(batch)
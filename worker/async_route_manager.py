@@ -0,0 +1,344 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import datetime
+import logging
+import os.path as path
+import time
+
+import how_late_is_muni.settings as settings
+from worker.libs import schedule_cache, utils
+from worker.prediction_fetcher import PredictionFetcher
+from worker.route_manager import RouteManager, get_next_switch_time, get_start_delay
+from worker.route_worker import get_next_poll_time
+
+LOG = logging.getLogger()
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class AsyncRouteManager(RouteManager):
+    """Route manager that polls every active route from a single asyncio event loop, instead of
+    running a thread for each route.
+
+    Requests to NextBus are made from a bounded pool of threads, so that only a limited number of
+    requests are in progress at a time. Arrivals are saved by the arrival writer's thread, and all
+    other database access happens in a single dedicated thread, so that the whole agency only uses
+    two database connections.
+
+    If batch_predictions is enabled in the config, the predictions for all routes are retrieved
+    together by a PredictionFetcher in as few requests as possible, instead of making a separate
+    request for each route, while each route keeps its own circuit breaker and poll interval.
+    """
+
+    # Workers are polled as soon as they are started, so their schedules must already be loaded
+    load_new_schedules = True
+
+    def __init__(self):
+        self.max_concurrent_requests = int(config.get('worker', 'max_concurrent_requests'))
+        self.batch_predictions = config.getboolean('worker', 'batch_predictions')
+
+        # Arrivals determined from the locations of vehicles need a separate request for each route
+        if self.batch_predictions and \
+                config.get('worker', 'arrival_detection') == 'vehicle_location':
+            LOG.warning('Not batching predictions, since arrivals are determined from the '
+                        'locations of vehicles')
+            self.batch_predictions = False
+
+        self.loop = asyncio.get_event_loop()
+        self.request_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests,
+                                                   thread_name_prefix='request')
+        self.database_executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='database')
+        self.request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self.tasks = []
+        self.route_tasks = {}
+        self.preload_future = None
+
+        self.prediction_fetcher = PredictionFetcher(agency=config.get('nextbus', 'agency'))
+
+        super().__init__()
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.run_async())
+        finally:
+            self.stop_workers()
+            if self.checkpointer is not None:
+                self.checkpointer.stop()
+            self.arrival_writer.stop()
+            if self.prediction_recorder is not None:
+                self.prediction_recorder.stop()
+            self.request_executor.shutdown()
+            self.database_executor.shutdown()
+
+    async def run_async(self):
+        """Run the manager's main loop, which switches the day when required while the routes are
+        being polled by the tasks started for each worker."""
+
+        current_day = datetime.date.today()
+        preload_date = None
+
+        while True:
+            switch_time = get_next_switch_time(current_day=current_day,
+                                               day_switch_time=self.day_switch_time)
+            if preload_date != switch_time.date() and \
+                    (switch_time - datetime.datetime.now()).total_seconds() <= self.preload_seconds:
+                self.preload(service_class=utils.get_service_class(switch_time))
+                preload_date = switch_time.date()
+
+            new_day = datetime.date.today()
+            if new_day != current_day:
+                day_time = utils.get_seconds_since_midnight()
+                if day_time > self.day_switch_time:
+                    await self.switch_day_async(previous_service_class=self.service_class)
+                    current_day = new_day
+
+            self.log_stats()
+
+            await asyncio.sleep(60)
+
+    def start_workers(self, workers):
+        """Schedule a task in the event loop to poll each of the workers that were created for the
+        current day, or restart the task that polls all of the workers together if predictions are
+        being batched.
+
+        Arguments:
+            workers: (List) Instances of RouteWorker that have had their schedules loaded, and are
+                not being polled yet.
+        """
+
+        if self.batch_predictions:
+            for task in self.tasks:
+                task.cancel()
+
+            # The task polling all of the workers was cancelled, so the new schedules can be
+            # switched to immediately, and the stops of all routes split into chunks again
+            for worker in self.workers:
+                worker.apply_pending_schedule()
+
+            self.prediction_fetcher.set_routes({worker.route.tag: worker.stop_tags
+                                                for worker in self.workers})
+            self.tasks = [self.loop.create_task(self.poll_all_routes(self.workers))]
+        else:
+            for index, worker in enumerate(workers):
+                LOG.info('Starting polling for route %s', worker.route.tag)
+                worker.start_delay = get_start_delay(index=index,
+                                                     count=len(workers),
+                                                     interval=self.update_frequency)
+                self.route_tasks[worker.route.tag] = self.loop.create_task(self.poll_route(worker))
+
+            self.tasks = list(self.route_tasks.values())
+
+    def stop_workers(self, workers=None):
+        """Stop the tasks polling workers.
+
+        Arguments:
+            workers: (List) Instances of RouteWorker to stop. If this is None, every worker is
+                stopped.
+        """
+
+        if workers is None:
+            LOG.info('Stopping all workers')
+            workers = self.workers
+
+        for worker in workers:
+            worker.running = False
+
+            if self.poll_scheduler is not None:
+                self.poll_scheduler.remove_route(worker.route.tag)
+
+            task = self.route_tasks.pop(worker.route.tag, None)
+            if task is not None:
+                task.cancel()
+
+            worker.remove_metrics()
+
+        if workers is self.workers:
+            for task in self.tasks:
+                task.cancel()
+
+            self.tasks = []
+        elif not self.batch_predictions:
+            self.tasks = list(self.route_tasks.values())
+
+    def preload(self, service_class):
+        """Prepare the next day in the database executor, so that the event loop keeps polling
+        routes while the schedules for the next day are loaded.
+
+        Arguments:
+            service_class: (String) The service class of the next day.
+        """
+
+        self.preloaded_day = None
+        self.preload_future = self.loop.run_in_executor(self.database_executor,
+                                                        self.get_next_day,
+                                                        service_class,
+                                                        True)
+
+    async def switch_day_async(self, previous_service_class):
+        """Switch to a new day from within the event loop. The database and NextBus API are only
+        accessed from the executors, so that routes continue to be polled until the workers are
+        switched to the new day.
+
+        Arguments:
+            previous_service_class: (String) The service class of the previous day, which is being
+                switched away from. Either "wkd", "sat", or "sun".
+        """
+
+        LOG.info('Switching day')
+
+        service_class = utils.get_current_service_class()
+
+        next_day = None
+        if self.preload_future is not None:
+            try:
+                next_day = await self.preload_future
+            except Exception:
+                LOG.exception('Failed to preload schedules for service class %s', service_class)
+            self.preload_future = None
+
+        if next_day is None or next_day['service_class'] != service_class:
+            next_day = await self.loop.run_in_executor(self.database_executor,
+                                                       self.get_next_day,
+                                                       service_class,
+                                                       True)
+
+        self.service_class = service_class
+        self.active_routes = next_day['routes']
+        self.update_workers(next_day)
+        schedule_cache.get_schedule_cache().retain(service_class=self.service_class)
+
+    async def poll_route(self, worker):
+        """Repeatedly get predictions for a single route, and save any arrivals that are found,
+        using the same steps as RouteWorker.run.
+
+        Arguments:
+            worker: Instance of RouteWorker for the route, which has had its schedule loaded.
+        """
+
+        worker.running = True
+
+        poll_time = time.monotonic() + worker.start_delay
+        while worker.running:
+            await asyncio.sleep(max(0, poll_time - time.monotonic()))
+
+            worker.apply_pending_schedule()
+            async with self.request_semaphore:
+                predictions = await self.loop.run_in_executor(self.request_executor,
+                                                              worker.fetch_predictions)
+
+            if predictions is None:
+                poll_time = get_next_poll_time(poll_time=poll_time,
+                                               interval=worker.get_retry_interval())
+                continue
+
+            if worker.vehicle_location_detector is not None:
+                worker.save_vehicle_arrivals(timed_arrivals=predictions)
+            else:
+                arrivals = worker.update_predictions(predictions=predictions,
+                                                     retrieve_time=time.time())
+                if arrivals:
+                    worker.save_arrivals(arrivals=arrivals,
+                                         arrival_time=worker.current_retrieve_time,
+                                         scheduled_arrival_index=worker.scheduled_arrival_index)
+
+            poll_time = get_next_poll_time(poll_time=poll_time,
+                                           interval=worker.get_poll_interval(predictions))
+
+        LOG.info('Stopping polling for route %s', worker.route.tag)
+
+    async def poll_all_routes(self, workers):
+        """Repeatedly get predictions for all routes together using the prediction fetcher, and save
+        any arrivals that are found for each route.
+
+        Each route is handled with the same steps as the poll_route method: only the chunks of stops
+        with a route that is due to be polled, and whose circuit breaker allows a request, are
+        requested, a chunk that could not be retrieved counts as a failure of each of its routes,
+        so that their breakers open and their retry intervals back off, and each worker records its
+        own predictions and chooses when its route is polled next. Polling continues until every
+        worker has been stopped.
+
+        Arguments:
+            workers: (List) Instances of RouteWorker for each route, which have had their schedules
+                loaded.
+        """
+
+        poll_times = {}
+        for worker in workers:
+            worker.running = True
+            poll_times[worker.route.tag] = time.monotonic()
+
+        while True:
+            workers = [worker for worker in workers if worker.running]
+            if not workers:
+                break
+
+            await asyncio.sleep(max(0, min(poll_times[worker.route.tag] for worker in workers) -
+                                    time.monotonic()))
+
+            now = time.monotonic()
+            routes_changed = False
+            polled_workers = {}
+            for worker in workers:
+                route_tag = worker.route.tag
+                if not worker.running or poll_times[route_tag] > now:
+                    continue
+
+                stop_tags = worker.stop_tags
+                worker.apply_pending_schedule()
+                routes_changed = routes_changed or worker.stop_tags != stop_tags
+
+                if worker.circuit_breaker.allow_request():
+                    polled_workers[route_tag] = worker
+                else:
+                    LOG.debug('Not getting predictions for route %s, circuit breaker is open',
+                              route_tag)
+                    poll_times[route_tag] = get_next_poll_time(
+                        poll_time=poll_times[route_tag], interval=worker.get_retry_interval())
+
+            if routes_changed:
+                self.prediction_fetcher.set_routes({worker.route.tag: worker.stop_tags
+                                                    for worker in workers})
+
+            requested_chunks = [index for index, route_tags
+                                in enumerate(self.prediction_fetcher.chunk_route_tags)
+                                if not route_tags.isdisjoint(polled_workers)]
+            results = await asyncio.gather(
+                *[self.loop.run_in_executor(self.request_executor,
+                                            self.prediction_fetcher.get_chunk_predictions,
+                                            self.prediction_fetcher.chunks[index])
+                  for index in requested_chunks],
+                return_exceptions=True)
+            retrieve_time = time.time()
+
+            chunk_predictions = [None] * len(self.prediction_fetcher.chunks)
+            for index, result in zip(requested_chunks, results):
+                chunk_predictions[index] = result
+
+            route_responses, route_errors = \
+                self.prediction_fetcher.get_route_responses(chunk_predictions)
+
+            for route_tag, worker in polled_workers.items():
+                if route_tag in route_errors:
+                    worker.record_fetch_failure(route_errors[route_tag])
+                    poll_times[route_tag] = get_next_poll_time(
+                        poll_time=poll_times[route_tag], interval=worker.get_retry_interval())
+                    continue
+
+                worker.record_fetch_success()
+                predictions = worker.parse_response(
+                    response=route_responses.get(route_tag, {'predictions': []}),
+                    retrieve_time=retrieve_time)
+
+                arrivals = worker.update_predictions(predictions=predictions,
+                                                     retrieve_time=retrieve_time)
+                if arrivals:
+                    worker.save_arrivals(arrivals=arrivals,
+                                         arrival_time=worker.current_retrieve_time,
+                                         scheduled_arrival_index=worker.scheduled_arrival_index)
+
+                poll_times[route_tag] = get_next_poll_time(
+                    poll_time=poll_times[route_tag], interval=worker.get_poll_interval(predictions))
+
+        LOG.info('Stopping polling for all routes')
@@ -0,0 +1,372 @@
+import configparser
+import datetime
+import logging
+import os.path as path
+
+from django.db import transaction
+
+import how_late_is_muni.settings as settings
+from worker.libs import benchmark, nextbus, prediction, prediction_snapshot, schedule, \
+    schedule_cache
+from worker.libs.fake_agency import AgencyTransport, FakeAgency
+from worker.models import Route
+from worker.route_worker import ARRIVAL_THRESHOLD, RouteWorker
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+# Names of the benchmarks, in the order they are run
+BENCHMARKS = (
+    'update_schedule_for_route',
+    'get_scheduled_arrivals',
+    'get_predictions',
+    'format_predictions',
+    'parse_predictions_snapshot',
+    'get_arrivals',
+    'get_arrivals_snapshot',
+    'match_arrivals',
+    'save_arrivals'
+)
+
+# Names of the fixture sizes, from a single small route to an agency the size of the one in the
+# [fake_nextbus] section of the config
+SIZES = ('small', 'route', 'large_route', 'agency')
+
+# Number of stops in each direction and number of vehicles of the route used by the "large_route"
+# size, which is about the size of the largest Muni routes, such as the 38 Geary
+LARGE_ROUTE_STOPS_PER_DIRECTION = 70
+LARGE_ROUTE_VEHICLES = 40
+
+# Service class of the schedules used by the benchmarks
+SERVICE_CLASS = 'wkd'
+
+# Number of seconds since midnight of the first predictions, and the number of predictions that are
+# retrieved for each route, every prediction_update_seconds
+START_SECONDS = 12 * 60 * 60
+TICKS = 20
+
+def get_agency(size):
+    """Get the synthetic agency used as the fixture for a size.
+
+    Arguments:
+        size: (String) Name of the size, one of SIZES.
+
+    Returns:
+        Instance of FakeAgency.
+    """
+
+    stops_per_direction = int(config.get('fake_nextbus', 'stops_per_direction'))
+    vehicles_per_route = int(config.get('fake_nextbus', 'vehicles_per_route'))
+    routes = 1
+    if size == 'small':
+        stops_per_direction = 10
+        vehicles_per_route = 2
+    elif size == 'large_route':
+        stops_per_direction = LARGE_ROUTE_STOPS_PER_DIRECTION
+        vehicles_per_route = LARGE_ROUTE_VEHICLES
+    elif size == 'agency':
+        routes = int(config.get('fake_nextbus', 'routes'))
+
+    return FakeAgency(routes=routes,
+                      stops_per_direction=stops_per_direction,
+                      vehicles_per_route=vehicles_per_route,
+                      seconds_between_stops=int(config.get('fake_nextbus',
+                                                           'seconds_between_stops')),
+                      max_delay_seconds=int(config.get('fake_nextbus', 'max_delay_seconds')),
+                      seed=int(config.get('fake_nextbus', 'seed')))
+
+def run_rolled_back(func):
+    """Get a function that runs a function inside of a transaction that is rolled back afterwards,
+    so that it can be run repeatedly with the same data in the database.
+
+    Arguments:
+        func: (Function) Function without arguments.
+
+    Returns:
+        Function without arguments.
+    """
+
+    def run():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+
+    return run
+
+class BenchmarkSuite(object):
+    """Class to time the hot paths of the worker against a synthetic agency.
+
+    Requests to NextBus are answered by the agency in the same process, and each response is only
+    generated once, so the benchmarks measure the worker instead of the agency. Benchmarks that
+    use the database add the routes and schedules of the agency, so they must be run inside of a
+    transaction that is rolled back, or against a scratch database.
+    """
+
+    def __init__(self, agency, size, repeat):
+        """
+        Arguments:
+            agency: (FakeAgency) The agency to use as the fixture.
+            size: (String) Name of the fixture size, used in the results.
+            repeat: (Integer) Number of times to time each benchmark.
+        """
+
+        self.agency = agency
+        self.size = size
+        self.repeat = repeat
+        self.update_frequency = int(config.get('worker', 'prediction_update_seconds'))
+
+        self.routes = []
+        self.workers = []
+
+        # Lists for each route of the "predictions" objects returned by NextBus at each tick, the
+        # same predictions in nested dictionaries, and the arrivals found between each pair of
+        # consecutive ticks
+        self.tick_responses = []
+        self.tick_predictions = []
+        self.tick_arrivals = []
+
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.midnight_timestamp = midnight.timestamp()
+
+    def get_tick_seconds(self, tick):
+        """Get the number of seconds since midnight that predictions are retrieved at a tick.
+
+        Arguments:
+            tick: (Integer) Index of the tick.
+
+        Returns:
+            Integer, the number of seconds.
+        """
+
+        return START_SECONDS + tick * self.update_frequency
+
+    def load_predictions(self):
+        """Generate the predictions for every tick, and find the arrivals between them. This must be
+        called after load_schedules."""
+
+        for route_tag in self.agency.route_tags:
+            stops = ['%s|%s' % (route_tag, stop['tag'])
+                     for stop in self.agency.get_route_config(route_tag)['route']['stop']]
+            responses = [self.agency.get_predictions_for_multi_stops(
+                stops, now=self.get_tick_seconds(tick))['predictions'] for tick in range(TICKS)]
+            self.tick_responses.append(responses)
+            self.tick_predictions.append([prediction.format_predictions(response)
+                                          for response in responses])
+
+        self.tick_arrivals = [
+            [worker.get_arrivals(current_predictions=predictions[tick],
+                                 current_predictions_retrieve_time=self.get_tick_seconds(tick),
+                                 previous_predictions=predictions[tick - 1],
+                                 previous_predictions_retrieve_time=self.get_tick_seconds(tick - 1))
+             for tick in range(1, TICKS)]
+            for worker, predictions in zip(self.workers, self.tick_predictions)
+        ]
+
+    def load_schedules(self):
+        """Add the routes and schedules of the agency to the database, and create a worker for each
+        route."""
+
+        for route_object in self.routes:
+            schedule.update_schedule_for_route(route_object)
+
+        self.workers = [RouteWorker(route_tag=route_object.tag,
+                                    agency='fake',
+                                    service_class=SERVICE_CLASS)
+                        for route_object in self.routes]
+        for worker in self.workers:
+            worker.load_schedule()
+
+    def benchmark_update_schedule_for_route(self):
+        """Time adding the schedules of every route to the database."""
+
+        def update_schedules():
+            for route_object in self.routes:
+                schedule.update_schedule_for_route(route_object)
+
+        schedules = [self.agency.get_schedule(route_tag) for route_tag in self.agency.route_tags]
+        items = sum(len(trip['stop'])
+                    for route_schedule in schedules
+                    for service_class_schedule in route_schedule['route']
+                    for trip in service_class_schedule['tr'])
+
+        return run_rolled_back(update_schedules), items
+
+    def benchmark_get_scheduled_arrivals(self):
+        """Time loading the scheduled arrivals of every route from the database."""
+
+        def get_scheduled_arrivals():
+            for worker in self.workers:
+                worker.get_scheduled_arrivals(service_class=SERVICE_CLASS)
+
+        items = sum(len(block_scheduled_arrivals)
+                    for worker in self.workers
+                    for blocks in worker.get_scheduled_arrivals(SERVICE_CLASS).values()
+                    for block_scheduled_arrivals in blocks.values())
+        return get_scheduled_arrivals, items
+
+    def benchmark_get_predictions(self):
+        """Time parsing the predictions for every stop of every route."""
+
+        def get_predictions():
+            for worker in self.workers:
+                worker.get_predictions(worker.stop_tags)
+
+        return get_predictions, sum(len(worker.stop_tags) for worker in self.workers)
+
+    def benchmark_get_arrivals(self):
+        """Time finding arrivals by comparing the nested dictionaries of consecutive predictions."""
+
+        def get_arrivals():
+            for worker, predictions in zip(self.workers, self.tick_predictions):
+                for tick in range(1, TICKS):
+                    worker.get_arrivals(
+                        current_predictions=predictions[tick],
+                        current_predictions_retrieve_time=self.get_tick_seconds(tick),
+                        previous_predictions=predictions[tick - 1],
+                        previous_predictions_retrieve_time=self.get_tick_seconds(tick - 1))
+
+        return get_arrivals, len(self.tick_predictions) * (TICKS - 1)
+
+    def benchmark_get_arrivals_snapshot(self):
+        """Time parsing the predictions into snapshots and finding arrivals by comparing them. The
+        sets used to compare snapshots are built while finding arrivals, so parsing is included,
+        and this should be compared to format_predictions and get_arrivals together."""
+
+        def get_arrivals():
+            for responses in self.tick_responses:
+                previous_snapshot = prediction_snapshot.parse_predictions(responses[0])
+                for tick in range(1, TICKS):
+                    current_snapshot = prediction_snapshot.parse_predictions(responses[tick])
+                    prediction_snapshot.get_arrivals(previous_snapshot=previous_snapshot,
+                                                     current_snapshot=current_snapshot,
+                                                     time_between_retrievals=self.update_frequency,
+                                                     arrival_threshold=ARRIVAL_THRESHOLD)
+                    previous_snapshot = current_snapshot
+
+        return get_arrivals, len(self.tick_responses) * (TICKS - 1)
+
+    def benchmark_format_predictions(self):
+        """Time parsing the predictions returned by NextBus into nested dictionaries."""
+
+        def format_predictions():
+            for responses in self.tick_responses:
+                for response in responses:
+                    prediction.format_predictions(response)
+
+        return format_predictions, len(self.tick_responses) * TICKS
+
+    def benchmark_parse_predictions_snapshot(self):
+        """Time parsing the predictions returned by NextBus directly into snapshots."""
+
+        def parse_predictions():
+            for responses in self.tick_responses:
+                for response in responses:
+                    prediction_snapshot.parse_predictions(response)
+
+        return parse_predictions, len(self.tick_responses) * TICKS
+
+    def benchmark_match_arrivals(self):
+        """Time matching the arrivals that were found to scheduled arrivals."""
+
+        def match_arrivals():
+            for worker, route_arrivals in zip(self.workers, self.tick_arrivals):
+                for tick, arrivals in enumerate(route_arrivals, 1):
+                    list(worker.scheduled_arrival_index.get_scheduled_arrivals_for_arrivals(
+                        arrivals=arrivals,
+                        arrival_time=self.get_tick_seconds(tick)))
+
+        return match_arrivals, self.get_arrival_count()
+
+    def benchmark_save_arrivals(self):
+        """Time matching and saving the arrivals that were found."""
+
+        def save_arrivals():
+            for worker, route_arrivals in zip(self.workers, self.tick_arrivals):
+                for tick, arrivals in enumerate(route_arrivals, 1):
+                    worker.save_arrivals(
+                        arrivals=arrivals,
+                        arrival_time=self.midnight_timestamp + self.get_tick_seconds(tick),
+                        scheduled_arrival_index=worker.scheduled_arrival_index)
+
+        return run_rolled_back(save_arrivals), self.get_arrival_count()
+
+    def get_arrival_count(self):
+        """Get the number of arrivals found between all of the ticks.
+
+        Returns:
+            Integer, the number of arrivals.
+        """
+
+        return sum(len(block_ids)
+                   for route_arrivals in self.tick_arrivals
+                   for arrivals in route_arrivals
+                   for block_ids in arrivals.values())
+
+    def run(self, names=BENCHMARKS):
+        """Run benchmarks.
+
+        Arguments:
+            names: (Iterable) Names of the benchmarks to run.
+
+        Returns:
+            List of dictionaries with the results of each benchmark, in the format returned by the
+            time_benchmark method.
+        """
+
+        previous_transport = nextbus.set_transport(benchmark.CachingTransport(
+            AgencyTransport(agency=self.agency, clock=lambda: START_SECONDS)))
+        schedule_cache.get_schedule_cache().invalidate()
+
+        try:
+            self.routes = [Route.objects.get_or_create(tag=route_tag,
+                                                       defaults={'title': route_tag})[0]
+                           for route_tag in self.agency.route_tags]
+
+            results = []
+
+            # Schedules can only be added once, so adding them is timed before they are loaded for
+            # the other benchmarks
+            if 'update_schedule_for_route' in names:
+                results.append(self.time_benchmark('update_schedule_for_route'))
+
+            self.load_schedules()
+            self.load_predictions()
+
+            for name in BENCHMARKS[1:]:
+                if name in names:
+                    results.append(self.time_benchmark(name))
+
+            return results
+        finally:
+            nextbus.set_transport(previous_transport)
+            schedule_cache.get_schedule_cache().invalidate()
+
+    def time_benchmark(self, name):
+        """Run a single benchmark.
+
+        Arguments:
+            name: (String) Name of the benchmark.
+
+        Returns:
+            Dictionary in the format returned by worker.libs.benchmark.time_call, with the following
+            keys added:
+                name: String, name of the benchmark.
+                size: String, name of the fixture size.
+                items: Integer, number of items processed by each call, such as stops or arrivals.
+                items_per_second: Float, number of items processed per second in the median call.
+        """
+
+        LOG.info('Running benchmark %s for size %s', name, self.size)
+
+        func, items = getattr(self, 'benchmark_%s' % name)()
+        result = benchmark.time_call(func, repeat=self.repeat)
+        result.update({
+            'name': name,
+            'size': self.size,
+            'items': items,
+            'items_per_second': items / result['median_seconds'] if result['median_seconds'] else 0
+        })
+
+        return result
@@ -0,0 +1,207 @@
+import configparser
+import logging
+import os.path as path
+import threading
+import time
+
+import how_late_is_muni.settings as settings
+from worker.libs import checkpoint
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class Checkpointer(threading.Thread):
+    """Class to periodically write the latest predictions and schedule of every route worker to a
+    checkpoint from a dedicated thread, so that a restarted worker can resume from them.
+
+    Workers put their state with the checkpointer after every retrieval of predictions, which only
+    keeps a reference to it, and the states are encoded and written by the checkpointer's thread
+    every interval_seconds, and once more when the checkpointer is stopped. Indexes of scheduled
+    arrivals are only encoded once for each schedule, since they do not change.
+    """
+
+    def __init__(self, checkpoint_path=None):
+        """
+        Arguments:
+            checkpoint_path: (String) Path of the checkpoint. If this is None, the path in the
+                config is used, relative to the base directory of the project if it is not
+                absolute.
+        """
+
+        threading.Thread.__init__(self, name='checkpointer', daemon=True)
+
+        if checkpoint_path is None:
+            checkpoint_path = path.join(settings.BASE_DIR, config.get('checkpoint', 'path'))
+        self.checkpoint_path = checkpoint_path
+
+        self.interval_seconds = float(config.get('checkpoint', 'interval_seconds'))
+        self.max_age_seconds = float(config.get('checkpoint', 'max_age_seconds'))
+
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        # Keyed by route tags, with the latest state put by the worker for each route as values
+        self.routes = {}
+
+        # Encoded states of the routes read from the checkpoint when the checkpointer was created,
+        # which have not been resumed from by a worker yet
+        self.restored_routes = {}
+
+        # Keyed by schedule keys, with the encoded index of scheduled arrivals for each schedule
+        self.scheduled_arrival_index_states = {}
+
+        self.stats_lock = threading.Lock()
+        self.checkpoints = 0
+        self.failed_checkpoints = 0
+        self.resumed_routes = 0
+
+    def get_stats(self):
+        """Get statistics about the checkpoints that have been written.
+
+        Returns:
+            Dictionary with the following keys:
+                routes: Integer, number of routes whose state will be written to the next
+                    checkpoint.
+                checkpoints: Integer, number of checkpoints that have been written.
+                failed_checkpoints: Integer, number of checkpoints that could not be written.
+                resumed_routes: Integer, number of routes that resumed from the checkpoint that was
+                    read when the checkpointer was created.
+        """
+
+        with self.lock:
+            routes = len(set(self.routes) | set(self.restored_routes))
+
+        with self.stats_lock:
+            return {
+                'routes': routes,
+                'checkpoints': self.checkpoints,
+                'failed_checkpoints': self.failed_checkpoints,
+                'resumed_routes': self.resumed_routes
+            }
+
+    def load(self):
+        """Read the states of the routes from the checkpoint, if it is recent enough, so that
+        workers can resume from them."""
+
+        restored_routes = checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=self.max_age_seconds)
+        with self.lock:
+            self.restored_routes = restored_routes
+
+        LOG.info('Read checkpoint with %d routes from %s', len(restored_routes),
+                 self.checkpoint_path)
+
+    def pop(self, route_tag, single_scheduled_arrival_threshold):
+        """Get the state of a route read from the checkpoint, so that its worker can resume from it.
+        The state of each route is only returned once.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            single_scheduled_arrival_threshold: (Integer) Threshold to create the index of scheduled
+                arrivals with.
+
+        Returns:
+            Dictionary in the format returned by worker.libs.checkpoint.decode_route, or None if
+            the checkpoint does not have a state for the route.
+        """
+
+        with self.lock:
+            state = self.restored_routes.pop(route_tag, None)
+
+        if state is None:
+            return None
+
+        try:
+            route_checkpoint = checkpoint.decode_route(
+                state=state,
+                single_scheduled_arrival_threshold=single_scheduled_arrival_threshold)
+        except (KeyError, TypeError, ValueError):
+            LOG.warning('Checkpoint for route %s is invalid, ignoring it', route_tag, exc_info=True)
+            return None
+
+        with self.stats_lock:
+            self.resumed_routes += 1
+
+        return route_checkpoint
+
+    def put(self, route_tag, route_checkpoint):
+        """Set the latest state of a route, to be written to the next checkpoint.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            route_checkpoint: (Dictionary) The state of the route, in the format returned by
+                RouteWorker.get_checkpoint, which must not be modified afterwards.
+        """
+
+        with self.lock:
+            self.routes[route_tag] = route_checkpoint
+
+    def run(self):
+        """Run the checkpointer, which writes a checkpoint every interval_seconds until the
+        checkpointer is stopped."""
+
+        while not self.stop_event.wait(self.interval_seconds):
+            self.write()
+
+        LOG.info('Stopping checkpointer')
+
+    def stop(self):
+        """Stop the checkpointer, and write a final checkpoint."""
+
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+        self.write()
+
+    def write(self):
+        """Write a checkpoint with the latest state of every route that is recent enough to resume
+        from. States that were read from the previous checkpoint, for routes whose workers have not
+        retrieved predictions yet, are written again, so that they are not lost if the worker is
+        restarted again straight away."""
+
+        now = time.time()
+        with self.lock:
+            routes = dict(self.routes)
+            restored_routes = dict(self.restored_routes)
+
+        encoded_routes = {}
+        index_states = {}
+        for route_tag, route_checkpoint in routes.items():
+            if now - route_checkpoint['retrieve_time'] > self.max_age_seconds:
+                continue
+
+            key = route_checkpoint['schedule_key']
+            index_state = self.scheduled_arrival_index_states.get(key)
+            if index_state is None:
+                index_state = route_checkpoint['scheduled_arrival_index'].get_state()
+            index_states[key] = index_state
+
+            encoded_routes[route_tag] = checkpoint.encode_route(
+                route_checkpoint=route_checkpoint,
+                scheduled_arrival_index_state=index_state)
+
+        for route_tag, state in restored_routes.items():
+            if route_tag not in encoded_routes and \
+                    now - state.get('retrieve_time', 0) <= self.max_age_seconds:
+                encoded_routes[route_tag] = state
+
+        # Indexes of schedules that are no longer used by any route are not kept
+        self.scheduled_arrival_index_states = index_states
+
+        try:
+            checkpoint.write_checkpoint(checkpoint_path=self.checkpoint_path,
+                                        routes=encoded_routes,
+                                        written_at=now)
+        except (OSError, TypeError, ValueError):
+            LOG.exception('Failed to write checkpoint to %s', self.checkpoint_path)
+            with self.stats_lock:
+                self.failed_checkpoints += 1
+            return
+
+        LOG.debug('Wrote checkpoint with %d routes in %.3f seconds', len(encoded_routes),
+                  time.time() - now)
+        with self.stats_lock:
+            self.checkpoints += 1
@@ -0,0 +1,188 @@
+import gzip
+import http.server
+import json
+import logging
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from worker.libs import fake_agency
+
+LOG = logging.getLogger(__name__)
+
+# Kinds of errors that the server can return instead of a response
+ERROR_HTTP = 'http'
+ERROR_RATE_LIMITED = 'rate_limited'
+ERROR_MESSAGE = 'message'
+ERROR_INVALID_JSON = 'invalid_json'
+ERROR_TIMEOUT = 'timeout'
+ERROR_KINDS = (ERROR_HTTP, ERROR_RATE_LIMITED, ERROR_MESSAGE, ERROR_INVALID_JSON, ERROR_TIMEOUT)
+
+class FakeNextBusHandler(http.server.BaseHTTPRequestHandler):
+    """Handles requests to the JSON feed of the fake NextBus server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """Respond to a request for a command of the NextBus API."""
+
+        server = self.server
+        server.record_request()
+
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+
+        if server.latency_seconds > 0:
+            time.sleep(server.latency_seconds * random.uniform(0.5, 1.5))
+
+        error_kind = server.choose_error()
+        if error_kind == ERROR_TIMEOUT:
+            time.sleep(server.timeout_seconds)
+        elif error_kind == ERROR_HTTP:
+            self.send_body(b'Service Unavailable', status=503, content_type='text/plain')
+            return
+        elif error_kind == ERROR_RATE_LIMITED:
+            self.send_json(fake_agency.get_error_response(
+                'Agency server cannot accept client while status is: agency name = %s,status = '
+                'exceeded limit' % server.agency_name, should_retry=True))
+            return
+        elif error_kind == ERROR_MESSAGE:
+            self.send_json(fake_agency.get_error_response('Internal error', should_retry=True))
+            return
+        elif error_kind == ERROR_INVALID_JSON:
+            self.send_body(b'{"predictions": [', status=200, content_type='application/json')
+            return
+
+        self.send_json(server.agency.get_response(
+            params=params,
+            now=fake_agency.get_service_day_seconds(time.time(), server.day_switch_time)))
+
+    def log_message(self, format, *args):
+        """Log requests at the debug level instead of writing them to stderr."""
+
+        LOG.debug('%s - %s', self.address_string(), format % args)
+
+    def send_body(self, body, status, content_type):
+        """Send a response, compressing it if the client accepts compressed responses.
+
+        Arguments:
+            body: (Bytes) The body of the response.
+            status: (Integer) HTTP status of the response.
+            content_type: (String) Content type of the body.
+        """
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            LOG.debug('Client disconnected before the response was sent')
+
+    def send_json(self, response):
+        """Send a response containing JSON.
+
+        Arguments:
+            response: (Dictionary) The JSON to send.
+        """
+
+        self.send_body(json.dumps(response).encode('utf-8'), status=200,
+                       content_type='application/json')
+
+class FakeNextBusServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server that responds to requests for the NextBus API with responses generated from a
+    FakeAgency, with configurable latency and errors, so that the worker can be tested without
+    making requests to NextBus. Each request is handled by a separate thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address, agency, agency_name='sf-muni', latency_seconds=0, error_rate=0,
+                 error_kinds=ERROR_KINDS, timeout_seconds=30, day_switch_time=11700):
+        """
+        Arguments:
+            address: (Tuple) Host and port to listen on. If the port is 0, any free port is used.
+            agency: (FakeAgency) The agency to generate responses from.
+            agency_name: (String) Name of the agency used in error messages.
+            latency_seconds: (Float) Average number of seconds to wait before responding to each
+                request. The actual wait varies between half and one and a half times this.
+            error_rate: (Float) Fraction of requests, between 0 and 1, that return an error instead
+                of a response.
+            error_kinds: (Iterable) Kinds of errors to return, chosen randomly for each error:
+                "http": An HTTP 503 status.
+                "rate_limited": The error NextBus returns when too many requests are made.
+                "message": Another error message that should be retried.
+                "invalid_json": A response that is not valid JSON.
+                "timeout": The response is delayed by timeout_seconds.
+            timeout_seconds: (Float) Number of seconds to delay responses by for "timeout" errors.
+            day_switch_time: (Integer) Number of seconds after midnight that the service day
+                changes.
+        """
+
+        super().__init__(address, FakeNextBusHandler)
+
+        self.agency = agency
+        self.agency_name = agency_name
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.error_kinds = list(error_kinds)
+        self.timeout_seconds = timeout_seconds
+        self.day_switch_time = day_switch_time
+
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = {error_kind: 0 for error_kind in ERROR_KINDS}
+
+    def choose_error(self):
+        """Choose whether a request should return an error.
+
+        Returns:
+            String with the kind of error to return, or None if the request should succeed.
+        """
+
+        if not self.error_kinds or random.random() >= self.error_rate:
+            return None
+
+        error_kind = random.choice(self.error_kinds)
+        with self.stats_lock:
+            self.errors[error_kind] += 1
+
+        return error_kind
+
+    def get_feed_url(self):
+        """Get the URL to set as the json_feed_url in the config to make requests to the server.
+
+        Returns:
+            String with the URL.
+        """
+
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/service/publicJSONFeed' % (host, port)
+
+    def get_stats(self):
+        """Get statistics about the requests the server has received.
+
+        Returns:
+            Dictionary with the following keys:
+                requests: Integer, total number of requests.
+                errors: Dictionary with the kinds of errors as keys and the number of requests that
+                    returned each kind of error as values.
+        """
+
+        with self.stats_lock:
+            return {
+                'requests': self.requests,
+                'errors': dict(self.errors)
+            }
+
+    def record_request(self):
+        """Count a request that was received."""
+
+        with self.stats_lock:
+            self.requests += 1
@@ -0,0 +1,83 @@
+"""Helper functions relating to arrivals."""
+
+import logging
+
+from django.db import connection
+from psycopg2.extras import execute_values
+
+LOG = logging.getLogger(__name__)
+
+# Inserts arrivals, or updates the most recent existing arrival for the same stop and scheduled
+# arrival if it is within the duplicate arrival threshold of the new arrival, in a single statement.
+# The threshold is substituted in before the statement is executed, so the placeholder for the
+# values of the arrivals is escaped.
+BULK_SAVE_ARRIVALS_SQL = """
+WITH new_arrival (stop_id, scheduled_arrival_id, time, difference) AS (
+    VALUES %%s
+),
+updated_arrival AS (
+    UPDATE arrival
+    SET time = new_arrival.time,
+        difference = new_arrival.difference
+    FROM new_arrival
+    WHERE arrival.id = (
+        SELECT existing_arrival.id
+        FROM arrival AS existing_arrival
+        WHERE existing_arrival.stop_id = new_arrival.stop_id
+            AND existing_arrival.scheduled_arrival_id = new_arrival.scheduled_arrival_id
+            AND existing_arrival.time >= new_arrival.time - %d
+        ORDER BY existing_arrival.time DESC
+        LIMIT 1
+    )
+    RETURNING arrival.stop_id, arrival.scheduled_arrival_id
+)
+INSERT INTO arrival (stop_id, scheduled_arrival_id, time, difference)
+SELECT new_arrival.stop_id, new_arrival.scheduled_arrival_id, new_arrival.time,
+    new_arrival.difference
+FROM new_arrival
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM updated_arrival
+    WHERE updated_arrival.stop_id = new_arrival.stop_id
+        AND updated_arrival.scheduled_arrival_id = new_arrival.scheduled_arrival_id
+)
+ON CONFLICT (stop_id, scheduled_arrival_id, time) DO NOTHING
+"""
+
+def bulk_save_arrivals(arrivals, duplicate_arrival_threshold):
+    """Save multiple arrivals to the database in a single query. If there is already an arrival at
+    the same stop for the same scheduled arrival within the duplicate arrival threshold of an
+    arrival, the two arrivals are considered to be duplicates and the existing arrival is updated
+    with the new arrival's time and difference, instead of a new arrival being added.
+
+    Arguments:
+        arrivals: (List of dictionaries) The arrivals to save. Each dictionary must contain the
+            following keys:
+                stop_id: Integer, ID of the Stop the arrival occurred at.
+                scheduled_arrival_id: Integer, ID of the ScheduledArrival for the arrival.
+                time: Integer, Unix timestamp indicating when the arrival occurred.
+                difference: Integer, number of seconds between the arrival time and the scheduled
+                    arrival time.
+        duplicate_arrival_threshold: (Integer) Number of seconds to consider multiple arrivals at a
+            stop for the same scheduled arrival to be duplicates.
+    """
+
+    # Only one row can be inserted or updated for each combination of stop and scheduled arrival
+    unique_arrivals = {}
+    for arrival in arrivals:
+        unique_arrivals[(arrival['stop_id'], arrival['scheduled_arrival_id'])] = arrival
+
+    if not unique_arrivals:
+        return
+
+    values = [(arrival['stop_id'], arrival['scheduled_arrival_id'], arrival['time'],
+               arrival['difference'])
+              for arrival in unique_arrivals.values()]
+
+    LOG.debug('Saving %d arrivals', len(values))
+
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor,
+                       BULK_SAVE_ARRIVALS_SQL % int(duplicate_arrival_threshold),
+                       values,
+                       page_size=len(values))
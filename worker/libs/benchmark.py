@@ -0,0 +1,126 @@
+"""Helpers for timing the worker's hot paths and comparing the results of benchmark runs."""
+
+import statistics
+import threading
+import time
+
+def compare_results(baseline_results, results, threshold):
+    """Compare the results of a benchmark run to the results of an earlier run.
+
+    The fastest time of each benchmark is compared, since it is the least affected by other activity
+    on the machine.
+
+    Arguments:
+        baseline_results: (List of dictionaries) Results of the earlier run, in the format returned
+            by time_call with "name" and "size" keys added.
+        results: (List of dictionaries) Results of the new run, in the same format.
+        threshold: (Float) Fraction that a benchmark must be slower by to be a regression, eg, 0.2
+            for 20% slower.
+
+    Returns:
+        List of dictionaries for each benchmark in both runs, with the following keys:
+            name: String, name of the benchmark.
+            size: String, name of the fixture size.
+            baseline_seconds: Float, fastest time of the earlier run.
+            seconds: Float, fastest time of the new run.
+            change: Float, fraction that the new run is slower by, which is negative if it is
+                faster.
+            regression: Boolean, true if the new run is slower by more than the threshold.
+    """
+
+    baseline_times = {(result['name'], result['size']): result['min_seconds']
+                      for result in baseline_results}
+
+    comparisons = []
+    for result in results:
+        baseline_seconds = baseline_times.get((result['name'], result['size']))
+        if baseline_seconds is None:
+            continue
+
+        change = (result['min_seconds'] - baseline_seconds) / baseline_seconds \
+            if baseline_seconds > 0 else 0
+        comparisons.append({
+            'name': result['name'],
+            'size': result['size'],
+            'baseline_seconds': baseline_seconds,
+            'seconds': result['min_seconds'],
+            'change': change,
+            'regression': change > threshold
+        })
+
+    return comparisons
+
+def time_call(func, repeat, warmup=True):
+    """Time how long a function takes to run.
+
+    Arguments:
+        func: (Function) Function without arguments to time.
+        repeat: (Integer) Number of times to time the function.
+        warmup: (Boolean) Whether to run the function once before timing it, so that caches are
+            filled and the first call does not skew the results.
+
+    Returns:
+        Dictionary with the following keys:
+            repeat: Integer, number of times the function was timed.
+            min_seconds: Float, fastest time.
+            median_seconds: Float, median time.
+            mean_seconds: Float, mean time.
+            max_seconds: Float, slowest time.
+            stdev_seconds: Float, standard deviation of the times, or 0 if it was only timed once.
+    """
+
+    if warmup:
+        func()
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+
+    return {
+        'repeat': repeat,
+        'min_seconds': min(times),
+        'median_seconds': statistics.median(times),
+        'mean_seconds': statistics.mean(times),
+        'max_seconds': max(times),
+        'stdev_seconds': statistics.stdev(times) if len(times) > 1 else 0
+    }
+
+class CachingTransport(object):
+    """Transport for NextBusClient that returns the same response every time the same URL is
+    requested, so that generating or downloading responses is not included in benchmarks.
+    Instances are thread-safe."""
+
+    def __init__(self, transport):
+        """
+        Arguments:
+            transport: Object with a get method with the same signature as PooledTransport.get,
+                used to make the first request for each URL.
+        """
+
+        self.transport = transport
+        self.responses = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, use_compression=True):
+        """Get the response for a URL, making the request only if the URL has not been requested
+        before.
+
+        Arguments:
+            url: (String) The URL to make the request to.
+            use_compression: (Boolean) Passed to the wrapped transport.
+
+        Returns:
+            Bytes containing the body of the response.
+        """
+
+        with self.lock:
+            response = self.responses.get(url)
+
+        if response is None:
+            response = self.transport.get(url, use_compression=use_compression)
+            with self.lock:
+                self.responses[url] = response
+
+        return response
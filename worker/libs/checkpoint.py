@@ -0,0 +1,160 @@
+"""Checkpoints of the state of every route worker, so that the worker can resume from the last
+predictions and schedules of each route when it is restarted, instead of starting without
+predictions and loading every schedule from the database.
+
+A checkpoint is a single gzip compressed JSON document with the following keys:
+    version: Integer, the version of the format, which is CHECKPOINT_VERSION.
+    written_at: Float, Unix timestamp of when the checkpoint was written.
+    routes: Dictionary with route tags as keys and the state of the route, in the format returned
+        by encode_route, as values.
+
+Checkpoints are written to a temporary file that replaces the previous checkpoint once it has been
+completely written and synced to disk, so that a crash while writing leaves the previous checkpoint
+intact."""
+
+import gzip
+import json
+import logging
+import os
+import os.path as path
+import time
+
+from worker.libs import prediction_snapshot
+from worker.libs.scheduled_arrival_index import ScheduledArrivalIndex
+
+LOG = logging.getLogger(__name__)
+
+# Version of the format of checkpoints. Checkpoints with a different version are ignored.
+CHECKPOINT_VERSION = 1
+
+def decode_route(state, single_scheduled_arrival_threshold):
+    """Decode the state of a route read from a checkpoint.
+
+    Arguments:
+        state: (Dictionary) The state of the route, in the format returned by encode_route.
+        single_scheduled_arrival_threshold: (Integer) Threshold to create the index of scheduled
+            arrivals with.
+
+    Returns:
+        Dictionary with the following keys:
+            service_class: String, the service class of the schedule of the route.
+            schedule_key: Tuple, the key of the schedule in the schedule cache.
+            retrieve_time: Float, Unix timestamp of when the predictions were retrieved.
+            snapshot: PredictionSnapshot with the predictions.
+            scheduled_arrival_index: ScheduledArrivalIndex for the schedule.
+    """
+
+    route_id, service_class, names = state['schedule_key']
+
+    return {
+        'service_class': state['service_class'],
+        'schedule_key': (route_id, service_class, tuple(names)),
+        'retrieve_time': state['retrieve_time'],
+        'snapshot': prediction_snapshot.PredictionSnapshot.from_state(state['predictions']),
+        'scheduled_arrival_index': ScheduledArrivalIndex.from_state(
+            state=state['scheduled_arrival_index'],
+            single_scheduled_arrival_threshold=single_scheduled_arrival_threshold)
+    }
+
+def encode_route(route_checkpoint, scheduled_arrival_index_state=None):
+    """Encode the state of a route to be written to a checkpoint.
+
+    Arguments:
+        route_checkpoint: (Dictionary) The state of the route, in the format returned by
+            RouteWorker.get_checkpoint.
+        scheduled_arrival_index_state: (List) The state of the route's index of scheduled arrivals
+            returned by ScheduledArrivalIndex.get_state, if it was already encoded for another
+            checkpoint. If this is None, the index is encoded.
+
+    Returns:
+        Dictionary that can be encoded as JSON.
+    """
+
+    predictions = route_checkpoint['predictions']
+    if not isinstance(predictions, prediction_snapshot.PredictionSnapshot):
+        predictions = prediction_snapshot.get_snapshot(predictions)
+
+    if scheduled_arrival_index_state is None:
+        scheduled_arrival_index_state = route_checkpoint['scheduled_arrival_index'].get_state()
+
+    route_id, service_class, names = route_checkpoint['schedule_key']
+
+    return {
+        'service_class': route_checkpoint['service_class'],
+        'schedule_key': [route_id, service_class, list(names)],
+        'retrieve_time': route_checkpoint['retrieve_time'],
+        'predictions': predictions.get_state(),
+        'scheduled_arrival_index': scheduled_arrival_index_state
+    }
+
+def read_checkpoint(checkpoint_path, max_age_seconds, now=None):
+    """Read the states of the routes from a checkpoint, if it is recent enough to resume from.
+
+    Arguments:
+        checkpoint_path: (String) Path of the checkpoint.
+        max_age_seconds: (Float) Maximum number of seconds since the checkpoint was written.
+        now: (Float) The current Unix timestamp. If this is None, the current time is used.
+
+    Returns:
+        Dictionary with route tags as keys and the encoded state of each route as values, which is
+        empty if there is no checkpoint, or it is too old, from a different version, or corrupt.
+    """
+
+    if now is None:
+        now = time.time()
+
+    try:
+        with gzip.open(checkpoint_path, 'rb') as checkpoint_file:
+            checkpoint = json.loads(checkpoint_file.read().decode('utf-8'))
+    except FileNotFoundError:
+        return {}
+    except (EOFError, OSError, ValueError):
+        LOG.warning('Checkpoint %s is corrupt, ignoring it', checkpoint_path, exc_info=True)
+        return {}
+
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != CHECKPOINT_VERSION:
+        LOG.warning('Checkpoint %s has an unsupported version, ignoring it', checkpoint_path)
+        return {}
+
+    age_seconds = now - checkpoint.get('written_at', 0)
+    if age_seconds > max_age_seconds:
+        LOG.info('Checkpoint %s is %d seconds old, ignoring it', checkpoint_path, age_seconds)
+        return {}
+
+    return checkpoint.get('routes', {})
+
+def write_checkpoint(checkpoint_path, routes, written_at=None, compression_level=1):
+    """Write a checkpoint, replacing the previous checkpoint only once it is completely written.
+
+    Arguments:
+        checkpoint_path: (String) Path of the checkpoint.
+        routes: (Dictionary) Route tags as keys and the states of the routes, in the format returned
+            by encode_route, as values.
+        written_at: (Float) Unix timestamp of when the checkpoint was written. If this is None, the
+            current time is used.
+        compression_level: (Integer) Level of gzip compression to use.
+    """
+
+    if written_at is None:
+        written_at = time.time()
+
+    directory = path.dirname(checkpoint_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    data = json.dumps({
+        'version': CHECKPOINT_VERSION,
+        'written_at': written_at,
+        'routes': routes
+    }, separators=(',', ':')).encode('utf-8')
+
+    temporary_path = '%s.tmp' % checkpoint_path
+    with open(temporary_path, 'wb') as checkpoint_file:
+        with gzip.GzipFile(fileobj=checkpoint_file, mode='wb',
+                           compresslevel=compression_level) as gzip_file:
+            gzip_file.write(data)
+
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+    os.replace(temporary_path, checkpoint_path)
@@ -0,0 +1,525 @@
+"""Synthetic transit agency that generates responses in the same format as the NextBus API, used by
+the fake NextBus server to test the worker without making requests to NextBus.
+
+Every route has an inbound and an outbound direction with its own stops. Each vehicle on a route is
+identified by a block ID, and runs back and forth between the ends of the route for the whole
+service day, starting at a different point of the cycle from the other vehicles on the route. Each
+vehicle runs late by a fixed number of seconds, so predicted arrivals are later than scheduled
+arrivals. Schedules and predictions are both derived from the same model, so the arrivals found from
+the predictions can be matched to the scheduled arrivals.
+"""
+
+import json
+import math
+import random
+import time
+import urllib.parse
+
+# Seconds since midnight of the service day when vehicles start and stop running. Service ends after
+# midnight, in the early hours of the next day, like it does for Muni.
+SERVICE_START_SECONDS = 5 * 60 * 60
+SERVICE_END_SECONDS = 25 * 60 * 60
+
+SERVICE_CLASSES = ('wkd', 'sat', 'sun')
+DIRECTIONS = ('Outbound', 'Inbound')
+
+# Coordinates that the stops of the agency are placed around
+BASE_LATITUDE = 37.7
+BASE_LONGITUDE = -122.5
+
+def collapse_list(items):
+    """Return a list the same way NextBus returns arrays in JSON, where an array with a single item
+    is returned as just the item.
+
+    Arguments:
+        items: (List) The items.
+
+    Returns:
+        The single item if there is only one item, otherwise the list.
+    """
+
+    return items[0] if len(items) == 1 else items
+
+def get_error_response(message, should_retry):
+    """Get the response that NextBus returns when a request fails.
+
+    Arguments:
+        message: (String) The error message.
+        should_retry: (Boolean) Whether the request should be retried.
+
+    Returns:
+        Dictionary with the response.
+    """
+
+    return {
+        'Error': {
+            'content': message,
+            'shouldRetry': 'true' if should_retry else 'false'
+        }
+    }
+
+def format_time(seconds):
+    """Format a number of seconds since midnight as the time of a scheduled arrival is formatted in
+    schedules, where times after midnight that are part of the previous service day have the time of
+    day after midnight.
+
+    Arguments:
+        seconds: (Integer) Number of seconds since midnight of the service day.
+
+    Returns:
+        String with the time, eg, "13:05:00".
+    """
+
+    return '%02d:%02d:%02d' % (seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+
+class FakeAgency(object):
+    """Synthetic transit agency with a configurable number of routes, stops, and vehicles."""
+
+    def __init__(self, routes, stops_per_direction, vehicles_per_route, seconds_between_stops=90,
+                 max_delay_seconds=300, seed=0, schedule_class='fake'):
+        """
+        Arguments:
+            routes: (Integer) Number of routes.
+            stops_per_direction: (Integer) Number of stops in each direction of each route.
+            vehicles_per_route: (Integer) Number of vehicles running on each route.
+            seconds_between_stops: (Integer) Number of seconds it takes vehicles to go from one
+                stop to the next.
+            max_delay_seconds: (Integer) Maximum number of seconds that a vehicle runs late by.
+            seed: (Integer) Seed used to choose how late each vehicle runs, so that agencies
+                created with the same arguments are identical.
+            schedule_class: (String) Name of the schedule class of every schedule.
+        """
+
+        self.stops_per_direction = stops_per_direction
+        self.vehicles_per_route = vehicles_per_route
+        self.seconds_between_stops = seconds_between_stops
+        self.schedule_class = schedule_class
+
+        # Number of seconds for a vehicle to run in both directions and return to where it started
+        self.cycle_seconds = 2 * stops_per_direction * seconds_between_stops
+
+        self.route_tags = ['F%d' % route_index for route_index in range(1, routes + 1)]
+        self.route_indexes = {route_tag: route_index
+                              for route_index, route_tag in enumerate(self.route_tags)}
+
+        rng = random.Random(seed)
+        self.delays = [[rng.randint(0, max_delay_seconds) for _ in range(vehicles_per_route)]
+                       for _ in self.route_tags]
+
+    def get_block_id(self, route_index, vehicle):
+        """Get the block ID of a vehicle.
+
+        Arguments:
+            route_index: (Integer) Index of the route the vehicle runs on.
+            vehicle: (Integer) Index of the vehicle on the route.
+
+        Returns:
+            Integer, the block ID.
+        """
+
+        return (route_index + 1) * 100 + vehicle + 1
+
+    def get_stop(self, route_tag, stop_tag):
+        """Get the position of a stop on a route.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            stop_tag: (Integer) Tag of the stop.
+
+        Returns:
+            Tuple of the index of the route, index of the direction, and index of the stop in the
+            direction, or None if the stop is not on the route.
+        """
+
+        route_index = self.route_indexes.get(route_tag)
+        if route_index is None:
+            return None
+
+        stop_offset = stop_tag - self.get_stop_tag(route_index, 0, 0)
+        if not 0 <= stop_offset < 2 * self.stops_per_direction:
+            return None
+
+        return route_index, stop_offset // self.stops_per_direction, \
+            stop_offset % self.stops_per_direction
+
+    def get_stop_tag(self, route_index, direction_index, stop_index):
+        """Get the tag of a stop, which is unique across every route of the agency.
+
+        Arguments:
+            route_index: (Integer) Index of the route.
+            direction_index: (Integer) Index of the direction.
+            stop_index: (Integer) Index of the stop in the direction.
+
+        Returns:
+            Integer, the stop tag.
+        """
+
+        return 10000 + (route_index * 2 + direction_index) * self.stops_per_direction + stop_index
+
+    def get_trip_start(self, route_index, vehicle, trip):
+        """Get the scheduled time that a vehicle starts a trip.
+
+        Arguments:
+            route_index: (Integer) Index of the route.
+            vehicle: (Integer) Index of the vehicle on the route.
+            trip: (Integer) Number of the trip the vehicle is making, where even trips are in the
+                first direction and odd trips are in the second direction.
+
+        Returns:
+            Integer, number of seconds since midnight of the service day.
+        """
+
+        offset = vehicle * self.cycle_seconds // self.vehicles_per_route
+        return SERVICE_START_SECONDS + offset + trip * self.cycle_seconds // 2
+
+    def get_trip_tag(self, route_index, vehicle, trip):
+        """Get the tag of a trip, which is unique across every route of the agency.
+
+        Arguments:
+            route_index: (Integer) Index of the route.
+            vehicle: (Integer) Index of the vehicle on the route.
+            trip: (Integer) Number of the trip the vehicle is making.
+
+        Returns:
+            Integer, the trip tag.
+        """
+
+        return (self.get_block_id(route_index, vehicle) * 1000) + trip
+
+    def get_route_config(self, route_tag):
+        """Get the response for the "routeConfig" command.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+
+        Returns:
+            Dictionary with the response, or None if the route does not exist.
+        """
+
+        route_index = self.route_indexes.get(route_tag)
+        if route_index is None:
+            return None
+
+        stops = []
+        directions = []
+        for direction_index, direction in enumerate(DIRECTIONS):
+            direction_stops = []
+            for stop_index in range(self.stops_per_direction):
+                stop_tag = self.get_stop_tag(route_index, direction_index, stop_index)
+                stops.append({
+                    'tag': str(stop_tag),
+                    'title': 'Stop %d' % stop_tag,
+                    'lat': '%.7f' % (BASE_LATITUDE + route_index * 0.001),
+                    'lon': '%.7f' % (BASE_LONGITUDE + stop_tag % 1000 * 0.0005),
+                    'stopId': str(stop_tag)
+                })
+                direction_stops.append({'tag': str(stop_tag)})
+
+            directions.append({
+                'tag': '%s_%s' % (route_tag, direction[0]),
+                'title': direction,
+                'name': direction,
+                'stop': direction_stops
+            })
+
+        return {
+            'route': {
+                'tag': route_tag,
+                'title': '%s-Fake' % route_tag,
+                'stop': stops,
+                'direction': directions
+            }
+        }
+
+    def get_route_list(self):
+        """Get the response for the "routeList" command.
+
+        Returns:
+            Dictionary with the response.
+        """
+
+        return {
+            'route': collapse_list([{'tag': route_tag, 'title': '%s-Fake' % route_tag}
+                                    for route_tag in self.route_tags])
+        }
+
+    def get_schedule(self, route_tag):
+        """Get the response for the "schedule" command, with a schedule for each direction of each
+        service class.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+
+        Returns:
+            Dictionary with the response, or None if the route does not exist.
+        """
+
+        route_index = self.route_indexes.get(route_tag)
+        if route_index is None:
+            return None
+
+        schedules = []
+        for direction_index, direction in enumerate(DIRECTIONS):
+            stop_tags = [self.get_stop_tag(route_index, direction_index, stop_index)
+                         for stop_index in range(self.stops_per_direction)]
+
+            trips = []
+            for vehicle in range(self.vehicles_per_route):
+                trip = direction_index
+                while self.get_trip_start(route_index, vehicle, trip) < SERVICE_END_SECONDS:
+                    trip_start = self.get_trip_start(route_index, vehicle, trip)
+                    trips.append({
+                        'blockID': str(self.get_block_id(route_index, vehicle)),
+                        'tripTag': str(self.get_trip_tag(route_index, vehicle, trip)),
+                        'stop': [{
+                            'tag': str(stop_tag),
+                            'epochTime': str((trip_start + stop_index *
+                                              self.seconds_between_stops) * 1000),
+                            'content': format_time(trip_start + stop_index *
+                                                   self.seconds_between_stops)
+                        } for stop_index, stop_tag in enumerate(stop_tags)]
+                    })
+                    trip += 2
+
+            for service_class in SERVICE_CLASSES:
+                schedules.append({
+                    'tag': route_tag,
+                    'title': '%s-Fake' % route_tag,
+                    'scheduleClass': self.schedule_class,
+                    'serviceClass': service_class,
+                    'direction': direction,
+                    'header': {
+                        'stop': [{'tag': str(stop_tag), 'content': 'Stop %d' % stop_tag}
+                                 for stop_tag in stop_tags]
+                    },
+                    'tr': trips
+                })
+
+        return {'route': schedules}
+
+    def get_stop_predictions(self, route_tag, stop_tag, now, predictions_per_vehicle=2):
+        """Get the "predictions" object returned by the "predictionsForMultiStops" command for a
+        single stop.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            stop_tag: (Integer) Tag of the stop.
+            now: (Float) Number of seconds since midnight of the service day.
+            predictions_per_vehicle: (Integer) Number of upcoming arrivals of each vehicle at the
+                stop to predict.
+
+        Returns:
+            Dictionary with the predictions, or None if the stop is not on the route.
+        """
+
+        stop = self.get_stop(route_tag, stop_tag)
+        if stop is None:
+            return None
+
+        route_index, direction_index, stop_index = stop
+        stop_seconds = stop_index * self.seconds_between_stops
+
+        predictions = []
+        for vehicle in range(self.vehicles_per_route):
+            delay = self.delays[route_index][vehicle]
+
+            # Find the first trip in the direction of the stop that has not passed the stop yet
+            first_trip_start = self.get_trip_start(route_index, vehicle, direction_index)
+            cycles = max(0, math.ceil((now - first_trip_start - stop_seconds - delay) /
+                                      self.cycle_seconds))
+            trip = direction_index + 2 * cycles
+
+            for _ in range(predictions_per_vehicle):
+                trip_start = self.get_trip_start(route_index, vehicle, trip)
+                if trip_start >= SERVICE_END_SECONDS:
+                    break
+
+                seconds = int(trip_start + stop_seconds + delay - now)
+                predictions.append({
+                    'seconds': str(seconds),
+                    'minutes': str(seconds // 60),
+                    'epochTime': str(int((time.time() + seconds) * 1000)),
+                    'isDeparture': 'false',
+                    'block': str(self.get_block_id(route_index, vehicle)),
+                    'dirTag': '%s_%s' % (route_tag, DIRECTIONS[direction_index][0]),
+                    'tripTag': str(self.get_trip_tag(route_index, vehicle, trip)),
+                    'vehicle': str(self.get_block_id(route_index, vehicle))
+                })
+                trip += 2
+
+        response = {
+            'routeTag': route_tag,
+            'routeTitle': '%s-Fake' % route_tag,
+            'stopTag': str(stop_tag),
+            'stopTitle': 'Stop %d' % stop_tag
+        }
+
+        if predictions:
+            predictions.sort(key=lambda prediction: int(prediction['seconds']))
+            response['direction'] = {
+                'title': DIRECTIONS[direction_index],
+                'prediction': collapse_list(predictions)
+            }
+        else:
+            response['dirTitleBecauseNoPredictions'] = DIRECTIONS[direction_index]
+
+        return response
+
+    def get_predictions_for_multi_stops(self, stops, now):
+        """Get the response for the "predictionsForMultiStops" command.
+
+        Arguments:
+            stops: (List of strings) The stops to get predictions for, each formatted as the route
+                tag and stop tag separated by "|".
+            now: (Float) Number of seconds since midnight of the service day.
+
+        Returns:
+            Dictionary with the response.
+        """
+
+        predictions = []
+        for stop in stops:
+            route_tag, _, stop_tag = stop.partition('|')
+            try:
+                stop_predictions = self.get_stop_predictions(route_tag, int(stop_tag), now)
+            except ValueError:
+                stop_predictions = None
+
+            if stop_predictions is None:
+                return get_error_response('Invalid stop %s' % stop, should_retry=False)
+
+            predictions.append(stop_predictions)
+
+        return {'predictions': collapse_list(predictions)}
+
+    def get_vehicle_locations(self, route_tag, now):
+        """Get the response for the "vehicleLocations" command. Every vehicle that is running is
+        returned, since their locations change continuously.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            now: (Float) Number of seconds since midnight of the service day.
+
+        Returns:
+            Dictionary with the response, or None if the route does not exist.
+        """
+
+        route_index = self.route_indexes.get(route_tag)
+        if route_index is None:
+            return None
+
+        first_stop_tag = self.get_stop_tag(route_index, 0, 0)
+        vehicles = []
+        for vehicle in range(self.vehicles_per_route):
+            # Vehicles move between the consecutive stops of both directions at a constant speed,
+            # and wait at the last stop of the route until they start the next cycle
+            seconds = now - self.get_trip_start(route_index, vehicle, 0) - \
+                self.delays[route_index][vehicle]
+            if seconds < 0 or now >= SERVICE_END_SECONDS:
+                continue
+
+            stop_offset = min((seconds % self.cycle_seconds) / self.seconds_between_stops,
+                              2 * self.stops_per_direction - 1)
+            direction_index = int(stop_offset) // self.stops_per_direction
+
+            vehicles.append({
+                'id': str(self.get_block_id(route_index, vehicle)),
+                'routeTag': route_tag,
+                'dirTag': '%s_%s' % (route_tag, DIRECTIONS[direction_index][0]),
+                'lat': '%.7f' % (BASE_LATITUDE + route_index * 0.001),
+                'lon': '%.7f' % (BASE_LONGITUDE + (first_stop_tag + stop_offset) % 1000 * 0.0005),
+                'secsSinceReport': '0',
+                'predictable': 'true',
+                'heading': '90' if direction_index == 0 else '270',
+                'speedKmHr': '20'
+            })
+
+        response = {'lastTime': {'time': str(int(time.time() * 1000))}}
+        if vehicles:
+            response['vehicle'] = collapse_list(vehicles)
+
+        return response
+
+    def get_response(self, params, now):
+        """Get the response for a request to the JSON feed of the NextBus API.
+
+        Arguments:
+            params: (Dictionary) Query parameters of the request, with the parameter names as keys
+                and lists of the values of each parameter as values.
+            now: (Float) Number of seconds since midnight of the service day.
+
+        Returns:
+            Dictionary with the response, which is an error response if the command is not
+            supported or the route does not exist.
+        """
+
+        command = params.get('command', [None])[0]
+        route_tag = params.get('r', [None])[0]
+
+        if command == 'routeList':
+            response = self.get_route_list()
+        elif command == 'routeConfig':
+            response = self.get_route_config(route_tag)
+        elif command == 'schedule':
+            response = self.get_schedule(route_tag)
+        elif command == 'predictionsForMultiStops':
+            response = self.get_predictions_for_multi_stops(stops=params.get('stops', []), now=now)
+        elif command == 'vehicleLocations':
+            response = self.get_vehicle_locations(route_tag, now=now)
+        else:
+            return get_error_response('Command %s is not supported' % command, should_retry=False)
+
+        if response is None:
+            return get_error_response('Invalid route %s' % route_tag, should_retry=False)
+
+        return response
+
+class AgencyTransport(object):
+    """Transport for NextBusClient that responds to requests with responses from a FakeAgency in the
+    same process, without making HTTP requests."""
+
+    def __init__(self, agency, clock):
+        """
+        Arguments:
+            agency: (FakeAgency) The agency to get responses from.
+            clock: (Function) Function without arguments that returns the number of seconds since
+                midnight of the service day to get predictions for.
+        """
+
+        self.agency = agency
+        self.clock = clock
+
+    def get(self, url, use_compression=True):
+        """Get the response for a request.
+
+        Arguments:
+            url: (String) The URL of the request.
+            use_compression: (Boolean) Ignored, since responses are not sent over the network.
+
+        Returns:
+            Bytes containing the JSON of the response.
+        """
+
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        return json.dumps(self.agency.get_response(params, now=self.clock())).encode('utf-8')
+
+def get_service_day_seconds(timestamp, day_switch_time):
+    """Get the number of seconds since midnight of the service day that a time is part of, where
+    times before the day switch time are part of the previous service day.
+
+    Arguments:
+        timestamp: (Float) Unix timestamp.
+        day_switch_time: (Integer) Number of seconds after midnight that the service day changes.
+
+    Returns:
+        Float, the number of seconds, which is greater than a day for times after midnight that are
+        part of the previous service day.
+    """
+
+    local_time = time.localtime(timestamp)
+    seconds = local_time.tm_hour * 3600 + local_time.tm_min * 60 + local_time.tm_sec + \
+        timestamp % 1
+    if seconds < day_switch_time:
+        seconds += 24 * 60 * 60
+
+    return seconds
@@ -0,0 +1,222 @@
+"""Time-limited leases on routes stored in the database, so that worker processes on one or more
+hosts can each track a disjoint share of the routes, and take over the routes of a process that
+stops renewing its leases.
+
+Every lease is claimed and renewed with a single conditional UPDATE, so that two shards can never
+hold the same route, and all times are taken from the database's clock, so that the clocks of the
+hosts do not need to agree."""
+
+import logging
+import os
+import random
+import socket
+
+from django.db import connection
+from django.db.models import Q
+
+from worker.libs import utils
+from worker.models import RouteLease, Shard
+
+LOG = logging.getLogger(__name__)
+
+def claim_leases(shard_name, route_ids, count, now, lease_seconds):
+    """Claim leases on routes that are not leased, or whose lease has expired.
+
+    Arguments:
+        shard_name: (String) Name of the shard claiming the leases.
+        route_ids: (Iterable) IDs of the routes that can be claimed.
+        count: (Integer) Maximum number of leases to claim.
+        now: (Float) The current Unix timestamp in the database's clock.
+        lease_seconds: (Integer) Number of seconds until the claimed leases expire.
+
+    Returns:
+        Set of the IDs of the routes that were claimed.
+    """
+
+    route_ids = list(route_ids)
+    if count <= 0 or not route_ids:
+        return set()
+
+    utils.bulk_upsert(model=RouteLease,
+                      data=[{'route_id': route_id, 'shard': '', 'expires': 0}
+                            for route_id in route_ids],
+                      update_on_conflict=False,
+                      conflict_columns=['route_id'])
+
+    available = Q(shard='') | Q(expires__lte=now)
+    candidates = list(RouteLease.objects.filter(available, route_id__in=route_ids)
+                      .values_list('route_id', flat=True))
+
+    # Shards that claim routes at the same time try the routes in different orders, so that they
+    # rarely try to claim the same route
+    random.shuffle(candidates)
+
+    claimed = set()
+    for route_id in candidates:
+        if len(claimed) >= count:
+            break
+
+        # The lease is only claimed if no other shard claimed it since it was found to be available
+        if RouteLease.objects.filter(available, route_id=route_id)\
+                             .update(shard=shard_name, expires=int(now + lease_seconds)):
+            claimed.add(route_id)
+
+    return claimed
+
+def get_database_time():
+    """Get the current time from the database's clock.
+
+    Returns:
+        Float, the current Unix timestamp.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXTRACT(EPOCH FROM CLOCK_TIMESTAMP())')
+        return float(cursor.fetchone()[0])
+
+def get_default_shard_name():
+    """Get the name of the shard run by this process, when no name is configured.
+
+    Returns:
+        String with the host name and the ID of the process.
+    """
+
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+def get_fair_share(route_count, shard_names, shard_name):
+    """Get the number of routes a shard should hold leases on, so that the routes are split as
+    evenly as possible between the running shards. Routes that cannot be split evenly are given to
+    the shards that are first by name, so that the shares of all of the shards add up to the number
+    of routes.
+
+    Arguments:
+        route_count: (Integer) Number of routes to split between the shards.
+        shard_names: (Iterable) Names of the running shards, including shard_name.
+        shard_name: (String) Name of the shard to get the share of.
+
+    Returns:
+        Integer, the number of routes.
+    """
+
+    shard_names = sorted(shard_names)
+    share, remainder = divmod(route_count, len(shard_names))
+    if shard_names.index(shard_name) < remainder:
+        share += 1
+
+    return share
+
+def get_live_shards(now):
+    """Get the shards that are running.
+
+    Arguments:
+        now: (Float) The current Unix timestamp in the database's clock.
+
+    Returns:
+        List of the names of the shards whose heartbeat has not expired, sorted by name.
+    """
+
+    return list(Shard.objects.filter(expires__gt=now)
+                .order_by('name')
+                .values_list('name', flat=True))
+
+def get_other_shards_route_tags(shard_name, now):
+    """Get the routes leased by other shards that are running.
+
+    Arguments:
+        shard_name: (String) Name of the shard whose own leases are not included.
+        now: (Float) The current Unix timestamp in the database's clock.
+
+    Returns:
+        Set of the tags of the routes whose leases are held by other shards and have not expired.
+    """
+
+    return set(RouteLease.objects.filter(expires__gt=now)
+               .exclude(shard__in=['', shard_name])
+               .values_list('route__tag', flat=True))
+
+def release_leases(shard_name, route_ids=None):
+    """Release leases held by a shard, so that other shards can claim the routes immediately
+    instead of after the leases expire.
+
+    Arguments:
+        shard_name: (String) Name of the shard holding the leases.
+        route_ids: (Iterable) IDs of the routes to release. If this is None, every lease held by the
+            shard is released.
+
+    Returns:
+        Integer, the number of leases that were released.
+    """
+
+    leases = RouteLease.objects.filter(shard=shard_name)
+    if route_ids is not None:
+        leases = leases.filter(route_id__in=list(route_ids))
+
+    return leases.update(shard='', expires=0)
+
+def remove_shard(shard_name):
+    """Release every lease held by a shard and remove its heartbeat, when it stops running, so that
+    the other shards take over its routes without waiting for them to expire.
+
+    Arguments:
+        shard_name: (String) Name of the shard.
+    """
+
+    release_leases(shard_name)
+    Shard.objects.filter(name=shard_name).delete()
+
+def update_leases(shard_name, route_ids, lease_seconds):
+    """Renew the heartbeat and leases of a shard, and rebalance the routes between the running
+    shards. Leases on routes beyond the shard's fair share are released, for when another shard
+    started, and routes that are not leased, or whose leases expired because their shard stopped,
+    are claimed up to the fair share.
+
+    Arguments:
+        shard_name: (String) Name of the shard.
+        route_ids: (Iterable) IDs of every route to split between the shards.
+        lease_seconds: (Integer) Number of seconds until the heartbeat and leases expire unless
+            they are renewed again.
+
+    Returns:
+        Set of the IDs of the routes the shard holds leases on.
+    """
+
+    route_ids = set(route_ids)
+    now = get_database_time()
+    expires = int(now + lease_seconds)
+
+    utils.bulk_upsert(model=Shard,
+                      data=[{'name': shard_name, 'expires': expires}],
+                      update_on_conflict=True,
+                      conflict_columns=['name'])
+
+    # Leases that expired are only renewed if no other shard has claimed them yet
+    RouteLease.objects.filter(shard=shard_name).update(expires=expires)
+    leased_route_ids = set(RouteLease.objects.filter(shard=shard_name)
+                           .values_list('route_id', flat=True))
+
+    inactive_route_ids = leased_route_ids - route_ids
+    if inactive_route_ids:
+        release_leases(shard_name, inactive_route_ids)
+        leased_route_ids -= inactive_route_ids
+
+    share = get_fair_share(route_count=len(route_ids),
+                           shard_names=get_live_shards(now),
+                           shard_name=shard_name)
+    if len(leased_route_ids) > share:
+        released_route_ids = set(sorted(leased_route_ids)[share:])
+        release_leases(shard_name, released_route_ids)
+        leased_route_ids -= released_route_ids
+
+        LOG.info('Released %d routes for other shards', len(released_route_ids))
+    elif len(leased_route_ids) < share:
+        claimed_route_ids = claim_leases(shard_name=shard_name,
+                                         route_ids=route_ids - leased_route_ids,
+                                         count=share - len(leased_route_ids),
+                                         now=now,
+                                         lease_seconds=lease_seconds)
+        leased_route_ids |= claimed_route_ids
+
+        if claimed_route_ids:
+            LOG.info('Claimed %d routes', len(claimed_route_ids))
+
+    return leased_route_ids
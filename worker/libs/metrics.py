@@ -0,0 +1,369 @@
+"""Counters, gauges, and histograms of the worker's activity, rendered in the Prometheus text format
+so that the stages and routes that are slow can be found while the worker is running."""
+
+import bisect
+import math
+import threading
+
+_registry = None
+_registry_lock = threading.Lock()
+
+# Upper bounds in seconds of the buckets of histograms of how long a stage takes, from the
+# sub-millisecond stages of finding arrivals to requests to NextBus that time out
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+
+# Upper bounds in bytes of the buckets of histograms of the sizes of responses
+BYTES_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+
+class Metric(object):
+    """Base class for a metric with a value for each combination of the values of its labels, which
+    is either updated directly or read from a function every time the metric is collected, such as
+    for statistics that are already kept by another object. Instances are thread-safe."""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, label_names=(), function=None):
+        """
+        Arguments:
+            name: (String) Name of the metric.
+            documentation: (String) Description of the metric.
+            label_names: (Tuple of strings) Names of the labels of the metric.
+            function: (Callable) Function without arguments that returns a dictionary with tuples
+                of the values of the labels as keys and the values of the metric as values. If this
+                is None, the values are updated with the methods of the metric.
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get_samples(self):
+        """Get the current samples of the metric.
+
+        Returns:
+            List of tuples of the name of the sample, a tuple of label names and values, and the
+            value of the sample.
+        """
+
+        with self.lock:
+            function = self.function
+
+        if function is not None:
+            values = {tuple(labels): value for labels, value in function().items()}
+            with self.lock:
+                self.values = values
+
+        with self.lock:
+            values = list(self.values.items())
+
+        return [(self.name, tuple(zip(self.label_names, labels)), value)
+                for labels, value in sorted(values)]
+
+    def remove(self, **labels):
+        """Remove the values with the given values of some of the labels, such as every value for a
+        route that is no longer running. Nothing is removed if the metric does not have one of the
+        labels.
+
+        Arguments:
+            labels: Label names as keywords, with the values of the labels to remove.
+        """
+
+        if any(label_name not in self.label_names for label_name in labels):
+            return
+
+        indexes = [(self.label_names.index(label_name), label_value)
+                   for label_name, label_value in labels.items()]
+        with self.lock:
+            for key in [key for key in self.values
+                        if all(key[index] == label_value for index, label_value in indexes)]:
+                del self.values[key]
+
+class Counter(Metric):
+    """Metric with a value that only increases."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """Increase the value of the counter.
+
+        Arguments:
+            amount: (Float) Amount to increase the value by.
+            labels: (Tuple) Values of the labels, in the order of the label names.
+        """
+
+        labels = tuple(labels)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """Metric with a value that can go up and down."""
+
+    type_name = 'gauge'
+
+    def set(self, value, labels=()):
+        """Set the value of the gauge.
+
+        Arguments:
+            value: (Float) The new value.
+            labels: (Tuple) Values of the labels, in the order of the label names.
+        """
+
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+class Histogram(Metric):
+    """Metric that counts observed values in buckets, along with the count and sum of the values.
+    Each bucket counts the values less than or equal to its upper bound, and the buckets are
+    cumulative when collected."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=SECONDS_BUCKETS):
+        """
+        Arguments:
+            name: (String) Name of the metric.
+            documentation: (String) Description of the metric.
+            label_names: (Tuple of strings) Names of the labels of the metric.
+            buckets: (Tuple of floats) Sorted upper bounds of the buckets. A bucket for values above
+                the largest bound is always added.
+        """
+
+        super().__init__(name=name, documentation=documentation, label_names=label_names)
+        self.buckets = tuple(buckets)
+
+    def get_samples(self):
+        with self.lock:
+            values = [(labels, (list(value[0]), value[1], value[2]))
+                      for labels, value in self.values.items()]
+
+        samples = []
+        for labels, (bucket_counts, total, count) in sorted(values):
+            label_pairs = tuple(zip(self.label_names, labels))
+
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative_count += bucket_count
+                samples.append(('%s_bucket' % self.name,
+                                label_pairs + (('le', format_value(upper_bound)),),
+                                cumulative_count))
+
+            samples.append(('%s_sum' % self.name, label_pairs, total))
+            samples.append(('%s_count' % self.name, label_pairs, count))
+
+        return samples
+
+    def observe(self, value, labels=()):
+        """Add an observed value to the histogram.
+
+        Arguments:
+            value: (Float) The observed value.
+            labels: (Tuple) Values of the labels, in the order of the label names.
+        """
+
+        labels = tuple(labels)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.values.get(labels)
+            if histogram is None:
+                histogram = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+            histogram[0][bucket_index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+class Registry(object):
+    """Collection of metrics that are rendered together. Metrics are registered by name, so that
+    modules can define their metrics when they are imported, and registering a metric that already
+    exists returns the existing metric. Instances are thread-safe."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def counter(self, name, documentation, label_names=(), function=None):
+        """Get a counter, registering it if it does not exist yet.
+
+        Arguments:
+            name: (String) Name of the metric.
+            documentation: (String) Description of the metric.
+            label_names: (Tuple of strings) Names of the labels of the metric.
+            function: (Callable) Function that returns the values of the counter, in the format
+                described in Metric.
+
+        Returns:
+            Instance of Counter.
+        """
+
+        return self.register(Counter(name=name,
+                                     documentation=documentation,
+                                     label_names=label_names,
+                                     function=function))
+
+    def gauge(self, name, documentation, label_names=(), function=None):
+        """Get a gauge, registering it if it does not exist yet.
+
+        Arguments:
+            name: (String) Name of the metric.
+            documentation: (String) Description of the metric.
+            label_names: (Tuple of strings) Names of the labels of the metric.
+            function: (Callable) Function that returns the values of the gauge, in the format
+                described in Metric.
+
+        Returns:
+            Instance of Gauge.
+        """
+
+        return self.register(Gauge(name=name,
+                                   documentation=documentation,
+                                   label_names=label_names,
+                                   function=function))
+
+    def histogram(self, name, documentation, label_names=(), buckets=SECONDS_BUCKETS):
+        """Get a histogram, registering it if it does not exist yet.
+
+        Arguments:
+            name: (String) Name of the metric.
+            documentation: (String) Description of the metric.
+            label_names: (Tuple of strings) Names of the labels of the metric.
+            buckets: (Tuple of floats) Sorted upper bounds of the buckets.
+
+        Returns:
+            Instance of Histogram.
+        """
+
+        return self.register(Histogram(name=name,
+                                       documentation=documentation,
+                                       label_names=label_names,
+                                       buckets=buckets))
+
+    def register(self, metric):
+        """Register a metric, unless a metric with the same name is already registered. If it is
+        and the new metric has a function, the function replaces the function of the existing
+        metric, so that the metrics of an object that is replaced, such as a route manager that is
+        created again, are collected from the new object.
+
+        Arguments:
+            metric: (Metric) The metric to register.
+
+        Returns:
+            The registered metric with the name of the metric.
+
+        Raises:
+            ValueError: If a metric of a different type is registered with the same name.
+        """
+
+        with self.lock:
+            existing_metric = self.metrics.get(metric.name)
+            if existing_metric is None:
+                self.metrics[metric.name] = metric
+                return metric
+
+        if type(existing_metric) is not type(metric):
+            raise ValueError('Metric %s is already registered as a %s' %
+                             (metric.name, existing_metric.type_name))
+
+        if metric.function is not None:
+            with existing_metric.lock:
+                existing_metric.function = metric.function
+
+        return existing_metric
+
+    def remove(self, **labels):
+        """Remove the values with the given values of some of the labels from every metric that has
+        the labels, such as every value for a route that is no longer running, so that they are no
+        longer rendered.
+
+        Arguments:
+            labels: Label names as keywords, with the values of the labels to remove.
+        """
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        for metric in metrics:
+            metric.remove(**labels)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            String containing the metrics.
+        """
+
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, escape(metric.documentation)))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for name, label_pairs, value in metric.get_samples():
+                if label_pairs:
+                    lines.append('%s{%s} %s' % (
+                        name,
+                        ','.join('%s="%s"' % (label_name, escape(str(label_value), quotes=True))
+                                 for label_name, label_value in label_pairs),
+                        format_value(value)))
+                else:
+                    lines.append('%s %s' % (name, format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+def escape(value, quotes=False):
+    """Escape a string to be used in the help text or as a label value of a metric.
+
+    Arguments:
+        value: (String) The string to escape.
+        quotes: (Boolean) Whether to also escape double quotes, which is required in label values.
+
+    Returns:
+        String, the escaped string.
+    """
+
+    value = value.replace('\\', r'\\').replace('\n', r'\n')
+    if quotes:
+        value = value.replace('"', r'\"')
+
+    return value
+
+def format_value(value):
+    """Format the value of a sample.
+
+    Arguments:
+        value: (Float) The value.
+
+    Returns:
+        String, the value as an integer if it is a whole number, otherwise as a float.
+    """
+
+    if math.isnan(value):
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+def get_registry():
+    """Get the registry of metrics shared by the process, creating it if it does not exist yet.
+
+    Returns:
+        Instance of Registry.
+    """
+
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = Registry()
+
+        return _registry
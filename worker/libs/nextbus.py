@@ -0,0 +1,247 @@
+"""NextBus API client that makes requests through a transport shared by the whole process."""
+
+import configparser
+import json
+import logging
+import os.path as path
+import threading
+import urllib.error
+import urllib.parse
+
+import py_nextbus
+import urllib3
+
+import how_late_is_muni.settings as settings
+from worker.libs import resilience
+from worker.libs.rate_limiter import RateLimiter
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+_transport = None
+_transport_lock = threading.Lock()
+
+class PooledTransport(object):
+    """Transport for making HTTP requests with a pool of persistent keep-alive connections, so that
+    a new TCP connection does not have to be opened for every request. Instances are thread-safe,
+    and a single instance should be shared by all callers in the process.
+    """
+
+    def __init__(self, pool_size, connect_timeout, read_timeout, rate_limiter=None):
+        """
+        Arguments:
+            pool_size: (Integer) Maximum number of idle connections to keep open to each host.
+            connect_timeout: (Float) Number of seconds to wait for a connection to be established
+                before giving up on a request.
+            read_timeout: (Float) Number of seconds to wait for data from the server before giving
+                up on a request.
+            rate_limiter: (RateLimiter) Rate limiter that every request waits for before it is
+                made. If this is None, requests are not rate limited.
+        """
+
+        self.rate_limiter = rate_limiter
+
+        self.pool_manager = urllib3.PoolManager(maxsize=pool_size,
+                                                timeout=urllib3.Timeout(connect=connect_timeout,
+                                                                        read=read_timeout),
+                                                retries=False)
+
+    def get(self, url, use_compression=True):
+        """Make a GET request.
+
+        Arguments:
+            url: (String) The URL to make the request to.
+            use_compression: (Boolean) Indicates whether the server should be asked to compress the
+                response. Compressed responses are decompressed before being returned.
+
+        Returns:
+            Bytes containing the body of the response.
+
+        Raises:
+            urllib.error.HTTPError: If the response has an error status.
+            urllib.error.URLError: If the request could not be completed, including if it timed out.
+        """
+
+        headers = {}
+        if use_compression:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+
+        try:
+            response = self.pool_manager.request('GET', url, headers=headers)
+        except urllib3.exceptions.HTTPError as exc:
+            raise urllib.error.URLError(exc)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_response(len(response.data))
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers,
+                                         None)
+
+        return response.data
+
+def get_transport():
+    """Get the transport shared by all NextBus clients in the process, creating it with the settings
+    in the config if it does not exist yet.
+
+    Returns:
+        Instance of PooledTransport.
+    """
+
+    global _transport
+
+    with _transport_lock:
+        if _transport is None:
+            _transport = PooledTransport(pool_size=int(config.get('nextbus', 'pool_size')),
+                                         connect_timeout=float(config.get('nextbus',
+                                                                          'connect_timeout')),
+                                         read_timeout=float(config.get('nextbus', 'read_timeout')),
+                                         rate_limiter=RateLimiter(
+                                             requests_per_second=float(
+                                                 config.get('nextbus', 'max_requests_per_second')),
+                                             bytes_per_minute=float(
+                                                 config.get('nextbus', 'max_bytes_per_minute'))))
+
+        return _transport
+
+def set_transport(transport):
+    """Replace the transport shared by all NextBus clients in the process, such as to make requests
+    to a fake agency. Only clients created afterwards use the new transport.
+
+    Arguments:
+        transport: Object with a get method with the same signature as PooledTransport.get, or None
+            to create a transport with the settings in the config the next time one is needed.
+
+    Returns:
+        The transport that was replaced, or None if there was no transport.
+    """
+
+    global _transport
+
+    with _transport_lock:
+        previous_transport = _transport
+        _transport = transport
+
+    return previous_transport
+
+class NextBusClient(py_nextbus.NextBusClient):
+    """Client for the NextBus API that makes requests through a pluggable transport instead of
+    opening a new connection for every request, and to the feed URL set in the config."""
+
+    def __init__(self, output_format, agency=None, use_compression=True, transport=None,
+                 circuit_breaker=None):
+        """
+        Arguments:
+            output_format: (String) Indicates the format of the data returned by requests, either
+                "json" or "xml".
+            agency: (String) Name of a transit agency on NextBus.
+            use_compression: (Boolean) Indicates whether the response data from requests to NextBus
+                should be compressed.
+            transport: Object with a get method with the same signature as PooledTransport.get, used
+                to make requests. If this is None, the transport shared by the process is used.
+            circuit_breaker: (CircuitBreaker) Circuit breaker that stops requests from being made
+                while NextBus is failing. If this is None, the breaker shared by the process is
+                used.
+        """
+
+        super().__init__(output_format=output_format,
+                         agency=agency,
+                         use_compression=use_compression)
+
+        self.transport = transport if transport is not None else get_transport()
+
+        # Total number of bytes of the responses to every request made by the client
+        self.response_bytes = 0
+
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else resilience.get_global_breaker()
+
+        if self.output_format == 'json':
+            self.feed_url = config.get('nextbus', 'json_feed_url')
+        else:
+            self.feed_url = config.get('nextbus', 'xml_feed_url')
+
+    def _perform_request(self, params):
+        """Make a request to the NextBus API with given parameters.
+
+        Arguments:
+            params: (Dictionary) Query parameters to provide with the request.
+
+        Returns:
+            If the output_format is "json": Dictionary containing the JSON returned by the request.
+            If the output_format is "xml": String containing the XML returned by the request.
+
+        Raises:
+            urllib.error.HTTPError: If an HTTP error occurs when making the request to the NextBus
+                API.
+            urllib.error.URLError: If the request could not be completed.
+            json.decoder.JSONDecodeError: If the output_format is "json" and the response was not
+                valid JSON.
+            worker.libs.resilience.CircuitOpenError: If the request was not made because the
+                circuit breaker is open.
+            worker.libs.resilience.NextBusError: If the output_format is "json" and NextBus
+                returned an error message.
+        """
+
+        if not self.circuit_breaker.allow_request():
+            raise resilience.CircuitOpenError(self.circuit_breaker.name)
+
+        try:
+            response = self.get_response(params)
+        except Exception as exc:
+            # Only errors that indicate a problem with NextBus count towards opening the breaker,
+            # any other response shows that NextBus is working
+            if resilience.classify_error(exc) in resilience.PROVIDER_ERRORS:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            raise
+
+        self.circuit_breaker.record_success()
+        return response
+
+    def get_response(self, params):
+        """Make a request to the NextBus API with given parameters, without checking the circuit
+        breaker.
+
+        Arguments:
+            params: (Dictionary) Query parameters to provide with the request.
+
+        Returns:
+            The response in the same format as the _perform_request method.
+
+        Raises:
+            The same exceptions as the _perform_request method, except for CircuitOpenError.
+        """
+
+        url = '%s?%s' % (self.feed_url, urllib.parse.urlencode(params, safe='&='))
+
+        LOG.debug('Making request to URL %s', url)
+        try:
+            response_text = self.transport.get(url, use_compression=self.use_compression)
+        except urllib.error.HTTPError as exc:
+            LOG.error('Request returned status %s due to reason: %s', exc.code, exc.reason)
+            raise
+
+        self.response_bytes += len(response_text)
+
+        if self.output_format == 'json':
+            try:
+                response = json.loads(response_text)
+            except json.decoder.JSONDecodeError as exc:
+                LOG.error('Request did not return valid JSON. %s', exc)
+                raise
+
+            if isinstance(response, dict) and 'Error' in response:
+                error = response['Error']
+                raise resilience.NextBusError(message=error.get('content', '').strip(),
+                                              should_retry=error.get('shouldRetry') == 'true')
+
+            return response
+
+        return response_text
@@ -0,0 +1,128 @@
+"""Helper functions relating to predictions."""
+
+import logging
+import urllib.parse
+
+from worker.libs import prediction_snapshot, utils
+
+LOG = logging.getLogger(__name__)
+
+def format_predictions(predictions):
+    """Format the predictions for stops returned by the NextBus API into nested dictionaries.
+
+    Arguments:
+        predictions: (List of dictionaries) The "predictions" objects returned by the NextBus API by
+            the "predictionsForMultiStops" command, each of which contain the predictions for a
+            single stop.
+
+    Returns:
+        Nested dictionaries keyed by stop tags -> block IDs -> trip tags, with the number of
+        seconds until the predicted arrival as the value. For example:
+        {
+            5001: {
+                2101: {
+                    7895989: 180
+                    7895991: 1259
+                }
+                2102: {
+                    7895990: 900
+                }
+            }
+        }
+    """
+
+    prediction_dict = {}
+    for stop in utils.ensure_is_list(predictions):
+        stop_predictions = {}
+        for direction in utils.ensure_is_list(stop.get('direction', [])):
+            for prediction in utils.ensure_is_list(direction.get('prediction', [])):
+                try:
+                    block_id = int(prediction['block'])
+                except (ValueError, TypeError):
+                    LOG.info('Block ID %s is not an integer', prediction['block'])
+                else:
+                    if block_id not in stop_predictions:
+                        stop_predictions[block_id] = {}
+
+                    stop_predictions[block_id][int(prediction['tripTag'])] = \
+                        int(prediction['seconds'])
+
+        prediction_dict[int(stop['stopTag'])] = stop_predictions
+
+    return prediction_dict
+
+def parse_predictions(predictions, arrival_detection):
+    """Parse the predictions for stops returned by the NextBus API into the representation used to
+    determine arrivals.
+
+    Arguments:
+        predictions: (List of dictionaries) The "predictions" objects returned by the NextBus API by
+            the "predictionsForMultiStops" command, each of which contain the predictions for a
+            single stop.
+        arrival_detection: (String) How arrivals are determined, either "nested" or "snapshot", as
+            set in the config.
+
+    Returns:
+        Instance of PredictionSnapshot if arrival_detection is "snapshot", otherwise nested
+        dictionaries in the format returned by format_predictions.
+    """
+
+    if arrival_detection == 'snapshot':
+        return prediction_snapshot.parse_predictions(predictions)
+
+    return format_predictions(predictions)
+
+def group_predictions_by_route(predictions):
+    """Group the predictions for stops returned by the NextBus API by the route they are for.
+
+    Arguments:
+        predictions: (List of dictionaries) The "predictions" objects returned by the NextBus API by
+            the "predictionsForMultiStops" command, each of which contain the predictions for a
+            single stop on a single route.
+
+    Returns:
+        Dictionary with route tags as keys and lists of the "predictions" objects for the route as
+        values.
+    """
+
+    route_predictions = {}
+    for stop in utils.ensure_is_list(predictions):
+        route_predictions.setdefault(stop['routeTag'], []).append(stop)
+
+    return route_predictions
+
+def split_stops_by_url_length(stops, base_url_length, max_url_length):
+    """Split combinations of routes and stops into chunks that can each be requested with the
+    "predictionsForMultiStops" command without the URL of the request exceeding a maximum length.
+
+    Arguments:
+        stops: (List of tuples) Tuples of a route tag and a stop tag for each stop to get predictions
+            for.
+        base_url_length: (Integer) Length of the URL of a request for predictions without any stops
+            in the query string.
+        max_url_length: (Integer) Maximum length of the URL of a single request.
+
+    Returns:
+        List of lists of tuples of a route tag and a stop tag, in the same order as the provided
+        stops. Every chunk contains at least one stop, even if a single stop exceeds the maximum
+        length.
+    """
+
+    chunks = []
+    chunk = []
+    url_length = base_url_length
+    for route_tag, stop_tag in stops:
+        stop_length = len('&stops=') + len(urllib.parse.quote('%s|%d' % (route_tag, stop_tag)))
+
+        if chunk and url_length + stop_length > max_url_length:
+            chunks.append(chunk)
+            chunk = []
+            url_length = base_url_length
+
+        chunk.append((route_tag, stop_tag))
+        url_length += stop_length
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
@@ -0,0 +1,308 @@
+"""Flat representation of predictions, for determining arrivals with bulk set operations."""
+
+import array
+import logging
+
+from worker.libs import utils
+
+LOG = logging.getLogger(__name__)
+
+class PredictionSnapshot(object):
+    """Predictions for a set of stops retrieved at the same time, stored as flat columns with a row
+    for each predicted arrival instead of as nested dictionaries.
+
+    Rows are in the order the predictions were added, and all of the rows for a stop, and for a
+    block ID at a stop, are contiguous, so the rows are in the same order as iterating over the
+    nested dictionaries returned by worker.libs.prediction.format_predictions.
+
+    Every column is an array of machine integers, so a snapshot is a handful of objects no matter
+    how many predictions it has, instead of a dictionary for every stop and block ID and an integer
+    object for every value.
+
+    Attributes:
+        stops: Array of the tags of every stop that predictions were retrieved for, including stops
+            that had no predictions.
+        stop_tags: Array of the stop tag of each row.
+        block_ids: Array of the block ID of each row.
+        trip_tags: Array of the trip tag of each row.
+        seconds: Array of the number of seconds until the predicted arrival of each row.
+    """
+
+    __slots__ = ('stops', 'stop_tags', 'block_ids', 'trip_tags', 'seconds', '_stop_set',
+                 '_block_keys', '_row_indexes')
+
+    def __init__(self):
+        self.stops = array.array('l')
+        self.stop_tags = array.array('l')
+        self.block_ids = array.array('l')
+        self.trip_tags = array.array('l')
+        self.seconds = array.array('l')
+
+        self._stop_set = None
+        self._block_keys = None
+        self._row_indexes = None
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @property
+    def stop_set(self):
+        """Set of the tags of every stop that predictions were retrieved for."""
+
+        if self._stop_set is None:
+            self._stop_set = set(self.stops)
+
+        return self._stop_set
+
+    @property
+    def block_keys(self):
+        """Set of tuples of a stop tag and block ID for each block ID with predictions at a stop."""
+
+        if self._block_keys is None:
+            self._block_keys = set(zip(self.stop_tags, self.block_ids))
+
+        return self._block_keys
+
+    @property
+    def trip_keys(self):
+        """Set-like view of tuples of a stop tag, block ID, and trip tag for each row."""
+
+        return self.row_indexes.keys()
+
+    @property
+    def row_indexes(self):
+        """Dictionary with tuples of a stop tag, block ID, and trip tag as keys and the index of the
+        row for the trip as values."""
+
+        if self._row_indexes is None:
+            self._row_indexes = dict(zip(zip(self.stop_tags, self.block_ids, self.trip_tags),
+                                         range(len(self.seconds))))
+
+        return self._row_indexes
+
+    @classmethod
+    def from_state(cls, state):
+        """Create a snapshot from the state of a snapshot returned by the get_state method.
+
+        Arguments:
+            state: (Dictionary) The state of the snapshot, in the format returned by the get_state
+                method.
+
+        Returns:
+            Instance of PredictionSnapshot.
+        """
+
+        snapshot = cls()
+        for column in ('stops', 'stop_tags', 'block_ids', 'trip_tags', 'seconds'):
+            getattr(snapshot, column).extend(state[column])
+
+        return snapshot
+
+    def get_state(self):
+        """Get the columns of the snapshot as lists of integers that can be encoded as JSON, such
+        as to write the snapshot to a checkpoint.
+
+        Returns:
+            Dictionary with the name of each column as keys and lists of the values of the columns
+            as values.
+        """
+
+        return {column: list(getattr(self, column))
+                for column in ('stops', 'stop_tags', 'block_ids', 'trip_tags', 'seconds')}
+
+    def add_stop(self, stop_tag):
+        """Add a stop that predictions were retrieved for. This must be called before adding the
+        predictions for the stop.
+
+        Arguments:
+            stop_tag: (Integer) Tag of the stop.
+        """
+
+        self.stops.append(stop_tag)
+        if self._stop_set is not None:
+            self._stop_set.add(stop_tag)
+
+    def add_prediction(self, stop_tag, block_id, trip_tag, seconds):
+        """Add a row for a predicted arrival. The predictions for a stop, and for a block ID at a
+        stop, must be added one after another.
+
+        Arguments:
+            stop_tag: (Integer) Tag of the stop the prediction is for.
+            block_id: (Integer) Block ID of the vehicle that is predicted to arrive.
+            trip_tag: (Integer) Tag of the trip the vehicle is predicted to arrive on.
+            seconds: (Integer) Number of seconds until the predicted arrival.
+        """
+
+        self.stop_tags.append(stop_tag)
+        self.block_ids.append(block_id)
+        self.trip_tags.append(trip_tag)
+        self.seconds.append(seconds)
+
+def get_snapshot(predictions):
+    """Create a snapshot from predictions in nested dictionaries.
+
+    Arguments:
+        predictions: (Dictionary) Nested dictionaries keyed by stop tags -> block IDs -> trip tags,
+            with the number of seconds until the predicted arrival as the value, in the format
+            returned by worker.libs.prediction.format_predictions.
+
+    Returns:
+        Instance of PredictionSnapshot containing the predictions.
+    """
+
+    snapshot = PredictionSnapshot()
+    for stop_tag, blocks in predictions.items():
+        snapshot.add_stop(stop_tag)
+        for block_id, trips in blocks.items():
+            for trip_tag, seconds in trips.items():
+                snapshot.add_prediction(stop_tag=stop_tag,
+                                        block_id=block_id,
+                                        trip_tag=trip_tag,
+                                        seconds=seconds)
+
+    return snapshot
+
+def get_predictions(snapshot):
+    """Get the predictions in a snapshot as nested dictionaries, the reverse of get_snapshot.
+
+    Arguments:
+        snapshot: (PredictionSnapshot) The snapshot to get the predictions of.
+
+    Returns:
+        Nested dictionaries keyed by stop tags -> block IDs -> trip tags, with the number of seconds
+        until the predicted arrival as the value, in the format returned by
+        worker.libs.prediction.format_predictions.
+    """
+
+    predictions = {stop_tag: {} for stop_tag in snapshot.stops}
+    for stop_tag, block_id, trip_tag, seconds in zip(snapshot.stop_tags, snapshot.block_ids,
+                                                     snapshot.trip_tags, snapshot.seconds):
+        predictions[stop_tag].setdefault(block_id, {})[trip_tag] = seconds
+
+    return predictions
+
+def get_stop_blocks(stop):
+    """Group the predictions for a single stop by block ID, since the same block ID can be predicted
+    in more than one direction of the stop.
+
+    Arguments:
+        stop: (Dictionary) A "predictions" object returned by NextBus for a single stop.
+
+    Returns:
+        Dictionary keyed by block IDs -> trip tags, with the number of seconds until the predicted
+        arrival as the value.
+    """
+
+    blocks = {}
+    for direction in utils.ensure_is_list(stop.get('direction', [])):
+        for prediction in utils.ensure_is_list(direction.get('prediction', [])):
+            try:
+                block_id = int(prediction['block'])
+            except (ValueError, TypeError):
+                LOG.info('Block ID %s is not an integer', prediction['block'])
+            else:
+                trips = blocks.get(block_id)
+                if trips is None:
+                    trips = blocks[block_id] = {}
+                trips[int(prediction['tripTag'])] = int(prediction['seconds'])
+
+    return blocks
+
+def parse_predictions(predictions):
+    """Create a snapshot directly from the predictions returned by NextBus, without creating nested
+    dictionaries for all of the stops first. The snapshot contains the same predictions, in the
+    same order, as calling get_snapshot with the predictions returned by
+    worker.libs.prediction.format_predictions.
+
+    Arguments:
+        predictions: (List of dictionaries) The "predictions" objects returned by the NextBus API by
+            the "predictionsForMultiStops" command, each of which contain the predictions for a
+            single stop.
+
+    Returns:
+        Instance of PredictionSnapshot containing the predictions.
+    """
+
+    snapshot = PredictionSnapshot()
+    for stop in utils.ensure_is_list(predictions):
+        stop_tag = int(stop['stopTag'])
+
+        # If the same stop is returned more than once, only its last predictions are used, at the
+        # position it was first returned in, which requires every stop to be grouped first
+        if stop_tag in snapshot.stop_set:
+            return get_snapshot({int(stop['stopTag']): get_stop_blocks(stop)
+                                 for stop in utils.ensure_is_list(predictions)})
+
+        snapshot.add_stop(stop_tag)
+        for block_id, trips in get_stop_blocks(stop).items():
+            for trip_tag, seconds in trips.items():
+                snapshot.add_prediction(stop_tag=stop_tag,
+                                        block_id=block_id,
+                                        trip_tag=trip_tag,
+                                        seconds=seconds)
+
+    return snapshot
+
+def get_arrivals(previous_snapshot, current_snapshot, time_between_retrievals, arrival_threshold):
+    """Determine the arrivals that occurred between two retrievals of predictions, using the same
+    rules as RouteWorker.get_arrivals, but finding the trips and block IDs that disappeared from
+    the predictions with set differences instead of checking every prediction individually.
+
+    Arguments:
+        previous_snapshot: (PredictionSnapshot) The predictions that were retrieved first.
+        current_snapshot: (PredictionSnapshot) The predictions that were retrieved most recently.
+        time_between_retrievals: (Integer) Number of seconds between the retrievals of the
+            predictions.
+        arrival_threshold: (Integer) Maximum number of seconds away a vehicle can have been in the
+            previous predictions to consider it to have arrived, unless the predictions were not
+            retrieved for longer than that.
+
+    Returns:
+        Dictionary with stop tags as keys and lists of block IDs of arrivals as values, which is
+        identical to the dictionary returned by RouteWorker.get_arrivals for the same predictions,
+        including the order of the block IDs and any duplicate block IDs.
+    """
+
+    for stop_tag in previous_snapshot.stops:
+        if stop_tag not in current_snapshot.stop_set:
+            LOG.warning('Stop %s is not in the current set of predictions', stop_tag)
+
+    # A prediction is close enough for the vehicle to be considered to have arrived if the vehicle
+    # disappears when the predicted arrival is below either threshold
+    maximum_seconds = max(arrival_threshold, time_between_retrievals)
+
+    missing_blocks = previous_snapshot.block_keys - current_snapshot.block_keys
+    missing_trips = previous_snapshot.trip_keys - current_snapshot.trip_keys
+
+    # Indexes of the rows of the previous predictions that are arrivals. When a whole block ID is
+    # missing, it is only an arrival once, no matter how many of its trips were close enough, so
+    # only the first row of the block ID is used.
+    arrival_rows = set()
+    arrived_blocks = {}
+    row_indexes = previous_snapshot.row_indexes
+    seconds = previous_snapshot.seconds
+    for trip_key in missing_trips:
+        stop_tag, block_id, _ = trip_key
+        if stop_tag not in current_snapshot.stop_set:
+            continue
+
+        row_index = row_indexes[trip_key]
+        if seconds[row_index] >= maximum_seconds:
+            continue
+
+        block_key = (stop_tag, block_id)
+        if block_key in missing_blocks:
+            if block_key not in arrived_blocks or row_index < arrived_blocks[block_key]:
+                arrived_blocks[block_key] = row_index
+        else:
+            arrival_rows.add(row_index)
+
+    arrival_rows.update(arrived_blocks.values())
+
+    arrivals = {}
+    for row_index in sorted(arrival_rows):
+        arrivals.setdefault(previous_snapshot.stop_tags[row_index], []).append(
+            previous_snapshot.block_ids[row_index])
+
+    LOG.debug('Found arrivals: %s', arrivals)
+    return arrivals
@@ -0,0 +1,156 @@
+"""Rate limiting for requests made by the whole process."""
+
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+class TokenBucket(object):
+    """Token bucket that refills at a constant rate up to a maximum capacity. Instances are
+    thread-safe.
+
+    Tokens can be reserved before they are available, in which case the bucket goes into debt and
+    the caller must wait until the debt would have been repaid, so callers are served in the order
+    they reserve tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Arguments:
+            rate: (Float) Number of tokens added to the bucket each second.
+            capacity: (Float) Maximum number of tokens the bucket can hold, which is the largest
+                burst that is allowed without waiting.
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """Add the tokens for the time that has passed since the bucket was last refilled. This must
+        be called while holding the lock."""
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_time) * self.rate)
+        self.updated_time = now
+
+    def reserve(self, tokens):
+        """Remove tokens from the bucket, even if there are not enough tokens available.
+
+        Arguments:
+            tokens: (Float) Number of tokens to remove.
+
+        Returns:
+            Float, the number of seconds until the bucket is no longer in debt, which is 0 if there
+            were enough tokens available.
+        """
+
+        with self.lock:
+            self.refill()
+            self.tokens -= tokens
+            return max(0, -self.tokens / self.rate)
+
+    def get_wait_seconds(self):
+        """Get the number of seconds until the bucket is no longer in debt.
+
+        Returns:
+            Float, the number of seconds, which is 0 if the bucket is not in debt.
+        """
+
+        with self.lock:
+            self.refill()
+            return max(0, -self.tokens / self.rate)
+
+class RateLimiter(object):
+    """Limits the number of requests made per second, and the number of bytes received per minute,
+    by every thread in the process together. Instances are thread-safe, and a single instance should
+    be shared by everything making requests to the same provider.
+
+    The size of a response is not known until it has been received, so responses are counted after
+    they are received, and requests wait while more bytes have been received than the limit allows.
+    """
+
+    def __init__(self, requests_per_second, bytes_per_minute):
+        """
+        Arguments:
+            requests_per_second: (Float) Maximum number of requests per second, or 0 for no limit.
+            bytes_per_minute: (Float) Maximum number of bytes received per minute, or 0 for no
+                limit.
+        """
+
+        self.request_bucket = None
+        if requests_per_second > 0:
+            self.request_bucket = TokenBucket(rate=requests_per_second,
+                                              capacity=max(1, requests_per_second))
+
+        self.byte_bucket = None
+        if bytes_per_minute > 0:
+            self.byte_bucket = TokenBucket(rate=bytes_per_minute / 60,
+                                           capacity=bytes_per_minute)
+
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.throttled_requests = 0
+        self.wait_seconds = 0
+        self.bytes = 0
+
+    def get_stats(self):
+        """Get statistics about the requests that have been rate limited.
+
+        Returns:
+            Dictionary with the following keys:
+                requests: Integer, total number of requests.
+                throttled_requests: Integer, number of requests that had to wait.
+                wait_seconds: Float, total number of seconds requests waited.
+                bytes: Integer, total number of bytes received.
+        """
+
+        with self.stats_lock:
+            return {
+                'requests': self.requests,
+                'throttled_requests': self.throttled_requests,
+                'wait_seconds': self.wait_seconds,
+                'bytes': self.bytes
+            }
+
+    def record_response(self, num_bytes):
+        """Count the bytes of a response towards the limit.
+
+        Arguments:
+            num_bytes: (Integer) Number of bytes in the response.
+        """
+
+        if self.byte_bucket is not None:
+            self.byte_bucket.reserve(num_bytes)
+
+        with self.stats_lock:
+            self.bytes += num_bytes
+
+    def wait(self):
+        """Wait until a request can be made without exceeding the limits.
+
+        Returns:
+            Float, the number of seconds that were spent waiting.
+        """
+
+        wait_seconds = 0
+        if self.byte_bucket is not None:
+            wait_seconds += self.byte_bucket.get_wait_seconds()
+
+        if self.request_bucket is not None:
+            wait_seconds = max(wait_seconds, self.request_bucket.reserve(1))
+
+        if wait_seconds > 0:
+            LOG.debug('Waiting %.3f seconds to stay within the rate limit', wait_seconds)
+            time.sleep(wait_seconds)
+
+        with self.stats_lock:
+            self.requests += 1
+            if wait_seconds > 0:
+                self.throttled_requests += 1
+                self.wait_seconds += wait_seconds
+
+        return wait_seconds
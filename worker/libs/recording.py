@@ -0,0 +1,215 @@
+"""Helpers for encoding and reading recordings of the raw prediction responses returned by NextBus.
+
+Recordings are directories of segment files, each of which is a gzip compressed file with one JSON
+record per line. Each record contains the predictions retrieved for a route at one time. To save
+space, most records only contain the stops whose predictions changed since the previous record for
+the same route, and the first record for each route in every segment contains all of the stops, so
+that each segment can be read on its own.
+
+Records have the following keys:
+    t: Float, Unix timestamp of when the predictions were retrieved.
+    route: String, tag of the route.
+    key: Boolean, true if the record contains every stop, or false if it only contains changes.
+    stops: Dictionary with stop keys as keys and the "predictions" objects returned by NextBus for
+        each stop that was added or changed as values.
+    removed: List of the keys of stops that were removed, only in records that contain changes.
+    order: List of the keys of all stops in the order they were returned, only if the order is not
+        the same as the order of the previous record with stops that were added at the end.
+    extra: Dictionary with any other keys in the response besides "predictions", only in records
+        that contain every stop.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os.path as path
+import zlib
+
+from worker.libs import utils
+
+LOG = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = 'predictions-*.jsonl.gz'
+
+def get_stop_key(stop):
+    """Get the key identifying the predictions for a stop in a record.
+
+    Arguments:
+        stop: (Dictionary) A "predictions" object returned by NextBus for a single stop.
+
+    Returns:
+        String containing the route tag and stop tag of the stop.
+    """
+
+    return '%s|%s' % (stop.get('routeTag'), stop.get('stopTag'))
+
+class DeltaEncoder(object):
+    """Encodes responses as records containing the changes since the previous response for the same
+    route."""
+
+    def __init__(self):
+        # Keyed by route tags, with tuples of the extra keys of the previous response for the route,
+        # and a dictionary with the stop keys and stops of the previous response as values
+        self.previous_responses = {}
+
+    def encode(self, route_tag, retrieve_time, response):
+        """Encode a response as a record.
+
+        Arguments:
+            route_tag: (String) Tag of the route the predictions are for.
+            retrieve_time: (Float) Unix timestamp of when the predictions were retrieved.
+            response: (Dictionary) The JSON returned by NextBus for the "predictionsForMultiStops"
+                command.
+
+        Returns:
+            Dictionary with the record.
+        """
+
+        extra = {key: value for key, value in response.items() if key != 'predictions'}
+        stops = {}
+        for stop in utils.ensure_is_list(response.get('predictions', [])):
+            stops[get_stop_key(stop)] = stop
+
+        previous = self.previous_responses.get(route_tag)
+        self.previous_responses[route_tag] = (extra, stops)
+
+        if previous is None or previous[0] != extra:
+            return {
+                't': retrieve_time,
+                'route': route_tag,
+                'key': True,
+                'stops': stops,
+                'extra': extra
+            }
+
+        previous_stops = previous[1]
+        record = {
+            't': retrieve_time,
+            'route': route_tag,
+            'key': False,
+            'stops': {stop_key: stop for stop_key, stop in stops.items()
+                      if previous_stops.get(stop_key) != stop},
+            'removed': [stop_key for stop_key in previous_stops if stop_key not in stops]
+        }
+
+        # Only record the order of the stops if it cannot be derived from the previous stops
+        expected_order = [stop_key for stop_key in previous_stops if stop_key in stops] + \
+            [stop_key for stop_key in stops if stop_key not in previous_stops]
+        if list(stops) != expected_order:
+            record['order'] = list(stops)
+
+        return record
+
+    def reset(self, route_tag=None):
+        """Forget the previous responses, so that the next record for each route contains every
+        stop. This must be called when starting a new segment, and for a route whose record could
+        not be written, since later records for the route would otherwise be decoded against it.
+
+        Arguments:
+            route_tag: (String) Tag of the route to forget the previous response of. If this is
+                None, the previous responses of every route are forgotten.
+        """
+
+        if route_tag is None:
+            self.previous_responses = {}
+        else:
+            self.previous_responses.pop(route_tag, None)
+
+class DeltaDecoder(object):
+    """Decodes records created by DeltaEncoder back into the original responses."""
+
+    def __init__(self):
+        # Keyed by route tags, with tuples of the extra keys and the dictionary of stops of the
+        # previous response for the route as values
+        self.previous_responses = {}
+
+    def decode(self, record):
+        """Decode a record into the response it was created from.
+
+        Arguments:
+            record: (Dictionary) A record created by DeltaEncoder.
+
+        Returns:
+            Dictionary with the response. If the response contained predictions for a single stop,
+            the "predictions" key contains a list with a single element instead of a dictionary.
+
+        Raises:
+            ValueError: If the record contains changes, but no previous record for the route was
+                decoded.
+        """
+
+        route_tag = record['route']
+        if record['key']:
+            extra = record.get('extra', {})
+            stops = dict(record['stops'])
+        else:
+            if route_tag not in self.previous_responses:
+                raise ValueError('No previous record for route %s' % route_tag)
+
+            extra, previous_stops = self.previous_responses[route_tag]
+            removed = set(record['removed'])
+            stops = {stop_key: stop for stop_key, stop in previous_stops.items()
+                     if stop_key not in removed}
+            stops.update(record['stops'])
+
+            if 'order' in record:
+                stops = {stop_key: stops[stop_key] for stop_key in record['order']}
+
+        self.previous_responses[route_tag] = (extra, stops)
+
+        response = dict(extra)
+        response['predictions'] = list(stops.values())
+        return response
+
+def get_segment_paths(directory):
+    """Get the paths of the segment files in a recording, in the order they were written.
+
+    Arguments:
+        directory: (String) Path of the directory containing the recording.
+
+    Returns:
+        List of strings with the paths of the segment files.
+    """
+
+    return sorted(glob.glob(path.join(directory, SEGMENT_PATTERN)))
+
+def read_segment(segment_path):
+    """Read the responses recorded in a segment file. If the file is incomplete, such as when the
+    recorder was stopped unexpectedly, the responses that were completely written are read.
+
+    Arguments:
+        segment_path: (String) Path of the segment file.
+
+    Yields:
+        Tuples of the retrieve time, route tag, and response for each record in the segment, in
+        the order they were recorded.
+    """
+
+    decoder = DeltaDecoder()
+    with gzip.open(segment_path, 'rt', encoding='utf-8') as segment:
+        try:
+            for line in segment:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    LOG.warning('Incomplete record at the end of segment %s', segment_path)
+                    return
+
+                yield record['t'], record['route'], decoder.decode(record)
+        except (EOFError, zlib.error):
+            LOG.warning('Segment %s is incomplete', segment_path)
+
+def read_recording(directory):
+    """Read the responses recorded in every segment file in a recording.
+
+    Arguments:
+        directory: (String) Path of the directory containing the recording.
+
+    Yields:
+        Tuples of the retrieve time, route tag, and response for each record, in the order they
+        were recorded.
+    """
+
+    for segment_path in get_segment_paths(directory):
+        yield from read_segment(segment_path)
@@ -0,0 +1,248 @@
+"""Helpers for handling errors from NextBus, including classifying errors, backing off after
+failures, and circuit breakers that stop requests while NextBus is failing."""
+
+import configparser
+import json
+import logging
+import os.path as path
+import random
+import socket
+import threading
+import time
+import urllib.error
+
+import how_late_is_muni.settings as settings
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+# Classes of errors returned by classify_error
+ERROR_TRANSIENT = 'transient'
+ERROR_RATE_LIMITED = 'rate_limited'
+ERROR_INVALID_RESPONSE = 'invalid_response'
+ERROR_CLIENT = 'client'
+ERROR_CIRCUIT_OPEN = 'circuit_open'
+ERROR_UNKNOWN = 'unknown'
+
+# Classes of errors that indicate a problem with NextBus itself, instead of with a single request
+PROVIDER_ERRORS = frozenset([ERROR_TRANSIENT, ERROR_RATE_LIMITED, ERROR_INVALID_RESPONSE])
+
+# Part of the error message NextBus returns when it rejects requests because too many requests were
+# made, such as "Agency server cannot accept client while status is: agency name = sf-muni,status =
+# exceeded limit"
+RATE_LIMIT_MESSAGE = 'exceeded limit'
+
+# States of circuit breakers
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+_global_breaker = None
+_global_breaker_lock = threading.Lock()
+
+class CircuitOpenError(urllib.error.URLError):
+    """Raised instead of making a request while a circuit breaker is open. This is a subclass of
+    URLError, so that code that handles requests that could not be completed also handles requests
+    that were not made."""
+
+    def __init__(self, name):
+        super().__init__('Circuit breaker %s is open' % name)
+
+class NextBusError(Exception):
+    """Raised when NextBus returns an error message instead of the requested data."""
+
+    def __init__(self, message, should_retry):
+        """
+        Arguments:
+            message: (String) The error message returned by NextBus.
+            should_retry: (Boolean) Whether NextBus indicated that the request should be retried.
+        """
+
+        super().__init__(message)
+        self.should_retry = should_retry
+
+class CircuitBreaker(object):
+    """Circuit breaker that stops requests from being made after too many consecutive failures.
+
+    After failure_threshold consecutive failures, the breaker opens and no requests are allowed for
+    reset_seconds. After that, the breaker is half open, and a single request is allowed to test if
+    the failures have stopped. If it succeeds the breaker closes, otherwise it opens again.
+    Instances are thread-safe.
+    """
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        """
+        Arguments:
+            name: (String) Name of the breaker, used in log messages.
+            failure_threshold: (Integer) Number of consecutive failures that open the breaker.
+            reset_seconds: (Float) Number of seconds the breaker stays open before a request is
+                allowed again.
+        """
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_time = None
+        self.times_opened = 0
+
+    def allow_request(self):
+        """Check if a request can be made. If the breaker has been open for long enough, this allows
+        a single request and makes the breaker half open.
+
+        Returns:
+            True if a request can be made, otherwise False.
+        """
+
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+
+            if self.state == STATE_OPEN and \
+                    time.monotonic() - self.opened_time >= self.reset_seconds:
+                LOG.info('Circuit breaker %s is half open, allowing a trial request', self.name)
+                self.state = STATE_HALF_OPEN
+                return True
+
+            return False
+
+    def cancel_trial(self):
+        """Return a half open breaker to open, without recording a failure, when the trial request
+        it allowed could not be made, such as when another breaker rejected it. The breaker stays
+        ready to allow another trial request."""
+
+        with self.lock:
+            if self.state == STATE_HALF_OPEN:
+                self.state = STATE_OPEN
+
+    def get_state(self):
+        """Get the current state of the breaker.
+
+        Returns:
+            Dictionary with the following keys:
+                name: String, name of the breaker.
+                state: String, either "closed", "open", or "half_open".
+                consecutive_failures: Integer, number of failures since the last success.
+                times_opened: Integer, number of times the breaker has opened.
+        """
+
+        with self.lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened
+            }
+
+    def record_failure(self):
+        """Record that a request failed, opening the breaker if there have been too many consecutive
+        failures, or if the trial request made while half open failed."""
+
+        with self.lock:
+            self.consecutive_failures += 1
+
+            if self.state == STATE_HALF_OPEN or \
+                    (self.state == STATE_CLOSED and
+                     self.consecutive_failures >= self.failure_threshold):
+                LOG.warning('Circuit breaker %s opened after %d consecutive failures', self.name,
+                            self.consecutive_failures)
+                self.state = STATE_OPEN
+                self.opened_time = time.monotonic()
+                self.times_opened += 1
+
+    def record_success(self):
+        """Record that a request succeeded, closing the breaker."""
+
+        with self.lock:
+            if self.state != STATE_CLOSED:
+                LOG.info('Circuit breaker %s closed', self.name)
+
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+
+def classify_error(exc):
+    """Classify an exception raised when making a request to NextBus or reading its response.
+
+    Arguments:
+        exc: (Exception) The exception.
+
+    Returns:
+        String with the class of the error, one of:
+            "circuit_open": The request was not made because a circuit breaker is open.
+            "rate_limited": NextBus rejected the request because too many requests were made,
+                either with an HTTP 429 status or with its "exceeded limit" error message.
+            "transient": The request could not be completed or NextBus had an internal error, and
+                the request may succeed if it is retried.
+            "invalid_response": NextBus responded, but the response was not in the expected format.
+            "client": NextBus rejected the request, and it will not succeed if it is retried.
+            "unknown": Any other error.
+    """
+
+    if isinstance(exc, CircuitOpenError):
+        return ERROR_CIRCUIT_OPEN
+
+    if isinstance(exc, urllib.error.HTTPError):
+        if exc.code == 429:
+            return ERROR_RATE_LIMITED
+        if exc.code >= 500:
+            return ERROR_TRANSIENT
+        return ERROR_CLIENT
+
+    if isinstance(exc, (urllib.error.URLError, socket.timeout, ConnectionError)):
+        return ERROR_TRANSIENT
+
+    if isinstance(exc, NextBusError):
+        if RATE_LIMIT_MESSAGE in str(exc).lower():
+            return ERROR_RATE_LIMITED
+        return ERROR_TRANSIENT if exc.should_retry else ERROR_CLIENT
+
+    if isinstance(exc, (json.decoder.JSONDecodeError, KeyError, TypeError, ValueError)):
+        return ERROR_INVALID_RESPONSE
+
+    return ERROR_UNKNOWN
+
+def get_backoff_seconds(failures, base_seconds, max_seconds):
+    """Get the number of seconds to wait before retrying after consecutive failures, using
+    exponential backoff with jitter, so that many callers that failed at the same time do not all
+    retry at the same time.
+
+    Arguments:
+        failures: (Integer) Number of consecutive failures.
+        base_seconds: (Float) Number of seconds to wait after the first failure, before jitter.
+        max_seconds: (Float) Maximum number of seconds to wait, before jitter.
+
+    Returns:
+        Float, the number of seconds to wait, which is between half of the backoff and the full
+        backoff, or 0 if there have not been any failures.
+    """
+
+    if failures <= 0:
+        return 0
+
+    # Limit the exponent, so that the backoff does not overflow after a very long outage
+    backoff_seconds = min(max_seconds, base_seconds * 2 ** min(failures - 1, 32))
+    return random.uniform(backoff_seconds / 2, backoff_seconds)
+
+def get_global_breaker():
+    """Get the circuit breaker shared by all requests to NextBus in the process, creating it with the
+    settings in the config if it does not exist yet.
+
+    Returns:
+        Instance of CircuitBreaker.
+    """
+
+    global _global_breaker
+
+    with _global_breaker_lock:
+        if _global_breaker is None:
+            _global_breaker = CircuitBreaker(
+                name='nextbus',
+                failure_threshold=int(config.get('nextbus', 'global_failure_threshold')),
+                reset_seconds=float(config.get('nextbus', 'circuit_reset_seconds')))
+
+        return _global_breaker
@@ -4,10 +4,9 @@ import configparser
 from datetime import time
 import logging
 import os.path as path
-import py_nextbus
 
 import how_late_is_muni.settings as settings
-from worker.libs import utils, stop, schedule
+from worker.libs import nextbus, utils, stop, schedule
 from worker.models import Route, ScheduleClass
 
 log = logging.getLogger(__name__)
@@ -26,8 +25,8 @@ def get_routes(agency):
             tag: String, short name of the route, eg, "38R".
             title: String, title of the route, eg, "38R-Geary Rapid".
     """
-    nextbus_client = py_nextbus.NextBusClient(output_format='json',
-                                              agency=agency)
+    nextbus_client = nextbus.NextBusClient(output_format='json',
+                                           agency=agency)
     route_list = nextbus_client.get_route_list()
     return utils.ensure_is_list(route_list.get('route', []))
 
@@ -69,55 +68,83 @@ def get_route_schedule(route_tag):
         be returned.
     """
 
-    nextbus_client = py_nextbus.NextBusClient(output_format='json',
-                                              agency=config.get('nextbus', 'agency'))
+    route_schedules = get_raw_route_schedules(route_tag=route_tag)
+    if route_schedules is None:
+        return None
+
+    return [parse_route_schedule(route_schedule) for route_schedule in route_schedules]
+
+def get_raw_route_schedules(route_tag):
+    """Get the schedule for a single route as it is returned by NextBus, without parsing it.
+
+    Arguments:
+        route_tag: (String) The route tag of the route to retrieve the schedule for.
+
+    Returns:
+        List of dictionaries with the "route" objects returned by the NextBus API by the "schedule"
+        command, one for each direction and service class of the route, or None if the schedule
+        returned by NextBus does not include any schedule data.
+    """
+
+    nextbus_client = nextbus.NextBusClient(output_format='json',
+                                           agency=config.get('nextbus', 'agency'))
     schedule = nextbus_client.get_schedule(route_tag=route_tag)
 
     if 'route' not in schedule:
         return None
 
-    response = []
-    for route_schedule in utils.ensure_is_list(schedule['route']):
-        arrivals = []
-        for trip in utils.ensure_is_list(route_schedule['tr']):
-            stops = []
-            for trip_stop in utils.ensure_is_list(trip['stop']):
-                epoch_time = int(trip_stop['epochTime'])
-                if epoch_time != -1:
-                    hours, minutes, seconds = trip_stop['content'].split(':')
-                    stops.append({
-                        'epochTime': epoch_time,
-                        'tag': int(trip_stop['tag']),
-                        'time': time(hour=int(hours),
-                                     minute=int(minutes),
-                                     second=int(seconds))
-                    })
-                else:
-                    stops.append({
-                        'epochTime': epoch_time,
-                        'tag': int(trip_stop['tag']),
-                        'time': None
-                    })
-            arrivals.append({
-                'stops': stops,
-                'blockID': int(trip['blockID'])
-            })
+    return utils.ensure_is_list(schedule['route'])
+
+def parse_route_schedule(route_schedule):
+    """Parse the schedule of a route for a single direction and service class.
 
+    Arguments:
+        route_schedule: (Dictionary) One of the "route" objects returned by the NextBus API by the
+            "schedule" command.
+
+    Returns:
+        Dictionary with the schedule, in the format of the items of the list returned by the
+        get_route_schedule function.
+    """
+
+    arrivals = []
+    for trip in utils.ensure_is_list(route_schedule['tr']):
         stops = []
-        for header_stop in utils.ensure_is_list(route_schedule['header']['stop']):
-            stops.append({
-                'name': header_stop['content'],
-                'tag': int(header_stop['tag'])
-            })
-
-        response.append({
-            'arrivals': arrivals,
-            'direction': route_schedule['direction'],
-            'scheduleClass': route_schedule['scheduleClass'],
-            'serviceClass': route_schedule['serviceClass'],
+        for trip_stop in utils.ensure_is_list(trip['stop']):
+            epoch_time = int(trip_stop['epochTime'])
+            if epoch_time != -1:
+                hours, minutes, seconds = trip_stop['content'].split(':')
+                stops.append({
+                    'epochTime': epoch_time,
+                    'tag': int(trip_stop['tag']),
+                    'time': time(hour=int(hours),
+                                 minute=int(minutes),
+                                 second=int(seconds))
+                })
+            else:
+                stops.append({
+                    'epochTime': epoch_time,
+                    'tag': int(trip_stop['tag']),
+                    'time': None
+                })
+        arrivals.append({
             'stops': stops,
-            'tag': route_schedule['tag'],
-            'title': route_schedule['title']
+            'blockID': int(trip['blockID'])
+        })
+
+    stops = []
+    for header_stop in utils.ensure_is_list(route_schedule['header']['stop']):
+        stops.append({
+            'name': header_stop['content'],
+            'tag': int(header_stop['tag'])
         })
 
-    return response
+    return {
+        'arrivals': arrivals,
+        'direction': route_schedule['direction'],
+        'scheduleClass': route_schedule['scheduleClass'],
+        'serviceClass': route_schedule['serviceClass'],
+        'stops': stops,
+        'tag': route_schedule['tag'],
+        'title': route_schedule['title']
+    }
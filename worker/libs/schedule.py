@@ -1,9 +1,13 @@
 """Helper functions relating to schedules."""
 
 import configparser
+import hashlib
+import json
 import logging
 import os.path as path
 
+from django.db import transaction
+
 import how_late_is_muni.settings as settings
 from worker.models import ScheduledArrival, ScheduleClass, Stop, StopScheduleClass
 from worker.libs import route, stop, utils
@@ -13,151 +17,220 @@ LOG = logging.getLogger(__name__)
 config = configparser.ConfigParser()
 config.read(path.join(settings.BASE_DIR, 'config.ini'))
 
+def get_schedule_digest(route_schedule):
+    """Get a digest of the schedule of a route for a single direction and service class, which only
+    changes when the schedule changes.
+
+    Arguments:
+        route_schedule: (Dictionary) One of the "route" objects returned by the NextBus API by the
+            "schedule" command.
+
+    Returns:
+        String, the hexadecimal SHA-256 digest of the schedule.
+    """
+
+    payload = json.dumps(route_schedule, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 def update_schedule_for_route(route_object):
-    """Update the schedule stored in the database for a single route.
+    """Update the schedule stored in the database for a single route. The schedule for each
+    direction and service class is only parsed and written to the database if its digest is
+    different from the digest of the active schedule class for it, so routes whose schedules have
+    not changed are skipped without any writes.
+
+    A changed schedule is added as a new schedule class, and the schedule class it replaces is
+    deactivated, keeping its scheduled arrivals for the arrivals that were matched to them. If the
+    schedule changes back to an earlier version, the schedule class of that version is reactivated
+    instead of being added again.
 
     Arguments:
         route_object: Instance of models.Route, the route to update the schedule for.
-    """
 
-    schedules = route.get_route_schedule(route_tag=route_object.tag)
-    if schedules is None:
-        return
+    Returns:
+        True if the schedule for any direction and service class of the route changed, otherwise
+        False.
+    """
 
+    route_schedules = route.get_raw_route_schedules(route_tag=route_object.tag)
+    if route_schedules is None:
+        return False
+
+    # Keyed by tuples of the direction, service class, and digest of every version of the schedule
+    # classes of the route, and by tuples of the direction and service class of the active ones
+    schedule_class_versions = {}
+    active_schedule_classes = {}
+    for schedule_class in ScheduleClass.objects.filter(route=route_object):
+        key = (schedule_class.direction, schedule_class.service_class)
+        schedule_class_versions[key + (schedule_class.digest,)] = schedule_class
+        if schedule_class.is_active:
+            active_schedule_classes[key] = schedule_class
+
+    # Only parse the schedules for the directions and service classes that changed to a version
+    # that is not in the database yet
     schedules_to_add = []
-    # Check if each combination of schedule class, service class, and direction already exists in
-    # the database for the route
-    for schedule in schedules:
-        try:
-            existing_schedule_class = \
-                ScheduleClass.objects.get(route=route_object,
-                                          direction=schedule.get('direction'),
-                                          service_class=schedule.get('serviceClass'))
-        except ScheduleClass.DoesNotExist:
-            schedules_to_add.append(schedule)
-
+    reactivated_schedule_class_ids = []
+    schedule_keys = set()
+    for route_schedule in route_schedules:
+        key = (route_schedule['direction'], route_schedule['serviceClass'])
+        schedule_keys.add(key)
+
+        digest = get_schedule_digest(route_schedule)
+        active_schedule_class = active_schedule_classes.get(key)
+        if active_schedule_class is not None and active_schedule_class.digest == digest:
+            continue
+
+        previous_schedule_class = schedule_class_versions.get(key + (digest,))
+        if previous_schedule_class is not None:
+            reactivated_schedule_class_ids.append(previous_schedule_class.id)
         else:
-            # If there is already a schedule class in the database for the route for the same
-            # direction but with a different name, deactivate thie existing schedule class and add
-            # a one with the new name
-            if existing_schedule_class.name != schedule.get('scheduleClass'):
-                schedules_to_add.append(schedule)
-
-                existing_schedule_class.is_active = False
-                existing_schedule_class.save()
+            schedule = route.parse_route_schedule(route_schedule)
+            schedule['digest'] = digest
+            schedules_to_add.append(schedule)
 
-    if not schedules_to_add:
-        LOG.info('No new schedules were found')
-        return
+    # Active schedule classes are deactivated if they are replaced by another version, or if their
+    # direction and service class are no longer in the schedule
+    replaced_keys = set((schedule['direction'], schedule['serviceClass'])
+                        for schedule in schedules_to_add)
+    replaced_keys.update((schedule_class.direction, schedule_class.service_class)
+                         for schedule_class in schedule_class_versions.values()
+                         if schedule_class.id in reactivated_schedule_class_ids)
+    deactivated_schedule_class_ids = [schedule_class.id
+                                      for key, schedule_class in active_schedule_classes.items()
+                                      if key in replaced_keys or key not in schedule_keys]
+
+    if not schedules_to_add and not reactivated_schedule_class_ids and \
+            not deactivated_schedule_class_ids:
+        LOG.info('Schedule for route %s has not changed', route_object.tag)
+        return False
+
+    # The changed schedules are written in a single transaction, so that the route is never left
+    # without an active schedule class, and a version is only added if its whole schedule was
+    # written
+    with transaction.atomic():
+        ScheduleClass.objects.filter(id__in=deactivated_schedule_class_ids).update(is_active=False)
+        ScheduleClass.objects.filter(id__in=reactivated_schedule_class_ids).update(is_active=True)
+
+        if schedules_to_add:
+            add_schedules_for_route(schedules=schedules_to_add, route_object=route_object)
+
+    LOG.info('Added %d schedules, reactivated %d schedules, and deactivated %d schedules for '
+             'route %s', len(schedules_to_add), len(reactivated_schedule_class_ids),
+             len(deactivated_schedule_class_ids), route_object.tag)
+    return True
+
+def add_schedules_for_route(schedules, route_object):
+    """Add the schedules for some of the directions and service classes of a route to the database,
+    each with a new active schedule class. The schedule classes that the schedules replace must be
+    deactivated by the caller.
 
-    # Deactivate all existing ScheduleClasses for the route in the database
-    ScheduleClass.objects.filter(route_id=route_object).update(is_active=False)
+    Arguments:
+        schedules: (List of dictionaries) Schedules in the format of the items of the list returned
+            by worker.libs.route.get_route_schedule, with the digest of each schedule as the value
+            of the "digest" key.
+        route_object: Instance of models.Route, the route to add the schedules for.
+    """
 
     # Get unique stops for the route
     stops = []
-    stop_tags = []
-    for schedule_class in schedules_to_add:
+    stop_tags = set()
+    for schedule_class in schedules:
         for schedule_class_stop in schedule_class['stops']:
             if schedule_class_stop['tag'] not in stop_tags:
                 stops.append(schedule_class_stop)
-                stop_tags.append(schedule_class_stop['tag'])
+                stop_tags.add(schedule_class_stop['tag'])
 
     stop.add_stops_for_route_to_database(stops=stops,
                                          route_object=route_object)
 
-    # Get all stops for the route from the database, including the routes that were just added, so
-    # that each stop doesn't need to be repeatedly retrieved from the database when adding stop
-    # schedule classes
-    route_stops = Stop.objects.filter(route=route_object)
+    # Get the IDs of all stops for the route from the database, including the stops that were just
+    # added, keyed by stop tag, so that the stop of each scheduled arrival is found without querying
+    # the database or searching the stops
+    stop_ids = dict(Stop.objects.filter(route=route_object).values_list('tag', 'id'))
 
-    schedule_classes = []
+    schedule_class_ids = []
     stop_schedule_classes = set()
     stop_schedule_class_dicts = []
     scheduled_arrivals = []
 
-    for schedule_class in schedules_to_add:
-        schedule_class_object, created = \
-            ScheduleClass.objects.get_or_create(defaults={
-                'route': route_object,
-                'direction': schedule_class['direction'],
-                'service_class': schedule_class['serviceClass'],
-                'name': schedule_class['scheduleClass'],
-                'is_active': True
-            },
-                                                route=route_object,
-                                                direction=schedule_class['direction'],
-                                                service_class=schedule_class['serviceClass'])
-        if created:
-            LOG.info('New ScheduleClass added to database: %s', schedule_class_object)
-        else:
-            LOG.info('Retrieved ScheduleClass from database: %s', schedule_class_object)
-
-        schedule_classes.append(schedule_class_object)
+    for schedule_class in schedules:
+        # Each version of a schedule has its own schedule class, so that none of the stop schedule
+        # classes and scheduled arrivals of the version it replaces are attached to it
+        schedule_class_object = ScheduleClass.objects.create(
+            route=route_object,
+            direction=schedule_class['direction'],
+            service_class=schedule_class['serviceClass'],
+            name=schedule_class['scheduleClass'],
+            is_active=True,
+            digest=schedule_class['digest'])
+        LOG.info('New ScheduleClass added to database: %s', schedule_class_object)
+
+        schedule_class_id = schedule_class_object.id
+        schedule_class_ids.append(schedule_class_id)
 
         for trip in schedule_class['arrivals']:
+            block_id = trip['blockID']
             for order, trip_stop in enumerate(trip['stops'], 1):
                 # Skip stops with an arrival time of -1, which indicates that the stop
                 # is not scheduled for that trip
-                if trip_stop['epochTime'] != -1:
-                    # Get the stop for the arrival, without querying the database. If the stop for
-                    # the arrival isn't one of the stops retrieved from the database, don't add the
-                    # arrival to the database.
-                    db_stop = [stop for stop in route_stops if stop.tag == trip_stop['tag']]
-                    if not db_stop:
-                        continue
-
-                    stop_schedule_class = {
-                        'stop_id': db_stop[0].id,
-                        'schedule_class_id': schedule_class_object.id,
+                if trip_stop['epochTime'] == -1:
+                    continue
+
+                # If the stop for the arrival isn't one of the stops retrieved from the database,
+                # don't add the arrival to the database.
+                stop_id = stop_ids.get(trip_stop['tag'])
+                if stop_id is None:
+                    continue
+
+                if (stop_id, schedule_class_id) not in stop_schedule_classes:
+                    stop_schedule_classes.add((stop_id, schedule_class_id))
+                    stop_schedule_class_dicts.append({
+                        'stop_id': stop_id,
+                        'schedule_class_id': schedule_class_id,
                         'stop_order': order
-                    }
-
-                    if (db_stop[0].id, schedule_class_object.id) not in stop_schedule_classes:
-                        stop_schedule_classes.add((db_stop[0].id, schedule_class_object.id))
-                        stop_schedule_class_dicts.append(stop_schedule_class)
-
-                    # Time is returned in milliseconds, convert to seconds to make easier to
-                    # work with
-                    arrival_time = trip_stop['epochTime'] / 1000
-
-                    # Arrivals after midnight that are part of the same service day have timestamps
-                    # that are greater than 24 hours from the midnight epoch. In this case, remove
-                    # 24 hours from the timestamp to simplify comparisons.
-                    if arrival_time >= 60 * 60 * 24:
-                        arrival_time -= 60 * 60 * 24
-
-                    # Add details for the scheduled arrivals that can be added now. The details of
-                    # the stop schedule class will be used to lookup the stop schedule class in
-                    # the database before adding the scheduled arrival to the database.
-                    scheduled_arrivals.append({
-                        'block_id': trip['blockID'],
-                        'time': arrival_time,
-                        'stop_schedule_class_dict': stop_schedule_class
                     })
 
+                # Time is returned in milliseconds, convert to seconds to make easier to work with
+                arrival_time = trip_stop['epochTime'] / 1000
+
+                # Arrivals after midnight that are part of the same service day have timestamps
+                # that are greater than 24 hours from the midnight epoch. In this case, remove 24
+                # hours from the timestamp to simplify comparisons.
+                if arrival_time >= 60 * 60 * 24:
+                    arrival_time -= 60 * 60 * 24
+
+                # The stop schedule class of the scheduled arrival is looked up by its key once the
+                # stop schedule classes have been added to the database
+                scheduled_arrivals.append((block_id, arrival_time,
+                                           (stop_id, schedule_class_id, order)))
+
     utils.bulk_upsert(model=StopScheduleClass,
                       data=stop_schedule_class_dicts,
                       update_on_conflict=False,
                       conflict_columns=['stop_id', 'schedule_class_id', 'stop_order'])
 
-    stop_schedule_class_objects = \
-        StopScheduleClass.objects.filter(schedule_class__in=schedule_classes,
-                                         stop__in=route_stops)
+    # Keyed by tuples of the stop ID, schedule class ID, and stop order of each stop schedule class
+    stop_schedule_class_ids = {
+        (stop_id, schedule_class_id, stop_order): stop_schedule_class_id
+        for stop_schedule_class_id, stop_id, schedule_class_id, stop_order in
+        StopScheduleClass.objects.filter(schedule_class_id__in=schedule_class_ids,
+                                         stop__route=route_object)
+        .values_list('id', 'stop_id', 'schedule_class_id', 'stop_order')
+    }
 
-    for scheduled_arrival in scheduled_arrivals:
-        stop_schedule_class = scheduled_arrival.pop('stop_schedule_class_dict')
-
-        scheduled_arrival['stop_schedule_class'] = \
-            [ssc for ssc in stop_schedule_class_objects if \
-                ssc.stop_id == stop_schedule_class['stop_id'] and \
-                ssc.schedule_class_id == stop_schedule_class['schedule_class_id'] and \
-                ssc.stop_order == stop_schedule_class['stop_order']][0]
-
-    # Remove possible duplicate arrivals
+    # Remove possible duplicate arrivals, keeping the order the arrivals are in the schedule
     unique_scheduled_arrivals = []
-    for scheduled_arrival in scheduled_arrivals:
-        if scheduled_arrival not in unique_scheduled_arrivals:
-            unique_scheduled_arrivals.append(scheduled_arrival)
+    scheduled_arrival_keys = set()
+    for block_id, arrival_time, stop_schedule_class_key in scheduled_arrivals:
+        stop_schedule_class_id = stop_schedule_class_ids[stop_schedule_class_key]
+        key = (stop_schedule_class_id, block_id, arrival_time)
+        if key not in scheduled_arrival_keys:
+            scheduled_arrival_keys.add(key)
+            unique_scheduled_arrivals.append({
+                'block_id': block_id,
+                'time': arrival_time,
+                'stop_schedule_class_id': stop_schedule_class_id
+            })
+
     utils.bulk_upsert(model=ScheduledArrival,
                       data=unique_scheduled_arrivals,
                       update_on_conflict=False,
@@ -0,0 +1,151 @@
+"""Cache of the scheduled arrivals of every route, shared by all workers in the process."""
+
+import logging
+import threading
+
+from worker.models import ScheduleClass
+
+LOG = logging.getLogger(__name__)
+
+_schedule_cache = None
+_schedule_cache_lock = threading.Lock()
+
+class ScheduleCache(object):
+    """Read-only cache of the scheduled arrivals of routes, so that the scheduled arrivals for a
+    route are only loaded from the database once per service day, and a single copy is shared by
+    every worker for the route, including workers that are restarted when switching days.
+
+    Entries are keyed by the ID of the route, the service class, and the names of the active
+    schedule classes for the route in the service class, so a new schedule for a route is never
+    served from an entry that was loaded for an older schedule. Entries must not be modified after
+    they are added to the cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, route_object, service_class, load, key=None):
+        """Get the cached entry for the schedule of a route, loading it and adding it to the cache if
+        it is not cached yet.
+
+        Arguments:
+            route_object: (Route) The route to get the schedule for.
+            service_class: (String) The service class to get the schedule for.
+            load: (Callable) Function without arguments that loads the entry for the schedule, which
+                is called if the schedule is not cached.
+            key: (Tuple) The key of the schedule returned by get_schedule_key, if the caller already
+                has it. If this is None, the key is looked up.
+
+        Returns:
+            The cached entry for the schedule of the route.
+        """
+
+        if key is None:
+            key = get_schedule_key(route_object=route_object, service_class=service_class)
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+
+        # The entry is loaded without holding the lock, so that the schedules of different routes
+        # can be loaded at the same time
+        LOG.info('Loading schedule for route %s in service class %s', route_object.tag,
+                 service_class)
+        entry = load()
+
+        with self.lock:
+            self.misses += 1
+
+            # Entries for older schedules of the route in the same service class will never be used
+            # again, since the names of the schedule classes changed
+            for existing_key in list(self.entries):
+                if existing_key[:2] == key[:2] and existing_key != key:
+                    del self.entries[existing_key]
+
+            return self.entries.setdefault(key, entry)
+
+    def get_stats(self):
+        """Get statistics about the usage of the cache.
+
+        Returns:
+            Dictionary with the following keys:
+                entries: Integer, number of schedules in the cache.
+                hits: Integer, number of times a schedule was retrieved from the cache.
+                misses: Integer, number of times a schedule had to be loaded.
+        """
+
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def invalidate(self, route_id=None):
+        """Remove cached schedules, so that they are loaded from the database again the next time
+        they are needed.
+
+        Arguments:
+            route_id: (Integer) ID of the route to remove the schedules of. If this is None, the
+                schedules of all routes are removed.
+        """
+
+        with self.lock:
+            for key in list(self.entries):
+                if route_id is None or key[0] == route_id:
+                    del self.entries[key]
+
+    def retain(self, service_class):
+        """Remove the cached schedules of all service classes except one, so that schedules for
+        days that are no longer being tracked do not use memory.
+
+        Arguments:
+            service_class: (String) The service class to keep the schedules of.
+        """
+
+        with self.lock:
+            for key in list(self.entries):
+                if key[1] != service_class:
+                    del self.entries[key]
+
+def get_schedule_key(route_object, service_class):
+    """Get the key identifying the current schedule of a route in a service class.
+
+    Arguments:
+        route_object: (Route) The route to get the key for.
+        service_class: (String) The service class to get the key for.
+
+    Returns:
+        Tuple of the ID of the route, the service class, and a tuple of the sorted names of the
+        active schedule classes for the route in the service class. Names of schedule classes with
+        a digest are followed by a colon and the digest, so that the key changes when a schedule
+        is updated without being renamed.
+    """
+
+    schedule_classes = ScheduleClass.objects.filter(route=route_object,
+                                                    service_class=service_class,
+                                                    is_active=True).values_list('name', 'digest')
+
+    names = set('%s:%s' % (name, digest) if digest else name
+                for name, digest in schedule_classes)
+    return (route_object.id, service_class, tuple(sorted(names)))
+
+def get_schedule_cache():
+    """Get the schedule cache shared by all workers in the process, creating it if it does not
+    exist yet.
+
+    Returns:
+        Instance of ScheduleCache.
+    """
+
+    global _schedule_cache
+
+    with _schedule_cache_lock:
+        if _schedule_cache is None:
+            _schedule_cache = ScheduleCache()
+
+        return _schedule_cache
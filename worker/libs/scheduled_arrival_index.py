@@ -0,0 +1,231 @@
+"""Index for finding the scheduled arrival closest to an arrival."""
+
+import array
+import bisect
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+class ScheduledArrivalRecord(object):
+    """Compact representation of a scheduled arrival, containing only the details needed to match
+    arrivals to it and save them, which uses far less memory than an instance of
+    worker.models.ScheduledArrival.
+
+    Attributes:
+        id: Integer, ID of the ScheduledArrival.
+        stop_id: Integer, ID of the Stop the scheduled arrival is at.
+        time: Integer, timestamp representing seconds after the start of the day of the scheduled
+            arrival.
+    """
+
+    __slots__ = ('id', 'stop_id', 'time')
+
+    def __init__(self, id, stop_id, time):
+        self.id = id
+        self.stop_id = stop_id
+        self.time = time
+
+    def __eq__(self, other):
+        return isinstance(other, ScheduledArrivalRecord) and \
+            (self.id, self.stop_id, self.time) == (other.id, other.stop_id, other.time)
+
+    def __hash__(self):
+        return hash((self.id, self.stop_id, self.time))
+
+    def __repr__(self):
+        return 'ScheduledArrivalRecord(id=%s, stop_id=%s, time=%s)' % (self.id, self.stop_id,
+                                                                       self.time)
+
+class ScheduledArrivalIndex(object):
+    """Index of the scheduled arrivals for a route, used to find the closest scheduled arrival to an
+    arrival at a stop by a block ID in logarithmic time.
+
+    The scheduled arrival times for each combination of stop and block ID are kept sorted, so that
+    the closest scheduled arrival can be found by bisection. Arrivals are compared to the scheduled
+    arrivals both on the same day and across midnight.
+    """
+
+    def __init__(self, scheduled_arrivals, single_scheduled_arrival_threshold):
+        """
+        Arguments:
+            scheduled_arrivals: (Dictionary) Dictionary with stop tags as keys and dictionaries of
+                scheduled arrivals for each block ID as values, in the format returned by
+                RouteWorker.get_scheduled_arrivals.
+            single_scheduled_arrival_threshold: (Integer) Maximum number of seconds between an
+                arrival and the scheduled arrival, for a stop and block ID with only one scheduled
+                arrival, for the scheduled arrival to be matched to the arrival.
+        """
+
+        self.single_scheduled_arrival_threshold = single_scheduled_arrival_threshold
+
+        # Keyed by tuples of stop tags and block IDs, with tuples of the sorted unique scheduled
+        # arrival times, the scheduled arrival for each time, the position of each of those
+        # scheduled arrivals in the original list, and the number of scheduled arrivals in the
+        # original list as values
+        self.entries = {}
+
+        for stop_tag, blocks in scheduled_arrivals.items():
+            for block_id, block_scheduled_arrivals in blocks.items():
+                self.add(stop_tag=stop_tag,
+                         block_id=block_id,
+                         scheduled_arrivals=block_scheduled_arrivals)
+
+    def __contains__(self, key):
+        """Check if there are scheduled arrivals for a combination of stop tag and block ID.
+
+        Arguments:
+            key: (Tuple) Tuple of a stop tag and block ID.
+
+        Returns:
+            True if there are scheduled arrivals for the stop and block ID, otherwise False.
+        """
+
+        return key in self.entries
+
+    def add(self, stop_tag, block_id, scheduled_arrivals):
+        """Add the scheduled arrivals for a combination of stop and block ID to the index, replacing
+        any that were already added for the stop and block ID.
+
+        Arguments:
+            stop_tag: (Integer) Tag of the stop.
+            block_id: (Integer) Block ID.
+            scheduled_arrivals: (List) Objects with an integer "time" attribute for each scheduled
+                arrival of the block ID at the stop, such as instances of ScheduledArrivalRecord.
+        """
+
+        # When there are multiple scheduled arrivals at the same time, only the first is kept, since
+        # it would always be matched before the others
+        earliest_positions = {}
+        for position, scheduled_arrival in enumerate(scheduled_arrivals):
+            earliest_positions.setdefault(scheduled_arrival.time, position)
+
+        times = sorted(earliest_positions)
+        positions = [earliest_positions[time] for time in times]
+        self.entries[(stop_tag, block_id)] = (array.array('l', times),
+                                              [scheduled_arrivals[position]
+                                               for position in positions],
+                                              array.array('l', positions),
+                                              len(scheduled_arrivals))
+
+    @classmethod
+    def from_state(cls, state, single_scheduled_arrival_threshold):
+        """Create an index from the state of an index returned by the get_state method, without
+        sorting the scheduled arrivals again.
+
+        Arguments:
+            state: (List) The state of the index, in the format returned by the get_state method.
+            single_scheduled_arrival_threshold: (Integer) Maximum number of seconds between an
+                arrival and the scheduled arrival, for a stop and block ID with only one scheduled
+                arrival, for the scheduled arrival to be matched to the arrival.
+
+        Returns:
+            Instance of ScheduledArrivalIndex.
+        """
+
+        index = cls(scheduled_arrivals={},
+                    single_scheduled_arrival_threshold=single_scheduled_arrival_threshold)
+        for stop_tag, block_id, times, records, positions, count in state:
+            index.entries[(stop_tag, block_id)] = (
+                array.array('l', times),
+                [ScheduledArrivalRecord(id=scheduled_arrival_id, stop_id=stop_id, time=time)
+                 for scheduled_arrival_id, stop_id, time in records],
+                array.array('l', positions),
+                count)
+
+        return index
+
+    def get_state(self):
+        """Get the contents of the index as lists of integers that can be encoded as JSON, such as
+        to write the index to a checkpoint. The scheduled arrivals must be instances of
+        ScheduledArrivalRecord.
+
+        Returns:
+            List with a list for each combination of stop tag and block ID of the stop tag, block
+            ID, sorted scheduled arrival times, lists of the ID, stop ID, and time of the scheduled
+            arrival for each time, positions of the scheduled arrivals, and number of scheduled
+            arrivals that were added.
+        """
+
+        return [[stop_tag, block_id, list(times),
+                 [[scheduled_arrival.id, scheduled_arrival.stop_id, scheduled_arrival.time]
+                  for scheduled_arrival in scheduled_arrivals],
+                 list(positions), count]
+                for (stop_tag, block_id), (times, scheduled_arrivals, positions, count)
+                in self.entries.items()]
+
+    def get_scheduled_arrival(self, stop_tag, block_id, arrival_time):
+        """Get the scheduled arrival closest to an arrival that occurred.
+
+        Arguments:
+            stop_tag: (Integer) The tag identifying the stop where the arrival occurred.
+            block_id: (Integer) Block ID of the vehicle that arrived at the stop.
+            arrival_time: (Integer) Midnight epoch timestamp indicating when the arrival occurred.
+
+        Returns:
+            The closest scheduled arrival to the arrival, or None if there are no scheduled arrivals
+            for the combination of stop and block, or if there is only one scheduled arrival and it
+            is not within the single scheduled arrival threshold of the arrival. If multiple
+            scheduled arrivals are equally close, the one that was first in the list they were
+            added with is returned.
+        """
+
+        entry = self.entries.get((stop_tag, block_id))
+        if entry is None:
+            return None
+
+        times, scheduled_arrivals, positions, count = entry
+
+        # Some stops only have one scheduled arrival time for a block ID even if there are multiple
+        # trips for the block ID that serve the stop, when there is a trip that begins or ends at
+        # the stop. To avoid every arrival throughout the day from being compared to the single
+        # scheduled arrival time, the arrival will only be compared to the single arrival time if
+        # the arrival is within a threshold.
+        if count == 1:
+            if abs(arrival_time - times[0]) <= self.single_scheduled_arrival_threshold:
+                return scheduled_arrivals[0]
+            else:
+                return None
+
+        closest_index = None
+        closest_difference = None
+        # Compare the arrival to the scheduled arrivals on the same day, to scheduled arrivals after
+        # midnight if the arrival is before midnight, and to scheduled arrivals before midnight if
+        # the arrival is after midnight
+        for target_time in (arrival_time,
+                            arrival_time - SECONDS_PER_DAY,
+                            arrival_time + SECONDS_PER_DAY):
+            insertion_index = bisect.bisect_left(times, target_time)
+            for index in (insertion_index - 1, insertion_index):
+                if index < 0 or index >= len(times):
+                    continue
+
+                difference = abs(target_time - times[index])
+                if closest_difference is None or difference < closest_difference or \
+                        (difference == closest_difference and
+                         positions[index] < positions[closest_index]):
+                    closest_index = index
+                    closest_difference = difference
+
+        if closest_index is None:
+            return None
+
+        return scheduled_arrivals[closest_index]
+
+    def get_scheduled_arrivals_for_arrivals(self, arrivals, arrival_time):
+        """Get the closest scheduled arrival for every arrival that occurred at the same time.
+
+        Arguments:
+            arrivals: (Dictionary) Dictionary with stop tags as keys and lists of block IDs of
+                arrivals as values, in the format returned by RouteWorker.get_arrivals.
+            arrival_time: (Integer) Midnight epoch timestamp indicating when the arrivals occurred.
+
+        Returns:
+            List of tuples of the stop tag, block ID, and closest scheduled arrival for each
+            arrival, in the same order as the provided arrivals. The scheduled arrival is None if
+            there is no matching scheduled arrival for the arrival.
+        """
+
+        return [(stop_tag, block_id, self.get_scheduled_arrival(stop_tag=stop_tag,
+                                                                block_id=block_id,
+                                                                arrival_time=arrival_time))
+                for stop_tag, block_ids in arrivals.items()
+                for block_id in block_ids]
@@ -3,11 +3,10 @@
 import configparser
 import logging
 import os.path as path
-import py_nextbus
 
 import how_late_is_muni.settings as settings
 from worker.models import Stop
-from worker.libs import utils
+from worker.libs import nextbus, utils
 
 log = logging.getLogger(__name__)
 
@@ -63,8 +62,8 @@ def get_stop_coordinates_for_route(route_tag):
             longitude: Float, the longitude of the stop's location.
     """
 
-    nextbus_client = py_nextbus.NextBusClient(output_format='json',
-                                              agency=config.get('nextbus', 'agency'))
+    nextbus_client = nextbus.NextBusClient(output_format='json',
+                                           agency=config.get('nextbus', 'agency'))
     route_config = nextbus_client.get_route_config(route_tag=route_tag)
 
     stops = {}
@@ -59,11 +59,24 @@ def get_current_service_class():
         if the current day is Saturday, and "sun" if the current day is Sunday.
     """
 
-    current_day = datetime.datetime.now().strftime('%A').lower()
+    return get_service_class(datetime.datetime.now())
 
-    if current_day == 'saturday':
+def get_service_class(date):
+    """Get the service class for a day.
+
+    Arguments:
+        date: (datetime.date or datetime.datetime) The day to get the service class for.
+
+    Returns:
+        String, the service class for the day. "wkd" if the day is a weekday, "sat" if the day is
+        Saturday, and "sun" if the day is Sunday.
+    """
+
+    day = date.strftime('%A').lower()
+
+    if day == 'saturday':
         return 'sat'
-    elif current_day == 'sunday':
+    elif day == 'sunday':
         return 'sun'
     else:
         return 'wkd'
@@ -0,0 +1,307 @@
+"""Detection of arrivals from the locations of vehicles returned by the NextBus "vehicleLocations"
+command, as an alternative to inferring arrivals from the predictions for every stop.
+
+A vehicle has arrived at a stop when it is reported within a radius of the stop. Stops are found in
+a grid of cells around the stops of the route, so that finding the stop a vehicle is at only
+compares it to the stops in the cells around it. Vehicles often pass stops between two reports, so
+when consecutive stops that a vehicle arrives at are in the same schedule, it is also considered to
+have arrived at the stops between them in the schedule's stop order, at times interpolated between
+the two reports."""
+
+import collections
+import logging
+import math
+
+from worker.libs import utils
+
+LOG = logging.getLogger(__name__)
+
+# Approximate number of meters in a degree of latitude, which is accurate enough for the distances
+# between a vehicle and a stop
+METERS_PER_DEGREE = 111320
+
+# Location of a vehicle reported by NextBus, with the time it was reported as a Unix timestamp
+VehicleReport = collections.namedtuple('VehicleReport', ('vehicle_id', 'latitude', 'longitude',
+                                                         'report_time'))
+
+# Arrival of a vehicle at a stop, with the time it arrived as a Unix timestamp
+VehicleArrival = collections.namedtuple('VehicleArrival', ('vehicle_id', 'stop_tag',
+                                                           'arrival_time'))
+
+class StopIndex(object):
+    """Spatial index of the stops of a route, for finding the stop that a vehicle is at, and the
+    order of the stops in each schedule of the route."""
+
+    def __init__(self, stops, sequences, radius_meters):
+        """
+        Arguments:
+            stops: (Dictionary) Stop tags as keys and tuples of the latitude and longitude of each
+                stop as values. Stops without a location are not included.
+            sequences: (List of lists) Tags of the stops of each schedule of the route, such as
+                each direction, in stop order.
+            radius_meters: (Float) Maximum distance between a vehicle and a stop for the vehicle to
+                be at the stop.
+        """
+
+        self.radius_meters = radius_meters
+        self.stops = stops
+
+        # Cells are as large as the radius, so every stop within the radius of a location is in the
+        # cell of the location or one of the cells around it
+        mean_latitude = sum(latitude for latitude, _ in stops.values()) / len(stops) \
+            if stops else 0
+        self.latitude_step = radius_meters / METERS_PER_DEGREE
+        self.longitude_step = radius_meters / \
+            (METERS_PER_DEGREE * max(math.cos(math.radians(mean_latitude)), 0.01))
+        self.longitude_scale = math.cos(math.radians(mean_latitude))
+
+        self.cells = {}
+        for stop_tag, (latitude, longitude) in stops.items():
+            self.cells.setdefault(self.get_cell(latitude, longitude), []).append(stop_tag)
+
+        # Keyed by stop tags, with lists of tuples of the index of each sequence the stop is in and
+        # the position of the stop in the sequence
+        self.sequences = [list(sequence) for sequence in sequences]
+        self.positions = {}
+        for sequence_index, sequence in enumerate(self.sequences):
+            for position, stop_tag in enumerate(sequence):
+                self.positions.setdefault(stop_tag, []).append((sequence_index, position))
+
+    def get_cell(self, latitude, longitude):
+        """Get the cell of the grid that a location is in.
+
+        Arguments:
+            latitude: (Float) Latitude of the location.
+            longitude: (Float) Longitude of the location.
+
+        Returns:
+            Tuple of the row and column of the cell.
+        """
+
+        return (math.floor(latitude / self.latitude_step),
+                math.floor(longitude / self.longitude_step))
+
+    def get_distance_meters(self, latitude, longitude, stop_tag):
+        """Get the approximate distance between a location and a stop, treating the area of the
+        route as flat.
+
+        Arguments:
+            latitude: (Float) Latitude of the location.
+            longitude: (Float) Longitude of the location.
+            stop_tag: (Integer) Tag of the stop.
+
+        Returns:
+            Float, the distance in meters.
+        """
+
+        stop_latitude, stop_longitude = self.stops[stop_tag]
+        return METERS_PER_DEGREE * math.hypot(latitude - stop_latitude,
+                                              (longitude - stop_longitude) * self.longitude_scale)
+
+    def get_nearest_stop(self, latitude, longitude):
+        """Get the closest stop to a location, if it is within the radius.
+
+        Arguments:
+            latitude: (Float) Latitude of the location.
+            longitude: (Float) Longitude of the location.
+
+        Returns:
+            The tag of the closest stop, or None if there is no stop within the radius.
+        """
+
+        row, column = self.get_cell(latitude, longitude)
+
+        nearest_stop_tag = None
+        nearest_distance = None
+        for cell_row in (row - 1, row, row + 1):
+            for cell_column in (column - 1, column, column + 1):
+                for stop_tag in self.cells.get((cell_row, cell_column), ()):
+                    distance = self.get_distance_meters(latitude, longitude, stop_tag)
+                    if distance <= self.radius_meters and \
+                            (nearest_distance is None or distance < nearest_distance):
+                        nearest_stop_tag = stop_tag
+                        nearest_distance = distance
+
+        return nearest_stop_tag
+
+    def get_stops_between(self, from_stop_tag, to_stop_tag):
+        """Get the stops that a vehicle passed going from one stop to another, in the first
+        schedule that has both stops with the first stop before the second.
+
+        Arguments:
+            from_stop_tag: (Integer) Tag of the stop the vehicle was at first.
+            to_stop_tag: (Integer) Tag of the stop the vehicle is at now.
+
+        Returns:
+            List of the tags of the stops between the two stops, in stop order, which is empty if
+            no schedule has the stops in that order.
+        """
+
+        to_positions = dict(self.positions.get(to_stop_tag, ()))
+        for sequence_index, from_position in self.positions.get(from_stop_tag, ()):
+            to_position = to_positions.get(sequence_index)
+            if to_position is not None and to_position > from_position:
+                return self.sequences[sequence_index][from_position + 1:to_position]
+
+        return []
+
+class VehicleTracker(object):
+    """Class to find the arrivals of the vehicles of a route at its stops from consecutive reports
+    of their locations."""
+
+    def __init__(self, stop_index, max_gap_seconds):
+        """
+        Arguments:
+            stop_index: (StopIndex) Index of the stops of the route.
+            max_gap_seconds: (Float) Maximum number of seconds between the arrivals of a vehicle at
+                two stops for it to be considered to have arrived at the stops between them.
+        """
+
+        self.stop_index = stop_index
+        self.max_gap_seconds = max_gap_seconds
+
+        # Keyed by vehicle IDs, with tuples of the tag of the last stop the vehicle arrived at, the
+        # time it arrived, and the time of its last report as values
+        self.vehicles = {}
+
+    def remove_vehicles(self, reported_before):
+        """Stop tracking the vehicles whose last report is older than a time.
+
+        Arguments:
+            reported_before: (Float) Unix timestamp that the last report of a vehicle must be
+                before for the vehicle to be removed.
+
+        Returns:
+            List of the IDs of the vehicles that were removed.
+        """
+
+        vehicle_ids = [vehicle_id for vehicle_id, (_, _, last_report_time) in self.vehicles.items()
+                       if last_report_time < reported_before]
+        for vehicle_id in vehicle_ids:
+            del self.vehicles[vehicle_id]
+
+        return vehicle_ids
+
+    def update(self, reports):
+        """Find the arrivals in new reports of the locations of vehicles.
+
+        Arguments:
+            reports: (Iterable) Instances of VehicleReport.
+
+        Returns:
+            List of instances of VehicleArrival, in the order they occurred for each vehicle.
+        """
+
+        arrivals = []
+        for report in sorted(reports, key=lambda report: report.report_time):
+            last_stop_tag, last_arrival_time, last_report_time = \
+                self.vehicles.get(report.vehicle_id, (None, None, None))
+
+            # Vehicles whose location has not changed are still returned by NextBus
+            if last_report_time is not None and report.report_time <= last_report_time:
+                continue
+
+            stop_tag = self.stop_index.get_nearest_stop(report.latitude, report.longitude)
+            if stop_tag is None or stop_tag == last_stop_tag:
+                self.vehicles[report.vehicle_id] = (last_stop_tag, last_arrival_time,
+                                                    report.report_time)
+                continue
+
+            if last_stop_tag is not None and \
+                    report.report_time - last_arrival_time <= self.max_gap_seconds:
+                passed_stop_tags = self.stop_index.get_stops_between(last_stop_tag, stop_tag)
+                for position, passed_stop_tag in enumerate(passed_stop_tags, 1):
+                    arrival_time = last_arrival_time + \
+                        (report.report_time - last_arrival_time) * position / \
+                        (len(passed_stop_tags) + 1)
+                    arrivals.append(VehicleArrival(vehicle_id=report.vehicle_id,
+                                                   stop_tag=passed_stop_tag,
+                                                   arrival_time=arrival_time))
+
+            arrivals.append(VehicleArrival(vehicle_id=report.vehicle_id,
+                                           stop_tag=stop_tag,
+                                           arrival_time=report.report_time))
+            self.vehicles[report.vehicle_id] = (stop_tag, report.report_time, report.report_time)
+
+        return arrivals
+
+def get_vehicle_blocks(predictions):
+    """Get the block ID of each vehicle in the predictions returned by NextBus, since the locations
+    of vehicles do not include their block IDs.
+
+    Arguments:
+        predictions: (List of dictionaries) The "predictions" objects returned by the NextBus API by
+            the "predictionsForMultiStops" command.
+
+    Returns:
+        Dictionary with vehicle IDs as keys and block IDs as values.
+    """
+
+    vehicle_blocks = {}
+    for stop in utils.ensure_is_list(predictions):
+        for direction in utils.ensure_is_list(stop.get('direction', [])):
+            for prediction in utils.ensure_is_list(direction.get('prediction', [])):
+                try:
+                    vehicle_blocks[prediction['vehicle']] = int(prediction['block'])
+                except (KeyError, ValueError, TypeError):
+                    continue
+
+    return vehicle_blocks
+
+def group_arrivals(vehicle_arrivals, vehicle_blocks):
+    """Group arrivals of vehicles by the second they occurred in, in the format that arrivals are
+    saved in.
+
+    Arguments:
+        vehicle_arrivals: (Iterable) Instances of VehicleArrival.
+        vehicle_blocks: (Dictionary) Vehicle IDs as keys and block IDs as values. Arrivals of
+            vehicles without a block ID are skipped.
+
+    Returns:
+        List of tuples of an integer Unix timestamp and a dictionary with stop tags as keys and lists
+        of the block IDs of the arrivals at the time as values, sorted by time.
+    """
+
+    grouped_arrivals = {}
+    for vehicle_arrival in vehicle_arrivals:
+        block_id = vehicle_blocks.get(vehicle_arrival.vehicle_id)
+        if block_id is None:
+            LOG.debug('Block ID of vehicle %s is not known', vehicle_arrival.vehicle_id)
+            continue
+
+        arrivals = grouped_arrivals.setdefault(int(vehicle_arrival.arrival_time), {})
+        arrivals.setdefault(vehicle_arrival.stop_tag, []).append(block_id)
+
+    return sorted(grouped_arrivals.items())
+
+def parse_vehicle_locations(response, retrieve_time):
+    """Parse the response to the "vehicleLocations" command.
+
+    Arguments:
+        response: (Dictionary) The JSON returned by NextBus.
+        retrieve_time: (Float) Unix timestamp of when the response was retrieved, which the ages of
+            the reports are relative to.
+
+    Returns:
+        Tuple of a list of instances of VehicleReport for the vehicles that are predictable, and the
+        "lastTime" of the response in milliseconds, to be used as the "t" parameter of the next
+        request, or None if the response does not have one.
+    """
+
+    reports = []
+    for vehicle in utils.ensure_is_list(response.get('vehicle', [])):
+        if vehicle.get('predictable', 'true') != 'true':
+            continue
+
+        try:
+            reports.append(VehicleReport(
+                vehicle_id=vehicle['id'],
+                latitude=float(vehicle['lat']),
+                longitude=float(vehicle['lon']),
+                report_time=retrieve_time - int(vehicle.get('secsSinceReport', 0))))
+        except (KeyError, ValueError, TypeError):
+            LOG.info('Vehicle location %s is not valid', vehicle)
+
+    last_time = response.get('lastTime', {}).get('time')
+
+    return reports, int(last_time) if last_time is not None else None
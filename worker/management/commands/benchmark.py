@@ -0,0 +1,109 @@
+"""Command for timing the hot paths of the worker against synthetic agencies of several sizes, from a
+single small route to an agency the size of the one in the [fake_nextbus] section of the config.
+
+The routes and schedules of the agencies are added to the database inside of a transaction that is
+rolled back once the benchmarks finish, so running the benchmarks does not change the database. The
+results can be written to a JSON file, and compared to the results of an earlier run to find
+regressions.
+"""
+
+import datetime
+import json
+import logging
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from worker import benchmark_suite
+from worker.libs import benchmark
+
+LOG = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Time the hot paths of the worker against synthetic agencies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size',
+                            dest='sizes',
+                            action='append',
+                            choices=benchmark_suite.SIZES,
+                            help='Size of the agency to run the benchmarks with. This can be ' \
+                                 'provided multiple times. Defaults to "small" and "route".')
+        parser.add_argument('--benchmark',
+                            dest='names',
+                            action='append',
+                            choices=benchmark_suite.BENCHMARKS,
+                            help='Only run the provided benchmark. This can be provided multiple ' \
+                                 'times.')
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=5,
+                            help='Number of times to time each benchmark.')
+        parser.add_argument('--output',
+                            help='Path of a file to write the results to as JSON.')
+        parser.add_argument('--compare',
+                            help='Path of a file with the results of an earlier run to compare ' \
+                                 'the results to. The command fails if any benchmark is slower ' \
+                                 'than it was by more than the threshold.')
+        parser.add_argument('--threshold',
+                            type=float,
+                            default=0.2,
+                            help='Fraction that a benchmark must be slower than it was in the ' \
+                                 'earlier run to be a regression.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('Repeat must be at least 1')
+
+        baseline = None
+        if options['compare'] is not None:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as exc:
+                raise CommandError('Could not read results from %s: %s' % (options['compare'],
+                                                                           exc))
+
+        sizes = options['sizes'] or ['small', 'route']
+        names = options['names'] or benchmark_suite.BENCHMARKS
+
+        results = []
+        for size in sizes:
+            suite = benchmark_suite.BenchmarkSuite(agency=benchmark_suite.get_agency(size),
+                                                   size=size,
+                                                   repeat=options['repeat'])
+            with transaction.atomic():
+                size_results = suite.run(names=names)
+                transaction.set_rollback(True)
+
+            for result in size_results:
+                self.stdout.write('%-26s %-7s %10.2f ms median %10.2f ms min %12.0f items/s' % (
+                    result['name'], result['size'], result['median_seconds'] * 1000,
+                    result['min_seconds'] * 1000, result['items_per_second']))
+            results.extend(size_results)
+
+        if options['output'] is not None:
+            with open(options['output'], 'w') as output_file:
+                json.dump({
+                    'created': datetime.datetime.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'machine': platform.platform(),
+                    'results': results
+                }, output_file, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            comparisons = benchmark.compare_results(baseline_results=baseline['results'],
+                                                    results=results,
+                                                    threshold=options['threshold'])
+            for comparison in comparisons:
+                self.stdout.write('%-26s %-7s %+7.1f%%%s' % (
+                    comparison['name'], comparison['size'], comparison['change'] * 100,
+                    ' REGRESSION' if comparison['regression'] else ''))
+
+            regressions = [comparison for comparison in comparisons if comparison['regression']]
+            if regressions:
+                raise CommandError('%d benchmarks are more than %d%% slower than in %s' % (
+                    len(regressions), options['threshold'] * 100, options['compare']))
@@ -0,0 +1,89 @@
+"""Command for running a fake NextBus server that serves a synthetic transit agency, so that the
+worker can be load tested and its handling of failures can be tested without making requests to
+NextBus.
+
+To make the worker and the update_schedules command use the fake server, set json_feed_url in the
+[nextbus] section of the config to the URL that is logged when the server starts.
+"""
+
+import configparser
+import logging
+import os.path as path
+
+from django.core.management.base import BaseCommand, CommandError
+
+import how_late_is_muni.settings as settings
+from worker.fake_nextbus_server import ERROR_KINDS, FakeNextBusServer
+from worker.libs.fake_agency import FakeAgency
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class Command(BaseCommand):
+    help = 'Run a fake NextBus server that serves a synthetic transit agency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host',
+                            default=config.get('fake_nextbus', 'host'),
+                            help='Host to listen on.')
+        parser.add_argument('--port',
+                            type=int,
+                            default=int(config.get('fake_nextbus', 'port')),
+                            help='Port to listen on.')
+        parser.add_argument('--scale',
+                            type=float,
+                            default=1,
+                            help='Multiply the number of routes in the config by this, to test ' \
+                                 'agencies several times larger than the configured agency.')
+        parser.add_argument('--latency-ms',
+                            dest='latency_ms',
+                            type=float,
+                            default=float(config.get('fake_nextbus', 'latency_ms')),
+                            help='Average number of milliseconds to wait before responding.')
+        parser.add_argument('--error-rate',
+                            dest='error_rate',
+                            type=float,
+                            default=float(config.get('fake_nextbus', 'error_rate')),
+                            help='Fraction of requests, between 0 and 1, that return an error.')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError('Error rate must be between 0 and 1')
+
+        error_kinds = [error_kind.strip()
+                       for error_kind in config.get('fake_nextbus', 'error_kinds').split(',')
+                       if error_kind.strip()]
+        for error_kind in error_kinds:
+            if error_kind not in ERROR_KINDS:
+                raise CommandError('Unknown error kind %s' % error_kind)
+
+        agency = FakeAgency(
+            routes=max(1, int(int(config.get('fake_nextbus', 'routes')) * options['scale'])),
+            stops_per_direction=int(config.get('fake_nextbus', 'stops_per_direction')),
+            vehicles_per_route=int(config.get('fake_nextbus', 'vehicles_per_route')),
+            seconds_between_stops=int(config.get('fake_nextbus', 'seconds_between_stops')),
+            max_delay_seconds=int(config.get('fake_nextbus', 'max_delay_seconds')),
+            seed=int(config.get('fake_nextbus', 'seed')))
+
+        server = FakeNextBusServer(
+            address=(options['host'], options['port']),
+            agency=agency,
+            agency_name=config.get('nextbus', 'agency'),
+            latency_seconds=options['latency_ms'] / 1000,
+            error_rate=options['error_rate'],
+            error_kinds=error_kinds,
+            timeout_seconds=float(config.get('nextbus', 'read_timeout')) + 1,
+            day_switch_time=int(config.get('worker', 'day_switch_time')))
+
+        LOG.info('Serving %d routes at %s', len(agency.route_tags), server.get_feed_url())
+        self.stdout.write('Serving %d routes at %s' % (len(agency.route_tags),
+                                                       server.get_feed_url()))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            LOG.info('Fake NextBus server stopped after %s', server.get_stats())
@@ -0,0 +1,87 @@
+"""Command for profiling a running worker without restarting it, by signalling the process of the
+run command to sample the stacks of all of its threads for a number of seconds.
+
+The profile is written by the worker's process to the directory in the [profiler] section of the
+config, as collapsed stacks that can be rendered as a flame graph, and a summary of the samples and
+CPU time of each thread.
+"""
+
+import configparser
+import glob
+import logging
+import os
+import os.path as path
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+import how_late_is_muni.settings as settings
+from worker import sampling_profiler
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class Command(BaseCommand):
+    help = 'Profile a running worker by sampling the stacks of all of its threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pid',
+                            type=int,
+                            help='ID of the process of the run command to profile.')
+        parser.add_argument('--seconds',
+                            type=float,
+                            help='Number of seconds to profile for. Defaults to the number of ' \
+                                 'seconds in the config.')
+        parser.add_argument('--no-wait',
+                            dest='wait',
+                            action='store_false',
+                            help='Return immediately after starting the profiler, instead of ' \
+                                 'waiting for the profile to be written.')
+
+    def handle(self, *args, **options):
+        if sampling_profiler.PROFILE_SIGNAL is None:
+            raise CommandError('Profiling on a signal is not supported on this platform')
+
+        if options['seconds'] is not None and options['seconds'] <= 0:
+            raise CommandError('Seconds must be greater than 0')
+
+        directory = sampling_profiler.get_profile_directory()
+        os.makedirs(directory, exist_ok=True)
+        pattern = path.join(directory, 'profile-*-%d.threads.txt' % options['pid'])
+        existing_profiles = set(glob.glob(pattern))
+
+        if options['seconds'] is not None:
+            with open(sampling_profiler.get_request_path(directory, options['pid']), 'w') \
+                    as request_file:
+                request_file.write(str(options['seconds']))
+
+        try:
+            os.kill(options['pid'], sampling_profiler.PROFILE_SIGNAL)
+        except OSError as exc:
+            raise CommandError('Could not signal process %d: %s' % (options['pid'], exc))
+
+        if not options['wait']:
+            return
+
+        seconds = options['seconds']
+        if seconds is None:
+            seconds = float(config.get('profiler', 'seconds'))
+
+        # Allow time for the profile to be written after profiling finishes
+        deadline = time.monotonic() + seconds + 30
+        while time.monotonic() < deadline:
+            new_profiles = set(glob.glob(pattern)) - existing_profiles
+            if new_profiles:
+                summary_path = sorted(new_profiles)[-1]
+                self.stdout.write('Wrote %s and %s' % (
+                    summary_path[:-len('.threads.txt')] + '.collapsed', summary_path))
+                with open(summary_path) as summary_file:
+                    self.stdout.write(summary_file.read())
+                return
+
+            time.sleep(0.5)
+
+        raise CommandError('Process %d did not write a profile. Check that it is running the run ' \
+                           'command, and that it is not already being profiled.' % options['pid'])
@@ -0,0 +1,80 @@
+"""Command for replaying recorded prediction responses through the same steps that are used to find
+and save arrivals from live predictions, to measure how quickly arrivals can be found and to check
+changes to arrival detection against real data.
+
+By default, the arrivals are saved inside of a transaction that is rolled back once the replay
+finishes, so that replaying does not change the database. To keep the arrivals, use the --commit
+argument, preferably with the DATABASES setting pointing to a scratch database.
+"""
+
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from worker.libs import recording
+from worker.prediction_replayer import PredictionReplayer, STAGES
+
+LOG = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Replay recorded predictions to find arrivals, and report how long it took'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory',
+                            help='Directory containing the segment files of the recording.')
+        parser.add_argument('--route',
+                            dest='route_tags',
+                            action='append',
+                            help='Only replay the predictions for the provided route. This can be ' \
+                                 'provided multiple times to replay several routes.')
+        parser.add_argument('--speed',
+                            type=float,
+                            default=0,
+                            help='How many times faster than real time to replay the predictions. ' \
+                                 'The default of 0 replays them as fast as possible.')
+        parser.add_argument('--commit',
+                            action='store_true',
+                            help='Keep the arrivals that are saved, instead of rolling them back ' \
+                                 'after the replay finishes.')
+        parser.add_argument('--format',
+                            dest='output_format',
+                            choices=['text', 'json'],
+                            default='text',
+                            help='Format to report the results in.')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('Speed must not be negative')
+
+        if not recording.get_segment_paths(options['directory']):
+            raise CommandError('No recorded predictions in %s' % options['directory'])
+
+        records = recording.read_recording(options['directory'])
+        if options['route_tags']:
+            route_tags = set(options['route_tags'])
+            records = (record for record in records if record[1] in route_tags)
+
+        replayer = PredictionReplayer(speed=options['speed'])
+        with transaction.atomic():
+            stats = replayer.replay(records)
+
+            if not options['commit']:
+                transaction.set_rollback(True)
+
+        if options['output_format'] == 'json':
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write('Snapshots replayed: %d (%d skipped)' % (stats['snapshots'],
+                                                                   stats['skipped_snapshots']))
+        self.stdout.write('Arrivals found: %d, saved: %d' % (stats['arrivals'],
+                                                             stats['saved_arrivals']))
+        self.stdout.write('Simulated %.1f seconds in %.3f seconds (%.1fx)' % (
+            stats['simulated_seconds'], stats['wall_seconds'], stats['speedup']))
+        self.stdout.write('Throughput: %.1f snapshots/sec' % stats['snapshots_per_second'])
+        for stage in STAGES:
+            self.stdout.write('  %-7s %9.3f s total %9.3f ms/snapshot' % (
+                stage, stats['stages'][stage]['total_seconds'],
+                stats['stages'][stage]['mean_milliseconds']))
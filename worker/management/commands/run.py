@@ -6,9 +6,14 @@ from django.core.management.base import BaseCommand, CommandError
 
 import how_late_is_muni.settings as settings
 import worker.libs.utils as utils
+from worker import sampling_profiler
+from worker.async_route_manager import AsyncRouteManager
+from worker.metrics_server import MetricsServer
 from worker.models import Route, ScheduleClass
+from worker.prediction_recorder import PredictionRecorder
 from worker.route_manager import RouteManager
 from worker.route_worker import RouteWorker
+from worker.sharded_route_manager import ShardedRouteManager
 
 LOG = logging.getLogger(__name__)
 
@@ -25,10 +30,61 @@ class Command(BaseCommand):
                                   'the routes for the transit agency. The value must be a route ' \
                                   'tag matching the tag of an existing route for the transit ' \
                                   'agency.')
+        parser.add_argument('--shard',
+                            action='store_true',
+                            help='Run the worker as one of several shards that each track a share ' \
+                                 'of the routes, which can be run on the same or other hosts ' \
+                                 'with the same database.')
+        parser.add_argument('--metrics-port',
+                            type=int,
+                            help='Serve metrics on the provided port, even if the metrics ' \
+                                 'endpoint is not enabled in the config.')
 
     def handle(self, *args, **options):
-        if options['route_tag'] is None:
-            manager = RouteManager()
+        # Allow the worker to be profiled with the profile command while it is running
+        sampling_profiler.install_signal_handler()
+
+        metrics_server = None
+        if options['metrics_port'] is not None or config.getboolean('metrics', 'enabled'):
+            port = options['metrics_port']
+            if port is None:
+                port = int(config.get('metrics', 'port'))
+
+            try:
+                metrics_server = MetricsServer((config.get('metrics', 'host'), port))
+            except OSError as exc:
+                raise CommandError('Could not serve metrics on port %d: %s' % (port, exc))
+            metrics_server.start()
+
+        try:
+            self.run_worker(options)
+        finally:
+            if metrics_server is not None:
+                metrics_server.stop()
+
+    def run_worker(self, options):
+        """Run the route manager for all routes or for the share of the routes of a shard, or a
+        worker for a single route.
+
+        Arguments:
+            options: (Dictionary) The options the command was run with.
+        """
+
+        if options['shard'] and options['route_tag'] is not None:
+            raise CommandError('A single route cannot be run as a shard')
+
+        if options['shard']:
+            if config.get('worker', 'manager_mode') != 'threads':
+                raise CommandError('Shards can only be run with the "threads" manager_mode')
+
+            ShardedRouteManager().run()
+        elif options['route_tag'] is None:
+            if config.get('worker', 'manager_mode') == 'asyncio':
+                manager = AsyncRouteManager()
+            else:
+                manager = RouteManager()
+
+            manager.run()
         else:
             service_class = utils.get_current_service_class()
             active_schedule_classes = ScheduleClass.objects.filter(is_active=True,
@@ -40,9 +96,19 @@ class Command(BaseCommand):
                 raise CommandError('Route %s is not a valid route' % options['route_tag'])
 
             else:
+                prediction_recorder = None
+                if config.getboolean('recorder', 'enabled'):
+                    prediction_recorder = PredictionRecorder()
+                    prediction_recorder.start()
+
                 route_worker = RouteWorker(route_tag=options['route_tag'],
                                            agency=config.get('nextbus', 'agency'),
-                                           service_class=service_class)
-                route_worker.run()
+                                           service_class=service_class,
+                                           prediction_recorder=prediction_recorder)
+                try:
+                    route_worker.run()
+                finally:
+                    if prediction_recorder is not None:
+                        prediction_recorder.stop()
 
                 LOG.warning('Worker stopped running')
@@ -39,17 +39,24 @@ class Command(BaseCommand):
 
         # Update all routes if one wasn't specified
         if options['route_tag'] is None:
-            # Deactivate all existing ScheduleClasses in the database
-            ScheduleClass.objects.all().update(is_active=False)
-
             routes = route.get_routes(agency)
             utils.bulk_upsert(model=Route,
                               data=routes,
                               update_on_conflict=True,
                               conflict_columns=['tag'])
 
+            # Only the schedules that changed are rewritten, so routes stay active while they are
+            # being updated
+            updated_routes = 0
             for r in routes:
-                schedule.update_schedule_for_route(Route.objects.get(tag=r['tag']))
+                if schedule.update_schedule_for_route(Route.objects.get(tag=r['tag'])):
+                    updated_routes += 1
+
+            # Deactivate the schedules of routes that are no longer run by the agency
+            ScheduleClass.objects.exclude(route__tag__in=[r['tag'] for r in routes]) \
+                .update(is_active=False)
+
+            log.info('Updated schedules for %d of %d routes', updated_routes, len(routes))
 
         # Update provided route
         else:
@@ -0,0 +1,101 @@
+import http.server
+import logging
+import socketserver
+import threading
+
+from worker.libs import metrics
+
+LOG = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Handles requests for the metrics of the worker."""
+
+    def do_GET(self):
+        """Respond to a request for the metrics."""
+
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_body(b'Not Found', status=404, content_type='text/plain')
+            return
+
+        try:
+            body = self.server.registry.render().encode('utf-8')
+        except Exception:
+            LOG.exception('Failed to render metrics due to exception')
+            self.send_body(b'Internal Server Error', status=500, content_type='text/plain')
+            return
+
+        self.send_body(body, status=200, content_type=CONTENT_TYPE)
+
+    def log_message(self, format, *args):
+        """Log requests at the debug level instead of writing them to stderr."""
+
+        LOG.debug('%s - %s', self.address_string(), format % args)
+
+    def send_body(self, body, status, content_type):
+        """Send a response.
+
+        Arguments:
+            body: (Bytes) The body of the response.
+            status: (Integer) HTTP status of the response.
+            content_type: (String) Content type of the body.
+        """
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            LOG.debug('Client disconnected before the response was sent')
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server that serves the metrics of the worker in the Prometheus text format from a
+    background thread, so that it can run alongside the route manager or a single route worker."""
+
+    daemon_threads = True
+
+    def __init__(self, address, registry=None):
+        """
+        Arguments:
+            address: (Tuple) Host and port to listen on. If the port is 0, any free port is used.
+            registry: (Registry) The metrics to serve. If this is None, the registry shared by the
+                process is used.
+        """
+
+        super().__init__(address, MetricsHandler)
+
+        self.registry = registry if registry is not None else metrics.get_registry()
+        self.thread = None
+
+    def get_url(self):
+        """Get the URL that the metrics are served at.
+
+        Returns:
+            String with the URL.
+        """
+
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/metrics' % (host, port)
+
+    def start(self):
+        """Start serving requests in a background thread."""
+
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='metrics server',
+                                       daemon=True)
+        self.thread.start()
+
+        LOG.info('Serving metrics at %s', self.get_url())
+
+    def stop(self):
+        """Stop serving requests, and close the server's socket."""
+
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
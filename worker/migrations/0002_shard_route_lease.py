@@ -0,0 +1,37 @@
+# Generated by Django 2.0.8 on 2026-10-17 01:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('expires', models.IntegerField(db_index=True)),
+            ],
+            options={
+                'db_table': 'shard',
+            },
+        ),
+        migrations.CreateModel(
+            name='RouteLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.CharField(db_index=True, max_length=100)),
+                ('expires', models.IntegerField()),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='lease', to='worker.Route')),
+            ],
+            options={
+                'db_table': 'route_lease',
+            },
+        ),
+    ]
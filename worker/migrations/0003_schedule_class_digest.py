@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worker', '0002_shard_route_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduleclass',
+            name='digest',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.0.8 on 2026-10-17 02:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worker', '0003_schedule_class_digest'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='scheduleclass',
+            unique_together={('route', 'direction', 'service_class', 'digest')},
+        ),
+    ]
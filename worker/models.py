@@ -54,7 +54,13 @@ class ScheduleClass(models.Model):
             when the schedules are changed. Names are based on the date such as "2015T_FALL" or
             "2013OCTOBER"
         is_active: Boolean indicating whether this is the currently active ScheduleClass for the
-            line.
+            line. Only one ScheduleClass is active for each direction and service class of a route,
+            and the ScheduleClasses of earlier versions of the schedule are kept inactive, so that
+            arrivals keep the scheduled arrivals they were matched to.
+        digest: SHA-256 digest of the schedule returned by NextBus for the direction and service
+            class, which identifies the version of the schedule, and is used to skip updating the
+            schedule when it has not changed. This is empty for schedule classes that were added
+            before digests were stored.
     """
 
     route = models.ForeignKey(Route,
@@ -64,9 +70,10 @@ class ScheduleClass(models.Model):
     service_class = models.CharField(max_length=3)
     name = models.TextField(max_length=20)
     is_active = models.BooleanField()
+    digest = models.CharField(max_length=64, default='')
 
     class Meta:
-        unique_together = (('route', 'direction', 'service_class'),)
+        unique_together = (('route', 'direction', 'service_class', 'digest'),)
         db_table = 'schedule_class'
 
 class StopScheduleClass(models.Model):
@@ -135,3 +142,40 @@ class Arrival(models.Model):
     class Meta:
         unique_together = (('stop', 'scheduled_arrival', 'time'),)
         db_table = 'arrival'
+
+class Shard(models.Model):
+    """Model of a worker process that runs the workers for a share of the routes, when the worker is
+    run in sharded mode.
+
+    Columns:
+        name: Unique name of the shard, which identifies the process and the host it runs on.
+        expires: Unix timestamp, in the database's clock, until which the shard is considered to be
+            running. Shards extend this while they are running, so a shard whose process stopped
+            expires and its share of the routes is taken over by the other shards.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    expires = models.IntegerField(db_index=True)
+
+    class Meta:
+        db_table = 'shard'
+
+class RouteLease(models.Model):
+    """Model of a time-limited claim by a shard on a route, so that each route is only tracked by
+    one shard at a time.
+
+    Columns:
+        route: The Route the lease is for.
+        shard: Name of the Shard holding the lease, or an empty string if the route is not leased.
+        expires: Unix timestamp, in the database's clock, when the lease expires unless it is
+            renewed by the shard holding it. An expired lease can be claimed by any shard.
+    """
+
+    route = models.OneToOneField(Route,
+                                 on_delete=models.CASCADE,
+                                 related_name='lease')
+    shard = models.CharField(max_length=100, db_index=True)
+    expires = models.IntegerField()
+
+    class Meta:
+        db_table = 'route_lease'
@@ -0,0 +1,157 @@
+import configparser
+import logging
+import os.path as path
+import statistics
+import threading
+
+import how_late_is_muni.settings as settings
+from worker.libs.prediction_snapshot import PredictionSnapshot
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class PollScheduler(object):
+    """Class to choose how long each route waits before its predictions are retrieved again, based
+    on the predictions that were just retrieved for the route.
+
+    Routes whose vehicles are usually close to their next stops are polled frequently, so that the
+    times of their arrivals are accurate, while routes whose vehicles are usually far from their
+    next stops are polled less often, and routes without any predictions are polled rarely. If the routes would
+    make more requests together than the request budget allows, every route's interval is
+    stretched by the same factor to stay within the budget. Instances are thread-safe, and a single
+    instance should be shared by all routes.
+    """
+
+    def __init__(self, min_interval, max_interval, idle_interval, request_budget):
+        """
+        Arguments:
+            min_interval: (Float) Minimum number of seconds between polls of a route.
+            max_interval: (Float) Maximum number of seconds between polls of a route that has
+                predictions, unless the request budget is exceeded.
+            idle_interval: (Float) Number of seconds between polls of a route without any
+                predictions, which usually means that the route is not in service.
+            request_budget: (Float) Maximum number of requests per minute for all routes together.
+        """
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.request_budget = request_budget
+
+        self.lock = threading.Lock()
+
+        # Keyed by route tags, with the number of seconds each route would like to wait between
+        # polls as values
+        self.desired_intervals = {}
+
+    @classmethod
+    def from_config(cls):
+        """Create a scheduler with the intervals and request budget in the config. If the config
+        does not have a minimum interval, the update frequency of the predictions is used.
+
+        Returns:
+            Instance of PollScheduler.
+        """
+
+        min_interval = config.get('worker', 'min_poll_seconds') or \
+            config.get('worker', 'prediction_update_seconds')
+
+        return cls(min_interval=float(min_interval),
+                   max_interval=float(config.get('worker', 'max_poll_seconds')),
+                   idle_interval=float(config.get('worker', 'idle_poll_seconds')),
+                   request_budget=float(config.get('worker', 'request_budget_per_minute')))
+
+    def get_desired_interval(self, predictions):
+        """Get the number of seconds a route would like to wait before it is polled again, without
+        considering the request budget.
+
+        Arguments:
+            predictions: Nested dictionaries keyed by stop tags -> block IDs -> trip tags, with the
+                number of seconds until the predicted arrival as the value, or an instance of
+                PredictionSnapshot, in the format returned by RouteWorker.get_predictions.
+
+        Returns:
+            Float, the number of seconds to wait. This is half of the median of the times until the
+            next predicted arrival of each vehicle, by block ID, at any stop on the route, limited to
+            between the minimum and maximum intervals, or the idle interval if there are no
+            predictions. The median is used instead of the earliest arrival, since a route with many
+            vehicles nearly always has one about to arrive at a stop.
+        """
+
+        # Keyed by block IDs, with the number of seconds until the vehicle's next arrival
+        next_arrival_seconds = {}
+        if isinstance(predictions, PredictionSnapshot):
+            for block_id, seconds in zip(predictions.block_ids, predictions.seconds):
+                if block_id not in next_arrival_seconds or \
+                        seconds < next_arrival_seconds[block_id]:
+                    next_arrival_seconds[block_id] = seconds
+        else:
+            for blocks in predictions.values():
+                for block_id, trips in blocks.items():
+                    for seconds in trips.values():
+                        if block_id not in next_arrival_seconds or \
+                                seconds < next_arrival_seconds[block_id]:
+                            next_arrival_seconds[block_id] = seconds
+
+        if not next_arrival_seconds:
+            return self.idle_interval
+
+        return min(max(statistics.median(next_arrival_seconds.values()) / 2, self.min_interval),
+                   self.max_interval)
+
+    def get_next_interval(self, route_tag, predictions):
+        """Get the number of seconds a route should wait before it is polled again.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            predictions: The predictions that were just retrieved for the route, in the format
+                returned by RouteWorker.get_predictions.
+
+        Returns:
+            Float, the number of seconds to wait.
+        """
+
+        desired_interval = self.get_desired_interval(predictions)
+
+        with self.lock:
+            self.desired_intervals[route_tag] = desired_interval
+            requests_per_minute = sum(60 / interval
+                                      for interval in self.desired_intervals.values())
+
+        if requests_per_minute > self.request_budget:
+            LOG.debug('Desired polling of %.1f requests per minute exceeds budget of %.1f',
+                      requests_per_minute, self.request_budget)
+            return desired_interval * requests_per_minute / self.request_budget
+
+        return desired_interval
+
+    def get_stats(self):
+        """Get statistics about the intervals chosen for the routes.
+
+        Returns:
+            Dictionary with the following keys:
+                routes: Integer, number of routes being scheduled.
+                requests_per_minute: Float, number of requests per minute the routes would make at
+                    their desired intervals.
+                request_budget: Float, maximum number of requests per minute.
+        """
+
+        with self.lock:
+            return {
+                'routes': len(self.desired_intervals),
+                'requests_per_minute': sum(60 / interval
+                                           for interval in self.desired_intervals.values()),
+                'request_budget': self.request_budget
+            }
+
+    def remove_route(self, route_tag):
+        """Stop scheduling a route, so that it no longer counts towards the request budget.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+        """
+
+        with self.lock:
+            self.desired_intervals.pop(route_tag, None)
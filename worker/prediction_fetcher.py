@@ -0,0 +1,173 @@
+import configparser
+import logging
+import os.path as path
+import time
+import urllib.parse
+
+import how_late_is_muni.settings as settings
+from worker.libs import metrics, nextbus, prediction
+from worker.route_worker import PARSE_SECONDS
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+CHUNK_FETCH_SECONDS = metrics.get_registry().histogram(
+    'muni_fetcher_chunk_fetch_seconds',
+    'Seconds taken to retrieve the predictions for a chunk of stops of many routes from NextBus')
+
+class PredictionFetcher(object):
+    """Class to get the predictions for the stops of many routes with as few requests as possible.
+
+    The "predictionsForMultiStops" command accepts stops from any route on the transit agency, so
+    the stops of all routes are packed into as few requests as possible without the URL of any
+    request exceeding a maximum length, and the predictions returned by the requests are split back
+    up by route.
+    """
+
+    def __init__(self, agency):
+        """
+        Arguments:
+            agency: (String) Name of the transit agency the routes are part of.
+        """
+
+        self.agency = agency
+        self.nextbus_client = nextbus.NextBusClient(output_format='json',
+                                                    agency=agency)
+        self.max_url_length = int(config.get('nextbus', 'max_url_length'))
+        self.arrival_detection = config.get('worker', 'arrival_detection')
+
+        self.chunks = []
+        self.chunk_route_tags = []
+
+    def set_routes(self, route_stop_tags):
+        """Set the routes and stops to get predictions for, and split them into the chunks of stops
+        that will each be requested with a single request.
+
+        Arguments:
+            route_stop_tags: (Dictionary) Dictionary with route tags as keys and lists of the tags of
+                the stops on the route to get predictions for as values.
+        """
+
+        stops = [(route_tag, stop_tag)
+                 for route_tag, stop_tags in route_stop_tags.items()
+                 for stop_tag in stop_tags]
+
+        base_url = '%s?%s' % (self.nextbus_client.feed_url,
+                              urllib.parse.urlencode({'command': 'predictionsForMultiStops',
+                                                      'a': self.agency}))
+        self.chunks = prediction.split_stops_by_url_length(stops=stops,
+                                                           base_url_length=len(base_url),
+                                                           max_url_length=self.max_url_length)
+        self.chunk_route_tags = [set(route_tag for route_tag, _ in chunk) for chunk in self.chunks]
+
+        LOG.info('Getting predictions for %d stops on %d routes with %d requests',
+                 len(stops), len(route_stop_tags), len(self.chunks))
+
+    def get_chunk_predictions(self, chunk):
+        """Get the predictions for a single chunk of stops.
+
+        Arguments:
+            chunk: (List of tuples) Tuples of a route tag and a stop tag for each stop to get
+                predictions for.
+
+        Returns:
+            List of the "predictions" objects returned by the NextBus API for each stop.
+        """
+
+        stops = [{'route_tag': route_tag, 'stop_tag': stop_tag} for route_tag, stop_tag in chunk]
+        start_time = time.perf_counter()
+        response = self.nextbus_client.get_predictions_for_multi_stops(stops)
+        CHUNK_FETCH_SECONDS.observe(time.perf_counter() - start_time)
+
+        return response.get('predictions', [])
+
+    def get_predictions(self, executor):
+        """Get the predictions for the stops of all routes, making the request for each chunk of
+        stops concurrently.
+
+        Arguments:
+            executor: Instance of concurrent.futures.Executor to make the requests with.
+
+        Returns:
+            Dictionary in the format returned by the get_route_predictions method.
+        """
+
+        futures = [executor.submit(self.get_chunk_predictions, chunk) for chunk in self.chunks]
+
+        chunk_predictions = []
+        for future in futures:
+            try:
+                chunk_predictions.append(future.result())
+            except Exception as exc:
+                chunk_predictions.append(exc)
+
+        return self.get_route_predictions(chunk_predictions)
+
+    def get_route_predictions(self, chunk_predictions):
+        """Split the predictions returned for each chunk of stops up by route, and parse them.
+
+        Arguments:
+            chunk_predictions: (List) The value returned by the get_chunk_predictions method for each
+                chunk, in the same order as the chunks. If getting the predictions for a chunk
+                failed, the exception that was raised should be provided instead.
+
+        Returns:
+            Dictionary with route tags as keys and the predictions for each route as values, in the
+            format returned by RouteWorker.get_predictions. Routes that had stops in a chunk that
+            could not be retrieved are not included, so that the incomplete predictions for the
+            route are not used to find arrivals.
+        """
+
+        route_responses, _ = self.get_route_responses(chunk_predictions)
+
+        parsed_route_predictions = {}
+        for route_tag, response in route_responses.items():
+            start_time = time.perf_counter()
+            parsed_route_predictions[route_tag] = prediction.parse_predictions(
+                response['predictions'], arrival_detection=self.arrival_detection)
+            PARSE_SECONDS.observe(time.perf_counter() - start_time, labels=(route_tag,))
+
+        return parsed_route_predictions
+
+    def get_route_responses(self, chunk_predictions):
+        """Split the predictions returned for each chunk of stops up by route, without parsing
+        them, so that each route's worker can record and parse its own predictions.
+
+        Arguments:
+            chunk_predictions: (List) The value returned by the get_chunk_predictions method for each
+                chunk, in the same order as the chunks. If getting the predictions for a chunk
+                failed, the exception that was raised should be provided instead, and if a chunk was
+                not requested, None.
+
+        Returns:
+            Tuple of two dictionaries with route tags as keys. The first has a dictionary in the
+            format returned by NextBus for the "predictionsForMultiStops" command, with the
+            "predictions" for the stops of the route, for each route whose stops were all
+            retrieved. The second has the exception raised for each route that had stops in a chunk
+            that could not be retrieved, so that the incomplete predictions for the route are not
+            used to find arrivals.
+        """
+
+        route_errors = {}
+        route_stops = {}
+        for route_tags, predictions in zip(self.chunk_route_tags, chunk_predictions):
+            if predictions is None:
+                continue
+
+            if isinstance(predictions, Exception):
+                LOG.error('Failed to get predictions for routes %s due to exception: %s',
+                          ', '.join(sorted(route_tags)), predictions)
+                for route_tag in route_tags:
+                    route_errors[route_tag] = predictions
+                continue
+
+            for route_tag, stops in prediction.group_predictions_by_route(predictions).items():
+                route_stops.setdefault(route_tag, []).extend(stops)
+
+        route_responses = {route_tag: {'predictions': stops}
+                           for route_tag, stops in route_stops.items()
+                           if route_tag not in route_errors}
+
+        return route_responses, route_errors
@@ -0,0 +1,225 @@
+import configparser
+import gzip
+import json
+import logging
+import os
+import os.path as path
+import queue
+import threading
+import time
+
+import how_late_is_muni.settings as settings
+from worker.libs import recording
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class PredictionRecorder(threading.Thread):
+    """Class to record the raw prediction responses returned by NextBus to compressed segment files
+    from a dedicated thread, so that recording does not delay getting predictions.
+
+    Responses are added to a bounded queue, and encoded and written by the recorder's thread. A new
+    segment file is started once the current segment covers segment_seconds of responses, and
+    segment files are never modified after they are finished. The format of the segments is
+    described in worker.libs.recording.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Arguments:
+            directory: (String) Path of the directory to write segment files to. If this is None,
+                the directory in the config is used, relative to the base directory of the project
+                if it is not absolute.
+        """
+
+        threading.Thread.__init__(self, name='prediction recorder')
+
+        self.running = False
+
+        if directory is None:
+            directory = path.join(settings.BASE_DIR, config.get('recorder', 'directory'))
+        self.directory = directory
+
+        self.segment_seconds = float(config.get('recorder', 'segment_seconds'))
+        self.compression_level = int(config.get('recorder', 'compression_level'))
+        self.queue = queue.Queue(maxsize=int(config.get('recorder', 'queue_size')))
+
+        self.encoder = recording.DeltaEncoder()
+        self.segment = None
+        self.segment_path = None
+        self.segment_start_time = None
+        self.segment_number = 0
+
+        self.stats_lock = threading.Lock()
+        self.recorded_responses = 0
+        self.dropped_responses = 0
+        self.segments = 0
+
+    def get_stats(self):
+        """Get statistics about the responses that have been recorded.
+
+        Returns:
+            Dictionary with the following keys:
+                queue_depth: Integer, number of responses currently waiting to be recorded.
+                recorded_responses: Integer, total number of responses that have been written.
+                dropped_responses: Integer, total number of responses that could not be queued
+                    because the queue was full.
+                segments: Integer, number of segment files that have been started.
+        """
+
+        with self.stats_lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'recorded_responses': self.recorded_responses,
+                'dropped_responses': self.dropped_responses,
+                'segments': self.segments
+            }
+
+    def record(self, route_tag, retrieve_time, response):
+        """Queue a response to be recorded. This never blocks; if the queue is full, the response is
+        dropped.
+
+        Arguments:
+            route_tag: (String) Tag of the route the predictions are for.
+            retrieve_time: (Float) Unix timestamp of when the predictions were retrieved.
+            response: (Dictionary) The JSON returned by NextBus for the "predictionsForMultiStops"
+                command. It must not be modified after it is recorded.
+        """
+
+        try:
+            self.queue.put_nowait((route_tag, retrieve_time, response))
+        except queue.Full:
+            LOG.warning('Prediction recorder queue is full, dropping response for route %s',
+                        route_tag)
+            with self.stats_lock:
+                self.dropped_responses += 1
+
+    def run(self):
+        """Run the recorder, which writes queued responses until the recorder is stopped."""
+
+        self.running = True
+
+        while self.running:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # The recorder keeps running if a response cannot be recorded, so that the responses
+            # after it are still recorded
+            try:
+                self.write(*item)
+            except Exception:
+                LOG.exception('Failed to record response for route %s', item[0])
+
+        LOG.info('Stopping prediction recorder')
+
+    def write(self, route_tag, retrieve_time, response):
+        """Encode a response and write it to the current segment, starting a new segment first if
+        the current segment is full.
+
+        Arguments:
+            route_tag: (String) Tag of the route the predictions are for.
+            retrieve_time: (Float) Unix timestamp of when the predictions were retrieved.
+            response: (Dictionary) The JSON returned by NextBus.
+        """
+
+        if self.segment is None or retrieve_time - self.segment_start_time >= self.segment_seconds:
+            try:
+                self.start_segment(retrieve_time)
+            except OSError:
+                # A new segment is tried again for the next response
+                LOG.exception('Failed to start prediction segment, dropping response for route %s',
+                              route_tag)
+                return
+
+        record = self.encoder.encode(route_tag=route_tag,
+                                     retrieve_time=retrieve_time,
+                                     response=response)
+        try:
+            self.segment.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+        except (OSError, TypeError, ValueError) as exc:
+            LOG.exception('Failed to record response for route %s', route_tag)
+
+            # The encoder has already replaced the route's previous response with the response that
+            # was not written, so the next record for the route must contain every stop
+            self.encoder.reset(route_tag=route_tag)
+
+            # The segment may end with part of the record, so the next response starts a new one
+            if isinstance(exc, OSError):
+                try:
+                    self.close_segment()
+                except OSError:
+                    LOG.exception('Failed to finish prediction segment %s', self.segment_path)
+            return
+
+        with self.stats_lock:
+            self.recorded_responses += 1
+
+    def start_segment(self, start_time):
+        """Finish the current segment, if there is one, and start a new segment. Segment files are
+        never overwritten, so if a file with the name of the new segment already exists, such as
+        from an earlier run, the segment number is increased until the name is not taken.
+
+        Arguments:
+            start_time: (Float) Unix timestamp of the first response in the new segment.
+        """
+
+        self.close_segment()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        while self.segment is None:
+            self.segment_number += 1
+            self.segment_path = path.join(
+                self.directory,
+                'predictions-%s-%06d.jsonl.gz' % (time.strftime('%Y%m%dT%H%M%S',
+                                                                time.gmtime(start_time)),
+                                                  self.segment_number))
+            try:
+                self.segment = gzip.GzipFile(filename=self.segment_path,
+                                             mode='xb',
+                                             compresslevel=self.compression_level)
+            except FileExistsError:
+                LOG.warning('Prediction segment %s already exists, starting the next segment',
+                            self.segment_path)
+
+        self.segment_start_time = start_time
+
+        # Every segment starts with a record containing every stop for each route, so that it can
+        # be read without the previous segments
+        self.encoder.reset()
+
+        LOG.info('Started prediction segment %s', self.segment_path)
+        with self.stats_lock:
+            self.segments += 1
+
+    def close_segment(self):
+        """Finish the current segment, if there is one."""
+
+        segment = self.segment
+        self.segment = None
+        if segment is not None:
+            segment.close()
+
+    def stop(self):
+        """Stop the recorder, and write any responses that are still queued."""
+
+        self.running = False
+        if self.is_alive():
+            self.join()
+
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                self.write(*item)
+            except Exception:
+                LOG.exception('Failed to record response for route %s', item[0])
+
+        self.close_segment()
@@ -0,0 +1,235 @@
+import configparser
+import datetime
+import logging
+import os.path as path
+import time
+
+import how_late_is_muni.settings as settings
+from worker.libs import arrival, prediction, utils
+from worker.models import Route
+from worker.poll_scheduler import PollScheduler
+from worker.route_worker import RouteWorker
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+# Stages of processing each recorded response that are timed
+STAGES = ('parse', 'detect', 'match', 'save')
+
+class PredictionReplayer(object):
+    """Class to replay recorded prediction responses through the same steps that are used to find
+    and save arrivals from live predictions, using the times the responses were retrieved as a
+    simulated clock instead of the current time.
+
+    The replayer is used as the arrival writer of the workers it creates, so that saving arrivals to
+    the database is timed separately from matching arrivals to scheduled arrivals.
+    """
+
+    def __init__(self, speed=0):
+        """
+        Arguments:
+            speed: (Float) How many times faster than real time to replay the responses. If this is
+                0, responses are replayed as fast as possible.
+        """
+
+        self.speed = speed
+        self.agency = config.get('nextbus', 'agency')
+        self.day_switch_time = int(config.get('worker', 'day_switch_time'))
+        self.duplicate_arrival_threshold = int(config.get('worker', 'duplicate_arrival_threshold'))
+
+        if config.getboolean('worker', 'adaptive_polling'):
+            self.poll_scheduler = PollScheduler.from_config()
+        else:
+            self.poll_scheduler = None
+
+        # Keyed by tuples of route tags and service classes, with the worker for the route in the
+        # service class, or None if the route does not exist, as values
+        self.workers = {}
+
+        self.snapshots = 0
+        self.skipped_snapshots = 0
+        self.arrivals = 0
+        self.saved_arrivals = 0
+        self.stage_seconds = {stage: 0 for stage in STAGES}
+        self.first_retrieve_time = None
+        self.last_retrieve_time = None
+        self.wall_seconds = 0
+
+    def get_service_class(self, retrieve_time):
+        """Get the service class of the service day that a time is part of, with service days
+        switching at the day switch time instead of at midnight.
+
+        Arguments:
+            retrieve_time: (Float) Unix timestamp.
+
+        Returns:
+            String, the service class.
+        """
+
+        return utils.get_service_class(
+            datetime.datetime.fromtimestamp(retrieve_time - self.day_switch_time))
+
+    def get_stats(self):
+        """Get statistics about the responses that have been replayed.
+
+        Returns:
+            Dictionary with the following keys:
+                snapshots: Integer, number of responses that were replayed.
+                skipped_snapshots: Integer, number of responses for routes that are not in the
+                    database.
+                arrivals: Integer, number of arrivals that were found.
+                saved_arrivals: Integer, number of arrivals that were matched to a scheduled
+                    arrival and saved.
+                simulated_seconds: Float, number of seconds between the first and last responses.
+                wall_seconds: Float, number of seconds the replay took.
+                snapshots_per_second: Float, number of responses replayed per second.
+                speedup: Float, how many times faster than real time the responses were replayed.
+                stages: Dictionary with the names of the stages as keys and dictionaries with the
+                    total_seconds and mean_milliseconds of each stage as values.
+        """
+
+        simulated_seconds = 0
+        if self.first_retrieve_time is not None:
+            simulated_seconds = self.last_retrieve_time - self.first_retrieve_time
+
+        return {
+            'snapshots': self.snapshots,
+            'skipped_snapshots': self.skipped_snapshots,
+            'arrivals': self.arrivals,
+            'saved_arrivals': self.saved_arrivals,
+            'simulated_seconds': simulated_seconds,
+            'wall_seconds': self.wall_seconds,
+            'snapshots_per_second': self.snapshots / self.wall_seconds if self.wall_seconds else 0,
+            'speedup': simulated_seconds / self.wall_seconds if self.wall_seconds else 0,
+            'stages': {
+                stage: {
+                    'total_seconds': seconds,
+                    'mean_milliseconds': seconds * 1000 / self.snapshots if self.snapshots else 0
+                }
+                for stage, seconds in self.stage_seconds.items()
+            }
+        }
+
+    def get_worker(self, route_tag, service_class):
+        """Get the worker for a route in a service class, creating it and loading its schedule if
+        it has not been created yet.
+
+        Arguments:
+            route_tag: (String) Tag of the route.
+            service_class: (String) The service class.
+
+        Returns:
+            Instance of RouteWorker, or None if the route does not exist in the database.
+        """
+
+        key = (route_tag, service_class)
+        if key not in self.workers:
+            try:
+                worker = RouteWorker(route_tag=route_tag,
+                                     agency=self.agency,
+                                     service_class=service_class,
+                                     arrival_writer=self,
+                                     poll_scheduler=self.poll_scheduler)
+            except Route.DoesNotExist:
+                LOG.warning('Route %s does not exist, skipping its predictions', route_tag)
+                worker = None
+            else:
+                worker.load_schedule()
+                worker.current_retrieve_time = None
+
+            self.workers[key] = worker
+
+        return self.workers[key]
+
+    def put(self, arrivals):
+        """Save arrivals that were matched by a worker, in the same way as the ArrivalWriter.
+
+        Arguments:
+            arrivals: (List of dictionaries) The arrivals to save, in the format accepted by
+                worker.libs.arrival.bulk_save_arrivals.
+        """
+
+        start_time = time.perf_counter()
+        arrival.bulk_save_arrivals(arrivals=arrivals,
+                                   duplicate_arrival_threshold=self.duplicate_arrival_threshold)
+        self.stage_seconds['save'] += time.perf_counter() - start_time
+        self.saved_arrivals += len(arrivals)
+
+    def replay(self, records):
+        """Replay recorded responses.
+
+        Arguments:
+            records: (Iterable) Tuples of the retrieve time, route tag, and response for each
+                response, in the order they were recorded, such as those returned by
+                worker.libs.recording.read_recording.
+
+        Returns:
+            Dictionary with the statistics returned by the get_stats method.
+        """
+
+        wall_start_time = time.perf_counter()
+
+        for retrieve_time, route_tag, response in records:
+            if self.first_retrieve_time is None:
+                self.first_retrieve_time = retrieve_time
+            self.last_retrieve_time = retrieve_time
+
+            if self.speed > 0:
+                # Wait until the simulated clock reaches the time the response was retrieved
+                delay = (retrieve_time - self.first_retrieve_time) / self.speed - \
+                    (time.perf_counter() - wall_start_time)
+                if delay > 0:
+                    time.sleep(delay)
+
+            worker = self.get_worker(route_tag=route_tag,
+                                     service_class=self.get_service_class(retrieve_time))
+            if worker is None:
+                self.skipped_snapshots += 1
+                continue
+
+            self.replay_response(worker=worker, retrieve_time=retrieve_time, response=response)
+
+        self.wall_seconds += time.perf_counter() - wall_start_time
+        return self.get_stats()
+
+    def replay_response(self, worker, retrieve_time, response):
+        """Find and save the arrivals for a single recorded response, using the same steps as
+        RouteWorker.run.
+
+        Arguments:
+            worker: (RouteWorker) The worker for the route the response is for.
+            retrieve_time: (Float) Unix timestamp of when the response was retrieved.
+            response: (Dictionary) The recorded response.
+        """
+
+        self.snapshots += 1
+
+        start_time = time.perf_counter()
+        predictions = prediction.parse_predictions(response.get('predictions', []),
+                                                   arrival_detection=worker.arrival_detection)
+        parse_time = time.perf_counter()
+
+        # The first response for a worker has nothing to be compared to
+        if worker.current_retrieve_time is None:
+            worker.current_retrieve_time = retrieve_time
+
+        arrivals = worker.update_predictions(predictions=predictions, retrieve_time=retrieve_time)
+        worker.get_poll_interval(predictions)
+        detect_time = time.perf_counter()
+
+        self.stage_seconds['parse'] += parse_time - start_time
+        self.stage_seconds['detect'] += detect_time - parse_time
+
+        if arrivals:
+            self.arrivals += sum(len(block_ids) for block_ids in arrivals.values())
+
+            save_seconds = self.stage_seconds['save']
+            worker.save_arrivals(arrivals=arrivals,
+                                 arrival_time=retrieve_time,
+                                 scheduled_arrival_index=worker.scheduled_arrival_index)
+
+            # Saving is timed by the put method, so it is excluded from the time spent matching
+            self.stage_seconds['match'] += time.perf_counter() - detect_time - \
+                (self.stage_seconds['save'] - save_seconds)
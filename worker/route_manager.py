@@ -5,91 +5,447 @@ import os.path as path
 import threading
 import time
 
+from django import db
+
 import how_late_is_muni.settings as settings
-from worker.libs import route, schedule, utils
+from worker.libs import metrics, resilience, route, schedule, schedule_cache, utils
+from worker.arrival_writer import ArrivalWriter
+from worker.checkpointer import Checkpointer
 from worker.models import Route, ScheduleClass
+from worker.poll_scheduler import PollScheduler
+from worker.prediction_recorder import PredictionRecorder
 from worker.route_worker import RouteWorker
 
-from py_nextbus import NextBusClient
-
 LOG = logging.getLogger()
 
 config = configparser.ConfigParser()
 config.read(path.join(settings.BASE_DIR, 'config.ini'))
 
+# Values of the metric of the state of each circuit breaker
+BREAKER_STATE_VALUES = {
+    resilience.STATE_CLOSED: 0,
+    resilience.STATE_HALF_OPEN: 0.5,
+    resilience.STATE_OPEN: 1
+}
+
 class RouteManager(object):
 
+    # Whether workers need their schedules loaded before they are started. Workers run as threads
+    # load their own schedules when they start, so that the schedules are loaded concurrently.
+    load_new_schedules = False
+
     def __init__(self):
         self.agency = config.get('nextbus', 'agency')
         self.day_switch_time = int(config.get('worker', 'day_switch_time'))
+        self.update_frequency = int(config.get('worker', 'prediction_update_seconds'))
+        self.preload_seconds = int(config.get('worker', 'preload_seconds'))
         self.workers = []
+
+        self.preload_thread = None
+        self.preloaded_day = None
+
+        self.arrival_writer = ArrivalWriter()
+        self.arrival_writer.start()
+
+        if config.getboolean('recorder', 'enabled'):
+            self.prediction_recorder = PredictionRecorder()
+            self.prediction_recorder.start()
+        else:
+            self.prediction_recorder = None
+
+        if config.getboolean('worker', 'adaptive_polling'):
+            self.poll_scheduler = PollScheduler.from_config()
+        else:
+            self.poll_scheduler = None
+
+        if config.getboolean('checkpoint', 'enabled'):
+            self.checkpointer = Checkpointer()
+            self.checkpointer.load()
+            self.checkpointer.start()
+        else:
+            self.checkpointer = None
+
+        self.register_metrics()
         self.switch_day(previous_service_class=None)
 
     def run(self):
         current_day = datetime.date.today()
 
-        self.start_workers()
+        preload_date = None
 
         try:
             while True:
+                switch_time = get_next_switch_time(current_day=current_day,
+                                                   day_switch_time=self.day_switch_time)
+                if preload_date != switch_time.date() and \
+                        (switch_time - datetime.datetime.now()).total_seconds() <= \
+                        self.preload_seconds:
+                    self.preload(service_class=utils.get_service_class(switch_time))
+                    preload_date = switch_time.date()
+
                 new_day = datetime.date.today()
                 if new_day != current_day:
                     day_time = utils.get_seconds_since_midnight()
                     if day_time > self.day_switch_time:
                         self.switch_day(previous_service_class=self.service_class)
+                        current_day = new_day
 
-                time.sleep(60)
+                self.log_stats()
 
-        except KeyboardInterrupt:
-            raise Exception('STOP NOW')
+                self.wait(60)
+
+        finally:
+            if self.preload_thread is not None:
+                self.preload_thread.join()
             self.stop_workers()
+            if self.checkpointer is not None:
+                self.checkpointer.stop()
+            self.arrival_writer.stop()
+            if self.prediction_recorder is not None:
+                self.prediction_recorder.stop()
 
-    def start_workers(self):
-        """Start workers for all active routes."""
+    def get_circuit_breaker_states(self):
+        """Get the states of the circuit breaker shared by all requests to NextBus, and of the
+        circuit breakers of any routes that are not closed.
 
-        LOG.info('Starting all workers')
+        Returns:
+            Dictionary with the following keys:
+                global: Dictionary with the state of the shared breaker, in the format returned by
+                    CircuitBreaker.get_state.
+                routes: List of dictionaries with the states of the breakers of routes that are
+                    open or half open.
+        """
 
-        self.workers = []
-        for route in self.active_routes:
-            LOG.info('Starting worker for route %s', route.tag)
-            worker = RouteWorker(route_tag=route.tag,
-                                 agency=self.agency,
-                                 service_class=self.service_class)
+        route_states = [worker.circuit_breaker.get_state() for worker in self.workers]
+        return {
+            'global': resilience.get_global_breaker().get_state(),
+            'routes': [state for state in route_states if state['state'] != resilience.STATE_CLOSED]
+        }
+
+    def get_circuit_breakers_open(self):
+        """Get how open the circuit breaker shared by all requests to NextBus, and the circuit
+        breaker of each route, are.
+
+        Returns:
+            Dictionary with tuples of the name of each breaker as keys and 1 if the breaker is
+            open, 0.5 if it is half open, or 0 if it is closed as values.
+        """
+
+        states = [resilience.get_global_breaker().get_state()]
+        states.extend(worker.circuit_breaker.get_state() for worker in self.workers)
+
+        return {(state['name'],): BREAKER_STATE_VALUES[state['state']] for state in states}
+
+    def get_running_workers(self):
+        """Get whether the worker for each route is running.
+
+        Returns:
+            Dictionary with tuples of the tag of each route as keys and 1 if the worker's thread is
+            alive or 0 if it is not as values.
+        """
+
+        return {(worker.route.tag,): int(worker.is_alive()) for worker in self.workers}
+
+    def register_metrics(self):
+        """Register metrics of the health of the workers, arrival writer, prediction recorder,
+        schedule cache, and circuit breakers, which are collected from their statistics whenever
+        the metrics are rendered."""
+
+        registry = metrics.get_registry()
+
+        registry.gauge('muni_worker_running',
+                       'Whether the worker for a route is running',
+                       label_names=('route',),
+                       function=self.get_running_workers)
+        registry.gauge('muni_circuit_breaker_open',
+                       'Whether a circuit breaker is open (1), half open (0.5), or closed (0)',
+                       label_names=('breaker',),
+                       function=self.get_circuit_breakers_open)
+
+        registry.gauge('muni_thread_alive',
+                       'Whether a background thread of the worker is alive',
+                       label_names=('thread',),
+                       function=lambda: {
+                           (thread.name,): int(thread.is_alive())
+                           for thread in (self.arrival_writer, self.prediction_recorder)
+                           if thread is not None
+                       })
+
+        registry.gauge('muni_arrival_writer_queue_depth',
+                       'Number of arrivals waiting to be saved by the arrival writer',
+                       function=lambda: {(): self.arrival_writer.get_stats()['queue_depth']})
+        registry.counter('muni_arrival_writer_arrivals_total',
+                         'Number of arrivals handled by the arrival writer, by outcome',
+                         label_names=('outcome',),
+                         function=lambda: {
+                             (outcome,): self.arrival_writer.get_stats()['%s_arrivals' % outcome]
+                             for outcome in ('queued', 'dropped', 'saved', 'failed')
+                         })
+
+        if self.prediction_recorder is not None:
+            registry.gauge('muni_prediction_recorder_queue_depth',
+                           'Number of responses waiting to be recorded by the prediction recorder',
+                           function=lambda: {
+                               (): self.prediction_recorder.get_stats()['queue_depth']
+                           })
+            registry.counter('muni_prediction_recorder_responses_total',
+                             'Number of responses handled by the prediction recorder, by outcome',
+                             label_names=('outcome',),
+                             function=lambda: {
+                                 (outcome,):
+                                     self.prediction_recorder.get_stats()['%s_responses' % outcome]
+                                 for outcome in ('recorded', 'dropped')
+                             })
+
+        registry.counter('muni_schedule_cache_requests_total',
+                         'Number of requests for schedules from the schedule cache, by result',
+                         label_names=('result',),
+                         function=lambda: {
+                             (result,): schedule_cache.get_schedule_cache().get_stats()[result]
+                             for result in ('hits', 'misses')
+                         })
+
+    def log_stats(self):
+        """Log statistics about the arrival writer, schedule cache, poll scheduler, prediction
+        recorder, checkpointer, and circuit breakers."""
+
+        LOG.info('Arrival writer stats: %s', self.arrival_writer.get_stats())
+        LOG.info('Schedule cache stats: %s', schedule_cache.get_schedule_cache().get_stats())
+        if self.poll_scheduler is not None:
+            LOG.info('Poll scheduler stats: %s', self.poll_scheduler.get_stats())
+        if self.prediction_recorder is not None:
+            LOG.info('Prediction recorder stats: %s', self.prediction_recorder.get_stats())
+        if self.checkpointer is not None:
+            LOG.info('Checkpointer stats: %s', self.checkpointer.get_stats())
+        LOG.info('Circuit breaker states: %s', self.get_circuit_breaker_states())
+
+    def start_workers(self, workers):
+        """Start workers that were created for the current day, spreading their first retrievals of
+        predictions across the update interval.
+
+        Arguments:
+            workers: (List) Instances of RouteWorker that have not been started.
+        """
+
+        for index, worker in enumerate(workers):
+            LOG.info('Starting worker for route %s', worker.route.tag)
+            worker.start_delay = get_start_delay(index=index,
+                                                 count=len(workers),
+                                                 interval=self.update_frequency)
             worker.start()
-            self.workers.append(worker)
-    def stop_workers(self):
-        """Stop all running threads."""
 
-        LOG.info('Stopping all workers')
+    def stop_workers(self, workers=None):
+        """Stop running workers, and wait for their threads to finish.
+
+        Arguments:
+            workers: (List) Instances of RouteWorker to stop. If this is None, every worker is
+                stopped.
+        """
+
+        if workers is None:
+            LOG.info('Stopping all workers')
+            workers = self.workers
+
+        for worker in workers:
+            worker.running = False
 
-        for worker in self.workers:
-            worker.is_running = False
-            worker.join()
+        for worker in workers:
+            if worker.is_alive():
+                worker.join()
+
+            if self.poll_scheduler is not None:
+                self.poll_scheduler.remove_route(worker.route.tag)
+
+            worker.remove_metrics()
+
+    def get_active_routes(self, service_class):
+        """Get the routes that the manager runs workers for in a service day.
+
+        Arguments:
+            service_class: (String) The service class of the day.
+
+        Returns:
+            List of instances of Route that have an active schedule in the day.
+        """
+
+        active_schedule_classes = ScheduleClass.objects.filter(is_active=True,
+                                                               service_class=service_class)\
+                                                       .values_list('route_id', flat=True)
+        return list(Route.objects.filter(id__in=active_schedule_classes))
+
+    def get_next_day(self, service_class, load_new_schedules, check_schedules=True):
+        """Prepare the workers and schedules for a service day, without changing the running
+        workers, so that they can keep polling while the next day is prepared.
+
+        Arguments:
+            service_class: (String) The service class of the day.
+            load_new_schedules: (Boolean) Whether to load the schedules of the workers that are
+                created for routes without a running worker. Otherwise, they load their schedules
+                when they are started.
+            check_schedules: (Boolean) Whether to retrieve new schedules from NextBus first.
+
+        Returns:
+            Dictionary with the following keys:
+                service_class: String, the service class of the day.
+                routes: List of instances of Route returned by the get_active_routes method.
+                workers: List of instances of RouteWorker for each of the routes, which are the
+                    running workers for routes that already have one, and new workers that have not
+                    been started for the other routes.
+                schedules: Dictionary with the tags of the routes with running workers whose
+                    schedule is different in the day as keys, and the schedules to switch the
+                    workers to as values, in the format returned by RouteWorker.get_schedule.
+        """
+
+        LOG.info('Preparing workers for service class %s', service_class)
+
+        if check_schedules:
+            self.check_for_new_schedules()
+
+        routes = self.get_active_routes(service_class)
+
+        running_workers = {worker.route.tag: worker for worker in self.workers}
+        workers = []
+        schedules = {}
+        for route_object in routes:
+            worker = running_workers.get(route_object.tag)
+            if worker is None:
+                worker = RouteWorker(route_tag=route_object.tag,
+                                     agency=self.agency,
+                                     service_class=service_class,
+                                     arrival_writer=self.arrival_writer,
+                                     poll_scheduler=self.poll_scheduler,
+                                     prediction_recorder=self.prediction_recorder,
+                                     checkpointer=self.checkpointer)
+                if load_new_schedules:
+                    worker.load_schedule()
+            else:
+                # Workers whose schedule is the same in the next day are left as they are
+                key = schedule_cache.get_schedule_key(route_object=route_object,
+                                                      service_class=service_class)
+                if key != worker.schedule_key:
+                    schedules[route_object.tag] = worker.get_schedule(service_class=service_class,
+                                                                      key=key)
+
+            workers.append(worker)
+
+        return {
+            'service_class': service_class,
+            'routes': routes,
+            'workers': workers,
+            'schedules': schedules
+        }
+
+    def get_preloaded_day(self, service_class):
+        """Get the day prepared in the background by the preload method, waiting for it to be
+        prepared if it is still being prepared.
+
+        Arguments:
+            service_class: (String) The service class of the day being switched to.
+
+        Returns:
+            Dictionary in the format returned by the get_next_day method, or None if the day was
+            not preloaded, preloading failed, or a day with a different service class was
+            preloaded.
+        """
+
+        if self.preload_thread is not None:
+            self.preload_thread.join()
+            self.preload_thread = None
+
+        next_day = self.preloaded_day
+        self.preloaded_day = None
+
+        if next_day is None or next_day['service_class'] != service_class:
+            return None
+
+        return next_day
+
+    def preload(self, service_class):
+        """Prepare the next day in a background thread, so that the schedules for the next day are
+        loaded before the day is switched.
+
+        Arguments:
+            service_class: (String) The service class of the next day.
+        """
+
+        def preload_day():
+            try:
+                self.preloaded_day = self.get_next_day(service_class=service_class,
+                                                       load_new_schedules=True)
+            except Exception:
+                LOG.exception('Failed to preload schedules for service class %s', service_class)
+            finally:
+                db.connections.close_all()
+
+        self.preloaded_day = None
+        self.preload_thread = threading.Thread(target=preload_day, name='preload')
+        self.preload_thread.start()
 
     def switch_day(self, previous_service_class):
-        """Tasks to perform when switching to a new day.
+        """Tasks to perform when switching to a new day. The workers are switched to the next day
+        one route at a time: routes that are no longer active are stopped, workers are started for
+        routes that became active, and the running workers of routes whose schedule changed switch
+        to the new schedule between retrievals of predictions, so that every other route keeps
+        being polled throughout the switch.
 
         Arguments:
             previous_service_class: (String) The service class of the previous day, which is being
-                switched away from. Either "wkd", "sat", or "sun".
+                switched away from. Either "wkd", "sat", or "sun". This is None when the manager
+                is started.
         """
 
         LOG.info('Switching day')
 
-        self.check_for_new_schedules()
+        service_class = utils.get_current_service_class()
+        next_day = self.get_preloaded_day(service_class=service_class)
+        if next_day is None:
+            next_day = self.get_next_day(service_class=service_class,
+                                         load_new_schedules=self.load_new_schedules)
 
-        self.service_class = utils.get_current_service_class()
-        active_schedule_classes = ScheduleClass.objects.filter(is_active=True,
-                                                               service_class=self.service_class)\
-                                                       .values_list('route_id', flat=True)
-        self.active_routes = Route.objects.filter(id__in=active_schedule_classes)
+        self.service_class = service_class
+        self.active_routes = next_day['routes']
+        self.update_workers(next_day)
+
+        # Schedules for other service classes will not be used again until their service class
+        # comes around again, and may be replaced by new schedules by then
+        schedule_cache.get_schedule_cache().retain(service_class=self.service_class)
 
-        self.stop_workers()
-        self.start_workers()
+    def update_workers(self, next_day):
+        """Switch the workers to a day prepared by the get_next_day method.
+
+        Arguments:
+            next_day: (Dictionary) The day in the format returned by the get_next_day method.
+        """
 
-    def check_for_new_schedules(self):
+        running_workers = {worker.route.tag: worker for worker in self.workers}
+        next_workers = {worker.route.tag: worker for worker in next_day['workers']}
+
+        stopped_workers = [worker for route_tag, worker in running_workers.items()
+                           if next_workers.get(route_tag) is not worker]
+        new_workers = [worker for route_tag, worker in next_workers.items()
+                       if running_workers.get(route_tag) is not worker]
+
+        for route_tag, schedule in next_day['schedules'].items():
+            next_workers[route_tag].set_schedule(schedule)
+
+        LOG.info('Stopping %d workers, starting %d workers, and switching %d workers to new '
+                 'schedules, out of %d workers', len(stopped_workers), len(new_workers),
+                 len(next_day['schedules']), len(next_workers))
+
+        self.stop_workers(stopped_workers)
+        self.workers = list(next_day['workers'])
+        self.start_workers(new_workers)
+
+    def check_for_new_schedules(self, route_tags=None, excluded_route_tags=None):
         """Check the NextBus API for any new schedules that have been published, and add any new
-        schedules or new routes to the database."""
+        schedules or new routes to the database. Cached schedules for routes with new schedules are
+        invalidated, so that workers load the new schedules.
+
+        Arguments:
+            route_tags: (Set of strings) Tags of the routes to check for new schedules. If this is
+                None, the schedules of every route are checked.
+            excluded_route_tags: (Set of strings) Tags of routes whose schedules are not checked.
+        """
 
         # Check if there are any new routes
         routes = route.get_routes(self.agency)
@@ -98,12 +454,78 @@ class RouteManager(object):
                           update_on_conflict=True,
                           conflict_columns=['tag'])
 
+        updated_route_ids = []
+
+        def update_schedule(route_object):
+            try:
+                if schedule.update_schedule_for_route(route_object):
+                    updated_route_ids.append(route_object.id)
+            except Exception:
+                LOG.exception('Failed to update schedule for route %s due to exception',
+                              route_object.tag)
+
         threads = []
         for r in routes:
-            thread = threading.Thread(target=schedule.update_schedule_for_route,
-                                      args=(Route.objects.get(tag=r['tag'])),)
+            if route_tags is not None and r['tag'] not in route_tags:
+                continue
+
+            if excluded_route_tags is not None and r['tag'] in excluded_route_tags:
+                continue
+
+            thread = threading.Thread(target=update_schedule,
+                                      args=(Route.objects.get(tag=r['tag']),))
             thread.start()
             threads.append(thread)
 
         for thread in threads:
             thread.join()
+
+        for route_id in updated_route_ids:
+            schedule_cache.get_schedule_cache().invalidate(route_id=route_id)
+
+    def wait(self, seconds):
+        """Wait between checks of whether the day needs to be switched.
+
+        Arguments:
+            seconds: (Float) Number of seconds to wait.
+        """
+
+        time.sleep(seconds)
+
+def get_next_switch_time(current_day, day_switch_time, now=None):
+    """Get the time that the day will next be switched.
+
+    Arguments:
+        current_day: (datetime.date) The calendar day that the day was last switched on, or that
+            the manager was started on.
+        day_switch_time: (Integer) Number of seconds after midnight that the day is switched.
+        now: (datetime.datetime) The current time. If this is None, the current time is used.
+
+    Returns:
+        datetime.datetime, the time the day will be switched.
+    """
+
+    if now is None:
+        now = datetime.datetime.now()
+
+    # The day is switched on the first calendar day after the current day, once the switch time has
+    # passed
+    switch_day = max(now.date(), current_day + datetime.timedelta(days=1))
+    return datetime.datetime.combine(switch_day, datetime.time()) + \
+        datetime.timedelta(seconds=day_switch_time)
+
+def get_start_delay(index, count, interval):
+    """Get the number of seconds a worker should wait before retrieving predictions for the first
+    time, so that the workers for all routes are spread evenly across the update interval instead
+    of all making requests at the same time.
+
+    Arguments:
+        index: (Integer) Position of the worker among all of the workers.
+        count: (Integer) Number of workers.
+        interval: (Float) Number of seconds between retrievals of predictions for each route.
+
+    Returns:
+        Float, the number of seconds to wait.
+    """
+
+    return index * interval / count
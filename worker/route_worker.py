@@ -4,29 +4,91 @@ import logging
 import os.path as path
 import threading
 import time
-from urllib.error import URLError
-
-import py_nextbus
 
 import how_late_is_muni.settings as settings
-from worker.models import Arrival, Route, ScheduleClass, ScheduledArrival, Stop
-import worker.libs.utils as utils
+from worker.models import Route, ScheduleClass, ScheduledArrival, Stop
+from worker.libs import (arrival, metrics, nextbus, prediction, prediction_snapshot, resilience,
+                         schedule_cache)
+from worker.libs.scheduled_arrival_index import ScheduledArrivalIndex, ScheduledArrivalRecord
+from worker.vehicle_location_detector import VehicleLocationDetector, get_stop_locations
 
 LOG = logging.getLogger(__name__)
 
 config = configparser.ConfigParser()
 config.read(path.join(settings.BASE_DIR, 'config.ini'))
 
+# Maximum number of seconds away a vehicle can have been in the previous predictions to consider it
+# to have arrived if it isn't in the most recent predictions, to prevent vehicles that are far from
+# the stop from incorrectly being considered to have arrived at the stop if they disappear from the
+# predictions
+ARRIVAL_THRESHOLD = 500
+
+# Metrics of each stage of every cycle of getting predictions and saving arrivals for each route
+FETCH_SECONDS = metrics.get_registry().histogram(
+    'muni_worker_fetch_seconds',
+    'Seconds taken to retrieve the predictions for a route from NextBus',
+    label_names=('route',))
+RESPONSE_BYTES = metrics.get_registry().histogram(
+    'muni_worker_response_bytes',
+    'Size in bytes of the responses returned by NextBus for the predictions for a route',
+    label_names=('route',),
+    buckets=metrics.BYTES_BUCKETS)
+PARSE_SECONDS = metrics.get_registry().histogram(
+    'muni_worker_parse_seconds',
+    'Seconds taken to parse the predictions for a route',
+    label_names=('route',))
+DIFF_SECONDS = metrics.get_registry().histogram(
+    'muni_worker_diff_seconds',
+    'Seconds taken to find arrivals by comparing consecutive predictions for a route',
+    label_names=('route',))
+MATCH_SECONDS = metrics.get_registry().histogram(
+    'muni_worker_match_seconds',
+    'Seconds taken to match the arrivals for a route to scheduled arrivals',
+    label_names=('route',))
+SAVE_SECONDS = metrics.get_registry().histogram(
+    'muni_worker_save_seconds',
+    'Seconds taken to save the arrivals for a route to the database, or to queue them with the '
+    'arrival writer',
+    label_names=('route',))
+ARRIVALS = metrics.get_registry().counter(
+    'muni_worker_arrivals_total',
+    'Number of arrivals detected for a route',
+    label_names=('route',))
+STALE_CYCLES = metrics.get_registry().counter(
+    'muni_worker_stale_cycles_total',
+    'Number of times the arrivals for a route were not saved because the previous predictions '
+    'were too old',
+    label_names=('route',))
+FETCH_ERRORS = metrics.get_registry().counter(
+    'muni_worker_fetch_errors_total',
+    'Number of failures to retrieve the predictions for a route, by class of error',
+    label_names=('route', 'error_class'))
+
 class RouteWorker(threading.Thread):
     """Class to manage the predictions and arrivals for a single route."""
 
-    def __init__(self, route_tag, agency, service_class):
+    def __init__(self, route_tag, agency, service_class, arrival_writer=None, poll_scheduler=None,
+                 start_delay=0, prediction_recorder=None, checkpointer=None):
         """
         Arguments:
             route_tag: (String) Number or letter of the route.
             agency: (String) Name of the transit agency this route is part of.
             service_class: (String) The current day of the week to use the schedule for, either
                 "wkd", "sat", "sun".
+            arrival_writer: (ArrivalWriter) Writer to queue arrivals with, so that they are saved
+                to the database in the background. If this is None, arrivals are saved to the
+                database directly.
+            poll_scheduler: (PollScheduler) Scheduler to choose how long to wait between retrieving
+                predictions with. If this is None, predictions are retrieved every
+                prediction_update_seconds.
+            start_delay: (Float) Number of seconds to wait before retrieving predictions for the
+                first time, so that the workers for different routes can be started at different
+                points in the update interval.
+            prediction_recorder: (PredictionRecorder) Recorder to record the raw predictions
+                returned by NextBus with. If this is None, predictions are not recorded.
+            checkpointer: (Checkpointer) Checkpointer to put the state of the worker with after
+                every retrieval of predictions, and to resume from the state in the checkpoint with
+                when the schedule is first loaded. If this is None, the worker is not checkpointed.
         """
 
         threading.Thread.__init__(self, name='%s worker' % route_tag)
@@ -36,17 +98,99 @@ class RouteWorker(threading.Thread):
         self.agency = agency
         self.route = Route.objects.get(tag=route_tag)
         self.service_class = service_class
+        self.arrival_writer = arrival_writer
+        self.poll_scheduler = poll_scheduler
+        self.start_delay = start_delay
+        self.prediction_recorder = prediction_recorder
+        self.checkpointer = checkpointer
+
+        self.stops = self.get_stops(service_class=service_class)
+
+        # The schedule is loaded by the load_schedule method, and replaced between retrievals of
+        # predictions with the schedule set by the set_schedule method
+        self.scheduled_arrival_index = None
+        self.schedule_key = None
+        self.pending_schedule = None
 
-        self.stops = Stop.objects.filter(route=self.route,
-                                         stop_schedule_class__schedule_class__service_class=service_class,
-                                         stop_schedule_class__schedule_class__is_active=True,
-                                         stop_schedule_class__schedule_class__route=self.route)
+        # Only used when arrivals are determined from the locations of vehicles, and created when
+        # the schedule is loaded
+        self.vehicle_location_detector = None
 
-        self.nextbus_client = py_nextbus.NextBusClient(output_format='json',
-                                                       agency=agency)
+        self.nextbus_client = nextbus.NextBusClient(output_format='json',
+                                                    agency=agency)
 
         self.update_frequency = int(config.get('worker', 'prediction_update_seconds'))
+        self.poll_interval = self.update_frequency
         self.duplicate_arrival_threshold = int(config.get('worker', 'duplicate_arrival_threshold'))
+        self.single_scheduled_arrival_threshold = \
+            int(config.get('worker', 'single_scheduled_arrival_threshold'))
+        self.arrival_detection = config.get('worker', 'arrival_detection')
+
+        self.max_backoff_seconds = float(config.get('nextbus', 'max_backoff_seconds'))
+        self.consecutive_failures = 0
+        self.circuit_breaker = resilience.CircuitBreaker(
+            name='route %s' % route_tag,
+            failure_threshold=int(config.get('nextbus', 'route_failure_threshold')),
+            reset_seconds=float(config.get('nextbus', 'circuit_reset_seconds')))
+
+    def fetch_predictions(self):
+        """Get predictions for all of the route's stops, handling any error that occurs so that the
+        worker can keep running. Errors count towards the route's circuit breaker, and no request
+        is made while the breaker is open.
+
+        Returns:
+            The predictions in the format returned by the get_predictions method, or None if the
+            predictions could not be retrieved. If arrivals are determined from the locations of
+            vehicles, the arrivals in the format returned by VehicleLocationDetector.get_arrivals
+            are returned instead.
+        """
+
+        if not self.circuit_breaker.allow_request():
+            LOG.debug('Not getting predictions for route %s, circuit breaker is open',
+                      self.route.tag)
+            return None
+
+        try:
+            if self.vehicle_location_detector is not None:
+                predictions = self.vehicle_location_detector.get_arrivals()
+            else:
+                predictions = self.get_predictions(stop_tags=self.stop_tags)
+        except Exception as exc:
+            self.record_fetch_failure(exc)
+            return None
+
+        self.record_fetch_success()
+        return predictions
+
+    def apply_pending_schedule(self):
+        """Replace the schedule of the worker with the schedule set by the set_schedule method, if
+        there is one. This is called by whatever is polling the worker before each retrieval of
+        predictions, so that the schedule is never replaced partway through a retrieval.
+
+        The predictions are kept, so that arrivals that occur across the replacement are found. A
+        stop that is no longer on the route is only missing from the next predictions.
+
+        Returns:
+            Boolean, true if the schedule was replaced.
+        """
+
+        pending_schedule = self.pending_schedule
+        if pending_schedule is None:
+            return False
+
+        self.pending_schedule = None
+        self.service_class = pending_schedule['service_class']
+        self.schedule_key = pending_schedule['key']
+        self.scheduled_arrival_index = pending_schedule['scheduled_arrival_index']
+        self.stop_tags = pending_schedule['stop_tags']
+        self.stops = self.get_stops(service_class=self.service_class)
+        if self.vehicle_location_detector is not None:
+            stops, sequences = pending_schedule['stop_locations']
+            self.vehicle_location_detector.set_stops(stops=stops, sequences=sequences)
+
+        LOG.info('Switched route %s to the schedule for service class %s', self.route.tag,
+                 self.service_class)
+        return True
 
     def get_arrivals(self, current_predictions, current_predictions_retrieve_time,
                      previous_predictions, previous_predictions_retrieve_time):
@@ -81,11 +225,7 @@ class RouteWorker(threading.Thread):
         time_between_retrievals = (current_predictions_retrieve_time -
                                    previous_predictions_retrieve_time)
 
-        # Maximum number of seconds away a vehicle can have been in the previous predictions to
-        # consider it to have arrived if it isn't in the most recent predictions, to prevent
-        # vehicles that are far from the stop from incorrectly being considered to have arrived at
-        # the stop if they disappear from the predictions
-        arrival_threshold = 500
+        arrival_threshold = ARRIVAL_THRESHOLD
 
         arrivals = {}
         for stop_tag, blocks in previous_predictions.items():
@@ -124,6 +264,55 @@ class RouteWorker(threading.Thread):
         LOG.debug('Found arrivals: %s', arrivals)
         return arrivals
 
+    def get_checkpoint(self):
+        """Get the state of the worker to write to a checkpoint.
+
+        Returns:
+            Dictionary with the following keys:
+                service_class: String, the service class of the schedule of the worker.
+                schedule_key: Tuple, the key of the schedule in the schedule cache.
+                retrieve_time: Float, Unix timestamp of when the current predictions were
+                    retrieved.
+                predictions: The current predictions, as a PredictionSnapshot if arrivals are
+                    determined with snapshots, otherwise as nested dictionaries.
+                scheduled_arrival_index: ScheduledArrivalIndex for the schedule.
+        """
+
+        if self.arrival_detection == 'snapshot':
+            predictions = self.current_snapshot
+        else:
+            predictions = self.current_predictions
+
+        return {
+            'service_class': self.service_class,
+            'schedule_key': self.schedule_key,
+            'retrieve_time': self.current_retrieve_time,
+            'predictions': predictions,
+            'scheduled_arrival_index': self.scheduled_arrival_index
+        }
+
+    def get_poll_interval(self, predictions):
+        """Get the number of seconds to wait before retrieving predictions again, and remember it so
+        that the next predictions can be checked for having been retrieved on time.
+
+        Arguments:
+            predictions: The predictions that were just retrieved, in the format returned by the
+                get_predictions method.
+
+        Returns:
+            The number of seconds to wait, chosen by the poll scheduler if the worker has one,
+            otherwise the update frequency. Arrivals determined from the locations of vehicles are
+            always retrieved at the update frequency.
+        """
+
+        if self.poll_scheduler is None or self.vehicle_location_detector is not None:
+            self.poll_interval = self.update_frequency
+        else:
+            self.poll_interval = self.poll_scheduler.get_next_interval(route_tag=self.route.tag,
+                                                                       predictions=predictions)
+
+        return self.poll_interval
+
     def get_predictions(self, stop_tags):
         """Get predictions for multiple stops, and return formatted arrival predictions for those
         stops.
@@ -133,8 +322,10 @@ class RouteWorker(threading.Thread):
                 predictions for.
 
         Returns:
-            Nested dictionaries keyed by stop tags -> block IDs -> trip tags, with the number of
-            seconds until the predicted arrival as the value. For example:
+            If arrivals are determined with snapshots, an instance of PredictionSnapshot parsed
+            directly from the response. Otherwise, nested dictionaries keyed by stop tags -> block
+            IDs -> trip tags, with the number of seconds until the predicted arrival as the value.
+            For example:
             {
                 5001: {
                     2101: {
@@ -151,69 +342,85 @@ class RouteWorker(threading.Thread):
         LOG.debug('Getting predictions')
 
         stops = [{'route_tag': self.route.tag, 'stop_tag': stop_tag} for stop_tag in stop_tags]
+        response_bytes = self.nextbus_client.response_bytes
+        start_time = time.perf_counter()
         predictions = self.nextbus_client.get_predictions_for_multi_stops(stops)
+        FETCH_SECONDS.observe(time.perf_counter() - start_time, labels=(self.route.tag,))
+        RESPONSE_BYTES.observe(self.nextbus_client.response_bytes - response_bytes,
+                               labels=(self.route.tag,))
 
-        prediction_dict = {}
-        for stop in predictions['predictions']:
-            stop_predictions = {}
-            for direction in utils.ensure_is_list(stop.get('direction', [])):
-                for prediction in utils.ensure_is_list(direction.get('prediction', [])):
-                    try:
-                        block_id = int(prediction['block'])
-                    except (ValueError, TypeError):
-                        LOG.info('Block ID %s is not an integer', prediction['block'])
-                    else:
-                        if block_id not in stop_predictions:
-                            stop_predictions[block_id] = {}
+        return self.parse_response(response=predictions, retrieve_time=time.time())
 
-                        stop_predictions[block_id][int(prediction['tripTag'])] = \
-                            int(prediction['seconds'])
+    def get_retry_interval(self):
+        """Get the number of seconds to wait before trying to get predictions again after a
+        failure, backing off exponentially from the update frequency the more consecutive failures
+        there have been.
 
-            prediction_dict[int(stop['stopTag'])] = stop_predictions
+        Returns:
+            Float, the number of seconds to wait.
+        """
 
-        return prediction_dict
+        return resilience.get_backoff_seconds(failures=self.consecutive_failures,
+                                              base_seconds=self.update_frequency,
+                                              max_seconds=self.max_backoff_seconds)
 
-    def get_scheduled_arrival_for_arrival(self, stop_tag, block_id, arrival_time,
-                                          scheduled_arrivals):
-        """Get the scheduled arrival for an arrival that occurred.
+    def get_schedule(self, service_class, key=None, scheduled_arrival_index=None):
+        """Get the schedule of the route in a service class, from the schedule cache if it was
+        already loaded.
 
         Arguments:
-            stop_tag: (Integer) The tag identifying the stop where the arrival occurred.
-            block_id: (Integer) Block ID of the vehicle that arrived at the stop.
-            arrival_time: (Intger) Midnight epoch timestamp indicating when the arrival occurred.
-            scheduled_arrivals: (List of instances of ScheduledArrivals) The scheduled arrivals for
-                the combination of stop and block ID where the arrival occurred.
+            service_class: (String) The service class to get the schedule for.
+            key: (Tuple) The key of the schedule in the schedule cache, if the caller already has
+                it.
+            scheduled_arrival_index: (ScheduledArrivalIndex) Index of the scheduled arrivals for the
+                schedule to add to the cache if it is not cached yet, such as an index read from a
+                checkpoint, instead of loading it from the database.
 
         Returns:
-            Instance of worker.models.ScheduledArrival for the closest scheduled arrival for the
-            arrival, or None if there are no scheduled arrivals for the combination of stop and
-            block.
+            Dictionary with the following keys:
+                service_class: String, the service class.
+                key: Tuple, the key of the schedule in the schedule cache, which changes whenever
+                    the active schedule of the route in the service class changes.
+                scheduled_arrival_index: ScheduledArrivalIndex for the schedule.
+                stop_tags: List of the tags of the stops on the route in the schedule.
+                stop_locations: Tuple of the locations and order of the stops on the route, in the
+                    format returned by worker.vehicle_location_detector.get_stop_locations, only
+                    if arrivals are determined from the locations of vehicles, so that they are
+                    loaded from the database before the schedule is applied.
         """
 
-        # Some stops only have one scheduled arrival time for a block ID even if there are multiple
-        # trips for the block ID that serve the stop, when there is a trip that begins or ends at
-        # the stop. To avoid every arrival throughout the day from being compared to the single
-        # scheduled arrival time, the arrival will only be compared to the single arrival time if
-        # the arrival is within a threshold.
-        if len(scheduled_arrivals) == 1:
-            if abs(arrival_time - scheduled_arrivals[0].time) <= \
-                    (int(config.get('worker', 'single_scheduled_arrival_threshold'))):
-                return scheduled_arrivals[0]
-            else:
-                return None
-
-        closest_arrival = None
-        closest_difference = None
-        for scheduled_arrival in scheduled_arrivals:
-            difference = min([abs(arrival_time - scheduled_arrival.time),
-                              # If arrival is before midnight and closest arrival is after midnight
-                              abs(arrival_time - scheduled_arrival.time - (60 * 60 * 24)),
-                              # If arrival is after midnight and closest arrival is before midnight
-                              abs(arrival_time - (scheduled_arrival.time - (60 * 60 * 24)))])
-            if closest_difference is  None or difference < closest_difference:
-                closest_arrival = scheduled_arrival
-                closest_difference = difference
-        return closest_arrival
+        if key is None:
+            key = schedule_cache.get_schedule_key(route_object=self.route,
+                                                  service_class=service_class)
+
+        restored_index = scheduled_arrival_index
+
+        def load():
+            if restored_index is not None:
+                return restored_index
+
+            return ScheduledArrivalIndex(
+                scheduled_arrivals=self.get_scheduled_arrivals(service_class=service_class),
+                single_scheduled_arrival_threshold=self.single_scheduled_arrival_threshold)
+
+        scheduled_arrival_index = schedule_cache.get_schedule_cache().get(
+            route_object=self.route,
+            service_class=service_class,
+            key=key,
+            load=load)
+
+        schedule = {
+            'service_class': service_class,
+            'key': key,
+            'scheduled_arrival_index': scheduled_arrival_index,
+            'stop_tags': [stop.tag for stop in self.get_stops(service_class=service_class)]
+        }
+
+        if self.arrival_detection == 'vehicle_location':
+            schedule['stop_locations'] = get_stop_locations(route=self.route,
+                                                            service_class=service_class)
+
+        return schedule
 
     def get_scheduled_arrivals(self, service_class):
         """Get the scheduled arrivals for the route in the service class for the current day.
@@ -224,12 +431,12 @@ class RouteWorker(threading.Thread):
         Returns:
             A dictionary with stop tags as keys and dictionaries of arrivals for each block ID on
             the route as values. Each dictionary of arrivals has block IDs as keys and an unsorted
-            list of instances of worker.models.ScheduledArrival as values. For example:
+            list of instances of ScheduledArrivalRecord as values. For example:
             {
-                "5001": {
+                5001: {
                     2101: [
-                        <instance of worker.models.ScheduledArrival>,
-                        <instance of worker.models.ScheduledArrival>
+                        <instance of ScheduledArrivalRecord>,
+                        <instance of ScheduledArrivalRecord>
                     ]
                 }
             }
@@ -237,25 +444,159 @@ class RouteWorker(threading.Thread):
 
         LOG.info('Getting scheculed arrivals for service class %s', service_class)
 
+        # Only the columns that are needed are retrieved, in a single query that is streamed from
+        # the database, instead of creating model instances and then querying for the stop
+        # schedule class and stop of each one
         scheduled_arrivals = ScheduledArrival.objects.filter(
             stop_schedule_class__schedule_class__route__exact=self.route,
             stop_schedule_class__schedule_class__service_class__exact=service_class,
             stop_schedule_class__schedule_class__is_active__exact=True
-        )
+        ).values_list('id',
+                      'stop_schedule_class__stop__tag',
+                      'stop_schedule_class__stop_id',
+                      'block_id',
+                      'time').iterator(chunk_size=5000)
 
         scheduled_arrival_dict = {}
-        for scheduled_arrival in scheduled_arrivals:
-            stop_tag = scheduled_arrival.stop_schedule_class.stop.tag
+        for scheduled_arrival_id, stop_tag, stop_id, block_id, arrival_time in scheduled_arrivals:
+            stop_scheduled_arrivals = scheduled_arrival_dict.setdefault(stop_tag, {})
+            stop_scheduled_arrivals.setdefault(block_id, []).append(
+                ScheduledArrivalRecord(id=scheduled_arrival_id,
+                                       stop_id=stop_id,
+                                       time=arrival_time))
 
-            if stop_tag not in scheduled_arrival_dict:
-                scheduled_arrival_dict[stop_tag] = {}
+        return scheduled_arrival_dict
 
-            if scheduled_arrival.block_id not in scheduled_arrival_dict[stop_tag]:
-                scheduled_arrival_dict[stop_tag][int(scheduled_arrival.block_id)] = []
+    def get_stops(self, service_class):
+        """Get the stops on the route in the active schedule for a service class.
 
-            scheduled_arrival_dict[stop_tag][int(scheduled_arrival.block_id)].append(scheduled_arrival)
+        Arguments:
+            service_class: (String) The service class to get the stops for.
 
-        return scheduled_arrival_dict
+        Returns:
+            QuerySet of instances of Stop.
+        """
+
+        return Stop.objects.filter(route=self.route,
+                                   stop_schedule_class__schedule_class__service_class=service_class,
+                                   stop_schedule_class__schedule_class__is_active=True,
+                                   stop_schedule_class__schedule_class__route=self.route)
+
+    def load_schedule(self):
+        """Load the index of scheduled arrivals and the stop tags for the route, and reset the
+        predictions, so that the worker is ready to start polling for predictions. The index is
+        shared with every other worker for the route through the schedule cache, so it is only
+        loaded from the database if it is not cached yet.
+
+        If the worker has a checkpointer with a state for the route in the same service class, the
+        worker resumes from the predictions in the checkpoint, and from its index of scheduled
+        arrivals if the schedule has not changed since, so that arrivals that occurred while the
+        worker was restarting are found. Arrivals are not saved if the predictions in the checkpoint
+        are too old, in the same way as when retrieving predictions fails."""
+
+        route_checkpoint = None
+        if self.checkpointer is not None:
+            route_checkpoint = self.checkpointer.pop(
+                route_tag=self.route.tag,
+                single_scheduled_arrival_threshold=self.single_scheduled_arrival_threshold)
+            if route_checkpoint is not None and \
+                    route_checkpoint['service_class'] != self.service_class:
+                route_checkpoint = None
+
+        key = schedule_cache.get_schedule_key(route_object=self.route,
+                                              service_class=self.service_class)
+        scheduled_arrival_index = None
+        if route_checkpoint is not None and route_checkpoint['schedule_key'] == key:
+            scheduled_arrival_index = route_checkpoint['scheduled_arrival_index']
+
+        schedule = self.get_schedule(service_class=self.service_class,
+                                     key=key,
+                                     scheduled_arrival_index=scheduled_arrival_index)
+        self.schedule_key = schedule['key']
+        self.scheduled_arrival_index = schedule['scheduled_arrival_index']
+        self.stop_tags = schedule['stop_tags']
+
+        if self.arrival_detection == 'vehicle_location':
+            self.vehicle_location_detector = VehicleLocationDetector(
+                route=self.route,
+                service_class=self.service_class,
+                nextbus_client=self.nextbus_client)
+
+        if route_checkpoint is None:
+            self.current_predictions = {}
+            self.current_snapshot = prediction_snapshot.PredictionSnapshot()
+            self.current_retrieve_time = time.time()
+        else:
+            LOG.info('Resuming route %s from predictions retrieved %d seconds ago', self.route.tag,
+                     time.time() - route_checkpoint['retrieve_time'])
+            self.current_snapshot = route_checkpoint['snapshot']
+            self.current_predictions = prediction_snapshot.get_predictions(self.current_snapshot)
+            self.current_retrieve_time = route_checkpoint['retrieve_time']
+
+    def parse_response(self, response, retrieve_time):
+        """Record the predictions returned by NextBus for the route with the prediction recorder, if
+        the worker has one, and parse them.
+
+        Arguments:
+            response: (Dictionary) The JSON returned by NextBus for the "predictionsForMultiStops"
+                command, with the "predictions" for the stops of the route.
+            retrieve_time: (Float) Unix timestamp of when the predictions were retrieved.
+
+        Returns:
+            The predictions in the format returned by the get_predictions method.
+        """
+
+        if self.prediction_recorder is not None:
+            self.prediction_recorder.record(route_tag=self.route.tag,
+                                            retrieve_time=retrieve_time,
+                                            response=response)
+
+        start_time = time.perf_counter()
+        predictions = prediction.parse_predictions(response['predictions'],
+                                                   arrival_detection=self.arrival_detection)
+        PARSE_SECONDS.observe(time.perf_counter() - start_time, labels=(self.route.tag,))
+
+        return predictions
+
+    def record_fetch_failure(self, exc):
+        """Record that the predictions for the route could not be retrieved, so that the failure
+        counts towards the route's circuit breaker and the retry interval backs off.
+
+        Arguments:
+            exc: (Exception) The exception raised while retrieving the predictions.
+        """
+
+        error_class = resilience.classify_error(exc)
+        self.consecutive_failures += 1
+        FETCH_ERRORS.inc(labels=(self.route.tag, error_class))
+
+        # Requests that were not made because the breaker shared by all routes is open are not
+        # failures of the route, but if the request was the trial of the route's half open breaker,
+        # the breaker must allow another trial
+        if error_class == resilience.ERROR_CIRCUIT_OPEN:
+            self.circuit_breaker.cancel_trial()
+        else:
+            self.circuit_breaker.record_failure()
+
+        if error_class == resilience.ERROR_UNKNOWN:
+            LOG.error('Failed to get arrival predictions for route %s due to exception',
+                      self.route.tag, exc_info=exc)
+        else:
+            LOG.warning('Failed to get arrival predictions for route %s due to %s error: %s',
+                        self.route.tag, error_class, exc)
+
+    def record_fetch_success(self):
+        """Record that the predictions for the route were retrieved, resetting the retry interval
+        and the route's circuit breaker."""
+
+        self.consecutive_failures = 0
+        self.circuit_breaker.record_success()
+
+    def remove_metrics(self):
+        """Remove the values of every metric for the route, once the worker has stopped, so that a
+        route that is no longer running is no longer exported."""
+
+        metrics.get_registry().remove(route=self.route.tag)
 
     def run(self):
         """Run the worker to get arrivals. This will start a loop that performs the following
@@ -268,56 +609,49 @@ class RouteWorker(threading.Thread):
 
         self.running = True
 
-        scheduled_arrivals = self.get_scheduled_arrivals(service_class=self.service_class)
-        stop_tags = [stop.tag for stop in self.stops]
+        # The schedule may have been loaded before the worker was started
+        if self.scheduled_arrival_index is None:
+            self.load_schedule()
 
-        current_predictions = {}
-        current_retrieve_time = time.time()
+        poll_time = time.monotonic() + self.start_delay
         while self.running:
-            previous_predictions = current_predictions
-            previous_retrieve_time = current_retrieve_time
-
-            try:
-                current_predictions = self.get_predictions(stop_tags=stop_tags)
-            except URLError:
-                LOG.exception('Failed to get arrival predictions due to exception')
-                time.sleep(self.update_frequency)
+            time.sleep(max(0, poll_time - time.monotonic()))
+            if not self.running:
+                break
+
+            self.apply_pending_schedule()
+            predictions = self.fetch_predictions()
+            if predictions is None:
+                poll_time = get_next_poll_time(poll_time=poll_time,
+                                               interval=self.get_retry_interval())
                 continue
 
-            current_retrieve_time = time.time()
-
-            arrivals = self.get_arrivals(current_predictions=current_predictions,
-                                         current_predictions_retrieve_time=current_retrieve_time,
-                                         previous_predictions=previous_predictions,
-                                         previous_predictions_retrieve_time=previous_retrieve_time)
-
-            if current_retrieve_time - previous_retrieve_time > self.update_frequency * 3:
-                LOG.warning('Predictions have not been updated in %d seconds, arrivals will be inaccurate and will not be saved',
-                            current_retrieve_time - previous_retrieve_time)
-
-            elif arrivals:
-                self.save_arrivals(arrivals=arrivals,
-                                   arrival_time=current_retrieve_time,
-                                   scheduled_arrivals=scheduled_arrivals)
+            if self.vehicle_location_detector is not None:
+                self.save_vehicle_arrivals(timed_arrivals=predictions)
             else:
-                LOG.debug('No arrivals to save')
+                arrivals = self.update_predictions(predictions=predictions,
+                                                   retrieve_time=time.time())
+                if arrivals:
+                    self.save_arrivals(arrivals=arrivals,
+                                       arrival_time=self.current_retrieve_time,
+                                       scheduled_arrival_index=self.scheduled_arrival_index)
 
-            time.sleep(self.update_frequency)
+            poll_time = get_next_poll_time(poll_time=poll_time,
+                                           interval=self.get_poll_interval(predictions))
 
         LOG.info('Stopping worker')
 
-    def save_arrivals(self, arrivals, arrival_time, scheduled_arrivals):
-        """Save arrivals to the database.
+    def save_arrivals(self, arrivals, arrival_time, scheduled_arrival_index):
+        """Save arrivals to the database, or queue them to be saved by the arrival writer if the
+        worker has one.
 
         Arguments:
             arrivals: (Dictionary) Dictionary with stop tags as keys and lists of block IDs of
                 arrivals as values.
             arrival_time: (Integer) Unix timestamp indicating the time at which the arrivals
                 occurred.
-            scheduled_arrivals: (Dictionary) Dictionary with stop tags as keys and dictionaries of
-                arrivals for each block ID on the route as values. Each dictionary of arrivals has
-                block IDs as keys and an unsorted list of instances of worker.model.ScheduledArrival
-                as values.
+            scheduled_arrival_index: (ScheduledArrivalIndex) Index of the scheduled arrivals for the
+                route.
         """
 
         arrival_date = datetime.datetime.fromtimestamp(arrival_time)
@@ -327,29 +661,140 @@ class RouteWorker(threading.Thread):
                                                                microseconds=arrival_date.microsecond)
         midnight_epoch_arrival = arrival_time - arrival_date_start.timestamp()
 
-        for stop_tag, block_ids in arrivals.items():
-            for block_id in block_ids:
-                if stop_tag in scheduled_arrivals and block_id in scheduled_arrivals[stop_tag]:
-                    scheduled_arrival = \
-                        self.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                               block_id=block_id,
-                                                               arrival_time=midnight_epoch_arrival,
-                                                               scheduled_arrivals=scheduled_arrivals[stop_tag][block_id])
-
-                    # Only save arrivals that can be associated with a scheduled arrival
-                    if scheduled_arrival is not None:
-                        # If there was already an arrival at the same stop for the same scheduled
-                        # arrival, consider the two arrivals to be duplicates if they are within a
-                        # certain threshold, and update the the arrival time to the current
-                        # arrival's time.
-                        Arrival.objects.update_or_create(
-                            stop=scheduled_arrival.stop_schedule_class.stop,
-                            scheduled_arrival=scheduled_arrival,
-                            time__gte=arrival_time - self.duplicate_arrival_threshold,
-                            defaults={
-                                'time': arrival_time,
-                                'difference': midnight_epoch_arrival - scheduled_arrival.time
-                            }
-                        )
-                else:
-                    LOG.warning('Block ID %s is not in scheduled arrivals' % block_id)
+        start_time = time.perf_counter()
+        arrival_rows = []
+        for stop_tag, block_id, scheduled_arrival in \
+                scheduled_arrival_index.get_scheduled_arrivals_for_arrivals(
+                    arrivals=arrivals,
+                    arrival_time=midnight_epoch_arrival):
+            if (stop_tag, block_id) not in scheduled_arrival_index:
+                LOG.warning('Block ID %s is not in scheduled arrivals' % block_id)
+
+            # Only save arrivals that can be associated with a scheduled arrival
+            elif scheduled_arrival is not None:
+                arrival_rows.append({
+                    'stop_id': scheduled_arrival.stop_id,
+                    'scheduled_arrival_id': scheduled_arrival.id,
+                    'time': int(arrival_time),
+                    'difference': int(midnight_epoch_arrival - scheduled_arrival.time)
+                })
+
+        save_start_time = time.perf_counter()
+        MATCH_SECONDS.observe(save_start_time - start_time, labels=(self.route.tag,))
+
+        if self.arrival_writer is not None:
+            self.arrival_writer.put(arrival_rows)
+        else:
+            # If there was already an arrival at the same stop for the same scheduled arrival,
+            # consider the two arrivals to be duplicates if they are within a certain threshold, and
+            # update the the arrival time to the current arrival's time.
+            arrival.bulk_save_arrivals(arrivals=arrival_rows,
+                                       duplicate_arrival_threshold=self.duplicate_arrival_threshold)
+
+        SAVE_SECONDS.observe(time.perf_counter() - save_start_time, labels=(self.route.tag,))
+
+    def save_vehicle_arrivals(self, timed_arrivals):
+        """Save the arrivals found from the locations of vehicles, each at the time it occurred.
+
+        Arguments:
+            timed_arrivals: (List) Tuples of a Unix timestamp and a dictionary with stop tags as
+                keys and lists of block IDs of arrivals as values, in the format returned by
+                VehicleLocationDetector.get_arrivals.
+        """
+
+        if not timed_arrivals:
+            LOG.debug('No arrivals to save')
+            return
+
+        for arrival_time, arrivals in timed_arrivals:
+            ARRIVALS.inc(sum(len(block_ids) for block_ids in arrivals.values()),
+                         labels=(self.route.tag,))
+            self.save_arrivals(arrivals=arrivals,
+                               arrival_time=arrival_time,
+                               scheduled_arrival_index=self.scheduled_arrival_index)
+
+    def set_schedule(self, schedule):
+        """Set a schedule to replace the schedule of the worker before it next retrieves
+        predictions, without stopping the worker.
+
+        Arguments:
+            schedule: (Dictionary) The schedule in the format returned by the get_schedule method.
+        """
+
+        self.pending_schedule = schedule
+
+    def update_predictions(self, predictions, retrieve_time):
+        """Replace the current predictions for the route with newly retrieved predictions, and
+        determine the arrivals that occurred since the previous predictions were retrieved.
+
+        Arguments:
+            predictions: The predictions that were just retrieved, in the format returned by the
+                get_predictions method. When arrivals are determined with snapshots, nested
+                dictionaries are also accepted and converted to a snapshot.
+            retrieve_time: (Integer) Unix timestamp of when the predictions were retrieved.
+
+        Returns:
+            Dictionary in the format returned by the get_arrivals method with the arrivals that
+            should be saved. The dictionary is empty if there were no arrivals, or if the previous
+            predictions are too old for the arrivals to be accurate.
+        """
+
+        previous_retrieve_time = self.current_retrieve_time
+        self.current_retrieve_time = retrieve_time
+
+        start_time = time.perf_counter()
+        if self.arrival_detection == 'snapshot':
+            if not isinstance(predictions, prediction_snapshot.PredictionSnapshot):
+                predictions = prediction_snapshot.get_snapshot(predictions)
+
+            previous_snapshot = self.current_snapshot
+            self.current_snapshot = predictions
+
+            arrivals = prediction_snapshot.get_arrivals(
+                previous_snapshot=previous_snapshot,
+                current_snapshot=self.current_snapshot,
+                time_between_retrievals=retrieve_time - previous_retrieve_time,
+                arrival_threshold=ARRIVAL_THRESHOLD)
+        else:
+            previous_predictions = self.current_predictions
+            self.current_predictions = predictions
+
+            arrivals = self.get_arrivals(current_predictions=predictions,
+                                         current_predictions_retrieve_time=retrieve_time,
+                                         previous_predictions=previous_predictions,
+                                         previous_predictions_retrieve_time=previous_retrieve_time)
+
+        DIFF_SECONDS.observe(time.perf_counter() - start_time, labels=(self.route.tag,))
+
+        if self.checkpointer is not None:
+            self.checkpointer.put(route_tag=self.route.tag, route_checkpoint=self.get_checkpoint())
+
+        if retrieve_time - previous_retrieve_time > self.poll_interval * 3:
+            LOG.warning('Predictions have not been updated in %d seconds, arrivals will be inaccurate and will not be saved',
+                        retrieve_time - previous_retrieve_time)
+            STALE_CYCLES.inc(labels=(self.route.tag,))
+            return {}
+
+        if not arrivals:
+            LOG.debug('No arrivals to save')
+        else:
+            ARRIVALS.inc(sum(len(block_ids) for block_ids in arrivals.values()),
+                         labels=(self.route.tag,))
+
+        return arrivals
+
+def get_next_poll_time(poll_time, interval):
+    """Get the time to retrieve predictions next, measured from when the previous retrieval was
+    scheduled instead of from when it finished, so that the time spent retrieving predictions and
+    saving arrivals does not make the schedule drift. If the next retrieval is already overdue, it
+    happens immediately, instead of several retrievals happening back to back to catch up.
+
+    Arguments:
+        poll_time: (Float) Monotonic time that the previous retrieval was scheduled for.
+        interval: (Float) Number of seconds between retrievals.
+
+    Returns:
+        Float, the monotonic time of the next retrieval.
+    """
+
+    return max(poll_time + interval, time.monotonic())
@@ -0,0 +1,339 @@
+import configparser
+import logging
+import os
+import os.path as path
+import signal
+import sys
+import threading
+import time
+
+import how_late_is_muni.settings as settings
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+# Signal that starts profiling a running worker
+PROFILE_SIGNAL = getattr(signal, 'SIGUSR2', None)
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+class SamplingProfiler(threading.Thread):
+    """Class to profile every thread of the process from a dedicated thread, by periodically taking
+    the stack of every other thread, without tracing every call like cProfile does. This keeps the
+    overhead low enough to profile a worker that is tracking arrivals without having to restart it.
+
+    Stacks are aggregated for each thread into collapsed stacks, with a line for each distinct stack
+    of the frames from the outermost to the innermost separated by semicolons, followed by the
+    number of samples it was seen in, which can be rendered as a flame graph. The CPU time used by
+    each thread is measured with its CPU clock, where the platform supports it, so that threads
+    that are waiting can be told apart from threads that are running.
+    """
+
+    def __init__(self, seconds, interval, directory=None):
+        """
+        Arguments:
+            seconds: (Float) Number of seconds to profile for.
+            interval: (Float) Number of seconds between samples.
+            directory: (String) Path of the directory to write the profile to. If this is None, the
+                profile is not written, and is only available from the get_collapsed_stacks and
+                get_thread_summary methods.
+        """
+
+        threading.Thread.__init__(self, name='sampling profiler', daemon=True)
+
+        self.seconds = seconds
+        self.interval = interval
+        self.directory = directory
+
+        # Keyed by thread names -> tuples of frames, with the number of samples as values
+        self.stacks = {}
+        self.samples = 0
+        self.thread_samples = {}
+        self.start_cpu_seconds = {}
+        self.end_cpu_seconds = {}
+        self.wall_seconds = 0
+        self.output_paths = []
+
+    def get_collapsed_stacks(self):
+        """Get the sampled stacks in the collapsed stack format.
+
+        Returns:
+            List of strings with a line for each distinct stack of each thread, starting with the
+            name of the thread, sorted by thread name and stack.
+        """
+
+        lines = []
+        for thread_name in sorted(self.stacks):
+            for stack, count in sorted(self.stacks[thread_name].items()):
+                lines.append('%s %d' % (';'.join((thread_name,) + stack), count))
+
+        return lines
+
+    def get_thread_summary(self):
+        """Get a summary of the samples and CPU time of each thread that was sampled.
+
+        Returns:
+            List of dictionaries sorted by CPU time and then samples, most first, with the
+            following keys:
+                thread: String, name of the thread.
+                samples: Integer, number of samples the thread was seen in.
+                cpu_seconds: Float, CPU time used by the thread while profiling, or None if it
+                    could not be measured.
+                cpu_fraction: Float, fraction of the wall time that the thread used the CPU, or
+                    None if it could not be measured.
+        """
+
+        summary = []
+        for thread_name, samples in self.thread_samples.items():
+            cpu_seconds = None
+            cpu_fraction = None
+            if thread_name in self.end_cpu_seconds:
+                cpu_seconds = self.end_cpu_seconds[thread_name] - \
+                    self.start_cpu_seconds.get(thread_name, 0)
+                cpu_fraction = cpu_seconds / self.wall_seconds if self.wall_seconds else 0
+
+            summary.append({
+                'thread': thread_name,
+                'samples': samples,
+                'cpu_seconds': cpu_seconds,
+                'cpu_fraction': cpu_fraction
+            })
+
+        return sorted(summary, key=lambda thread: (-(thread['cpu_seconds'] or 0),
+                                                   -thread['samples'],
+                                                   thread['thread']))
+
+    def run(self):
+        """Sample the stacks of every thread until the profiling time has elapsed, and write the
+        profile if the profiler has a directory."""
+
+        LOG.info('Profiling all threads for %.1f seconds', self.seconds)
+
+        self.start_cpu_seconds = get_thread_cpu_seconds()
+        start_time = time.monotonic()
+        end_time = start_time + self.seconds
+        next_sample_time = start_time
+        while True:
+            self.sample()
+
+            next_sample_time += self.interval
+            now = time.monotonic()
+            if now >= end_time:
+                break
+
+            time.sleep(max(0, min(next_sample_time, end_time) - now))
+
+        self.wall_seconds = time.monotonic() - start_time
+        self.end_cpu_seconds = get_thread_cpu_seconds()
+
+        LOG.info('Took %d samples in %.1f seconds', self.samples, self.wall_seconds)
+
+        if self.directory is not None:
+            try:
+                self.write()
+            except OSError:
+                LOG.exception('Failed to write profile to %s', self.directory)
+
+    def sample(self):
+        """Take a sample of the stack of every thread other than the profiler's thread."""
+
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own_ident = threading.get_ident()
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            thread_name = thread_names.get(ident, 'thread %d' % ident)
+            stack = get_stack(frame)
+
+            thread_stacks = self.stacks.setdefault(thread_name, {})
+            thread_stacks[stack] = thread_stacks.get(stack, 0) + 1
+            self.thread_samples[thread_name] = self.thread_samples.get(thread_name, 0) + 1
+
+        self.samples += 1
+
+    def write(self):
+        """Write the collapsed stacks and the summary of each thread to files in the directory,
+        named after the time the profile was written and the ID of the process."""
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = 'profile-%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+
+        collapsed_path = path.join(self.directory, '%s.collapsed' % name)
+        with open(collapsed_path, 'w') as collapsed_file:
+            for line in self.get_collapsed_stacks():
+                collapsed_file.write(line + '\n')
+
+        summary_path = path.join(self.directory, '%s.threads.txt' % name)
+        with open(summary_path, 'w') as summary_file:
+            summary_file.write('%d samples in %.1f seconds\n' % (self.samples, self.wall_seconds))
+            summary_file.write('%-40s %8s %12s %8s\n' % ('thread', 'samples', 'cpu seconds',
+                                                         'cpu %'))
+            for thread in self.get_thread_summary():
+                if thread['cpu_seconds'] is None:
+                    cpu = '%12s %8s' % ('-', '-')
+                else:
+                    cpu = '%12.3f %7.1f%%' % (thread['cpu_seconds'], thread['cpu_fraction'] * 100)
+                summary_file.write('%-40s %8d %s\n' % (thread['thread'], thread['samples'], cpu))
+
+        self.output_paths = [collapsed_path, summary_path]
+        LOG.info('Wrote profile to %s', ', '.join(self.output_paths))
+
+def format_frame(frame):
+    """Format a frame for a collapsed stack.
+
+    Arguments:
+        frame: The frame to format.
+
+    Returns:
+        String with the name of the function and the file it is in, relative to the project
+        directory if it is part of the project. Line numbers are not included, so that samples in
+        different lines of the same function are aggregated together.
+    """
+
+    filename = frame.f_code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = path.relpath(filename, settings.BASE_DIR)
+    else:
+        filename = path.join(path.basename(path.dirname(filename)), path.basename(filename))
+
+    # Semicolons separate the frames of collapsed stacks
+    return ('%s (%s)' % (frame.f_code.co_name, filename)).replace(';', ':')
+
+def get_profile_directory():
+    """Get the directory that profiles are written to.
+
+    Returns:
+        String, the path in the config, relative to the project directory if it is not absolute.
+    """
+
+    return path.join(settings.BASE_DIR, config.get('profiler', 'directory'))
+
+def get_profiler():
+    """Get the profiler that is currently profiling the process.
+
+    Returns:
+        Instance of SamplingProfiler, or None if the process is not being profiled.
+    """
+
+    with _profiler_lock:
+        if _profiler is not None and _profiler.is_alive():
+            return _profiler
+
+        return None
+
+def get_request_path(directory, pid):
+    """Get the path of the file that the profile command writes the number of seconds to profile
+    for to, before signalling a process to start profiling.
+
+    Arguments:
+        directory: (String) Directory that profiles are written to.
+        pid: (Integer) ID of the process to profile.
+
+    Returns:
+        String, the path of the file.
+    """
+
+    return path.join(directory, 'request-%d' % pid)
+
+def get_stack(frame):
+    """Get the frames of a stack, from the outermost to the innermost.
+
+    Arguments:
+        frame: The innermost frame of the stack.
+
+    Returns:
+        Tuple of strings with each frame formatted by format_frame.
+    """
+
+    stack = []
+    while frame is not None:
+        stack.append(format_frame(frame))
+        frame = frame.f_back
+
+    stack.reverse()
+    return tuple(stack)
+
+def get_thread_cpu_seconds():
+    """Get the CPU time used by each thread, if the platform has a CPU clock for each thread.
+
+    Returns:
+        Dictionary with the names of threads as keys and the number of seconds of CPU time each
+        thread has used as values, which is empty if the CPU time cannot be measured.
+    """
+
+    getcpuclockid = getattr(time, 'pthread_getcpuclockid', None)
+    if getcpuclockid is None:
+        return {}
+
+    cpu_seconds = {}
+    for thread in threading.enumerate():
+        try:
+            cpu_seconds[thread.name] = time.clock_gettime(getcpuclockid(thread.ident))
+        except (OSError, TypeError):
+            # The thread finished, or has not started yet
+            continue
+
+    return cpu_seconds
+
+def install_signal_handler():
+    """Start profiling the process whenever it receives PROFILE_SIGNAL, such as from the profile
+    command. This must be called from the main thread.
+
+    Returns:
+        Boolean, true if the handler was installed, or false if the platform does not support the
+        signal.
+    """
+
+    if PROFILE_SIGNAL is None:
+        LOG.warning('Profiling on a signal is not supported on this platform')
+        return False
+
+    signal.signal(PROFILE_SIGNAL, lambda signum, frame: start_profiler())
+    return True
+
+def start_profiler(seconds=None):
+    """Start profiling the process with the interval and directory in the config, unless it is
+    already being profiled.
+
+    Arguments:
+        seconds: (Float) Number of seconds to profile for. If this is None, the number of seconds
+            written to the request file by the profile command is used if there is one, otherwise
+            the number of seconds in the config.
+
+    Returns:
+        The instance of SamplingProfiler that was started, or None if the process is already being
+        profiled.
+    """
+
+    global _profiler
+
+    directory = get_profile_directory()
+    if seconds is None:
+        seconds = float(config.get('profiler', 'seconds'))
+
+        request_path = get_request_path(directory, os.getpid())
+        try:
+            with open(request_path) as request_file:
+                seconds = float(request_file.read())
+            os.remove(request_path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            LOG.exception('Failed to read profiling request %s', request_path)
+
+    with _profiler_lock:
+        if _profiler is not None and _profiler.is_alive():
+            LOG.warning('Not starting profiler, the process is already being profiled')
+            return None
+
+        _profiler = SamplingProfiler(seconds=seconds,
+                                     interval=float(config.get('profiler', 'interval_ms')) / 1000,
+                                     directory=directory)
+        _profiler.start()
+
+        return _profiler
@@ -0,0 +1,178 @@
+import configparser
+import logging
+import os.path as path
+import time
+
+from django import db
+
+import how_late_is_muni.settings as settings
+from worker.libs import lease
+from worker.models import Route
+from worker.route_manager import RouteManager
+
+LOG = logging.getLogger()
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class ShardedRouteManager(RouteManager):
+    """Route manager that only runs the workers for a share of the routes, so that the routes of the
+    agency can be split between several processes, on one or more hosts, that use the same
+    database.
+
+    Each process is a shard that holds time-limited leases on its routes in the database, which it
+    renews every renew_seconds. When a shard starts, the other shards release their routes beyond
+    their new fair share for it to claim, and when a shard stops renewing its leases, the other
+    shards claim its routes once its leases expire after lease_seconds. Workers are started and
+    stopped as routes are claimed and released, without restarting the workers for other routes.
+    """
+
+    def __init__(self, shard_name=None):
+        """
+        Arguments:
+            shard_name: (String) Unique name of the shard. If this is None, the name in the config
+                is used, or the host name and ID of the process if the config does not have one.
+        """
+
+        if shard_name is None:
+            shard_name = config.get('sharding', 'name') or lease.get_default_shard_name()
+
+        self.shard_name = shard_name
+        self.lease_seconds = int(config.get('sharding', 'lease_seconds'))
+        self.renew_seconds = int(config.get('sharding', 'renew_seconds'))
+
+        if self.renew_seconds >= self.lease_seconds:
+            raise ValueError('renew_seconds must be less than lease_seconds')
+
+        self.leased_route_ids = set()
+
+        # Number of times the routes leased by the shard changed, so that a day that was preloaded
+        # before the routes were rebalanced is not used
+        self.lease_changes = 0
+        self.preload_lease_changes = 0
+
+        # Time in the monotonic clock after which the leases may have expired, if they could not be
+        # renewed since
+        self.leases_expire = 0
+
+        super().__init__()
+
+    def run(self):
+        LOG.info('Running as shard %s', self.shard_name)
+
+        try:
+            super().run()
+        finally:
+            try:
+                lease.remove_shard(self.shard_name)
+            except Exception:
+                LOG.exception('Failed to release the leases of shard %s', self.shard_name)
+
+    def check_for_new_schedules(self, route_tags=None, excluded_route_tags=None):
+        """Check for new schedules for the routes that the shard holds leases on, so that every
+        shard checks the schedules of its own routes.
+
+        Leases are only claimed on routes that have active schedules, so the shard with the lowest
+        name among the running shards also checks every route that no other running shard holds a
+        lease on, including new routes and routes without schedules. A shard that has not sent its
+        first heartbeat yet, such as when the database is empty, checks them if no other shard is
+        running."""
+
+        if route_tags is None and excluded_route_tags is None:
+            now = lease.get_database_time()
+            live_shards = lease.get_live_shards(now)
+            if min(live_shards + [self.shard_name]) == self.shard_name:
+                excluded_route_tags = lease.get_other_shards_route_tags(shard_name=self.shard_name,
+                                                                        now=now)
+                LOG.info('Shard %s is checking the schedules of every route not leased by %d other '
+                         'shards', self.shard_name, len(set(live_shards) - {self.shard_name}))
+            else:
+                route_tags = set(Route.objects.filter(id__in=self.leased_route_ids)
+                                 .values_list('tag', flat=True))
+
+        super().check_for_new_schedules(route_tags=route_tags,
+                                        excluded_route_tags=excluded_route_tags)
+
+    def get_active_routes(self, service_class):
+        """Get the active routes in a service day that the shard holds leases on."""
+
+        return [route_object for route_object in super().get_active_routes(service_class)
+                if route_object.id in self.leased_route_ids]
+
+    def get_preloaded_day(self, service_class):
+        """Get the day prepared in the background by the preload method, unless the routes leased by
+        the shard changed since it was prepared."""
+
+        next_day = super().get_preloaded_day(service_class=service_class)
+        if next_day is not None and self.preload_lease_changes != self.lease_changes:
+            LOG.info('Routes were rebalanced since the next day was preloaded, preparing it again')
+            return None
+
+        return next_day
+
+    def preload(self, service_class):
+        self.preload_lease_changes = self.lease_changes
+        super().preload(service_class=service_class)
+
+    def rebalance(self):
+        """Renew the leases of the shard and rebalance the routes between the shards, then start
+        workers for the routes that were claimed and stop the workers for the routes that were
+        released. If the leases could not be renewed before they may have expired, every worker is
+        stopped, since other shards may have claimed their routes."""
+
+        renew_time = time.monotonic()
+        try:
+            route_ids = [route_object.id for route_object in
+                         RouteManager.get_active_routes(self, service_class=self.service_class)]
+            leased_route_ids = lease.update_leases(shard_name=self.shard_name,
+                                                   route_ids=route_ids,
+                                                   lease_seconds=self.lease_seconds)
+        except Exception:
+            LOG.exception('Failed to renew leases of shard %s', self.shard_name)
+            db.connections.close_all()
+
+            # Leases are renewed every renew_seconds, so the workers are stopped one renewal before
+            # the leases may expire, rather than after other shards may have started polling
+            if self.leased_route_ids and \
+                    time.monotonic() >= self.leases_expire - self.renew_seconds:
+                LOG.warning('Leases of shard %s expired, stopping all workers', self.shard_name)
+                self.leased_route_ids = set()
+                self.lease_changes += 1
+                self.stop_workers()
+                self.workers = []
+
+            return
+
+        self.leases_expire = renew_time + self.lease_seconds
+        if leased_route_ids == self.leased_route_ids:
+            return
+
+        LOG.info('Shard %s holds leases on %d routes', self.shard_name, len(leased_route_ids))
+
+        self.leased_route_ids = leased_route_ids
+        self.lease_changes += 1
+        next_day = self.get_next_day(service_class=self.service_class,
+                                     load_new_schedules=self.load_new_schedules,
+                                     check_schedules=False)
+        self.update_workers(next_day)
+
+    def switch_day(self, previous_service_class):
+        """Switch to a new day, then rebalance the routes that are active in the new day between
+        the shards."""
+
+        super().switch_day(previous_service_class=previous_service_class)
+        self.rebalance()
+
+    def wait(self, seconds):
+        """Wait between checks of whether the day needs to be switched, renewing the leases every
+        renew_seconds while waiting."""
+
+        end_time = time.monotonic() + seconds
+        while True:
+            self.rebalance()
+
+            remaining_seconds = end_time - time.monotonic()
+            if remaining_seconds <= 0:
+                break
+
+            time.sleep(min(self.renew_seconds, remaining_seconds))
@@ -0,0 +1,71 @@
+"""Unit tests for libs/benchmark.py"""
+
+import unittest
+import unittest.mock
+
+from django.test import tag
+
+from worker.libs import benchmark
+
+def _get_result(name, min_seconds):
+    """Get the result of a benchmark.
+
+    Arguments:
+        name: (String) Name of the benchmark.
+        min_seconds: (Float) Fastest time of the benchmark.
+
+    Returns:
+        Dictionary with the result.
+    """
+
+    return {'name': name, 'size': 'small', 'min_seconds': min_seconds}
+
+@tag('unit')
+class TestCompareResults(unittest.TestCase):
+    """Tests for the compare_results function"""
+
+    def test_regressions_found(self):
+        """Test that only benchmarks that are slower by more than the threshold are regressions,
+        and that benchmarks missing from the earlier run are not compared."""
+
+        comparisons = benchmark.compare_results(
+            baseline_results=[_get_result('foo', 1.0), _get_result('bar', 1.0)],
+            results=[_get_result('foo', 1.5), _get_result('bar', 1.1), _get_result('baz', 9.0)],
+            threshold=0.2)
+
+        self.assertEquals([(comparison['name'], comparison['regression'])
+                           for comparison in comparisons],
+                          [('foo', True), ('bar', False)])
+        self.assertAlmostEqual(comparisons[0]['change'], 0.5)
+
+@tag('unit')
+class TestTimeCall(unittest.TestCase):
+    """Tests for the time_call function"""
+
+    def test_function_timed(self):
+        """Test that the function is called once to warm up and then once for each repetition."""
+
+        func = unittest.mock.MagicMock()
+
+        result = benchmark.time_call(func, repeat=3)
+
+        self.assertEquals(func.call_count, 4)
+        self.assertEquals(result['repeat'], 3)
+        self.assertLessEqual(result['min_seconds'], result['median_seconds'])
+        self.assertLessEqual(result['median_seconds'], result['max_seconds'])
+
+@tag('unit')
+class TestCachingTransport(unittest.TestCase):
+    """Tests for the CachingTransport class"""
+
+    def test_responses_cached(self):
+        """Test that each URL is only requested from the wrapped transport once."""
+
+        wrapped_transport = unittest.mock.MagicMock()
+        wrapped_transport.get.side_effect = lambda url, use_compression: url.encode('utf-8')
+        transport = benchmark.CachingTransport(wrapped_transport)
+
+        self.assertEquals(transport.get('http://foo'), b'http://foo')
+        self.assertEquals(transport.get('http://foo'), b'http://foo')
+        self.assertEquals(transport.get('http://bar'), b'http://bar')
+        self.assertEquals(wrapped_transport.get.call_count, 2)
@@ -0,0 +1,127 @@
+"""Unit tests for libs/checkpoint.py"""
+
+import gzip
+import os
+import os.path as path
+import shutil
+import tempfile
+import unittest
+
+from django.test import tag
+
+import worker.libs.checkpoint as checkpoint
+import worker.libs.prediction_snapshot as prediction_snapshot
+from worker.tests.utils import get_route_checkpoint
+
+@tag('unit')
+class TestEncodeRoute(unittest.TestCase):
+    """Tests for the encode_route and decode_route functions in the checkpoint module."""
+
+    def test_route_round_trip(self):
+        """Test that the predictions and index of scheduled arrivals of a route are the same after
+        being encoded and decoded."""
+
+        route_checkpoint = get_route_checkpoint()
+
+        decoded = checkpoint.decode_route(state=checkpoint.encode_route(route_checkpoint),
+                                          single_scheduled_arrival_threshold=1800)
+
+        self.assertEquals(decoded['service_class'], 'wkd')
+        self.assertEquals(decoded['schedule_key'], route_checkpoint['schedule_key'])
+        self.assertEquals(decoded['retrieve_time'], 12300.5)
+        self.assertEquals(prediction_snapshot.get_predictions(decoded['snapshot']),
+                          route_checkpoint['predictions'])
+
+        index = route_checkpoint['scheduled_arrival_index']
+        decoded_index = decoded['scheduled_arrival_index']
+        for stop_tag, block_id in ((1234, 5678), (2345, 5678)):
+            for arrival_time in (0, 600, 2000, 3600, 86000, 86399):
+                self.assertEquals(decoded_index.get_scheduled_arrival(stop_tag=stop_tag,
+                                                                      block_id=block_id,
+                                                                      arrival_time=arrival_time),
+                                  index.get_scheduled_arrival(stop_tag=stop_tag,
+                                                              block_id=block_id,
+                                                              arrival_time=arrival_time))
+
+    def test_snapshot_encoded_as_is(self):
+        """Test that predictions that are already a snapshot are encoded without conversion."""
+
+        route_checkpoint = get_route_checkpoint()
+        snapshot = prediction_snapshot.get_snapshot(route_checkpoint['predictions'])
+        route_checkpoint['predictions'] = snapshot
+
+        self.assertEquals(checkpoint.encode_route(route_checkpoint)['predictions'],
+                          snapshot.get_state())
+
+@tag('unit')
+class TestReadCheckpoint(unittest.TestCase):
+    """Tests for the read_checkpoint and write_checkpoint functions in the checkpoint module."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_path = path.join(self.directory, 'checkpoints', 'worker.json.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_checkpoint_round_trip(self):
+        """Test that the routes written to a checkpoint are read back, and that no temporary file
+        is left behind."""
+
+        routes = {'N': checkpoint.encode_route(get_route_checkpoint())}
+        checkpoint.write_checkpoint(checkpoint_path=self.checkpoint_path,
+                                    routes=routes,
+                                    written_at=1000)
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600,
+                                                     now=1100),
+                          routes)
+        self.assertEquals(os.listdir(path.dirname(self.checkpoint_path)), ['worker.json.gz'])
+
+    def test_old_checkpoint_ignored(self):
+        """Test that a checkpoint older than the maximum age is ignored."""
+
+        checkpoint.write_checkpoint(checkpoint_path=self.checkpoint_path,
+                                    routes={'N': {}},
+                                    written_at=1000)
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600,
+                                                     now=1601),
+                          {})
+
+    def test_missing_checkpoint(self):
+        """Test that no routes are read if there is no checkpoint."""
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600),
+                          {})
+
+    def test_corrupt_checkpoint_ignored(self):
+        """Test that a truncated checkpoint is ignored."""
+
+        checkpoint.write_checkpoint(checkpoint_path=self.checkpoint_path,
+                                    routes={'N': checkpoint.encode_route(get_route_checkpoint())},
+                                    written_at=1000)
+        with open(self.checkpoint_path, 'rb') as checkpoint_file:
+            data = checkpoint_file.read()
+        with open(self.checkpoint_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(data[:len(data) // 2])
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600,
+                                                     now=1100),
+                          {})
+
+    def test_other_version_ignored(self):
+        """Test that a checkpoint with a different version is ignored."""
+
+        os.makedirs(path.dirname(self.checkpoint_path))
+        with gzip.open(self.checkpoint_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(b'{"version": 0, "written_at": 1000, "routes": {"N": {}}}')
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600,
+                                                     now=1100),
+                          {})
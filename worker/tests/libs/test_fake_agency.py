@@ -0,0 +1,97 @@
+"""Unit tests for libs/fake_agency.py"""
+
+import unittest
+
+from django.test import tag
+
+from worker.libs import fake_agency, prediction, utils
+
+@tag('unit')
+class TestFakeAgency(unittest.TestCase):
+    """Tests for the FakeAgency class"""
+
+    def setUp(self):
+        self.agency = fake_agency.FakeAgency(routes=3,
+                                             stops_per_direction=4,
+                                             vehicles_per_route=2,
+                                             seconds_between_stops=60,
+                                             max_delay_seconds=0)
+
+    def test_stop_tags_unique(self):
+        """Test that the stops of every route have different tags."""
+
+        stop_tags = [stop['tag']
+                     for route_tag in self.agency.route_tags
+                     for stop in self.agency.get_route_config(route_tag)['route']['stop']]
+
+        self.assertEquals(len(stop_tags), 3 * 2 * 4)
+        self.assertEquals(len(set(stop_tags)), len(stop_tags))
+
+    def test_unknown_route(self):
+        """Test that None is returned for routes that are not part of the agency."""
+
+        self.assertIsNone(self.agency.get_route_config('38R'))
+        self.assertIsNone(self.agency.get_schedule('38R'))
+        self.assertIn('Error', self.agency.get_predictions_for_multi_stops(['38R|10000'], now=0))
+
+    def test_predictions_match_schedule(self):
+        """Test that the predicted arrivals of a vehicle that is not running late are at the same
+        times as its scheduled arrivals."""
+
+        route_tag = self.agency.route_tags[1]
+        route_schedule = self.agency.get_schedule(route_tag)['route'][0]
+        trip = route_schedule['tr'][3]
+        trip_stop = trip['stop'][2]
+        scheduled_seconds = int(trip_stop['epochTime']) // 1000
+
+        now = scheduled_seconds - 100
+        response = self.agency.get_predictions_for_multi_stops(
+            ['%s|%s' % (route_tag, trip_stop['tag'])], now=now)
+        predictions = prediction.format_predictions(response['predictions'])
+
+        self.assertEquals(
+            predictions[int(trip_stop['tag'])][int(trip['blockID'])][int(trip['tripTag'])], 100)
+
+    def test_passed_trips_not_predicted(self):
+        """Test that a trip is no longer predicted at a stop once its vehicle has passed it."""
+
+        route_tag = self.agency.route_tags[0]
+        trip = self.agency.get_schedule(route_tag)['route'][0]['tr'][0]
+        trip_stop = trip['stop'][0]
+        scheduled_seconds = int(trip_stop['epochTime']) // 1000
+        stop = '%s|%s' % (route_tag, trip_stop['tag'])
+
+        before = self.agency.get_predictions_for_multi_stops([stop], now=scheduled_seconds - 10)
+        after = self.agency.get_predictions_for_multi_stops([stop], now=scheduled_seconds + 10)
+
+        def get_trip_tags(response):
+            return [item['tripTag']
+                    for item in utils.ensure_is_list(response['predictions']['direction']
+                                                     ['prediction'])]
+
+        self.assertIn(trip['tripTag'], get_trip_tags(before))
+        self.assertNotIn(trip['tripTag'], get_trip_tags(after))
+
+    def test_time_formatted_after_midnight(self):
+        """Test that scheduled times after midnight are formatted as the time of day after midnight,
+        as they are in NextBus schedules."""
+
+        self.assertEquals(fake_agency.format_time(25 * 3600 + 61), '01:01:01')
+
+    def test_vehicle_at_stop_at_scheduled_time(self):
+        """Test that a vehicle that is not running late is located at a stop at the time it is
+        scheduled to arrive there."""
+
+        route_tag = self.agency.route_tags[1]
+        trip = self.agency.get_schedule(route_tag)['route'][0]['tr'][3]
+        trip_stop = trip['stop'][2]
+        scheduled_seconds = int(trip_stop['epochTime']) // 1000
+
+        stop = [stop for stop in self.agency.get_route_config(route_tag)['route']['stop']
+                if stop['tag'] == trip_stop['tag']][0]
+        vehicle = [vehicle
+                   for vehicle in self.agency.get_vehicle_locations(route_tag,
+                                                                    now=scheduled_seconds)['vehicle']
+                   if vehicle['id'] == trip['blockID']][0]
+
+        self.assertEquals((vehicle['lat'], vehicle['lon']), (stop['lat'], stop['lon']))
@@ -0,0 +1,123 @@
+"""Tests for the functions in the lease module"""
+
+import unittest
+import unittest.mock
+
+from django.test import TestCase, tag
+
+import worker.libs.lease as lease
+from worker.models import Route, RouteLease, Shard
+
+@tag('unit')
+class TestGetFairShare(unittest.TestCase):
+    """Tests for the get_fair_share function in the lease module."""
+
+    def test_routes_split_evenly(self):
+        """Test that the routes are split between the shards with the remainder given to the first
+        shards by name, and that the shares add up to the number of routes."""
+
+        shard_names = ['c', 'a', 'b']
+        shares = [lease.get_fair_share(route_count=10, shard_names=shard_names, shard_name=name)
+                  for name in ('a', 'b', 'c')]
+
+        self.assertEquals(shares, [4, 3, 3])
+
+    def test_single_shard(self):
+        """Test that a single shard holds every route."""
+
+        self.assertEquals(lease.get_fair_share(route_count=7, shard_names=['a'], shard_name='a'), 7)
+
+class TestUpdateLeases(TestCase):
+    """Tests for the update_leases function in the lease module."""
+
+    def setUp(self):
+        self.route_ids = [Route.objects.create(tag=str(index), title=str(index)).id
+                          for index in range(5)]
+
+    def test_single_shard_claims_every_route(self):
+        """Test that a shard claims every route when it is the only shard."""
+
+        leased_route_ids = lease.update_leases(shard_name='a',
+                                               route_ids=self.route_ids,
+                                               lease_seconds=60)
+
+        self.assertEquals(leased_route_ids, set(self.route_ids))
+        self.assertEquals(RouteLease.objects.filter(shard='a').count(), 5)
+
+    def test_routes_rebalanced_when_shard_joins(self):
+        """Test that a shard that is already running releases routes for a shard that starts, and
+        that the routes held by each shard are disjoint."""
+
+        lease.update_leases(shard_name='a', route_ids=self.route_ids, lease_seconds=60)
+
+        # The new shard cannot claim any routes until the running shard releases them
+        self.assertEquals(lease.update_leases(shard_name='b',
+                                              route_ids=self.route_ids,
+                                              lease_seconds=60),
+                          set())
+
+        a_route_ids = lease.update_leases(shard_name='a', route_ids=self.route_ids,
+                                          lease_seconds=60)
+        b_route_ids = lease.update_leases(shard_name='b', route_ids=self.route_ids,
+                                          lease_seconds=60)
+
+        self.assertEquals(len(a_route_ids), 3)
+        self.assertEquals(len(b_route_ids), 2)
+        self.assertEquals(a_route_ids | b_route_ids, set(self.route_ids))
+
+    def test_expired_leases_claimed(self):
+        """Test that the routes of a shard whose heartbeat and leases expired are claimed by the
+        shards that are still running."""
+
+        lease.update_leases(shard_name='a', route_ids=self.route_ids, lease_seconds=60)
+        Shard.objects.filter(name='a').update(expires=0)
+        RouteLease.objects.filter(shard='a').update(expires=0)
+
+        leased_route_ids = lease.update_leases(shard_name='b',
+                                               route_ids=self.route_ids,
+                                               lease_seconds=60)
+
+        self.assertEquals(leased_route_ids, set(self.route_ids))
+
+    def test_inactive_routes_released(self):
+        """Test that leases on routes that are no longer active are released."""
+
+        lease.update_leases(shard_name='a', route_ids=self.route_ids, lease_seconds=60)
+
+        leased_route_ids = lease.update_leases(shard_name='a',
+                                               route_ids=self.route_ids[:2],
+                                               lease_seconds=60)
+
+        self.assertEquals(leased_route_ids, set(self.route_ids[:2]))
+        self.assertEquals(RouteLease.objects.filter(shard='').count(), 3)
+
+    def test_remove_shard(self):
+        """Test that removing a shard releases its leases, so that they can be claimed
+        immediately."""
+
+        lease.update_leases(shard_name='a', route_ids=self.route_ids, lease_seconds=60)
+        lease.remove_shard('a')
+
+        self.assertFalse(Shard.objects.filter(name='a').exists())
+        self.assertEquals(lease.update_leases(shard_name='b',
+                                              route_ids=self.route_ids,
+                                              lease_seconds=60),
+                          set(self.route_ids))
+
+    def test_other_shards_route_tags(self):
+        """Test that the routes leased by other running shards are found, without the shard's own
+        routes or routes whose leases expired."""
+
+        lease.update_leases(shard_name='a', route_ids=self.route_ids[:2], lease_seconds=60)
+        lease.update_leases(shard_name='b', route_ids=self.route_ids, lease_seconds=60)
+        RouteLease.objects.filter(route_id=self.route_ids[0]).update(expires=0)
+
+        now = lease.get_database_time()
+
+        b_route_tags = set(RouteLease.objects.filter(shard='b').values_list('route__tag',
+                                                                            flat=True))
+
+        self.assertEquals(lease.get_other_shards_route_tags(shard_name='b', now=now), {'1'})
+        self.assertEquals(lease.get_other_shards_route_tags(shard_name='a', now=now),
+                          b_route_tags)
+        self.assertTrue(b_route_tags)
@@ -0,0 +1,159 @@
+"""Unit tests for libs/metrics.py"""
+
+import unittest
+
+from django.test import tag
+
+import worker.libs.metrics as metrics
+
+@tag('unit')
+class TestCounter(unittest.TestCase):
+    """Tests for the Counter class"""
+
+    def test_counters_increased_for_each_label(self):
+        """Test that a separate value is kept for each combination of label values."""
+
+        counter = metrics.Counter(name='foo_total', documentation='Foo', label_names=('route',))
+        counter.inc(labels=('1',))
+        counter.inc(amount=2, labels=('1',))
+        counter.inc(labels=('2',))
+
+        self.assertEquals(counter.get_samples(), [
+            ('foo_total', (('route', '1'),), 3),
+            ('foo_total', (('route', '2'),), 1)
+        ])
+
+    def test_values_read_from_function(self):
+        """Test that the values of a metric with a function are read from the function when the
+        metric is collected."""
+
+        values = {('1',): 5}
+        counter = metrics.Counter(name='foo_total',
+                                  documentation='Foo',
+                                  label_names=('route',),
+                                  function=lambda: values)
+
+        self.assertEquals(counter.get_samples(), [('foo_total', (('route', '1'),), 5)])
+
+        values = {('2',): 6}
+        self.assertEquals(counter.get_samples(), [('foo_total', (('route', '2'),), 6)])
+
+    def test_values_removed_for_label_value(self):
+        """Test that every value with the label value is removed, whatever its other labels are,
+        and that nothing is removed for a label the metric does not have."""
+
+        counter = metrics.Counter(name='foo_total',
+                                  documentation='Foo',
+                                  label_names=('route', 'error_class'))
+        counter.inc(labels=('1', 'timeout'))
+        counter.inc(labels=('1', 'client'))
+        counter.inc(labels=('2', 'timeout'))
+
+        counter.remove(stop='1')
+        self.assertEquals(len(counter.get_samples()), 3)
+
+        counter.remove(route='1')
+        self.assertEquals(counter.get_samples(), [
+            ('foo_total', (('route', '2'), ('error_class', 'timeout')), 1)
+        ])
+
+@tag('unit')
+class TestHistogram(unittest.TestCase):
+    """Tests for the Histogram class"""
+
+    def test_cumulative_buckets_returned(self):
+        """Test that each value is counted in the first bucket with an upper bound that is at least
+        the value, that the buckets are cumulative, and that the sum and count are returned."""
+
+        histogram = metrics.Histogram(name='foo_seconds', documentation='Foo', buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+
+        self.assertEquals(histogram.get_samples(), [
+            ('foo_seconds_bucket', (('le', '1'),), 2),
+            ('foo_seconds_bucket', (('le', '5'),), 3),
+            ('foo_seconds_bucket', (('le', '+Inf'),), 4),
+            ('foo_seconds_sum', (), 14.5),
+            ('foo_seconds_count', (), 4)
+        ])
+
+@tag('unit')
+class TestRegistry(unittest.TestCase):
+    """Tests for the Registry class"""
+
+    def test_existing_metric_returned(self):
+        """Test that registering a metric with the same name as a registered metric returns the
+        registered metric, and replaces its function if a new function is provided."""
+
+        registry = metrics.Registry()
+        gauge = registry.gauge(name='foo', documentation='Foo', function=lambda: {(): 1})
+
+        self.assertIs(registry.gauge(name='foo', documentation='Foo'), gauge)
+        self.assertEquals(gauge.get_samples(), [('foo', (), 1)])
+
+        registry.gauge(name='foo', documentation='Foo', function=lambda: {(): 2})
+        self.assertEquals(gauge.get_samples(), [('foo', (), 2)])
+
+    def test_error_raised_for_different_type(self):
+        """Test that a metric cannot be registered with the name of a metric of a different
+        type."""
+
+        registry = metrics.Registry()
+        registry.counter(name='foo', documentation='Foo')
+
+        with self.assertRaises(ValueError):
+            registry.gauge(name='foo', documentation='Foo')
+
+    def test_metrics_rendered_in_text_format(self):
+        """Test that the metrics are rendered in the Prometheus text format, sorted by name, with
+        label values escaped."""
+
+        registry = metrics.Registry()
+        registry.gauge(name='foo', documentation='Foo\nbar').set(1.5)
+        registry.counter(name='bar_total',
+                         documentation='Bar',
+                         label_names=('route', 'error_class')).inc(labels=('F"1', 'timeout'))
+
+        self.assertEquals(registry.render(),
+                          '# HELP bar_total Bar\n'
+                          '# TYPE bar_total counter\n'
+                          'bar_total{route="F\\"1",error_class="timeout"} 1\n'
+                          '# HELP foo Foo\\nbar\n'
+                          '# TYPE foo gauge\n'
+                          'foo 1.5\n')
+
+    def test_route_removed_from_every_metric(self):
+        """Test that the values for a route are removed from every metric with a route label."""
+
+        registry = metrics.Registry()
+        histogram = registry.histogram(name='foo_seconds', documentation='Foo',
+                                       label_names=('route',), buckets=(1,))
+        histogram.observe(0.5, labels=('1',))
+        histogram.observe(0.5, labels=('2',))
+        registry.counter(name='bar_total', documentation='Bar').inc()
+
+        registry.remove(route='1')
+
+        self.assertEquals(registry.render(),
+                          '# HELP bar_total Bar\n'
+                          '# TYPE bar_total counter\n'
+                          'bar_total 1\n'
+                          '# HELP foo_seconds Foo\n'
+                          '# TYPE foo_seconds histogram\n'
+                          'foo_seconds_bucket{route="2",le="1"} 1\n'
+                          'foo_seconds_bucket{route="2",le="+Inf"} 1\n'
+                          'foo_seconds_sum{route="2"} 0.5\n'
+                          'foo_seconds_count{route="2"} 1\n')
+
+@tag('unit')
+class TestFormatValue(unittest.TestCase):
+    """Tests for the format_value function in the metrics module"""
+
+    def test_special_values_formatted(self):
+        """Test that infinite and NaN values are formatted as Prometheus expects them."""
+
+        self.assertEquals(metrics.format_value(float('inf')), '+Inf')
+        self.assertEquals(metrics.format_value(float('-inf')), '-Inf')
+        self.assertEquals(metrics.format_value(float('nan')), 'NaN')
+        self.assertEquals(metrics.format_value(3), '3')
+        self.assertEquals(metrics.format_value(0.25), '0.25')
@@ -0,0 +1,145 @@
+"""Unit tests for libs/nextbus.py"""
+
+import urllib.error
+import unittest
+import unittest.mock
+
+from django.test import tag
+import urllib3
+
+import worker.libs.nextbus as nextbus
+import worker.libs.resilience as resilience
+
+@tag('unit')
+class TestPooledTransportGet(unittest.TestCase):
+    """Tests for the get method in the PooledTransport class"""
+
+    def test_response_body_returned(self):
+        """Test that the body of a successful response is returned."""
+
+        transport = nextbus.PooledTransport(pool_size=1, connect_timeout=1, read_timeout=1)
+        transport.pool_manager = unittest.mock.MagicMock()
+        transport.pool_manager.request.return_value.status = 200
+        transport.pool_manager.request.return_value.data = b'{}'
+
+        response = transport.get('http://foo/bar')
+
+        self.assertEquals(response, b'{}')
+        transport.pool_manager.request.assert_called_once_with(
+            'GET', 'http://foo/bar', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    def test_http_error_raised_for_error_status(self):
+        """Test that an HTTPError is raised if the response has an error status."""
+
+        transport = nextbus.PooledTransport(pool_size=1, connect_timeout=1, read_timeout=1)
+        transport.pool_manager = unittest.mock.MagicMock()
+        transport.pool_manager.request.return_value.status = 503
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            transport.get('http://foo/bar')
+
+        self.assertEquals(context.exception.code, 503)
+
+    def test_url_error_raised_if_request_fails(self):
+        """Test that a URLError is raised if the request could not be completed, such as when it
+        times out."""
+
+        transport = nextbus.PooledTransport(pool_size=1, connect_timeout=1, read_timeout=1)
+        transport.pool_manager = unittest.mock.MagicMock()
+        transport.pool_manager.request.side_effect = \
+            urllib3.exceptions.ReadTimeoutError(None, 'http://foo/bar', 'Read timed out.')
+
+        with self.assertRaises(urllib.error.URLError):
+            transport.get('http://foo/bar')
+
+    def test_rate_limiter_used(self):
+        """Test that the transport waits for the rate limiter before making a request, and records
+        the size of the response with it."""
+
+        rate_limiter = unittest.mock.MagicMock()
+        transport = nextbus.PooledTransport(pool_size=1, connect_timeout=1, read_timeout=1,
+                                            rate_limiter=rate_limiter)
+        transport.pool_manager = unittest.mock.MagicMock()
+        transport.pool_manager.request.return_value.status = 200
+        transport.pool_manager.request.return_value.data = b'{"foo": 1}'
+
+        transport.get('http://foo/bar')
+
+        rate_limiter.wait.assert_called_once_with()
+        rate_limiter.record_response.assert_called_once_with(10)
+
+@tag('unit')
+class TestNextBusClient(unittest.TestCase):
+    """Tests for the NextBusClient class"""
+
+    def test_request_made_with_transport(self):
+        """Test that requests are made to the configured feed URL with the provided transport, and
+        that the JSON in the response is returned."""
+
+        transport = unittest.mock.MagicMock()
+        transport.get.return_value = b'{"route": []}'
+
+        client = nextbus.NextBusClient(output_format='json',
+                                       agency='foo',
+                                       transport=transport)
+        response = client.get_route_list()
+
+        self.assertEquals(response, {'route': []})
+        transport.get.assert_called_once_with(
+            '%s?command=routeList&a=foo' % nextbus.config.get('nextbus', 'json_feed_url'),
+            use_compression=True)
+
+    def test_shared_transport_used_by_default(self):
+        """Test that the transport shared by the process is used if no transport is provided."""
+
+        first_client = nextbus.NextBusClient(output_format='json', agency='foo')
+        second_client = nextbus.NextBusClient(output_format='json', agency='bar')
+
+        self.assertIs(first_client.transport, nextbus.get_transport())
+        self.assertIs(second_client.transport, first_client.transport)
+
+    def test_error_message_raised(self):
+        """Test that a NextBusError is raised if NextBus returns an error message, and that it
+        counts as a failure for the circuit breaker."""
+
+        transport = unittest.mock.MagicMock()
+        transport.get.return_value = \
+            b'{"Error": {"content": " Agency parameter \\"a=foo\\" is not valid. ", ' \
+            b'"shouldRetry": "false"}}'
+        circuit_breaker = resilience.CircuitBreaker(name='foo', failure_threshold=1,
+                                                    reset_seconds=60)
+
+        client = nextbus.NextBusClient(output_format='json',
+                                       agency='foo',
+                                       transport=transport,
+                                       circuit_breaker=circuit_breaker)
+
+        with self.assertRaises(resilience.NextBusError) as context:
+            client.get_route_list()
+
+        self.assertEquals(str(context.exception), 'Agency parameter "a=foo" is not valid.')
+        self.assertFalse(context.exception.should_retry)
+
+        # An error that will not succeed if it is retried shows that NextBus is working
+        self.assertEquals(circuit_breaker.get_state()['state'], resilience.STATE_CLOSED)
+
+    def test_no_request_made_while_circuit_open(self):
+        """Test that no request is made and a CircuitOpenError is raised while the circuit breaker
+        is open."""
+
+        transport = unittest.mock.MagicMock()
+        transport.get.side_effect = urllib.error.URLError('timed out')
+        circuit_breaker = resilience.CircuitBreaker(name='foo', failure_threshold=1,
+                                                    reset_seconds=60)
+
+        client = nextbus.NextBusClient(output_format='json',
+                                       agency='foo',
+                                       transport=transport,
+                                       circuit_breaker=circuit_breaker)
+
+        with self.assertRaises(urllib.error.URLError):
+            client.get_route_list()
+        with self.assertRaises(resilience.CircuitOpenError):
+            client.get_route_list()
+
+        self.assertEquals(transport.get.call_count, 1)
@@ -0,0 +1,91 @@
+"""Unit tests for libs/prediction.py"""
+
+import unittest
+
+from django.test import tag
+
+import worker.libs.prediction as prediction
+
+@tag('unit')
+class TestGroupPredictionsByRoute(unittest.TestCase):
+    """Tests for the group_predictions_by_route function"""
+
+    def test_predictions_grouped_by_route_tag(self):
+        """Test that the predictions for each stop are grouped by the route tag of the stop."""
+
+        first_stop = {'routeTag': 'N', 'stopTag': '1234'}
+        second_stop = {'routeTag': '38R', 'stopTag': '5678'}
+        third_stop = {'routeTag': 'N', 'stopTag': '9101'}
+
+        response = prediction.group_predictions_by_route([first_stop, second_stop, third_stop])
+
+        self.assertEquals(response, {
+            'N': [
+                first_stop,
+                third_stop
+            ],
+            '38R': [
+                second_stop
+            ]
+        })
+
+    def test_single_prediction_grouped(self):
+        """Test that predictions for a single stop, which the NextBus API returns as an object
+        instead of an array, are grouped by route."""
+
+        stop = {'routeTag': 'N', 'stopTag': '1234'}
+
+        response = prediction.group_predictions_by_route(stop)
+
+        self.assertEquals(response, {'N': [stop]})
+
+@tag('unit')
+class TestSplitStopsByUrlLength(unittest.TestCase):
+    """Tests for the split_stops_by_url_length function"""
+
+    def test_all_stops_in_one_chunk_if_below_maximum_length(self):
+        """Test that all of the stops are returned in a single chunk if the URL for all of the stops
+        would not exceed the maximum length."""
+
+        stops = [('N', 1234), ('N', 5678), ('38R', 9101)]
+
+        response = prediction.split_stops_by_url_length(stops=stops,
+                                                        base_url_length=50,
+                                                        max_url_length=2000)
+
+        self.assertEquals(response, [stops])
+
+    def test_stops_split_when_maximum_length_exceeded(self):
+        """Test that the stops are split into multiple chunks in their original order when the URL
+        for all of the stops would exceed the maximum length, and that no chunk exceeds the maximum
+        length."""
+
+        stops = [('N', 1000 + i) for i in range(10)]
+        stop_length = len('&stops=N%7C1000')
+
+        response = prediction.split_stops_by_url_length(stops=stops,
+                                                        base_url_length=10,
+                                                        max_url_length=10 + stop_length * 4)
+
+        self.assertEquals(response, [stops[0:4], stops[4:8], stops[8:10]])
+
+    def test_stop_exceeding_maximum_length_in_own_chunk(self):
+        """Test that a stop that would exceed the maximum length on its own is still returned in a
+        chunk."""
+
+        stops = [('N', 1234), ('N', 5678)]
+
+        response = prediction.split_stops_by_url_length(stops=stops,
+                                                        base_url_length=10,
+                                                        max_url_length=15)
+
+        self.assertEquals(response, [[stops[0]], [stops[1]]])
+
+    def test_no_chunks_returned_for_no_stops(self):
+        """Test that no chunks are returned if there are no stops."""
+
+        response = prediction.split_stops_by_url_length(stops=[],
+                                                        base_url_length=10,
+                                                        max_url_length=2000)
+
+        self.assertEquals(response, [])
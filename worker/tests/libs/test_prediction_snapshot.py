@@ -0,0 +1,236 @@
+"""Unit tests for libs/prediction_snapshot.py"""
+
+import random
+import unittest
+import unittest.mock
+
+from django.test import tag
+
+import worker.libs.prediction as prediction
+import worker.libs.prediction_snapshot as prediction_snapshot
+import worker.route_worker as route_worker
+
+def _get_random_predictions(stop_tags, block_ids, trip_tags):
+    """Get random predictions in nested dictionaries.
+
+    Arguments:
+        stop_tags: (List) Stop tags to randomly select the stops with predictions from.
+        block_ids: (List) Block IDs to randomly select the block IDs with predictions from.
+        trip_tags: (List) Trip tags to randomly select the trips with predictions from.
+
+    Returns:
+        Nested dictionaries keyed by stop tags -> block IDs -> trip tags, with the number of
+        seconds until the predicted arrival as the value.
+    """
+
+    predictions = {}
+    for stop_tag in random.sample(stop_tags, random.randint(0, len(stop_tags))):
+        predictions[stop_tag] = {}
+        for block_id in random.sample(block_ids, random.randint(0, len(block_ids))):
+            predictions[stop_tag][block_id] = {
+                trip_tag: random.randint(0, 1200)
+                for trip_tag in random.sample(trip_tags, random.randint(1, len(trip_tags)))
+            }
+
+    return predictions
+
+@tag('unit')
+class TestGetSnapshot(unittest.TestCase):
+    """Tests for the get_snapshot function"""
+
+    def test_predictions_flattened(self):
+        """Test that the predictions are flattened into rows in the order of the nested
+        dictionaries, and that stops without predictions are included in the stops."""
+
+        snapshot = prediction_snapshot.get_snapshot({
+            1234: {
+                5678: {
+                    123: 60,
+                    124: 600
+                },
+                5679: {
+                    125: 300
+                }
+            },
+            4321: {}
+        })
+
+        self.assertEquals(list(snapshot.stops), [1234, 4321])
+        self.assertEquals(list(snapshot.stop_tags), [1234, 1234, 1234])
+        self.assertEquals(list(snapshot.block_ids), [5678, 5678, 5679])
+        self.assertEquals(list(snapshot.trip_tags), [123, 124, 125])
+        self.assertEquals(list(snapshot.seconds), [60, 600, 300])
+
+def _get_response(predictions):
+    """Get the "predictions" objects that NextBus would return for predictions in nested
+    dictionaries, with each block ID split randomly between two directions.
+
+    Arguments:
+        predictions: (Dictionary) Nested dictionaries keyed by stop tags -> block IDs -> trip tags,
+            with the number of seconds until the predicted arrival as the value.
+
+    Returns:
+        List of dictionaries with the "predictions" object for each stop.
+    """
+
+    response = []
+    for stop_tag, blocks in predictions.items():
+        directions = [[], []]
+        for block_id, trips in blocks.items():
+            for trip_tag, seconds in trips.items():
+                random.choice(directions).append({
+                    'block': str(block_id),
+                    'tripTag': str(trip_tag),
+                    'seconds': str(seconds)
+                })
+
+        stop = {'stopTag': str(stop_tag)}
+        directions = [{'prediction': direction} for direction in directions if direction]
+        if directions:
+            stop['direction'] = directions
+        response.append(stop)
+
+    return response
+
+@tag('unit')
+class TestParsePredictions(unittest.TestCase):
+    """Tests for the parse_predictions function"""
+
+    def test_snapshot_matches_formatted_predictions(self):
+        """Test that the snapshot parsed from a response is identical to the snapshot of the nested
+        dictionaries that the same response is formatted into, for random predictions."""
+
+        random.seed(4321)
+        for _ in range(200):
+            response = _get_response(_get_random_predictions(stop_tags=list(range(1000, 1010)),
+                                                             block_ids=list(range(2000, 2006)),
+                                                             trip_tags=list(range(3000, 3004))))
+
+            snapshot = prediction_snapshot.parse_predictions(response)
+            expected_snapshot = prediction_snapshot.get_snapshot(
+                prediction.format_predictions(response))
+
+            for column in ('stops', 'stop_tags', 'block_ids', 'trip_tags', 'seconds'):
+                self.assertEquals(getattr(snapshot, column), getattr(expected_snapshot, column))
+
+    def test_duplicate_stop_uses_last_predictions(self):
+        """Test that if a stop is returned more than once, its last predictions are used at the
+        position it was first returned in, as they are when formatting the predictions."""
+
+        response = [
+            {'stopTag': '1234', 'direction': {'prediction': {'block': '5678', 'tripTag': '1',
+                                                             'seconds': '60'}}},
+            {'stopTag': '4321'},
+            {'stopTag': '1234', 'direction': {'prediction': {'block': '5679', 'tripTag': '2',
+                                                             'seconds': '120'}}}
+        ]
+
+        snapshot = prediction_snapshot.parse_predictions(response)
+
+        self.assertEquals(list(snapshot.stops), [1234, 4321])
+        self.assertEquals(list(snapshot.block_ids), [5679])
+        self.assertEquals(list(snapshot.seconds), [120])
+
+    def test_invalid_block_id_skipped(self):
+        """Test that predictions with block IDs that are not integers are skipped."""
+
+        snapshot = prediction_snapshot.parse_predictions({
+            'stopTag': '1234',
+            'direction': {
+                'prediction': [
+                    {'block': 'foo', 'tripTag': '1', 'seconds': '60'},
+                    {'block': '5678', 'tripTag': '2', 'seconds': '120'}
+                ]
+            }
+        })
+
+        self.assertEquals(list(snapshot.block_ids), [5678])
+
+@tag('unit')
+class TestGetArrivals(unittest.TestCase):
+    """Tests for the get_arrivals function"""
+
+    def test_missing_block_is_single_arrival(self):
+        """Test that a block ID that disappeared from the predictions is only one arrival, even if
+        multiple trips for the block ID were close enough to have arrived."""
+
+        previous_snapshot = prediction_snapshot.get_snapshot({
+            1234: {
+                5678: {
+                    123: 60,
+                    124: 120
+                }
+            }
+        })
+        current_snapshot = prediction_snapshot.get_snapshot({1234: {}})
+
+        arrivals = prediction_snapshot.get_arrivals(previous_snapshot=previous_snapshot,
+                                                    current_snapshot=current_snapshot,
+                                                    time_between_retrievals=30,
+                                                    arrival_threshold=500)
+
+        self.assertEquals(arrivals, {1234: [5678]})
+
+    def test_missing_trips_are_separate_arrivals(self):
+        """Test that each trip that disappeared from the predictions for a block ID that is still
+        in the predictions is a separate arrival."""
+
+        previous_snapshot = prediction_snapshot.get_snapshot({
+            1234: {
+                5678: {
+                    123: 60,
+                    124: 120,
+                    125: 900
+                }
+            }
+        })
+        current_snapshot = prediction_snapshot.get_snapshot({1234: {5678: {125: 870}}})
+
+        arrivals = prediction_snapshot.get_arrivals(previous_snapshot=previous_snapshot,
+                                                    current_snapshot=current_snapshot,
+                                                    time_between_retrievals=30,
+                                                    arrival_threshold=500)
+
+        self.assertEquals(arrivals, {1234: [5678, 5678]})
+
+    def test_no_arrivals_for_missing_stop(self):
+        """Test that there are no arrivals at a stop that is not in the current predictions."""
+
+        previous_snapshot = prediction_snapshot.get_snapshot({1234: {5678: {123: 60}}})
+        current_snapshot = prediction_snapshot.get_snapshot({})
+
+        arrivals = prediction_snapshot.get_arrivals(previous_snapshot=previous_snapshot,
+                                                    current_snapshot=current_snapshot,
+                                                    time_between_retrievals=30,
+                                                    arrival_threshold=500)
+
+        self.assertEquals(arrivals, {})
+
+    @unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+    def test_arrivals_match_route_worker(self, _):
+        """Test that the arrivals are identical to the arrivals found by RouteWorker.get_arrivals,
+        including the order of the stops and block IDs, for random predictions."""
+
+        random.seed(1234)
+        worker = route_worker.RouteWorker(route_tag='foo', agency='bar', service_class='baz')
+        stop_tags = list(range(1000, 1010))
+        block_ids = list(range(2000, 2006))
+        trip_tags = list(range(3000, 3004))
+
+        for _ in range(500):
+            previous_predictions = _get_random_predictions(stop_tags, block_ids, trip_tags)
+            current_predictions = _get_random_predictions(stop_tags, block_ids, trip_tags)
+            time_between_retrievals = random.choice([30, 600, 1000])
+
+            expected_arrivals = worker.get_arrivals(
+                current_predictions=current_predictions,
+                current_predictions_retrieve_time=time_between_retrievals,
+                previous_predictions=previous_predictions,
+                previous_predictions_retrieve_time=0)
+            arrivals = prediction_snapshot.get_arrivals(
+                previous_snapshot=prediction_snapshot.get_snapshot(previous_predictions),
+                current_snapshot=prediction_snapshot.get_snapshot(current_predictions),
+                time_between_retrievals=time_between_retrievals,
+                arrival_threshold=route_worker.ARRIVAL_THRESHOLD)
+
+            self.assertEquals(list(arrivals.items()), list(expected_arrivals.items()))
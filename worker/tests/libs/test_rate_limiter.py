@@ -0,0 +1,86 @@
+"""Unit tests for libs/rate_limiter.py"""
+
+import unittest
+import unittest.mock
+
+from django.test import tag
+
+import worker.libs.rate_limiter as rate_limiter
+
+@tag('unit')
+@unittest.mock.patch('worker.libs.rate_limiter.time')
+class TestTokenBucket(unittest.TestCase):
+    """Tests for the TokenBucket class"""
+
+    def test_no_wait_with_tokens_available(self, time):
+        """Test that no wait is required when there are enough tokens in the bucket."""
+
+        time.monotonic.return_value = 100
+        bucket = rate_limiter.TokenBucket(rate=2, capacity=2)
+
+        self.assertEquals(bucket.reserve(1), 0)
+        self.assertEquals(bucket.reserve(1), 0)
+
+    def test_wait_until_debt_repaid(self, time):
+        """Test that reserving more tokens than are available requires waiting until the bucket
+        would have refilled enough to cover them."""
+
+        time.monotonic.return_value = 100
+        bucket = rate_limiter.TokenBucket(rate=2, capacity=2)
+        bucket.reserve(2)
+
+        self.assertEquals(bucket.reserve(1), 0.5)
+        self.assertEquals(bucket.reserve(1), 1)
+
+        time.monotonic.return_value = 101
+        self.assertEquals(bucket.get_wait_seconds(), 0)
+
+    def test_refill_limited_to_capacity(self, time):
+        """Test that the bucket does not refill beyond its capacity."""
+
+        time.monotonic.return_value = 100
+        bucket = rate_limiter.TokenBucket(rate=2, capacity=2)
+
+        time.monotonic.return_value = 1000
+        bucket.reserve(2)
+
+        self.assertEquals(bucket.reserve(1), 0.5)
+
+@tag('unit')
+@unittest.mock.patch('worker.libs.rate_limiter.time')
+class TestRateLimiter(unittest.TestCase):
+    """Tests for the RateLimiter class"""
+
+    def test_requests_limited(self, time):
+        """Test that requests beyond the number of requests per second have to wait."""
+
+        time.monotonic.return_value = 100
+        limiter = rate_limiter.RateLimiter(requests_per_second=2, bytes_per_minute=0)
+
+        self.assertEquals(limiter.wait(), 0)
+        self.assertEquals(limiter.wait(), 0)
+        self.assertEquals(limiter.wait(), 0.5)
+        time.sleep.assert_called_once_with(0.5)
+        self.assertEquals(limiter.get_stats()['throttled_requests'], 1)
+
+    def test_requests_wait_for_bytes(self, time):
+        """Test that requests have to wait after more bytes were received than the limit allows."""
+
+        time.monotonic.return_value = 100
+        limiter = rate_limiter.RateLimiter(requests_per_second=0, bytes_per_minute=600)
+
+        limiter.record_response(900)
+
+        # The 300 bytes over the limit are repaid at 10 bytes per second
+        self.assertEquals(limiter.wait(), 30)
+        self.assertEquals(limiter.get_stats()['bytes'], 900)
+
+    def test_no_limits(self, time):
+        """Test that requests never wait if both limits are disabled."""
+
+        time.monotonic.return_value = 100
+        limiter = rate_limiter.RateLimiter(requests_per_second=0, bytes_per_minute=0)
+
+        limiter.record_response(1000000)
+        for _ in range(100):
+            self.assertEquals(limiter.wait(), 0)
@@ -0,0 +1,129 @@
+"""Unit tests for libs/recording.py"""
+
+import gzip
+import json
+import os.path as path
+import random
+import tempfile
+import unittest
+
+from django.test import tag
+
+import worker.libs.recording as recording
+from worker.tests.utils import get_response, get_stop_predictions
+
+@tag('unit')
+class TestDeltaEncoder(unittest.TestCase):
+    """Tests for the DeltaEncoder class"""
+
+    def test_only_changes_recorded(self):
+        """Test that the first record for a route contains every stop, and that later records only
+        contain the stops that changed or were removed."""
+
+        encoder = recording.DeltaEncoder()
+        first_record = encoder.encode(route_tag='38R',
+                                      retrieve_time=100,
+                                      response={
+                                          'predictions': [get_stop_predictions('38R', 1, 3801, 60),
+                                                          get_stop_predictions('38R', 2, 3801, 120)]
+                                      })
+        second_record = encoder.encode(route_tag='38R',
+                                       retrieve_time=130,
+                                       response=get_response('38R', 1, 3801, 30))
+
+        self.assertTrue(first_record['key'])
+        self.assertEquals(sorted(first_record['stops']), ['38R|1', '38R|2'])
+        self.assertFalse(second_record['key'])
+        self.assertEquals(second_record['stops'],
+                          {'38R|1': get_stop_predictions('38R', 1, 3801, 30)})
+        self.assertEquals(second_record['removed'], ['38R|2'])
+        self.assertNotIn('order', second_record)
+
+    def test_reset_starts_new_key_record(self):
+        """Test that after the encoder is reset, the next record for a route contains every stop."""
+
+        encoder = recording.DeltaEncoder()
+        encoder.encode(route_tag='38R', retrieve_time=100,
+                       response=get_response('38R', 1, 3801, 60))
+        encoder.reset()
+        record = encoder.encode(route_tag='38R', retrieve_time=130,
+                                response=get_response('38R', 1, 3801, 60))
+
+        self.assertTrue(record['key'])
+
+@tag('unit')
+class TestDeltaDecoder(unittest.TestCase):
+    """Tests for the DeltaDecoder class"""
+
+    def test_reset_route_starts_new_key_record(self):
+        """Test that resetting a single route only makes the next record for that route contain
+        every stop."""
+
+        encoder = recording.DeltaEncoder()
+        encoder.encode(route_tag='38R', retrieve_time=100,
+                       response=get_response('38R', 1, 3801, 60))
+        encoder.encode(route_tag='N', retrieve_time=100,
+                       response=get_response('N', 2, 3801, 60))
+
+        encoder.reset(route_tag='38R')
+
+        self.assertTrue(encoder.encode(route_tag='38R', retrieve_time=130,
+                                       response=get_response('38R', 1, 3801, 60))['key'])
+        self.assertFalse(encoder.encode(route_tag='N', retrieve_time=130,
+                                        response=get_response('N', 2, 3801, 60))['key'])
+
+    def test_responses_decoded_identically(self):
+        """Test that decoding the records created by the encoder returns the original responses,
+        including the order of the stops, for random responses."""
+
+        random.seed(1234)
+        encoder = recording.DeltaEncoder()
+        decoder = recording.DeltaDecoder()
+
+        for retrieve_time in range(0, 30000, 30):
+            stop_tags = random.sample(range(20), random.randint(0, 20))
+            response = {
+                'predictions': [get_stop_predictions('38R', stop_tag, 3801,
+                                                     random.choice([60, 120]))
+                                for stop_tag in stop_tags],
+                'copyright': 'foo'
+            }
+
+            record = encoder.encode(route_tag='38R', retrieve_time=retrieve_time,
+                                    response=response)
+
+            # Records are decoded after being serialized, in the same way as they are written to
+            # segments
+            self.assertEquals(decoder.decode(json.loads(json.dumps(record))), response)
+
+    def test_error_raised_without_previous_record(self):
+        """Test that a ValueError is raised when decoding a record of changes without the previous
+        record for the route."""
+
+        with self.assertRaises(ValueError):
+            recording.DeltaDecoder().decode({'t': 100, 'route': '38R', 'key': False, 'stops': {},
+                                             'removed': []})
+
+@tag('unit')
+class TestReadSegment(unittest.TestCase):
+    """Tests for the read_segment function"""
+
+    def test_complete_records_read_from_incomplete_segment(self):
+        """Test that the records that were completely written are read from a segment that was not
+        finished."""
+
+        encoder = recording.DeltaEncoder()
+        lines = [json.dumps(encoder.encode(route_tag='38R', retrieve_time=retrieve_time,
+                                           response=get_response('38R', 1, 3801, retrieve_time)))
+                 for retrieve_time in [100, 130]]
+
+        with tempfile.TemporaryDirectory() as directory:
+            segment_path = path.join(directory, 'predictions-1.jsonl.gz')
+            with gzip.open(segment_path, 'wt') as segment:
+                segment.write('\n'.join(lines) + '\n' + lines[1][:10])
+
+            records = list(recording.read_segment(segment_path))
+
+        self.assertEquals([(retrieve_time, route_tag)
+                           for retrieve_time, route_tag, _ in records], [(100, '38R'), (130, '38R')])
+        self.assertEquals(records[1][2], get_response('38R', 1, 3801, 130))
@@ -0,0 +1,153 @@
+"""Unit tests for libs/resilience.py"""
+
+import json
+import socket
+import unittest
+import unittest.mock
+import urllib.error
+
+from django.test import tag
+
+import worker.libs.resilience as resilience
+
+@tag('unit')
+class TestClassifyError(unittest.TestCase):
+    """Tests for the classify_error function"""
+
+    def test_http_errors_classified_by_status(self):
+        """Test that HTTP errors are classified by their status code."""
+
+        def get_http_error(code):
+            return urllib.error.HTTPError('http://foo/bar', code, 'baz', {}, None)
+
+        self.assertEquals(resilience.classify_error(get_http_error(429)),
+                          resilience.ERROR_RATE_LIMITED)
+        self.assertEquals(resilience.classify_error(get_http_error(503)),
+                          resilience.ERROR_TRANSIENT)
+        self.assertEquals(resilience.classify_error(get_http_error(404)), resilience.ERROR_CLIENT)
+
+    def test_connection_errors_are_transient(self):
+        """Test that errors completing a request are classified as transient."""
+
+        self.assertEquals(resilience.classify_error(urllib.error.URLError('foo')),
+                          resilience.ERROR_TRANSIENT)
+        self.assertEquals(resilience.classify_error(socket.timeout()), resilience.ERROR_TRANSIENT)
+
+    def test_response_errors_are_invalid_response(self):
+        """Test that errors reading the response are classified as invalid responses."""
+
+        self.assertEquals(resilience.classify_error(json.decoder.JSONDecodeError('foo', 'bar', 0)),
+                          resilience.ERROR_INVALID_RESPONSE)
+        self.assertEquals(resilience.classify_error(KeyError('predictions')),
+                          resilience.ERROR_INVALID_RESPONSE)
+
+    def test_nextbus_errors_classified_by_should_retry(self):
+        """Test that error messages from NextBus are transient if they should be retried."""
+
+        self.assertEquals(resilience.classify_error(resilience.NextBusError('foo', True)),
+                          resilience.ERROR_TRANSIENT)
+        self.assertEquals(resilience.classify_error(resilience.NextBusError('foo', False)),
+                          resilience.ERROR_CLIENT)
+
+    def test_rate_limit_message_is_rate_limited(self):
+        """Test that the error message NextBus returns when too many requests are made is classified
+        as rate limited."""
+
+        exc = resilience.NextBusError('Agency server cannot accept client while status is: agency '
+                                      'name = sf-muni,status = exceeded limit', True)
+        self.assertEquals(resilience.classify_error(exc), resilience.ERROR_RATE_LIMITED)
+
+    def test_circuit_open(self):
+        """Test that requests that were not made due to an open circuit breaker are classified as
+        such, instead of as transient."""
+
+        self.assertEquals(resilience.classify_error(resilience.CircuitOpenError('foo')),
+                          resilience.ERROR_CIRCUIT_OPEN)
+
+@tag('unit')
+class TestGetBackoffSeconds(unittest.TestCase):
+    """Tests for the get_backoff_seconds function"""
+
+    def test_no_backoff_without_failures(self):
+        """Test that there is no backoff if there have not been any failures."""
+
+        self.assertEquals(resilience.get_backoff_seconds(failures=0, base_seconds=30,
+                                                         max_seconds=300), 0)
+
+    def test_backoff_doubles_up_to_maximum(self):
+        """Test that the backoff doubles with each failure up to the maximum, with jitter of up to
+        half of the backoff."""
+
+        for failures, backoff_seconds in [(1, 30), (2, 60), (3, 120), (4, 240), (5, 300),
+                                          (1000, 300)]:
+            seconds = resilience.get_backoff_seconds(failures=failures, base_seconds=30,
+                                                     max_seconds=300)
+            self.assertTrue(backoff_seconds / 2 <= seconds <= backoff_seconds)
+
+@tag('unit')
+@unittest.mock.patch('worker.libs.resilience.time')
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the CircuitBreaker class"""
+
+    def test_opens_after_threshold(self, time):
+        """Test that the breaker opens after the threshold of consecutive failures, and that
+        successes reset the count of failures."""
+
+        time.monotonic.return_value = 100
+        breaker = resilience.CircuitBreaker(name='foo', failure_threshold=2, reset_seconds=60)
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+        self.assertEquals(breaker.get_state()['state'], resilience.STATE_OPEN)
+
+    def test_cancelled_trial_allowed_again(self, time):
+        """Test that a trial request that was cancelled returns the breaker to open, and that
+        another trial request is allowed."""
+
+        time.monotonic.return_value = 100
+        breaker = resilience.CircuitBreaker(name='foo', failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+
+        time.monotonic.return_value = 160
+        self.assertTrue(breaker.allow_request())
+        breaker.cancel_trial()
+
+        self.assertEquals(breaker.get_state()['state'], resilience.STATE_OPEN)
+        self.assertEquals(breaker.get_state()['times_opened'], 1)
+        self.assertTrue(breaker.allow_request())
+
+    def test_single_trial_request_after_reset(self, time):
+        """Test that a single trial request is allowed once the breaker has been open for the reset
+        time, and that the breaker closes if it succeeds."""
+
+        time.monotonic.return_value = 100
+        breaker = resilience.CircuitBreaker(name='foo', failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+
+        time.monotonic.return_value = 160
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+        self.assertEquals(breaker.get_state()['state'], resilience.STATE_CLOSED)
+
+    def test_reopens_if_trial_request_fails(self, time):
+        """Test that the breaker opens again if the trial request fails."""
+
+        time.monotonic.return_value = 100
+        breaker = resilience.CircuitBreaker(name='foo', failure_threshold=3, reset_seconds=60)
+        for _ in range(3):
+            breaker.record_failure()
+
+        time.monotonic.return_value = 160
+        breaker.allow_request()
+        breaker.record_failure()
+
+        self.assertFalse(breaker.allow_request())
+        self.assertEquals(breaker.get_state()['times_opened'], 2)
@@ -0,0 +1,242 @@
+"""Unit tests for libs/schedule.py"""
+
+import copy
+import unittest.mock
+
+from django.test import TestCase
+
+from worker.libs import nextbus, schedule
+from worker.libs.fake_agency import AgencyTransport, FakeAgency, SERVICE_START_SECONDS
+from worker.models import Route, ScheduledArrival, ScheduleClass, StopScheduleClass
+
+class TestUpdateScheduleForRoute(TestCase):
+    """Tests for the update_schedule_for_route function in the schedule module."""
+
+    def setUp(self):
+        self.agency = FakeAgency(routes=1, stops_per_direction=3, vehicles_per_route=2,
+                                 seconds_between_stops=600)
+        self.previous_transport = nextbus.set_transport(
+            AgencyTransport(agency=self.agency, clock=lambda: SERVICE_START_SECONDS))
+
+        self.route = Route.objects.create(tag=self.agency.route_tags[0], title='Route')
+        self.schedule = self.agency.get_schedule(self.route.tag)
+
+    def tearDown(self):
+        nextbus.set_transport(self.previous_transport)
+
+    def _set_schedule(self, route_schedules):
+        """Set the schedule that the agency returns for the route.
+
+        Arguments:
+            route_schedules: (List of dictionaries) The "route" objects of the schedule.
+        """
+
+        self.agency.get_schedule = unittest.mock.MagicMock(return_value={'route': route_schedules})
+
+    def _get_schedule_classes(self):
+        """Get the active schedule classes of the route.
+
+        Returns:
+            Dictionary with tuples of the direction and service class as keys, and tuples of the
+            name, digest, and whether the schedule class is active as values.
+        """
+
+        return {(schedule_class.direction, schedule_class.service_class):
+                (schedule_class.name, schedule_class.digest, schedule_class.is_active)
+                for schedule_class in ScheduleClass.objects.filter(route=self.route,
+                                                                   is_active=True)}
+
+    def _get_scheduled_arrivals(self, direction, service_class):
+        """Get the scheduled arrivals of the active schedule class for a direction and service
+        class of the route.
+
+        Arguments:
+            direction: (String) The direction.
+            service_class: (String) The service class.
+
+        Returns:
+            Set of tuples of the stop tag, stop order, block ID, and time of each scheduled
+            arrival.
+        """
+
+        return set(ScheduledArrival.objects.filter(
+            stop_schedule_class__schedule_class__route=self.route,
+            stop_schedule_class__schedule_class__direction=direction,
+            stop_schedule_class__schedule_class__service_class=service_class,
+            stop_schedule_class__schedule_class__is_active=True
+        ).values_list('stop_schedule_class__stop__tag', 'stop_schedule_class__stop_order',
+                      'block_id', 'time'))
+
+    def _get_expected_scheduled_arrivals(self, route_schedule):
+        """Get the scheduled arrivals that should be added for a schedule.
+
+        Arguments:
+            route_schedule: (Dictionary) One of the "route" objects of the schedule.
+
+        Returns:
+            Set of tuples in the format returned by _get_scheduled_arrivals.
+        """
+
+        return set((int(trip_stop['tag']), order, int(trip['blockID']),
+                    int(trip_stop['epochTime']) // 1000 % (60 * 60 * 24))
+                   for trip in route_schedule['tr']
+                   for order, trip_stop in enumerate(trip['stop'], 1))
+
+    def test_schedule_added(self):
+        """Test that a schedule class with a digest, and the scheduled arrivals, are added for each
+        direction and service class of a new schedule."""
+
+        self.assertTrue(schedule.update_schedule_for_route(self.route))
+
+        schedule_classes = self._get_schedule_classes()
+        self.assertEquals(len(schedule_classes), len(self.schedule['route']))
+        for route_schedule in self.schedule['route']:
+            self.assertEquals(
+                schedule_classes[(route_schedule['direction'], route_schedule['serviceClass'])],
+                (route_schedule['scheduleClass'], schedule.get_schedule_digest(route_schedule),
+                 True))
+
+        self.assertEquals(ScheduledArrival.objects.count(),
+                          sum(len(trip['stop'])
+                              for route_schedule in self.schedule['route']
+                              for trip in route_schedule['tr']))
+
+    def test_unchanged_schedule_skipped(self):
+        """Test that an unchanged schedule is not parsed or written to the database."""
+
+        schedule.update_schedule_for_route(self.route)
+
+        with unittest.mock.patch('worker.libs.route.parse_route_schedule') as parse_route_schedule:
+            with self.assertNumQueries(1):
+                self.assertFalse(schedule.update_schedule_for_route(self.route))
+
+        parse_route_schedule.assert_not_called()
+
+    def test_changed_schedule_rewritten(self):
+        """Test that only the schedule for the direction and service class that changed is
+        rewritten, and that its schedule class is renamed and stays active."""
+
+        schedule.update_schedule_for_route(self.route)
+        schedule_classes = self._get_schedule_classes()
+
+        route_schedules = copy.deepcopy(self.schedule['route'])
+        changed_schedule = route_schedules[0]
+        changed_schedule['scheduleClass'] = '2019T_SPRING'
+        changed_schedule['tr'] = changed_schedule['tr'][:1]
+        self._set_schedule(route_schedules)
+
+        with unittest.mock.patch('worker.libs.route.parse_route_schedule',
+                                 wraps=schedule.route.parse_route_schedule) as parse_route_schedule:
+            self.assertTrue(schedule.update_schedule_for_route(self.route))
+
+        parse_route_schedule.assert_called_once_with(changed_schedule)
+
+        key = (changed_schedule['direction'], changed_schedule['serviceClass'])
+        schedule_classes[key] = ('2019T_SPRING', schedule.get_schedule_digest(changed_schedule),
+                                 True)
+        self.assertEquals(self._get_schedule_classes(), schedule_classes)
+
+        # Only the scheduled arrivals of the new version of the schedule are active
+        self.assertEquals(self._get_scheduled_arrivals(*key),
+                          self._get_expected_scheduled_arrivals(changed_schedule))
+
+    def test_previous_schedule_reactivated(self):
+        """Test that the schedule class of an earlier version of a schedule is reactivated, without
+        adding the schedule again, when the schedule changes back to it."""
+
+        schedule.update_schedule_for_route(self.route)
+        schedule_classes = self._get_schedule_classes()
+        scheduled_arrival_count = ScheduledArrival.objects.count()
+
+        route_schedules = copy.deepcopy(self.schedule['route'])
+        route_schedules[0]['tr'] = route_schedules[0]['tr'][:1]
+        self._set_schedule(route_schedules)
+        schedule.update_schedule_for_route(self.route)
+
+        self._set_schedule(self.schedule['route'])
+        with unittest.mock.patch('worker.libs.schedule.add_schedules_for_route') as add_schedules:
+            self.assertTrue(schedule.update_schedule_for_route(self.route))
+
+        add_schedules.assert_not_called()
+        self.assertEquals(self._get_schedule_classes(), schedule_classes)
+        self.assertEquals(ScheduledArrival.objects.count(),
+                          scheduled_arrival_count + len(route_schedules[0]['tr'][0]['stop']))
+
+        route_schedule = self.schedule['route'][0]
+        self.assertEquals(self._get_scheduled_arrivals(route_schedule['direction'],
+                                                       route_schedule['serviceClass']),
+                          self._get_expected_scheduled_arrivals(route_schedule))
+
+    def test_removed_schedule_deactivated(self):
+        """Test that the schedule class for a direction and service class that is no longer in the
+        schedule is deactivated, without rewriting the other schedules."""
+
+        schedule.update_schedule_for_route(self.route)
+        stop_schedule_class_count = StopScheduleClass.objects.count()
+
+        removed_schedule = self.schedule['route'][-1]
+        self._set_schedule(self.schedule['route'][:-1])
+
+        self.assertTrue(schedule.update_schedule_for_route(self.route))
+
+        active_schedule_classes = ScheduleClass.objects.filter(route=self.route, is_active=True)
+        self.assertEquals(active_schedule_classes.count(), len(self.schedule['route']) - 1)
+        self.assertFalse(ScheduleClass.objects.get(route=self.route,
+                                                   direction=removed_schedule['direction'],
+                                                   service_class=removed_schedule['serviceClass'])
+                         .is_active)
+        self.assertEquals(StopScheduleClass.objects.count(), stop_schedule_class_count)
+
+    def test_skipped_stops_and_duplicate_arrivals(self):
+        """Test that stops that are not scheduled for a trip are skipped, and that scheduled
+        arrivals that are in the schedule more than once are only added once."""
+
+        route_schedules = copy.deepcopy(self.schedule['route'][:1])
+        trips = route_schedules[0]['tr']
+        trips[0]['stop'][1]['epochTime'] = '-1'
+        trips.append(copy.deepcopy(trips[1]))
+        self._set_schedule(route_schedules)
+
+        schedule.update_schedule_for_route(self.route)
+
+        self.assertEquals(ScheduledArrival.objects.count(),
+                          sum(len(trip['stop']) for trip in trips) - len(trips[-1]['stop']) - 1)
+        self.assertEquals(list(StopScheduleClass.objects.order_by('stop_order')
+                               .values_list('stop__tag', 'stop_order')),
+                          [(int(trip_stop['tag']), order)
+                           for order, trip_stop in enumerate(trips[1]['stop'], 1)])
+
+    def test_rewritten_schedule_same_as_new_schedule(self):
+        """Test that rewriting a changed schedule leaves the same active stop schedule classes and
+        scheduled arrivals as adding the changed schedule to a route without a schedule."""
+
+        schedule.update_schedule_for_route(self.route)
+
+        route_schedules = copy.deepcopy(self.schedule['route'])
+        for route_schedule in route_schedules:
+            route_schedule['tr'] = route_schedule['tr'][1:]
+            route_schedule['tr'][0]['stop'][1]['epochTime'] = '-1'
+        self._set_schedule(route_schedules)
+        schedule.update_schedule_for_route(self.route)
+
+        def get_rows():
+            return (
+                sorted(StopScheduleClass.objects.filter(schedule_class__is_active=True)
+                       .values_list('stop__tag', 'schedule_class__direction',
+                                    'schedule_class__service_class', 'stop_order')),
+                sorted(ScheduledArrival.objects
+                       .filter(stop_schedule_class__schedule_class__is_active=True)
+                       .values_list('stop_schedule_class__stop__tag',
+                                    'stop_schedule_class__schedule_class__direction',
+                                    'stop_schedule_class__schedule_class__service_class',
+                                    'stop_schedule_class__stop_order', 'block_id', 'time'))
+            )
+
+        rewritten_rows = get_rows()
+
+        ScheduledArrival.objects.all().delete()
+        StopScheduleClass.objects.all().delete()
+        ScheduleClass.objects.all().delete()
+        schedule.update_schedule_for_route(self.route)
+
+        self.assertEquals(rewritten_rows, get_rows())
@@ -0,0 +1,70 @@
+"""Unit tests for libs/schedule_cache.py"""
+
+import types
+import unittest
+import unittest.mock
+
+from django.test import tag
+
+import worker.libs.schedule_cache as schedule_cache
+
+@tag('unit')
+@unittest.mock.patch('worker.libs.schedule_cache.get_schedule_key')
+class TestScheduleCache(unittest.TestCase):
+    """Tests for the ScheduleCache class"""
+
+    def setUp(self):
+        self.route = types.SimpleNamespace(id=1, tag='foo')
+
+    def test_schedule_only_loaded_once(self, get_schedule_key):
+        """Test that a schedule is only loaded the first time it is requested, and the same entry is
+        returned every time."""
+
+        get_schedule_key.return_value = (1, 'wkd', ('bar',))
+        load = unittest.mock.MagicMock(side_effect=lambda: object())
+        cache = schedule_cache.ScheduleCache()
+
+        first_entry = cache.get(route_object=self.route, service_class='wkd', load=load)
+        second_entry = cache.get(route_object=self.route, service_class='wkd', load=load)
+
+        self.assertIs(first_entry, second_entry)
+        load.assert_called_once_with()
+        self.assertEquals(cache.get_stats(), {'entries': 1, 'hits': 1, 'misses': 1})
+
+    def test_new_schedule_class_name_replaces_entry(self, get_schedule_key):
+        """Test that if the names of the schedule classes for a route change, the schedule is loaded
+        again and the entry for the old schedule is removed."""
+
+        get_schedule_key.return_value = (1, 'wkd', ('bar',))
+        cache = schedule_cache.ScheduleCache()
+        old_entry = cache.get(route_object=self.route, service_class='wkd', load=object)
+
+        get_schedule_key.return_value = (1, 'wkd', ('baz',))
+        new_entry = cache.get(route_object=self.route, service_class='wkd', load=object)
+
+        self.assertIsNot(old_entry, new_entry)
+        self.assertEquals(list(cache.entries), [(1, 'wkd', ('baz',))])
+
+    def test_invalidate_removes_entries_for_route(self, get_schedule_key):
+        """Test that invalidating a route only removes the entries for that route."""
+
+        cache = schedule_cache.ScheduleCache()
+        for key in [(1, 'wkd', ('bar',)), (1, 'sat', ('bar',)), (2, 'wkd', ('bar',))]:
+            get_schedule_key.return_value = key
+            cache.get(route_object=self.route, service_class=key[1], load=object)
+
+        cache.invalidate(route_id=1)
+
+        self.assertEquals(list(cache.entries), [(2, 'wkd', ('bar',))])
+
+    def test_retain_removes_other_service_classes(self, get_schedule_key):
+        """Test that retaining a service class removes the entries for all other service classes."""
+
+        cache = schedule_cache.ScheduleCache()
+        for key in [(1, 'wkd', ('bar',)), (1, 'sat', ('bar',)), (2, 'wkd', ('bar',))]:
+            get_schedule_key.return_value = key
+            cache.get(route_object=self.route, service_class=key[1], load=object)
+
+        cache.retain(service_class='wkd')
+
+        self.assertEquals(sorted(cache.entries), [(1, 'wkd', ('bar',)), (2, 'wkd', ('bar',))])
@@ -0,0 +1,302 @@
+"""Unit tests for libs/scheduled_arrival_index.py"""
+
+import random
+import types
+import unittest
+import unittest.mock
+
+from django.test import tag
+
+from worker.libs.scheduled_arrival_index import ScheduledArrivalIndex, SECONDS_PER_DAY
+
+def _get_closest_scheduled_arrival(arrival_time, scheduled_arrivals, threshold):
+    """Find the closest scheduled arrival to an arrival by comparing the arrival to every scheduled
+    arrival, which the index is expected to return the same results as.
+
+    Arguments:
+        arrival_time: (Integer) Midnight epoch timestamp of the arrival.
+        scheduled_arrivals: (List) Objects with a "time" attribute for each scheduled arrival.
+        threshold: (Integer) The single scheduled arrival threshold.
+
+    Returns:
+        The closest scheduled arrival, or None if there is no matching scheduled arrival.
+    """
+
+    if len(scheduled_arrivals) == 1:
+        if abs(arrival_time - scheduled_arrivals[0].time) <= threshold:
+            return scheduled_arrivals[0]
+        else:
+            return None
+
+    closest_arrival = None
+    closest_difference = None
+    for scheduled_arrival in scheduled_arrivals:
+        difference = min([abs(arrival_time - scheduled_arrival.time),
+                          abs(arrival_time - scheduled_arrival.time - SECONDS_PER_DAY),
+                          abs(arrival_time - (scheduled_arrival.time - SECONDS_PER_DAY))])
+        if closest_difference is None or difference < closest_difference:
+            closest_arrival = scheduled_arrival
+            closest_difference = difference
+    return closest_arrival
+
+@tag('unit')
+class TestGetScheduledArrival(unittest.TestCase):
+    """Tests for the get_scheduled_arrival method in the ScheduledArrivalIndex class"""
+
+    def test_none_returned_for_unknown_stop_and_block(self):
+        """Test that None is returned if there are no scheduled arrivals for the stop and block."""
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={},
+                                      single_scheduled_arrival_threshold=1800)
+
+        self.assertIsNone(index.get_scheduled_arrival(stop_tag=1234,
+                                                      block_id=5678,
+                                                      arrival_time=1000))
+
+    def test_closest_scheduled_arrival_across_midnight_returned(self):
+        """Test that a scheduled arrival shortly after midnight is returned for an arrival shortly
+        before midnight, if it is the closest."""
+
+        before_midnight = unittest.mock.MagicMock(time=SECONDS_PER_DAY - 100)
+        after_midnight = unittest.mock.MagicMock(time=50)
+        midday = unittest.mock.MagicMock(time=SECONDS_PER_DAY // 2)
+
+        index = ScheduledArrivalIndex(
+            scheduled_arrivals={1234: {5678: [before_midnight, midday, after_midnight]}},
+            single_scheduled_arrival_threshold=1800)
+
+        response = index.get_scheduled_arrival(stop_tag=1234,
+                                               block_id=5678,
+                                               arrival_time=SECONDS_PER_DAY - 10)
+
+        self.assertIs(response, after_midnight)
+
+    def test_first_scheduled_arrival_returned_for_tie(self):
+        """Test that if two scheduled arrivals are equally close to the arrival, the one that was
+        first in the list of scheduled arrivals is returned."""
+
+        later = unittest.mock.MagicMock(time=1100)
+        earlier = unittest.mock.MagicMock(time=900)
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={1234: {5678: [later, earlier]}},
+                                      single_scheduled_arrival_threshold=1800)
+
+        response = index.get_scheduled_arrival(stop_tag=1234,
+                                               block_id=5678,
+                                               arrival_time=1000)
+
+        self.assertIs(response, later)
+
+    def test_same_results_as_comparing_every_scheduled_arrival(self):
+        """Test that the index returns the same scheduled arrival as comparing the arrival to every
+        scheduled arrival, for random scheduled arrivals and arrival times."""
+
+        random.seed(1234)
+        threshold = 1800
+
+        for _ in range(500):
+            scheduled_arrivals = [types.SimpleNamespace(time=random.randrange(0, SECONDS_PER_DAY, 60))
+                                  for _ in range(random.randint(0, 20))]
+            index = ScheduledArrivalIndex(scheduled_arrivals={1234: {5678: scheduled_arrivals}},
+                                          single_scheduled_arrival_threshold=threshold)
+
+            for _ in range(20):
+                arrival_time = random.randrange(0, SECONDS_PER_DAY, 30)
+                self.assertIs(index.get_scheduled_arrival(stop_tag=1234,
+                                                          block_id=5678,
+                                                          arrival_time=arrival_time),
+                              _get_closest_scheduled_arrival(arrival_time=arrival_time,
+                                                             scheduled_arrivals=scheduled_arrivals,
+                                                             threshold=threshold))
+
+    def test_none_returned_if_block_has_no_scheduled_arrivals(self):
+        """Test that None is returned if the arrival was made by a vehicle with a block ID that is
+        in the scheduled arrivals but does not have any scheduled arrivals."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: []}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=10)
+        self.assertIs(response, None)
+
+    def test_exact_match_arrival_time_returned(self):
+        """Test that when the arrival time is exactly the same as a scheduled arrival time for
+        the combination of stop and block ID, the scheduled arrival for that exact is returned."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        arrival_time = 10
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=arrival_time - 1),
+            unittest.mock.MagicMock(time=arrival_time + 1),
+            unittest.mock.MagicMock(time=arrival_time),
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[2])
+
+    def test_earlier_arrival_time_returned(self):
+        """Test that when the closest scheduled arrival time for an arrival is earlier than the
+        arrival time, the earlier scheduled arrival is returned."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        arrival_time = 10
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=arrival_time - 1),
+            unittest.mock.MagicMock(time=arrival_time + 2)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[0])
+
+    def test_later_arrival_time_returned(self):
+        """Test that when the closest scheduled arrival time for an arrival is later than the
+        arrival time, the later scheduled arrival is returned."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        arrival_time = 10
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=arrival_time - 2),
+            unittest.mock.MagicMock(time=arrival_time + 1)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[1])
+
+    def test_time_after_midnight_returned(self):
+        """Test that when an arrival time is just before midnight and the closest scheduled arrival
+        is after midnight, the correct scheduled arrival is returned."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        # Time right before midnight
+        arrival_time = (60 * 60 * 24) - 1
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=60),
+            unittest.mock.MagicMock(time=arrival_time - 120),
+            unittest.mock.MagicMock(time=15)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[2])
+
+    def test_time_before_midnight_returned(self):
+        """Test that when an arrival time is just after midnight and the closest scheduled arrival
+        is before midnight, the correct scheduled arrival is returned."""
+
+        stop_tag = 'buz'
+        block_id = 1234
+
+        # Time right after midnight
+        arrival_time = 1
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=120),
+            unittest.mock.MagicMock(time=(60 * 60 * 24) - 60),
+            unittest.mock.MagicMock(time=(60 * 60 * 24) - 120)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={stop_tag: {block_id: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=1800)
+        response = index.get_scheduled_arrival(stop_tag=stop_tag,
+                                               block_id=block_id,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[1])
+
+    def test_arrival_returned_if_block_id_has_one_scheduled_arrival_and_time_within_threshold(
+            self):
+        """Test that if there is only one scheduled arrival for the block ID and stop, that
+        scheduled arrival is returned if the difference between the scheduled arrival time and the
+        actual arrival time is less than the threshold for counting arrivals at stops with only one
+        scheduled arrival for the block ID."""
+
+        threshold = 100
+
+        arrival_time = 1000
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=arrival_time + threshold - 1)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={'buz': {1234: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=threshold)
+        response = index.get_scheduled_arrival(stop_tag='buz',
+                                               block_id=1234,
+                                               arrival_time=arrival_time)
+        self.assertEquals(response, scheduled_arrivals[0])
+
+    def test_none_returned_if_block_id_has_one_scheduled_arrival_and_time_greater_than_threshold(
+            self):
+        """Test that if there is only one scheduled arrival for the block ID and stop, None is
+        returned if the difference between the scheduled arrival time and the actual arrival time
+        is higher than the threshold for counting arrivals at stops with only one scheduled arrival
+        for the block ID."""
+
+        threshold = 100
+
+        arrival_time = 1000
+        scheduled_arrivals = [
+            unittest.mock.MagicMock(time=arrival_time + threshold + 1)
+        ]
+
+        index = ScheduledArrivalIndex(scheduled_arrivals={'buz': {1234: scheduled_arrivals}},
+                                      single_scheduled_arrival_threshold=threshold)
+        response = index.get_scheduled_arrival(stop_tag='buz',
+                                               block_id=1234,
+                                               arrival_time=arrival_time)
+        self.assertIsNone(response)
+
+@tag('unit')
+class TestGetScheduledArrivalsForArrivals(unittest.TestCase):
+    """Tests for the get_scheduled_arrivals_for_arrivals method in the ScheduledArrivalIndex
+    class"""
+
+    def test_scheduled_arrival_returned_for_every_arrival(self):
+        """Test that the closest scheduled arrival is returned for every arrival, in the same order
+        as the arrivals."""
+
+        first_scheduled_arrival = unittest.mock.MagicMock(time=1000)
+        second_scheduled_arrival = unittest.mock.MagicMock(time=1060)
+
+        index = ScheduledArrivalIndex(
+            scheduled_arrivals={
+                1234: {
+                    5678: [first_scheduled_arrival],
+                    9101: [second_scheduled_arrival]
+                }
+            },
+            single_scheduled_arrival_threshold=1800)
+
+        response = index.get_scheduled_arrivals_for_arrivals(arrivals={1234: [5678, 9101],
+                                                                       4321: [5678]},
+                                                             arrival_time=1030)
+
+        self.assertEquals(response, [
+            (1234, 5678, first_scheduled_arrival),
+            (1234, 9101, second_scheduled_arrival),
+            (4321, 5678, None)
+        ])
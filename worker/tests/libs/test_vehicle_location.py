@@ -0,0 +1,176 @@
+"""Unit tests for libs/vehicle_location.py"""
+
+import unittest
+
+from django.test import tag
+
+from worker.libs import vehicle_location
+from worker.libs.vehicle_location import StopIndex, VehicleArrival, VehicleReport, VehicleTracker
+
+# Stops along a straight line of latitude, about 44 meters apart
+LATITUDE = 37.7
+STOPS = {stop_tag: (LATITUDE, -122.5 + index * 0.0005)
+         for index, stop_tag in enumerate((1, 2, 3, 4, 5))}
+
+def _get_report(vehicle_id, stop_position, report_time):
+    """Get a report of a vehicle's location along the stops.
+
+    Arguments:
+        vehicle_id: (String) ID of the vehicle.
+        stop_position: (Float) Index of the stop the vehicle is at, with a fraction if it is between
+            stops.
+        report_time: (Float) Unix timestamp of the report.
+
+    Returns:
+        Instance of VehicleReport.
+    """
+
+    return VehicleReport(vehicle_id=vehicle_id,
+                         latitude=LATITUDE,
+                         longitude=-122.5 + stop_position * 0.0005,
+                         report_time=report_time)
+
+@tag('unit')
+class TestStopIndex(unittest.TestCase):
+    """Tests for the StopIndex class"""
+
+    def setUp(self):
+        self.stop_index = StopIndex(stops=STOPS,
+                                    sequences=[[1, 2, 3, 4, 5], [5, 4, 3, 2, 1]],
+                                    radius_meters=15)
+
+    def test_nearest_stop(self):
+        """Test that the closest stop within the radius is found."""
+
+        self.assertEquals(self.stop_index.get_nearest_stop(LATITUDE, -122.5 + 2.1 * 0.0005), 3)
+        self.assertEquals(self.stop_index.get_nearest_stop(LATITUDE, -122.5 + 3.8 * 0.0005), 5)
+
+    def test_no_stop_within_radius(self):
+        """Test that no stop is found for a location between stops or far from the route."""
+
+        self.assertIsNone(self.stop_index.get_nearest_stop(LATITUDE, -122.5 + 2.5 * 0.0005))
+        self.assertIsNone(self.stop_index.get_nearest_stop(LATITUDE + 0.01, -122.5))
+
+    def test_stops_between(self):
+        """Test that the stops between two stops are found in the schedule with the stops in that
+        order."""
+
+        self.assertEquals(self.stop_index.get_stops_between(1, 4), [2, 3])
+        self.assertEquals(self.stop_index.get_stops_between(4, 1), [3, 2])
+        self.assertEquals(self.stop_index.get_stops_between(2, 3), [])
+        self.assertEquals(self.stop_index.get_stops_between(1, 6), [])
+
+@tag('unit')
+class TestVehicleTracker(unittest.TestCase):
+    """Tests for the VehicleTracker class"""
+
+    def setUp(self):
+        stop_index = StopIndex(stops=STOPS, sequences=[[1, 2, 3, 4, 5]], radius_meters=15)
+        self.tracker = VehicleTracker(stop_index=stop_index, max_gap_seconds=600)
+
+    def test_arrival_at_stop(self):
+        """Test that a vehicle arrives at a stop when it is first reported near it, and not again
+        while it stays there or moves away."""
+
+        self.assertEquals(self.tracker.update([_get_report('A', 0, 1000)]),
+                          [VehicleArrival(vehicle_id='A', stop_tag=1, arrival_time=1000)])
+        self.assertEquals(self.tracker.update([_get_report('A', 0.1, 1010),
+                                               _get_report('A', 0.5, 1020)]),
+                          [])
+        self.assertEquals(self.tracker.update([_get_report('A', 1, 1030)]),
+                          [VehicleArrival(vehicle_id='A', stop_tag=2, arrival_time=1030)])
+
+    def test_repeated_report_ignored(self):
+        """Test that a report that is not newer than the previous report of a vehicle is ignored."""
+
+        self.tracker.update([_get_report('A', 0, 1000)])
+
+        self.assertEquals(self.tracker.update([_get_report('A', 1, 1000)]), [])
+
+    def test_passed_stops_interpolated(self):
+        """Test that a vehicle that passed stops between two reports arrives at them at times
+        interpolated between the reports."""
+
+        self.tracker.update([_get_report('A', 0, 1000)])
+
+        self.assertEquals(self.tracker.update([_get_report('A', 3, 1300)]),
+                          [VehicleArrival(vehicle_id='A', stop_tag=2, arrival_time=1100),
+                           VehicleArrival(vehicle_id='A', stop_tag=3, arrival_time=1200),
+                           VehicleArrival(vehicle_id='A', stop_tag=4, arrival_time=1300)])
+
+    def test_passed_stops_not_interpolated_after_gap(self):
+        """Test that stops are not interpolated when too long has passed since the vehicle's
+        previous arrival."""
+
+        self.tracker.update([_get_report('A', 0, 1000)])
+
+        self.assertEquals(self.tracker.update([_get_report('A', 3, 1601)]),
+                          [VehicleArrival(vehicle_id='A', stop_tag=4, arrival_time=1601)])
+
+    def test_vehicles_not_reported_removed(self):
+        """Test that only the vehicles whose last report is older than the time are removed."""
+
+        self.tracker.update([_get_report('A', 0, 1000), _get_report('B', 2.5, 1000)])
+        self.tracker.update([_get_report('A', 1, 1500)])
+
+        self.assertEquals(self.tracker.remove_vehicles(reported_before=1200), ['B'])
+        self.assertEquals(list(self.tracker.vehicles), ['A'])
+
+@tag('unit')
+class TestParseVehicleLocations(unittest.TestCase):
+    """Tests for the parse_vehicle_locations function"""
+
+    def test_parse_vehicle_locations(self):
+        """Test that predictable vehicles are parsed with their report times, along with the last
+        time of the response."""
+
+        response = {
+            'vehicle': [
+                {'id': '1401', 'lat': '37.7', 'lon': '-122.5', 'secsSinceReport': '5',
+                 'predictable': 'true'},
+                {'id': '1402', 'lat': '37.8', 'lon': '-122.4', 'secsSinceReport': '2',
+                 'predictable': 'false'}
+            ],
+            'lastTime': {'time': '1539000000000'}
+        }
+
+        self.assertEquals(vehicle_location.parse_vehicle_locations(response, retrieve_time=1000),
+                          ([VehicleReport(vehicle_id='1401', latitude=37.7, longitude=-122.5,
+                                          report_time=995)],
+                           1539000000000))
+
+    def test_single_vehicle(self):
+        """Test that a single vehicle, which NextBus returns without a list, is parsed."""
+
+        response = {'vehicle': {'id': '1401', 'lat': '37.7', 'lon': '-122.5'}}
+
+        reports, last_time = vehicle_location.parse_vehicle_locations(response, retrieve_time=1000)
+
+        self.assertEquals([report.vehicle_id for report in reports], ['1401'])
+        self.assertIsNone(last_time)
+
+@tag('unit')
+class TestGroupArrivals(unittest.TestCase):
+    """Tests for the get_vehicle_blocks and group_arrivals functions"""
+
+    def test_group_arrivals(self):
+        """Test that arrivals are grouped by time and stop with the block IDs of their vehicles,
+        skipping vehicles whose block ID is not known."""
+
+        predictions = {
+            'stopTag': '1',
+            'direction': {
+                'prediction': [{'vehicle': '1401', 'block': '9701'},
+                               {'vehicle': '1402', 'block': '9702'}]
+            }
+        }
+        vehicle_blocks = vehicle_location.get_vehicle_blocks(predictions)
+
+        vehicle_arrivals = [VehicleArrival(vehicle_id='1401', stop_tag=1, arrival_time=1000.5),
+                            VehicleArrival(vehicle_id='1402', stop_tag=1, arrival_time=1000),
+                            VehicleArrival(vehicle_id='1402', stop_tag=2, arrival_time=990),
+                            VehicleArrival(vehicle_id='1403', stop_tag=2, arrival_time=990)]
+
+        self.assertEquals(vehicle_blocks, {'1401': 9701, '1402': 9702})
+        self.assertEquals(vehicle_location.group_arrivals(vehicle_arrivals, vehicle_blocks),
+                          [(990, {2: [9702]}), (1000, {1: [9701, 9702]})])
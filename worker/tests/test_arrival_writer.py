@@ -0,0 +1,106 @@
+"""Tests for the ArrivalWriter class"""
+
+import unittest
+import unittest.mock
+
+from worker.arrival_writer import ArrivalWriter
+
+def _get_arrival(scheduled_arrival_id):
+    """Get the details of an arrival in the format accepted by the ArrivalWriter.
+
+    Arguments:
+        scheduled_arrival_id: (Integer) ID of the scheduled arrival for the arrival.
+
+    Returns:
+        Dictionary with the details of an arrival.
+    """
+
+    return {
+        'stop_id': 1,
+        'scheduled_arrival_id': scheduled_arrival_id,
+        'time': 12345,
+        'difference': 60
+    }
+
+class TestGetBatch(unittest.TestCase):
+    """Tests for the get_batch method in the ArrivalWriter class."""
+
+    def test_batch_limited_to_batch_size(self):
+        """Test that a batch contains no more than the batch size number of arrivals."""
+
+        writer = ArrivalWriter()
+        writer.batch_size = 2
+        writer.flush_seconds = 0.01
+        writer.put([_get_arrival(1), _get_arrival(2), _get_arrival(3)])
+
+        self.assertEquals(writer.get_batch(), [_get_arrival(1), _get_arrival(2)])
+        self.assertEquals(writer.get_batch(), [_get_arrival(3)])
+
+    def test_empty_batch_returned_if_no_arrivals_queued(self):
+        """Test that an empty batch is returned if no arrivals are queued within the flush
+        interval."""
+
+        writer = ArrivalWriter()
+        writer.flush_seconds = 0.01
+
+        self.assertEquals(writer.get_batch(), [])
+
+class TestPut(unittest.TestCase):
+    """Tests for the put method in the ArrivalWriter class."""
+
+    def test_arrivals_dropped_when_queue_is_full(self):
+        """Test that arrivals are dropped without blocking when the queue is full."""
+
+        writer = ArrivalWriter()
+        writer.queue.maxsize = 1
+        writer.put([_get_arrival(1), _get_arrival(2)])
+
+        stats = writer.get_stats()
+        self.assertEquals(stats['queue_depth'], 1)
+        self.assertEquals(stats['queued_arrivals'], 1)
+        self.assertEquals(stats['dropped_arrivals'], 1)
+
+@unittest.mock.patch('worker.arrival_writer.arrival.bulk_save_arrivals')
+class TestFlush(unittest.TestCase):
+    """Tests for the flush method in the ArrivalWriter class."""
+
+    def test_batch_saved(self, bulk_save_arrivals):
+        """Test that the arrivals in the batch are saved and counted in the stats."""
+
+        writer = ArrivalWriter()
+        writer.flush([_get_arrival(1), _get_arrival(2)])
+
+        bulk_save_arrivals.assert_called_once_with(
+            arrivals=[_get_arrival(1), _get_arrival(2)],
+            duplicate_arrival_threshold=writer.duplicate_arrival_threshold)
+        stats = writer.get_stats()
+        self.assertEquals(stats['saved_arrivals'], 2)
+        self.assertEquals(stats['flushes'], 1)
+
+    @unittest.mock.patch('worker.arrival_writer.db.close_old_connections')
+    def test_failed_batch_counted(self, _, bulk_save_arrivals):
+        """Test that arrivals in a batch that could not be saved are counted in the stats."""
+
+        bulk_save_arrivals.side_effect = Exception('Database is down')
+
+        writer = ArrivalWriter()
+        writer.flush([_get_arrival(1), _get_arrival(2)])
+
+        stats = writer.get_stats()
+        self.assertEquals(stats['saved_arrivals'], 0)
+        self.assertEquals(stats['failed_arrivals'], 2)
+
+@unittest.mock.patch('worker.arrival_writer.arrival.bulk_save_arrivals')
+class TestStop(unittest.TestCase):
+    """Tests for the stop method in the ArrivalWriter class."""
+
+    def test_queued_arrivals_saved(self, bulk_save_arrivals):
+        """Test that arrivals that are still queued when the writer is stopped are saved."""
+
+        writer = ArrivalWriter()
+        writer.put([_get_arrival(1), _get_arrival(2)])
+        writer.stop()
+
+        bulk_save_arrivals.assert_called_once_with(
+            arrivals=[_get_arrival(1), _get_arrival(2)],
+            duplicate_arrival_threshold=writer.duplicate_arrival_threshold)
@@ -0,0 +1,132 @@
+"""Tests for the AsyncRouteManager class"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+import unittest
+import unittest.mock
+
+from worker.async_route_manager import AsyncRouteManager
+
+def _get_worker(route_tag, polls=1):
+    """Get a mock of a worker that stops after its route has been polled a number of times.
+
+    Arguments:
+        route_tag: (String) Tag of the worker's route.
+        polls: (Integer) Number of times the route is polled before the worker stops.
+
+    Returns:
+        Instance of MagicMock in place of a RouteWorker.
+    """
+
+    worker = unittest.mock.MagicMock()
+    worker.route.tag = route_tag
+    worker.stop_tags = [1234]
+    worker.circuit_breaker.allow_request.return_value = True
+    worker.update_predictions.return_value = []
+
+    def stop(*_, **__):
+        if worker.get_poll_interval.call_count + worker.get_retry_interval.call_count >= polls:
+            worker.running = False
+        return 0
+
+    worker.get_poll_interval.side_effect = stop
+    worker.get_retry_interval.side_effect = stop
+
+    return worker
+
+@unittest.mock.patch('worker.async_route_manager.AsyncRouteManager.__init__', return_value=None)
+class TestPollAllRoutes(unittest.TestCase):
+    """Tests for the poll_all_routes method in the AsyncRouteManager class."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+
+    def _get_manager(self, chunk_predictions):
+        """Get a manager whose prediction fetcher has a chunk of stops for each route.
+
+        Arguments:
+            chunk_predictions: (Dictionary) Route tags as keys and the predictions, or exception, to
+                return for the chunk of the route as values.
+
+        Returns:
+            Instance of AsyncRouteManager.
+        """
+
+        manager = AsyncRouteManager()
+        manager.loop = self.loop
+        manager.request_executor = self.executor
+        manager.prediction_fetcher = unittest.mock.MagicMock()
+        manager.prediction_fetcher.chunks = [[(route_tag, 1234)] for route_tag in chunk_predictions]
+        manager.prediction_fetcher.chunk_route_tags = [{route_tag}
+                                                       for route_tag in chunk_predictions]
+
+        def get_chunk_predictions(chunk):
+            predictions = chunk_predictions[chunk[0][0]]
+            if isinstance(predictions, Exception):
+                raise predictions
+            return predictions
+
+        manager.prediction_fetcher.get_chunk_predictions.side_effect = get_chunk_predictions
+        manager.prediction_fetcher.get_route_responses.side_effect = lambda chunk_predictions: (
+            {chunk[0][0]: {'predictions': predictions}
+             for chunk, predictions in zip(manager.prediction_fetcher.chunks, chunk_predictions)
+             if isinstance(predictions, list)},
+            {chunk[0][0]: predictions
+             for chunk, predictions in zip(manager.prediction_fetcher.chunks, chunk_predictions)
+             if isinstance(predictions, Exception)})
+
+        return manager
+
+    def test_failed_chunk_recorded_for_its_routes(self, _):
+        """Test that a chunk that could not be retrieved counts as a failure of its routes and backs
+        off their retry interval, while the routes in other chunks are recorded and parsed by their
+        workers."""
+
+        error = URLError('timed out')
+        manager = self._get_manager({'N': error, '38R': []})
+        failed_worker = _get_worker('N')
+        worker = _get_worker('38R')
+
+        self.loop.run_until_complete(manager.poll_all_routes([failed_worker, worker]))
+
+        failed_worker.record_fetch_failure.assert_called_once_with(error)
+        failed_worker.record_fetch_success.assert_not_called()
+        failed_worker.parse_response.assert_not_called()
+        self.assertEquals(failed_worker.get_retry_interval.call_count, 1)
+
+        worker.record_fetch_success.assert_called_once_with()
+        worker.record_fetch_failure.assert_not_called()
+        self.assertEquals(worker.parse_response.call_args[1]['response'], {'predictions': []})
+        worker.get_poll_interval.assert_called_once_with(worker.parse_response.return_value)
+
+    def test_chunk_not_requested_while_circuit_open(self, _):
+        """Test that the chunk of a route whose circuit breaker is open is not requested."""
+
+        manager = self._get_manager({'N': [], '38R': []})
+        open_worker = _get_worker('N')
+        open_worker.circuit_breaker.allow_request.return_value = False
+        worker = _get_worker('38R')
+
+        self.loop.run_until_complete(manager.poll_all_routes([open_worker, worker]))
+
+        manager.prediction_fetcher.get_chunk_predictions.assert_called_once_with([('38R', 1234)])
+        open_worker.parse_response.assert_not_called()
+        self.assertEquals(open_worker.get_retry_interval.call_count, 1)
+
+    def test_other_routes_polled_after_worker_stopped(self, _):
+        """Test that the other routes keep being polled after one of the workers is stopped."""
+
+        manager = self._get_manager({'N': [], '38R': []})
+        stopped_worker = _get_worker('N', polls=1)
+        worker = _get_worker('38R', polls=3)
+
+        self.loop.run_until_complete(manager.poll_all_routes([stopped_worker, worker]))
+
+        self.assertEquals(stopped_worker.parse_response.call_count, 1)
+        self.assertEquals(worker.parse_response.call_count, 3)
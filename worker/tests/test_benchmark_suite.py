@@ -0,0 +1,29 @@
+"""Tests for the BenchmarkSuite class"""
+
+from django.test import TestCase
+
+from worker.benchmark_suite import BENCHMARKS, BenchmarkSuite
+from worker.libs.fake_agency import FakeAgency
+from worker.models import Arrival, ScheduledArrival
+
+class TestBenchmarkSuite(TestCase):
+    """Tests for the BenchmarkSuite class."""
+
+    def test_benchmarks_run(self):
+        """Test that every benchmark runs against a tiny agency, and that the benchmarks that change
+        the database do not leave their changes behind."""
+
+        agency = FakeAgency(routes=2, stops_per_direction=3, vehicles_per_route=2,
+                            seconds_between_stops=600)
+        suite = BenchmarkSuite(agency=agency, size='tiny', repeat=1)
+
+        results = suite.run()
+
+        self.assertEquals([result['name'] for result in results], list(BENCHMARKS))
+        for result in results:
+            self.assertGreater(result['items'], 0, result['name'])
+
+        # The schedules are added once more for the benchmarks that use them, but the arrivals that
+        # are saved are rolled back
+        self.assertEquals(ScheduledArrival.objects.count(), results[0]['items'])
+        self.assertEquals(Arrival.objects.count(), 0)
@@ -0,0 +1,87 @@
+"""Tests for the Checkpointer class"""
+
+import os.path as path
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from worker.checkpointer import Checkpointer
+from worker.libs import checkpoint, prediction_snapshot
+from worker.tests.utils import get_route_checkpoint
+
+class TestCheckpointer(unittest.TestCase):
+    """Tests for the Checkpointer class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_path = path.join(self.directory, 'worker.json.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_routes_resumed_after_restart(self):
+        """Test that the states put with a checkpointer are written when it is stopped, and can be
+        resumed from by a new checkpointer only once for each route."""
+
+        checkpointer = Checkpointer(checkpoint_path=self.checkpoint_path)
+        checkpointer.start()
+        checkpointer.put(route_tag='N', route_checkpoint=get_route_checkpoint(time.time()))
+        checkpointer.stop()
+
+        restarted_checkpointer = Checkpointer(checkpoint_path=self.checkpoint_path)
+        restarted_checkpointer.load()
+        route_checkpoint = restarted_checkpointer.pop(route_tag='N',
+                                                      single_scheduled_arrival_threshold=1800)
+
+        self.assertEquals(prediction_snapshot.get_predictions(route_checkpoint['snapshot']),
+                          {1234: {5678: {123: 60, 124: 900}}, 2345: {}})
+        self.assertEquals(route_checkpoint['schedule_key'], (1, 'wkd', ('2018T_FALL',)))
+        self.assertIsNone(restarted_checkpointer.pop(route_tag='N',
+                                                     single_scheduled_arrival_threshold=1800))
+        self.assertEquals(restarted_checkpointer.get_stats()['resumed_routes'], 1)
+
+    def test_old_routes_not_written(self):
+        """Test that routes whose predictions are older than the maximum age are not written."""
+
+        checkpointer = Checkpointer(checkpoint_path=self.checkpoint_path)
+        checkpointer.put(route_tag='N', route_checkpoint=get_route_checkpoint(time.time()))
+        checkpointer.put(route_tag='J', route_checkpoint=get_route_checkpoint(
+            time.time() - checkpointer.max_age_seconds - 1))
+        checkpointer.write()
+
+        self.assertEquals(list(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                          max_age_seconds=600)),
+                          ['N'])
+
+    def test_index_encoded_once(self):
+        """Test that the index of scheduled arrivals for a schedule is only encoded once, no matter
+        how many checkpoints it is written to."""
+
+        route_checkpoint = get_route_checkpoint(time.time())
+        index = route_checkpoint['scheduled_arrival_index']
+
+        checkpointer = Checkpointer(checkpoint_path=self.checkpoint_path)
+        checkpointer.put(route_tag='N', route_checkpoint=route_checkpoint)
+        with unittest.mock.patch.object(index, 'get_state', wraps=index.get_state) as get_state:
+            checkpointer.write()
+            checkpointer.write()
+
+        get_state.assert_called_once_with()
+        self.assertEquals(checkpointer.get_stats()['checkpoints'], 2)
+
+    def test_unresumed_routes_written_again(self):
+        """Test that states read from the previous checkpoint that have not been resumed from are
+        written to the next checkpoint."""
+
+        route_state = checkpoint.encode_route(get_route_checkpoint(time.time()))
+        checkpoint.write_checkpoint(checkpoint_path=self.checkpoint_path, routes={'N': route_state})
+
+        checkpointer = Checkpointer(checkpoint_path=self.checkpoint_path)
+        checkpointer.load()
+        checkpointer.write()
+
+        self.assertEquals(checkpoint.read_checkpoint(checkpoint_path=self.checkpoint_path,
+                                                     max_age_seconds=600),
+                          {'N': route_state})
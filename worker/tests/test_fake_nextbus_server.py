@@ -0,0 +1,75 @@
+"""Tests for the FakeNextBusServer class"""
+
+import threading
+import unittest
+
+from worker.fake_nextbus_server import FakeNextBusServer
+from worker.libs import nextbus, resilience
+from worker.libs.fake_agency import FakeAgency
+
+class TestFakeNextBusServer(unittest.TestCase):
+    """Tests for the FakeNextBusServer class."""
+
+    def start_server(self, **kwargs):
+        """Start a server for a small agency on a free port, and get a client for it.
+
+        Arguments:
+            kwargs: Keyword arguments for the server.
+
+        Returns:
+            Tuple of the server and an instance of NextBusClient that makes requests to it.
+        """
+
+        agency = FakeAgency(routes=2, stops_per_direction=3, vehicles_per_route=2)
+        server = FakeNextBusServer(address=('127.0.0.1', 0), agency=agency, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop_server():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop_server)
+
+        client = nextbus.NextBusClient(
+            output_format='json',
+            agency='fake',
+            transport=nextbus.PooledTransport(pool_size=1, connect_timeout=1, read_timeout=1),
+            circuit_breaker=resilience.CircuitBreaker(name='test', failure_threshold=100,
+                                                      reset_seconds=1))
+        client.feed_url = server.get_feed_url()
+
+        return server, client
+
+    def test_commands_served(self):
+        """Test that the commands used by the worker return responses from the agency."""
+
+        server, client = self.start_server()
+
+        route_list = client.get_route_list()
+        self.assertEquals([route['tag'] for route in route_list['route']], ['F1', 'F2'])
+
+        route_config = client.get_route_config(route_tag='F2')
+        self.assertEquals(len(route_config['route']['stop']), 6)
+
+        schedule = client.get_schedule(route_tag='F2')
+        self.assertEquals(len(schedule['route']), 6)
+
+        stop_tags = [int(stop['tag']) for stop in route_config['route']['stop']]
+        predictions = client.get_predictions_for_multi_stops(
+            [{'route_tag': 'F2', 'stop_tag': stop_tag} for stop_tag in stop_tags])
+        self.assertEquals([int(stop['stopTag']) for stop in predictions['predictions']],
+                          stop_tags)
+
+        self.assertEquals(server.get_stats()['requests'], 4)
+
+    def test_errors_returned(self):
+        """Test that requests return the configured errors."""
+
+        server, client = self.start_server(error_rate=1, error_kinds=['message'])
+
+        with self.assertRaises(resilience.NextBusError) as context:
+            client.get_route_list()
+
+        self.assertTrue(context.exception.should_retry)
+        self.assertEquals(server.get_stats()['errors']['message'], 1)
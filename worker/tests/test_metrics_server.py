@@ -0,0 +1,37 @@
+"""Tests for the MetricsServer class"""
+
+import unittest
+import urllib.error
+import urllib.request
+
+from worker.libs import metrics
+from worker.metrics_server import CONTENT_TYPE, MetricsServer
+
+class TestMetricsServer(unittest.TestCase):
+    """Tests for the MetricsServer class."""
+
+    def setUp(self):
+        """Start a server with its own registry on a free port."""
+
+        self.registry = metrics.Registry()
+        self.server = MetricsServer(address=('127.0.0.1', 0), registry=self.registry)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_metrics_served(self):
+        """Test that the rendered metrics are returned from the metrics path."""
+
+        self.registry.counter(name='foo_total', documentation='Foo').inc(amount=3)
+
+        with urllib.request.urlopen(self.server.get_url(), timeout=5) as response:
+            self.assertEquals(response.headers['Content-Type'], CONTENT_TYPE)
+            self.assertEquals(response.read().decode('utf-8'), self.registry.render())
+
+    def test_unknown_path_not_found(self):
+        """Test that requests for any other path return a 404 status."""
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(self.server.get_url().replace('/metrics', '/foo'), timeout=5)
+
+        self.assertEquals(context.exception.code, 404)
+        context.exception.close()
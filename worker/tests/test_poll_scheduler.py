@@ -0,0 +1,159 @@
+"""Tests for the PollScheduler class"""
+
+import unittest
+import unittest.mock
+
+from worker.libs import prediction_snapshot
+from worker.poll_scheduler import PollScheduler
+
+def _get_scheduler(request_budget=1000):
+    """Get a scheduler with a minimum interval of 10 seconds, a maximum interval of 120 seconds, and
+    an idle interval of 300 seconds.
+
+    Arguments:
+        request_budget: (Float) Maximum number of requests per minute.
+
+    Returns:
+        Instance of PollScheduler.
+    """
+
+    return PollScheduler(min_interval=10,
+                         max_interval=120,
+                         idle_interval=300,
+                         request_budget=request_budget)
+
+class TestFromConfig(unittest.TestCase):
+    """Tests for the from_config method in the PollScheduler class."""
+
+    @unittest.mock.patch('worker.poll_scheduler.config.get')
+    def test_update_frequency_used_without_minimum_interval(self, config_get):
+        """Test that the minimum interval is the update frequency of the predictions if the config
+        does not have a minimum interval."""
+
+        settings = {
+            'min_poll_seconds': '',
+            'prediction_update_seconds': '30',
+            'max_poll_seconds': '120',
+            'idle_poll_seconds': '300',
+            'request_budget_per_minute': '240'
+        }
+        config_get.side_effect = lambda section, option: settings[option]
+
+        self.assertEquals(PollScheduler.from_config().min_interval, 30)
+
+class TestGetDesiredInterval(unittest.TestCase):
+    """Tests for the get_desired_interval method in the PollScheduler class."""
+
+    def test_half_of_median_next_arrival_returned(self):
+        """Test that the interval is half of the median of the times until each block's earliest
+        predicted arrival at any stop."""
+
+        scheduler = _get_scheduler()
+        predictions = {
+            1234: {
+                5678: {
+                    123: 600,
+                    124: 1200
+                },
+                9101: {
+                    126: 40
+                }
+            },
+            4321: {
+                5678: {
+                    125: 90
+                },
+                1121: {
+                    127: 160
+                }
+            }
+        }
+
+        self.assertEquals(scheduler.get_desired_interval(predictions), 45)
+
+    def test_interval_not_limited_by_single_vehicle(self):
+        """Test that a single vehicle about to arrive at a stop does not reduce the interval to the
+        minimum."""
+
+        scheduler = _get_scheduler()
+        predictions = {
+            1234: {
+                5678: {
+                    123: 5
+                },
+                9101: {
+                    124: 200
+                },
+                1121: {
+                    125: 240
+                }
+            }
+        }
+
+        self.assertEquals(scheduler.get_desired_interval(predictions), 100)
+
+    def test_interval_limited_to_minimum_and_maximum(self):
+        """Test that the interval is not below the minimum interval or above the maximum interval
+        when there are predictions."""
+
+        scheduler = _get_scheduler()
+
+        self.assertEquals(scheduler.get_desired_interval({1234: {5678: {123: 5}}}), 10)
+        self.assertEquals(scheduler.get_desired_interval({1234: {5678: {123: 2400}}}), 120)
+
+    def test_idle_interval_returned_without_predictions(self):
+        """Test that the idle interval is returned if there are no predictions for any stop."""
+
+        scheduler = _get_scheduler()
+
+        self.assertEquals(scheduler.get_desired_interval({1234: {}, 4321: {}}), 300)
+
+    def test_snapshot_interval_returned(self):
+        """Test that the interval is determined the same way for predictions in a snapshot."""
+
+        scheduler = _get_scheduler()
+        snapshot = prediction_snapshot.get_snapshot({1234: {5678: {123: 600}, 9101: {126: 40}},
+                                                     4321: {5678: {125: 90}, 1121: {127: 160}}})
+
+        self.assertEquals(scheduler.get_desired_interval(snapshot), 45)
+        self.assertEquals(scheduler.get_desired_interval(prediction_snapshot.get_snapshot(
+            {1234: {}})), 300)
+
+class TestGetNextInterval(unittest.TestCase):
+    """Tests for the get_next_interval method in the PollScheduler class."""
+
+    def test_desired_interval_returned_within_budget(self):
+        """Test that the desired interval is returned when the routes are within the request
+        budget."""
+
+        scheduler = _get_scheduler(request_budget=10)
+
+        self.assertEquals(scheduler.get_next_interval(route_tag='foo',
+                                                      predictions={1234: {5678: {123: 60}}}), 30)
+
+    def test_interval_stretched_over_budget(self):
+        """Test that intervals are stretched proportionally when the routes together would exceed
+        the request budget."""
+
+        scheduler = _get_scheduler(request_budget=2)
+        scheduler.get_next_interval(route_tag='foo', predictions={1234: {5678: {123: 60}}})
+
+        # Both routes want to poll every 30 seconds, which is 4 requests per minute in total, or
+        # twice the budget
+        interval = scheduler.get_next_interval(route_tag='bar',
+                                               predictions={4321: {8765: {123: 60}}})
+
+        self.assertEquals(interval, 60)
+
+    def test_removed_route_not_counted(self):
+        """Test that a route that was removed no longer counts towards the request budget."""
+
+        scheduler = _get_scheduler(request_budget=2)
+        scheduler.get_next_interval(route_tag='foo', predictions={1234: {5678: {123: 60}}})
+        scheduler.remove_route('foo')
+
+        interval = scheduler.get_next_interval(route_tag='bar',
+                                               predictions={4321: {8765: {123: 60}}})
+
+        self.assertEquals(interval, 30)
+        self.assertEquals(scheduler.get_stats()['routes'], 1)
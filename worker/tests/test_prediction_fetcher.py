@@ -0,0 +1,139 @@
+"""Tests for the PredictionFetcher class"""
+
+from urllib.error import URLError
+import unittest
+import unittest.mock
+
+from worker.prediction_fetcher import PredictionFetcher
+
+@unittest.mock.patch('worker.prediction_fetcher.nextbus.NextBusClient')
+class TestGetRoutePredictions(unittest.TestCase):
+    """Tests for the get_route_predictions method in the PredictionFetcher class."""
+
+    def test_predictions_split_by_route(self, _):
+        """Test that the predictions for every chunk are combined and split up by route."""
+
+        fetcher = PredictionFetcher(agency='foo')
+        fetcher.chunks = [[('N', 1234), ('38R', 5678)], [('38R', 9101)]]
+        fetcher.chunk_route_tags = [{'N', '38R'}, {'38R'}]
+
+        chunk_predictions = [
+            [
+                {
+                    'routeTag': 'N',
+                    'stopTag': '1234',
+                    'direction': {
+                        'prediction': {
+                            'seconds': '120',
+                            'block': '3804',
+                            'tripTag': '123456'
+                        }
+                    }
+                },
+                {
+                    'routeTag': '38R',
+                    'stopTag': '5678'
+                }
+            ],
+            [
+                {
+                    'routeTag': '38R',
+                    'stopTag': '9101',
+                    'direction': {
+                        'prediction': {
+                            'seconds': '60',
+                            'block': '3815',
+                            'tripTag': '123458'
+                        }
+                    }
+                }
+            ]
+        ]
+
+        response = fetcher.get_route_predictions(chunk_predictions)
+
+        self.assertEquals(response, {
+            'N': {
+                1234: {
+                    3804: {
+                        123456: 120
+                    }
+                }
+            },
+            '38R': {
+                5678: {},
+                9101: {
+                    3815: {
+                        123458: 60
+                    }
+                }
+            }
+        })
+
+    def test_routes_in_failed_chunk_not_returned(self, _):
+        """Test that routes with stops in a chunk that could not be retrieved are not returned, even
+        if the route's other chunks were retrieved."""
+
+        fetcher = PredictionFetcher(agency='foo')
+        fetcher.chunks = [[('N', 1234), ('38R', 5678)], [('38R', 9101)]]
+        fetcher.chunk_route_tags = [{'N', '38R'}, {'38R'}]
+
+        chunk_predictions = [
+            [
+                {
+                    'routeTag': 'N',
+                    'stopTag': '1234'
+                },
+                {
+                    'routeTag': '38R',
+                    'stopTag': '5678'
+                }
+            ],
+            URLError('timed out')
+        ]
+
+        response = fetcher.get_route_predictions(chunk_predictions)
+
+        self.assertEquals(response, {
+            'N': {
+                1234: {}
+            }
+        })
+
+@unittest.mock.patch('worker.prediction_fetcher.nextbus.NextBusClient')
+class TestGetRouteResponses(unittest.TestCase):
+    """Tests for the get_route_responses method in the PredictionFetcher class."""
+
+    def test_errors_returned_for_routes_in_failed_chunk(self, _):
+        """Test that the exception for a chunk that could not be retrieved is returned for each
+        route with stops in the chunk, and that chunks that were not requested are skipped."""
+
+        fetcher = PredictionFetcher(agency='foo')
+        fetcher.chunks = [[('N', 1234)], [('38R', 5678)], [('J', 9101)]]
+        fetcher.chunk_route_tags = [{'N'}, {'38R'}, {'J'}]
+
+        error = URLError('timed out')
+        chunk_predictions = [
+            [
+                {
+                    'routeTag': 'N',
+                    'stopTag': '1234'
+                }
+            ],
+            error,
+            None
+        ]
+
+        route_responses, route_errors = fetcher.get_route_responses(chunk_predictions)
+
+        self.assertEquals(route_responses, {
+            'N': {
+                'predictions': [
+                    {
+                        'routeTag': 'N',
+                        'stopTag': '1234'
+                    }
+                ]
+            }
+        })
+        self.assertEquals(route_errors, {'38R': error})
@@ -0,0 +1,160 @@
+"""Tests for the PredictionRecorder class"""
+
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from worker.libs import recording
+from worker.prediction_recorder import PredictionRecorder
+from worker.tests.utils import get_response
+
+class TestPredictionRecorder(unittest.TestCase):
+    """Tests for the PredictionRecorder class."""
+
+    def test_recorded_responses_read(self):
+        """Test that the responses written by the recorder are read back from the recording in the
+        order they were recorded."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+            recorder.start()
+            for retrieve_time in range(100, 400, 30):
+                recorder.record(route_tag='38R', retrieve_time=retrieve_time,
+                                response=get_response('38R', 1234, 3801, retrieve_time))
+            recorder.stop()
+
+            records = list(recording.read_recording(directory))
+
+        self.assertEquals(records, [(retrieve_time, '38R',
+                                     get_response('38R', 1234, 3801, retrieve_time))
+                                    for retrieve_time in range(100, 400, 30)])
+        self.assertEquals(recorder.get_stats()['recorded_responses'], 10)
+
+    def test_segments_rotated(self):
+        """Test that a new segment is started once the current segment covers the segment length,
+        and that each segment can be read on its own."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+            recorder.segment_seconds = 60
+            for retrieve_time in range(100, 400, 30):
+                recorder.write(route_tag='38R', retrieve_time=retrieve_time,
+                               response=get_response('38R', 1234, 3801, retrieve_time))
+            recorder.stop()
+
+            segment_paths = recording.get_segment_paths(directory)
+            last_segment_records = list(recording.read_segment(segment_paths[-1]))
+
+        self.assertEquals(len(segment_paths), 5)
+        self.assertEquals(last_segment_records,
+                          [(340, '38R', get_response('38R', 1234, 3801, 340)),
+                           (370, '38R', get_response('38R', 1234, 3801, 370))])
+
+    def test_full_queue_drops_responses(self):
+        """Test that responses are dropped instead of blocking when the queue is full."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+            recorder.queue.maxsize = 1
+
+            recorder.record(route_tag='38R', retrieve_time=100,
+                            response=get_response('38R', 1234, 3801, 100))
+            recorder.record(route_tag='38R', retrieve_time=130,
+                            response=get_response('38R', 1234, 3801, 130))
+
+            self.assertEquals(recorder.get_stats()['dropped_responses'], 1)
+            self.assertEquals(os.listdir(directory), [])
+
+    def test_existing_segment_not_overwritten(self):
+        """Test that a segment whose file already exists is started with the next segment number,
+        without changing the existing file."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+            existing_path = os.path.join(directory, 'predictions-19700101T000140-000001.jsonl.gz')
+            with open(existing_path, 'wb') as existing_file:
+                existing_file.write(b'existing')
+
+            recorder.write(route_tag='38R', retrieve_time=100,
+                           response=get_response('38R', 1234, 3801, 100))
+            recorder.stop()
+
+            with open(existing_path, 'rb') as existing_file:
+                self.assertEquals(existing_file.read(), b'existing')
+            self.assertEquals(recorder.segment_number, 2)
+            self.assertEquals(list(recording.read_segment(recorder.segment_path)),
+                              [(100, '38R', get_response('38R', 1234, 3801, 100))])
+
+    def test_response_dropped_if_segment_not_started(self):
+        """Test that a response is dropped if its segment cannot be started, and that a new
+        segment is started for the next response."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+
+            with unittest.mock.patch('worker.prediction_recorder.gzip.GzipFile',
+                                     side_effect=PermissionError()):
+                recorder.write(route_tag='38R', retrieve_time=100,
+                               response=get_response('38R', 1234, 3801, 100))
+
+            recorder.write(route_tag='38R', retrieve_time=130,
+                           response=get_response('38R', 1234, 3801, 130))
+            recorder.stop()
+
+            records = list(recording.read_recording(directory))
+
+        self.assertEquals(records, [(130, '38R', get_response('38R', 1234, 3801, 130))])
+        self.assertEquals(recorder.get_stats()['recorded_responses'], 1)
+
+    def test_responses_decoded_after_write_error(self):
+        """Test that the responses recorded after a response that could not be written are read
+        back as they were recorded, instead of as changes from the response that was not written,
+        whether or not the segment is finished after the error."""
+
+        for error in (ValueError(), OSError()):
+            with self.subTest(error=error), tempfile.TemporaryDirectory() as directory:
+                recorder = PredictionRecorder(directory=directory)
+                recorder.write(route_tag='38R', retrieve_time=100,
+                               response=get_response('38R', 1234, 3801, 300))
+
+                with unittest.mock.patch.object(recorder.segment, 'write', side_effect=error):
+                    recorder.write(route_tag='38R', retrieve_time=130,
+                                   response=get_response('38R', 1234, 3801, 200))
+
+                recorder.write(route_tag='38R', retrieve_time=160,
+                               response=get_response('38R', 1234, 3801, 200))
+                recorder.write(route_tag='38R', retrieve_time=190,
+                               response=get_response('38R', 1234, 3801, 100))
+                recorder.stop()
+
+                records = list(recording.read_recording(directory))
+
+                self.assertEquals(records, [(100, '38R', get_response('38R', 1234, 3801, 300)),
+                                            (160, '38R', get_response('38R', 1234, 3801, 200)),
+                                            (190, '38R', get_response('38R', 1234, 3801, 100))])
+                self.assertEquals(recorder.get_stats()['recorded_responses'], 3)
+
+    def test_recorder_keeps_running_after_error(self):
+        """Test that the recorder's thread keeps running and recording responses after a response
+        could not be recorded."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = PredictionRecorder(directory=directory)
+            write = recorder.write
+            recorder.write = unittest.mock.MagicMock(side_effect=[ValueError(), None])
+            recorder.start()
+
+            recorder.record(route_tag='38R', retrieve_time=100,
+                            response=get_response('38R', 1234, 3801, 100))
+            recorder.record(route_tag='38R', retrieve_time=130,
+                            response=get_response('38R', 1234, 3801, 130))
+            deadline = time.monotonic() + 5
+            while recorder.write.call_count < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            self.assertEquals(recorder.write.call_count, 2)
+            self.assertTrue(recorder.is_alive())
+            recorder.write = write
+            recorder.stop()
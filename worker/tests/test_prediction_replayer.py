@@ -0,0 +1,74 @@
+"""Tests for the PredictionReplayer class"""
+
+import datetime
+
+from django.test import TestCase
+
+from worker.models import Arrival, Route, ScheduledArrival, ScheduleClass, Stop, StopScheduleClass
+from worker.prediction_replayer import PredictionReplayer
+from worker.tests.utils import get_response
+
+# Noon on a Wednesday
+RETRIEVE_TIME = datetime.datetime(2018, 8, 15, 12, 0).timestamp()
+
+class TestPredictionReplayer(TestCase):
+    """Tests for the PredictionReplayer class."""
+
+    def setUp(self):
+        """Setup a route with a single scheduled arrival at noon on weekdays."""
+
+        self.route = Route(tag='T', title='Third')
+        self.route.save()
+        self.stop = Stop(tag=7654, title='Third St & 20th St', route=self.route)
+        self.stop.save()
+
+        schedule_class = ScheduleClass(route=self.route,
+                                       direction='Inbound',
+                                       service_class='wkd',
+                                       name='2018T_WKD',
+                                       is_active=True)
+        schedule_class.save()
+        stop_schedule_class = StopScheduleClass(stop=self.stop,
+                                                schedule_class=schedule_class,
+                                                stop_order=1)
+        stop_schedule_class.save()
+        self.scheduled_arrival = ScheduledArrival(stop_schedule_class=stop_schedule_class,
+                                                  block_id=3801,
+                                                  time=12 * 60 * 60)
+        self.scheduled_arrival.save()
+
+    def test_arrivals_saved(self):
+        """Test that arrivals found in the replayed responses are saved using the retrieve times of
+        the responses as the current time."""
+
+        records = [
+            (RETRIEVE_TIME - 30, 'T', get_response('T', self.stop.tag, block_id=3801, seconds=20)),
+            (RETRIEVE_TIME, 'T', get_response('T', self.stop.tag))
+        ]
+
+        stats = PredictionReplayer().replay(records)
+
+        self.assertEquals(stats['snapshots'], 2)
+        self.assertEquals(stats['arrivals'], 1)
+        self.assertEquals(stats['saved_arrivals'], 1)
+        self.assertEquals(stats['simulated_seconds'], 30)
+        self.assertEquals(set(stats['stages']), {'parse', 'detect', 'match', 'save'})
+
+        saved_arrival = Arrival.objects.get()
+        self.assertEquals(saved_arrival.scheduled_arrival_id, self.scheduled_arrival.id)
+        self.assertEquals(saved_arrival.time, int(RETRIEVE_TIME))
+        self.assertEquals(saved_arrival.difference, 0)
+
+    def test_unknown_route_skipped(self):
+        """Test that responses for routes that are not in the database are skipped."""
+
+        records = [
+            (RETRIEVE_TIME - 30, 'X', get_response('X', 1, block_id=3801, seconds=20)),
+            (RETRIEVE_TIME, 'X', get_response('X', 1))
+        ]
+
+        stats = PredictionReplayer().replay(records)
+
+        self.assertEquals(stats['snapshots'], 0)
+        self.assertEquals(stats['skipped_snapshots'], 2)
+        self.assertEquals(Arrival.objects.count(), 0)
@@ -0,0 +1,98 @@
+"""Tests for the RouteManager class"""
+
+import datetime
+import unittest
+import unittest.mock
+
+from worker import route_manager
+
+def _get_worker(route_tag):
+    """Get a mock of a worker for a route.
+
+    Arguments:
+        route_tag: (String) Tag of the route.
+
+    Returns:
+        Instance of MagicMock with the attributes of a RouteWorker.
+    """
+
+    return unittest.mock.MagicMock(route=unittest.mock.MagicMock(tag=route_tag))
+
+class TestGetNextSwitchTime(unittest.TestCase):
+    """Tests for the get_next_switch_time function in the route_manager module."""
+
+    def test_switch_time_on_next_day(self):
+        """Test that the day is switched on the day after the current day, if the current day is
+        today."""
+
+        self.assertEquals(
+            route_manager.get_next_switch_time(current_day=datetime.date(2018, 9, 3),
+                                               day_switch_time=11700,
+                                               now=datetime.datetime(2018, 9, 3, 22)),
+            datetime.datetime(2018, 9, 4, 3, 15))
+
+    def test_switch_time_today_if_not_switched_yet(self):
+        """Test that the day is switched today if it was last switched on the day before, before
+        the switch time has passed."""
+
+        self.assertEquals(
+            route_manager.get_next_switch_time(current_day=datetime.date(2018, 9, 3),
+                                               day_switch_time=11700,
+                                               now=datetime.datetime(2018, 9, 4, 2)),
+            datetime.datetime(2018, 9, 4, 3, 15))
+
+@unittest.mock.patch('worker.route_manager.RouteManager.__init__', return_value=None)
+class TestUpdateWorkers(unittest.TestCase):
+    """Tests for the update_workers method in the RouteManager class."""
+
+    def test_only_changed_routes_updated(self, _):
+        """Test that workers for routes that are no longer active are stopped, workers for new
+        routes are started, workers with new schedules are switched to them without being
+        restarted, and other workers are left running."""
+
+        unchanged_worker = _get_worker('1')
+        changed_worker = _get_worker('2')
+        stopped_worker = _get_worker('3')
+        new_worker = _get_worker('4')
+        schedule = {'service_class': 'sat'}
+
+        manager = route_manager.RouteManager()
+        manager.workers = [unchanged_worker, changed_worker, stopped_worker]
+        manager.stop_workers = unittest.mock.MagicMock()
+        manager.start_workers = unittest.mock.MagicMock()
+
+        manager.update_workers({
+            'service_class': 'sat',
+            'routes': [],
+            'workers': [unchanged_worker, changed_worker, new_worker],
+            'schedules': {'2': schedule}
+        })
+
+        manager.stop_workers.assert_called_once_with([stopped_worker])
+        manager.start_workers.assert_called_once_with([new_worker])
+        changed_worker.set_schedule.assert_called_once_with(schedule)
+        unchanged_worker.set_schedule.assert_not_called()
+        self.assertEquals(manager.workers, [unchanged_worker, changed_worker, new_worker])
+
+@unittest.mock.patch('worker.route_manager.RouteManager.__init__', return_value=None)
+class TestStopWorkers(unittest.TestCase):
+    """Tests for the stop_workers method in the RouteManager class."""
+
+    def test_metrics_removed_for_stopped_workers(self, _):
+        """Test that the metrics of the routes of stopped workers are removed once the workers have
+        finished, while the other workers are left running."""
+
+        stopped_worker = _get_worker('1')
+        stopped_worker.is_alive.return_value = True
+        running_worker = _get_worker('2')
+
+        manager = route_manager.RouteManager()
+        manager.workers = [stopped_worker, running_worker]
+        manager.poll_scheduler = None
+
+        manager.stop_workers([stopped_worker])
+
+        self.assertFalse(stopped_worker.running)
+        stopped_worker.join.assert_called_once_with()
+        stopped_worker.remove_metrics.assert_called_once_with()
+        running_worker.remove_metrics.assert_not_called()
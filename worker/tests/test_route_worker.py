@@ -8,6 +8,8 @@ import unittest.mock
 
 from django.test import TestCase
 
+from worker.libs import prediction_snapshot, resilience, schedule_cache
+from worker.libs.scheduled_arrival_index import ScheduledArrivalIndex, ScheduledArrivalRecord
 from worker.models import Arrival, Route, ScheduledArrival, ScheduleClass, Stop, StopScheduleClass
 import worker.route_worker as route_worker
 
@@ -23,6 +25,20 @@ def _get_random_string(length):
 
     return ''.join(random.choices(string.ascii_lowercase, k=length))
 
+def _get_scheduled_arrival_record(scheduled_arrival):
+    """Get the ScheduledArrivalRecord for a ScheduledArrival that has been saved to the database.
+
+    Arguments:
+        scheduled_arrival (ScheduledArrival) The scheduled arrival.
+
+    Returns:
+        Instance of ScheduledArrivalRecord with the details of the scheduled arrival.
+    """
+
+    return ScheduledArrivalRecord(id=scheduled_arrival.id,
+                                  stop_id=scheduled_arrival.stop_schedule_class.stop_id,
+                                  time=scheduled_arrival.time)
+
 @unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
 class TestGetArrivals(unittest.TestCase):
     """Tests for the get_arrivals method in the RouteWorker class."""
@@ -243,193 +259,6 @@ class TestGetArrivals(unittest.TestCase):
 
         self.assertEquals(response, {})
 
-@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
-class TestGetScheduledArrivalForArrival(unittest.TestCase):
-    """Tests for the get_scheduled_arrival_for_arrival in the RouteWorker class."""
-
-    def test_none_returned_if_block_has_no_scheduled_arrivals(self, _):
-        """Test that None is returned if the arrival was made by a vehicle with a block ID that is
-        in the scheduled arrivals but does not have any scheduled arrivals."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=10,
-                                                            scheduled_arrivals=[])
-        self.assertIs(response, None)
-
-    def test_exact_match_arrival_time_returned(self, _):
-        """Test that when the arrival time is exactly the same as a scheduled arrival time for
-        the combination of stop and block ID, the scheduled arrival for that exact is returned."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        arrival_time = 10
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time - 1),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time + 1),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time),
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[2])
-
-    def test_earlier_arrival_time_returned(self, _):
-        """Test that when the closest scheduled arrival time for an arrival is earlier than the
-        arrival time, the earlier scheduled arrival is returned."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        arrival_time = 10
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time - 1),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time + 2)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[0])
-
-
-    def test_later_arrival_time_returned(self, _):
-        """Test that when the closest scheduled arrival time for an arrival is later than the
-        arrival time, the later scheduled arrival is returned."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        arrival_time = 10
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time - 2),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time + 1)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[1])
-
-    def test_time_after_midnight_returned(self, _):
-        """Test that when an arrival time is just before midnight and the closest scheduled arrival
-        is after midnight, the correct scheduled arrival is returned."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        # Time right before midnight
-        arrival_time = (60 * 60 * 24) - 1
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=60),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time - 120),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=15)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[2])
-
-    def test_time_before_midnight_returned(self, _):
-        """Test that when an arrival time is just after midnight and the closest scheduled arrival
-        is before midnight, the correct scheduled arrival is returned."""
-
-        stop_tag = 'buz'
-        block_id = 1234
-
-        # Time right after midnight
-        arrival_time = 1
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=120),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=(60 * 60 * 24) - 60),
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=(60 * 60 * 24) - 120)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agency='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag=stop_tag,
-                                                            block_id=block_id,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[1])
-
-    @unittest.mock.patch('worker.route_worker.config.get', autospec=True)
-    def test_arrival_returned_if_block_id_has_one_scheduled_arrival_and_time_within_threshold(
-        self, config_get, _):
-        """Test that if there is only one scheduled arrival for the block ID and stop, that
-        scheduled arrival is returned if the difference between the scheduled arrival time and the
-        actual arrival time is less than the threshold for counting arrivals at stops with only one
-        scheduled arrival for the block ID."""
-
-        threshold = 100
-        config_get.return_value = threshold
-
-        arrival_time = 1000
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time + threshold - 1)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agencey='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag='buz',
-                                                            block_id=1234,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertEquals(response, scheduled_arrivals[0])
-
-    @unittest.mock.patch('worker.route_worker.config.get', autospec=True)
-    def test_none_returned_if_block_id_has_one_scheduled_arrival_and_time_greater_than_threshold(
-        self, config_get, _):
-        """Test that if there is only one scheduled arrival for the block ID and stop, None is
-        returned if the difference between the scheduled arrival time and the actual arrival time
-        is higher than the threshold for counting arrivals at stops with only one scheduled arrival
-        for the block ID."""
-
-        threshold = 100
-        config_get.return_value = threshold
-
-        arrival_time = 1000
-        scheduled_arrivals = [
-            unittest.mock.MagicMock(spec=ScheduledArrival, time=arrival_time + threshold + 1)
-        ]
-
-        worker = route_worker.RouteWorker(route_tag='foo',
-                                          agencey='bar',
-                                          service_class='baz')
-        response = worker.get_scheduled_arrival_for_arrival(stop_tag='buz',
-                                                            block_id=1234,
-                                                            arrival_time=arrival_time,
-                                                            scheduled_arrivals=scheduled_arrivals)
-        self.assertIsNone(response)
-
 class TestGetScheduledArrivals(TestCase):
     """Tests for the get_scheduled_arrivals method in the RouteWorker class."""
 
@@ -524,18 +353,18 @@ class TestGetScheduledArrivals(TestCase):
         self.assertEquals(result, {
             self.stop.tag: {
                 self.active_scheduled_arrival.block_id: [
-                    self.active_scheduled_arrival
+                    _get_scheduled_arrival_record(self.active_scheduled_arrival)
                 ],
                 second_arrival.block_id: [
-                    second_arrival
+                    _get_scheduled_arrival_record(second_arrival)
                 ],
                 third_arrival.block_id: [
-                    third_arrival
+                    _get_scheduled_arrival_record(third_arrival)
                 ]
             }
         })
 
-@unittest.mock.patch('worker.route_worker.py_nextbus.NextBusClient')
+@unittest.mock.patch('worker.route_worker.nextbus.NextBusClient')
 class TestGetPredictions(TestCase):
     """Tests for the get_predictions method in the RouteWorker class."""
 
@@ -543,6 +372,7 @@ class TestGetPredictions(TestCase):
         """Test that the stops in the arguments are passed to the get_predictions_for_multi_stops
         method in the NextBus client in the expected format."""
 
+        nextbus_client.return_value.response_bytes = 0
         test_route = Route(tag='foo',
                            title='bar')
         test_route.save()
@@ -575,6 +405,7 @@ class TestGetPredictions(TestCase):
         """Test that the response from the NextBus API is formatted into the expected structure and
         returned."""
 
+        nextbus_client.return_value.response_bytes = 0
         nextbus_client.return_value.get_predictions_for_multi_stops.return_value = {
             'predictions': [
                 {
@@ -673,7 +504,7 @@ class TestGetPredictions(TestCase):
 
         self.assertEqual(response, expected_response)
 
-@unittest.mock.patch('worker.route_worker.RouteWorker.get_scheduled_arrival_for_arrival')
+@unittest.mock.patch('worker.route_worker.ScheduledArrivalIndex.get_scheduled_arrival')
 class TestSaveArrivals(TestCase):
     """Tests for the save_arrivals method in the RouteWorker class."""
 
@@ -699,7 +530,7 @@ class TestSaveArrivals(TestCase):
                                                      stop_order=random.randint(1, 20))
         self.stop_schedule_class.save()
 
-    def test_arrivals_saved_to_database(self, get_scheduled_arrival_for_arrival):
+    def test_arrivals_saved_to_database(self, get_scheduled_arrival):
         """Test that the details of the provided arrivals are saved to the database."""
 
         first_block_id = random.randint(1, 9999)
@@ -710,22 +541,23 @@ class TestSaveArrivals(TestCase):
         second_scheduled_arrival = ScheduledArrival(stop_schedule_class=self.stop_schedule_class,
                                                     block_id=second_block_id,
                                                     time=3456789)
+        first_scheduled_arrival.save()
+        second_scheduled_arrival.save()
+        first_record = _get_scheduled_arrival_record(first_scheduled_arrival)
+        second_record = _get_scheduled_arrival_record(second_scheduled_arrival)
 
         scheduled_arrivals = {
             self.stop.tag: {
                 first_block_id: [
-                    first_scheduled_arrival
+                    first_record
                 ],
                 second_block_id: [
-                    second_scheduled_arrival
+                    second_record
                 ]
             }
         }
-        first_scheduled_arrival.save()
-        second_scheduled_arrival.save()
 
-        get_scheduled_arrival_for_arrival.side_effect = \
-            [first_scheduled_arrival, second_scheduled_arrival]
+        get_scheduled_arrival.side_effect = [first_record, second_record]
 
         arrivals = {
             self.stop.tag: [
@@ -741,7 +573,9 @@ class TestSaveArrivals(TestCase):
 
         worker.save_arrivals(arrivals=arrivals,
                              arrival_time=arrival_time,
-                             scheduled_arrivals=scheduled_arrivals)
+                             scheduled_arrival_index=ScheduledArrivalIndex(
+                                 scheduled_arrivals=scheduled_arrivals,
+                                 single_scheduled_arrival_threshold=1800))
 
         # Try to get both Arrivals that should have been added to the database
         Arrival.objects.get(stop=self.stop,
@@ -752,11 +586,11 @@ class TestSaveArrivals(TestCase):
                            time=arrival_time)
 
     def test_arrival_not_saved_if_scheduled_arrival_does_not_exist(
-            self, get_scheduled_arrival_for_arrival):
+            self, get_scheduled_arrival):
         """Test that arrivals are not saved to the database if no scheduled arrival time could be
         found for an arrival."""
 
-        get_scheduled_arrival_for_arrival.return_value = None
+        get_scheduled_arrival.return_value = None
         stop_tag = 1234
         block_id = 5678
         arrivals = {
@@ -780,6 +614,556 @@ class TestSaveArrivals(TestCase):
 
         worker.save_arrivals(arrivals=arrivals,
                              arrival_time=678910,
-                             scheduled_arrivals=scheduled_arrivals)
+                             scheduled_arrival_index=ScheduledArrivalIndex(
+                                 scheduled_arrivals=scheduled_arrivals,
+                                 single_scheduled_arrival_threshold=1800))
 
         self.assertEquals(Arrival.objects.count(), num_arrivals_before)
+
+    def test_arrival_within_duplicate_threshold_updated(self, get_scheduled_arrival):
+        """Test that if there is already an arrival for the same stop and scheduled arrival within
+        the duplicate arrival threshold, the existing arrival is updated instead of a new arrival
+        being added."""
+
+        scheduled_arrival = ScheduledArrival(stop_schedule_class=self.stop_schedule_class,
+                                             block_id=random.randint(1, 9999),
+                                             time=1234)
+        scheduled_arrival.save()
+        existing_arrival = Arrival(stop=self.stop,
+                                   scheduled_arrival=scheduled_arrival,
+                                   time=678000,
+                                   difference=0)
+        existing_arrival.save()
+
+        scheduled_arrival_record = _get_scheduled_arrival_record(scheduled_arrival)
+        get_scheduled_arrival.return_value = scheduled_arrival_record
+        arrivals = {
+            self.stop.tag: [
+                scheduled_arrival.block_id
+            ]
+        }
+        scheduled_arrivals = {
+            self.stop.tag: {
+                scheduled_arrival.block_id: [
+                    scheduled_arrival_record
+                ]
+            }
+        }
+
+        worker = route_worker.RouteWorker(route_tag=self.route.tag,
+                                          agency='foo',
+                                          service_class='bar')
+        worker.duplicate_arrival_threshold = 1800
+
+        worker.save_arrivals(arrivals=arrivals,
+                             arrival_time=678910,
+                             scheduled_arrival_index=ScheduledArrivalIndex(
+                                 scheduled_arrivals=scheduled_arrivals,
+                                 single_scheduled_arrival_threshold=1800))
+
+        arrivals = Arrival.objects.filter(stop=self.stop, scheduled_arrival=scheduled_arrival)
+        self.assertEquals(arrivals.count(), 1)
+        self.assertEquals(arrivals[0].id, existing_arrival.id)
+        self.assertEquals(arrivals[0].time, 678910)
+
+    def test_arrival_outside_duplicate_threshold_added(self, get_scheduled_arrival):
+        """Test that if there is already an arrival for the same stop and scheduled arrival that is
+        not within the duplicate arrival threshold, a new arrival is added."""
+
+        scheduled_arrival = ScheduledArrival(stop_schedule_class=self.stop_schedule_class,
+                                             block_id=random.randint(1, 9999),
+                                             time=1234)
+        scheduled_arrival.save()
+        existing_arrival = Arrival(stop=self.stop,
+                                   scheduled_arrival=scheduled_arrival,
+                                   time=600000,
+                                   difference=0)
+        existing_arrival.save()
+
+        scheduled_arrival_record = _get_scheduled_arrival_record(scheduled_arrival)
+        get_scheduled_arrival.return_value = scheduled_arrival_record
+        arrivals = {
+            self.stop.tag: [
+                scheduled_arrival.block_id
+            ]
+        }
+        scheduled_arrivals = {
+            self.stop.tag: {
+                scheduled_arrival.block_id: [
+                    scheduled_arrival_record
+                ]
+            }
+        }
+
+        worker = route_worker.RouteWorker(route_tag=self.route.tag,
+                                          agency='foo',
+                                          service_class='bar')
+        worker.duplicate_arrival_threshold = 1800
+
+        worker.save_arrivals(arrivals=arrivals,
+                             arrival_time=678910,
+                             scheduled_arrival_index=ScheduledArrivalIndex(
+                                 scheduled_arrivals=scheduled_arrivals,
+                                 single_scheduled_arrival_threshold=1800))
+
+        arrivals = Arrival.objects.filter(stop=self.stop, scheduled_arrival=scheduled_arrival)
+        self.assertEquals(sorted(arrival.time for arrival in arrivals), [600000, 678910])
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestSaveVehicleArrivals(unittest.TestCase):
+    """Tests for the save_vehicle_arrivals method in the RouteWorker class."""
+
+    def test_arrivals_saved_at_their_times(self, _):
+        """Test that each group of arrivals found from the locations of vehicles is saved with the
+        time it occurred."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.scheduled_arrival_index = unittest.mock.MagicMock()
+        worker.save_arrivals = unittest.mock.MagicMock()
+
+        worker.save_vehicle_arrivals(timed_arrivals=[(12300, {1234: [5678]}),
+                                                     (12310, {1235: [5678, 5679]})])
+
+        self.assertEquals(worker.save_arrivals.call_args_list, [
+            unittest.mock.call(arrivals={1234: [5678]},
+                               arrival_time=12300,
+                               scheduled_arrival_index=worker.scheduled_arrival_index),
+            unittest.mock.call(arrivals={1235: [5678, 5679]},
+                               arrival_time=12310,
+                               scheduled_arrival_index=worker.scheduled_arrival_index)
+        ])
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestUpdatePredictions(unittest.TestCase):
+    """Tests for the update_predictions method in the RouteWorker class."""
+
+    def test_current_predictions_replaced(self, _):
+        """Test that the provided predictions and retrieve time replace the worker's current
+        predictions and retrieve time."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.update_frequency = 30
+        worker.poll_interval = 30
+        worker.arrival_detection = 'nested'
+        worker.checkpointer = None
+        worker.current_predictions = {}
+        worker.current_retrieve_time = 12300
+
+        predictions = {
+            1234: {
+                5678: {
+                    123: 60
+                }
+            }
+        }
+        worker.update_predictions(predictions=predictions,
+                                  retrieve_time=12330)
+
+        self.assertIs(worker.current_predictions, predictions)
+        self.assertEquals(worker.current_retrieve_time, 12330)
+
+    def test_arrivals_returned(self, _):
+        """Test that the arrivals found between the previous and provided predictions are
+        returned."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.update_frequency = 30
+        worker.poll_interval = 30
+        worker.arrival_detection = 'nested'
+        worker.checkpointer = None
+        worker.current_predictions = {
+            1234: {
+                5678: {
+                    123: 1
+                }
+            }
+        }
+        worker.current_retrieve_time = 12300
+
+        response = worker.update_predictions(predictions={1234: {}},
+                                             retrieve_time=12330)
+
+        self.assertEquals(response, {
+            1234: [
+                5678
+            ]
+        })
+
+    def test_arrivals_returned_from_snapshots(self, _):
+        """Test that when arrivals are detected with snapshots, the arrivals found between the
+        previous and provided predictions are returned, and the snapshot is replaced."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.update_frequency = 30
+        worker.poll_interval = 30
+        worker.arrival_detection = 'snapshot'
+        worker.checkpointer = None
+        worker.current_predictions = {}
+        worker.current_snapshot = prediction_snapshot.get_snapshot({
+            1234: {
+                5678: {
+                    123: 1
+                }
+            }
+        })
+        worker.current_retrieve_time = 12300
+
+        response = worker.update_predictions(predictions={1234: {}},
+                                             retrieve_time=12330)
+
+        self.assertEquals(response, {
+            1234: [
+                5678
+            ]
+        })
+        self.assertEquals(list(worker.current_snapshot.stops), [1234])
+        self.assertEquals(len(worker.current_snapshot), 0)
+
+    def test_no_arrivals_returned_if_previous_predictions_are_too_old(self, _):
+        """Test that no arrivals are returned if the previous predictions were retrieved more than
+        three times the update frequency before the provided predictions."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.update_frequency = 30
+        worker.poll_interval = 30
+        worker.arrival_detection = 'nested'
+        worker.checkpointer = None
+        worker.current_predictions = {
+            1234: {
+                5678: {
+                    123: 1
+                }
+            }
+        }
+        worker.current_retrieve_time = 12300
+
+        stale_cycles = route_worker.STALE_CYCLES.values.get(('foo',), 0)
+        response = worker.update_predictions(predictions={1234: {}},
+                                             retrieve_time=12391)
+
+        self.assertEquals(response, {})
+        self.assertEquals(route_worker.STALE_CYCLES.values[('foo',)], stale_cycles + 1)
+
+    def test_state_put_with_checkpointer(self, _):
+        """Test that the state of the worker is put with the checkpointer after the predictions are
+        replaced."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.update_frequency = 30
+        worker.poll_interval = 30
+        worker.arrival_detection = 'nested'
+        worker.checkpointer = unittest.mock.MagicMock()
+        worker.service_class = 'wkd'
+        worker.schedule_key = (1, 'wkd', ('2018',))
+        worker.scheduled_arrival_index = unittest.mock.MagicMock()
+        worker.current_predictions = {}
+        worker.current_retrieve_time = 12300
+
+        predictions = {1234: {}}
+        worker.update_predictions(predictions=predictions, retrieve_time=12330)
+
+        worker.checkpointer.put.assert_called_once_with(route_tag='foo', route_checkpoint={
+            'service_class': 'wkd',
+            'schedule_key': (1, 'wkd', ('2018',)),
+            'retrieve_time': 12330,
+            'predictions': predictions,
+            'scheduled_arrival_index': worker.scheduled_arrival_index
+        })
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.get_stops', return_value=[])
+@unittest.mock.patch('worker.route_worker.schedule_cache.get_schedule_key',
+                     return_value=(999, 'wkd', ('2018',)))
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestLoadSchedule(unittest.TestCase):
+    """Tests for the load_schedule method in the RouteWorker class."""
+
+    def tearDown(self):
+        schedule_cache.get_schedule_cache().invalidate(route_id=999)
+
+    def _get_worker(self, route_checkpoint):
+        """Get a worker with a checkpointer that returns the state of a route.
+
+        Arguments:
+            route_checkpoint: (Dictionary) The state returned by the checkpointer.
+
+        Returns:
+            Instance of RouteWorker.
+        """
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo', id=999)
+        worker.service_class = 'wkd'
+        worker.single_scheduled_arrival_threshold = 1800
+        worker.arrival_detection = 'snapshot'
+        worker.checkpointer = unittest.mock.MagicMock()
+        worker.checkpointer.pop.return_value = route_checkpoint
+        worker.get_scheduled_arrivals = unittest.mock.MagicMock(return_value={})
+
+        return worker
+
+    def test_resumes_from_checkpoint(self, *_):
+        """Test that the worker resumes from the predictions and index of scheduled arrivals in the
+        checkpoint, without loading the scheduled arrivals from the database."""
+
+        snapshot = prediction_snapshot.get_snapshot({1234: {5678: {123: 60}}})
+        scheduled_arrival_index = ScheduledArrivalIndex(scheduled_arrivals={},
+                                                        single_scheduled_arrival_threshold=1800)
+        worker = self._get_worker({
+            'service_class': 'wkd',
+            'schedule_key': (999, 'wkd', ('2018',)),
+            'retrieve_time': 12300,
+            'snapshot': snapshot,
+            'scheduled_arrival_index': scheduled_arrival_index
+        })
+
+        worker.load_schedule()
+
+        worker.get_scheduled_arrivals.assert_not_called()
+        self.assertIs(worker.scheduled_arrival_index, scheduled_arrival_index)
+        self.assertIs(worker.current_snapshot, snapshot)
+        self.assertEquals(worker.current_predictions, {1234: {5678: {123: 60}}})
+        self.assertEquals(worker.current_retrieve_time, 12300)
+
+    def test_schedule_loaded_if_schedule_changed(self, *_):
+        """Test that the worker resumes from the predictions in the checkpoint, but loads the
+        scheduled arrivals from the database, if the schedule changed since the checkpoint."""
+
+        worker = self._get_worker({
+            'service_class': 'wkd',
+            'schedule_key': (999, 'wkd', ('2017',)),
+            'retrieve_time': 12300,
+            'snapshot': prediction_snapshot.get_snapshot({1234: {}}),
+            'scheduled_arrival_index': unittest.mock.MagicMock()
+        })
+
+        worker.load_schedule()
+
+        worker.get_scheduled_arrivals.assert_called_once_with(service_class='wkd')
+        self.assertEquals(worker.current_predictions, {1234: {}})
+        self.assertEquals(worker.current_retrieve_time, 12300)
+
+    def test_checkpoint_ignored_for_other_service_class(self, *_):
+        """Test that the worker starts without predictions if the checkpoint is for a different
+        service class."""
+
+        worker = self._get_worker({
+            'service_class': 'sat',
+            'schedule_key': (999, 'sat', ('2018',)),
+            'retrieve_time': 12300,
+            'snapshot': prediction_snapshot.get_snapshot({1234: {}}),
+            'scheduled_arrival_index': unittest.mock.MagicMock()
+        })
+
+        worker.load_schedule()
+
+        worker.get_scheduled_arrivals.assert_called_once_with(service_class='wkd')
+        self.assertEquals(worker.current_predictions, {})
+        self.assertGreater(worker.current_retrieve_time, 12300)
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.get_stops')
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestApplyPendingSchedule(unittest.TestCase):
+    """Tests for the apply_pending_schedule method in the RouteWorker class."""
+
+    def test_pending_schedule_replaces_schedule(self, _, get_stops):
+        """Test that a schedule set with the set_schedule method replaces the schedule once it is
+        applied, without resetting the predictions."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='wkd')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.service_class = 'wkd'
+        worker.schedule_key = (1, 'wkd', ('foo',))
+        worker.scheduled_arrival_index = unittest.mock.MagicMock()
+        worker.stop_tags = [1234]
+        worker.current_predictions = {1234: {5678: {123: 60}}}
+        worker.pending_schedule = None
+        worker.vehicle_location_detector = None
+
+        self.assertFalse(worker.apply_pending_schedule())
+
+        scheduled_arrival_index = unittest.mock.MagicMock()
+        worker.set_schedule({
+            'service_class': 'sat',
+            'key': (1, 'sat', ('bar',)),
+            'scheduled_arrival_index': scheduled_arrival_index,
+            'stop_tags': [1234, 4321]
+        })
+
+        # The schedule is not replaced until it is applied
+        self.assertEquals(worker.service_class, 'wkd')
+
+        self.assertTrue(worker.apply_pending_schedule())
+        self.assertEquals(worker.service_class, 'sat')
+        self.assertEquals(worker.schedule_key, (1, 'sat', ('bar',)))
+        self.assertIs(worker.scheduled_arrival_index, scheduled_arrival_index)
+        self.assertEquals(worker.stop_tags, [1234, 4321])
+        self.assertEquals(worker.current_predictions, {1234: {5678: {123: 60}}})
+        get_stops.assert_called_once_with(service_class='sat')
+
+        self.assertFalse(worker.apply_pending_schedule())
+
+    def test_vehicle_stops_set_from_schedule(self, _, get_stops):
+        """Test that the stops of the vehicle location detector are set from the locations in the
+        schedule, instead of being loaded from the database."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='wkd')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.vehicle_location_detector = unittest.mock.MagicMock()
+        stops = {1234: (37.7, -122.5)}
+        worker.set_schedule({
+            'service_class': 'sat',
+            'key': (1, 'sat', ('bar',)),
+            'scheduled_arrival_index': unittest.mock.MagicMock(),
+            'stop_tags': [1234],
+            'stop_locations': (stops, [[1234]])
+        })
+
+        self.assertTrue(worker.apply_pending_schedule())
+        worker.vehicle_location_detector.set_stops.assert_called_once_with(stops=stops,
+                                                                           sequences=[[1234]])
+        worker.vehicle_location_detector.load_stops.assert_not_called()
+
+@unittest.mock.patch('worker.route_worker.time')
+class TestGetNextPollTime(unittest.TestCase):
+    """Tests for the get_next_poll_time function in the route_worker module."""
+
+    def test_interval_added_to_scheduled_time(self, time):
+        """Test that the next poll is an interval after the previous poll was scheduled, not after
+        the current time."""
+
+        time.monotonic.return_value = 105
+
+        self.assertEquals(route_worker.get_next_poll_time(poll_time=100, interval=30), 130)
+
+    def test_overdue_poll_happens_now(self, time):
+        """Test that if the next poll is already overdue, it is scheduled for the current time."""
+
+        time.monotonic.return_value = 200
+
+        self.assertEquals(route_worker.get_next_poll_time(poll_time=100, interval=30), 200)
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.get_predictions')
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestFetchPredictions(unittest.TestCase):
+    """Tests for the fetch_predictions method in the RouteWorker class."""
+
+    def _get_worker(self):
+        """Get a worker with a circuit breaker that opens after two failures.
+
+        Returns:
+            Instance of RouteWorker.
+        """
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='foo')
+        worker.stop_tags = [1234]
+        worker.vehicle_location_detector = None
+        worker.update_frequency = 30
+        worker.max_backoff_seconds = 300
+        worker.consecutive_failures = 0
+        worker.circuit_breaker = resilience.CircuitBreaker(name='foo',
+                                                           failure_threshold=2,
+                                                           reset_seconds=60)
+        return worker
+
+    def test_predictions_returned(self, _, get_predictions):
+        """Test that the predictions are returned if they were retrieved successfully."""
+
+        get_predictions.return_value = {1234: {}}
+        worker = self._get_worker()
+
+        self.assertEquals(worker.fetch_predictions(), {1234: {}})
+        self.assertEquals(worker.get_retry_interval(), 0)
+
+    def test_none_returned_for_any_error(self, _, get_predictions):
+        """Test that None is returned instead of an exception being raised for any error, and that
+        the retry interval backs off."""
+
+        get_predictions.side_effect = KeyError('predictions')
+        worker = self._get_worker()
+
+        self.assertIsNone(worker.fetch_predictions())
+        self.assertEquals(worker.consecutive_failures, 1)
+        self.assertTrue(15 <= worker.get_retry_interval() <= 30)
+
+    def test_trial_retried_if_global_circuit_open(self, _, get_predictions):
+        """Test that the trial request of the route's half open circuit breaker is allowed again if
+        it was not made because the circuit breaker shared by all routes is open."""
+
+        worker = self._get_worker()
+        worker.circuit_breaker = resilience.CircuitBreaker(name='foo',
+                                                           failure_threshold=1,
+                                                           reset_seconds=0)
+        worker.circuit_breaker.record_failure()
+
+        get_predictions.side_effect = resilience.CircuitOpenError('nextbus')
+        self.assertIsNone(worker.fetch_predictions())
+        self.assertIsNone(worker.fetch_predictions())
+
+        get_predictions.side_effect = None
+        get_predictions.return_value = {1234: {}}
+        self.assertEquals(worker.fetch_predictions(), {1234: {}})
+        self.assertEquals(get_predictions.call_count, 3)
+        self.assertEquals(worker.circuit_breaker.get_state()['state'], resilience.STATE_CLOSED)
+
+    def test_no_request_while_circuit_open(self, _, get_predictions):
+        """Test that predictions are not requested while the route's circuit breaker is open."""
+
+        get_predictions.side_effect = ValueError()
+        worker = self._get_worker()
+        worker.fetch_predictions()
+        worker.fetch_predictions()
+
+        self.assertIsNone(worker.fetch_predictions())
+        self.assertEquals(get_predictions.call_count, 2)
+
+
+@unittest.mock.patch('worker.route_worker.RouteWorker.__init__', return_value=None)
+class TestRemoveMetrics(unittest.TestCase):
+    """Tests for the remove_metrics method in the RouteWorker class."""
+
+    def test_only_route_metrics_removed(self, _):
+        """Test that the metrics for the worker's route are removed, and the metrics for other
+        routes are kept."""
+
+        worker = route_worker.RouteWorker(route_tag='foo',
+                                          agency='bar',
+                                          service_class='baz')
+        worker.route = unittest.mock.MagicMock(tag='removed')
+        route_worker.FETCH_ERRORS.inc(labels=('removed', resilience.ERROR_CLIENT))
+        route_worker.FETCH_SECONDS.observe(0.1, labels=('removed',))
+        route_worker.FETCH_ERRORS.inc(labels=('kept', resilience.ERROR_CLIENT))
+
+        worker.remove_metrics()
+
+        route_tags = set(dict(label_pairs)['route']
+                         for metric in (route_worker.FETCH_ERRORS, route_worker.FETCH_SECONDS)
+                         for _, label_pairs, _ in metric.get_samples())
+        self.assertNotIn('removed', route_tags)
+        self.assertIn('kept', route_tags)
@@ -0,0 +1,102 @@
+"""Tests for the SamplingProfiler class"""
+
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from worker import sampling_profiler
+from worker.sampling_profiler import SamplingProfiler
+
+def _busy_function(stop_event):
+    """Loop until an event is set, so that it is sampled by the profiler."""
+
+    while not stop_event.is_set():
+        sum(range(1000))
+
+class TestSamplingProfiler(unittest.TestCase):
+    """Tests for the SamplingProfiler class."""
+
+    def setUp(self):
+        """Start a thread that is busy until the test finishes."""
+
+        stop_event = threading.Event()
+        thread = threading.Thread(target=_busy_function, args=(stop_event,), name='busy thread')
+        thread.start()
+
+        def stop_thread():
+            stop_event.set()
+            thread.join()
+        self.addCleanup(stop_thread)
+
+    def test_stacks_of_other_threads_sampled(self):
+        """Test that the stacks of the other threads are aggregated by thread, and that the
+        profiler's own thread is not sampled."""
+
+        profiler = SamplingProfiler(seconds=0.2, interval=0.01)
+        profiler.start()
+        profiler.join()
+
+        self.assertGreater(profiler.samples, 1)
+        self.assertIn('busy thread', profiler.thread_samples)
+        self.assertNotIn('sampling profiler', profiler.thread_samples)
+
+        busy_stacks = [line for line in profiler.get_collapsed_stacks()
+                       if line.startswith('busy thread;')]
+        self.assertTrue(busy_stacks)
+        for line in busy_stacks:
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn('_busy_function (worker/tests/test_sampling_profiler.py)',
+                          stack.split(';'))
+            self.assertGreater(int(count), 0)
+
+        self.assertEquals(sum(int(line.rsplit(' ', 1)[1]) for line in busy_stacks),
+                          profiler.thread_samples['busy thread'])
+
+    def test_profile_written(self):
+        """Test that the collapsed stacks and the summary of each thread are written to the
+        directory."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SamplingProfiler(seconds=0.1, interval=0.01, directory=directory)
+            profiler.start()
+            profiler.join()
+
+            self.assertEquals(len(profiler.output_paths), 2)
+            with open(profiler.output_paths[0]) as collapsed_file:
+                self.assertEquals(collapsed_file.read().splitlines(),
+                                  profiler.get_collapsed_stacks())
+            with open(profiler.output_paths[1]) as summary_file:
+                self.assertIn('busy thread', summary_file.read())
+
+    def test_second_profiler_not_started(self):
+        """Test that the process is only profiled by a single profiler at a time."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            with unittest.mock.patch('worker.sampling_profiler.get_profile_directory',
+                                     return_value=directory):
+                profiler = sampling_profiler.start_profiler(seconds=0.2)
+                self.assertIsNotNone(profiler)
+                self.assertIs(sampling_profiler.get_profiler(), profiler)
+                self.assertIsNone(sampling_profiler.start_profiler(seconds=0.2))
+
+                profiler.join()
+                self.assertIsNone(sampling_profiler.get_profiler())
+
+    def test_request_file_used(self):
+        """Test that the number of seconds written to the request file for the process is used, and
+        that the request file is removed."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            request_path = sampling_profiler.get_request_path(directory, os.getpid())
+            with open(request_path, 'w') as request_file:
+                request_file.write('0.05')
+
+            with unittest.mock.patch('worker.sampling_profiler.get_profile_directory',
+                                     return_value=directory):
+                profiler = sampling_profiler.start_profiler()
+                profiler.join()
+
+            self.assertEquals(profiler.seconds, 0.05)
+            self.assertFalse(os.path.exists(request_path))
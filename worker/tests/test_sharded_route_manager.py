@@ -0,0 +1,146 @@
+"""Tests for the ShardedRouteManager class"""
+
+import time
+import unittest
+import unittest.mock
+
+from worker.sharded_route_manager import ShardedRouteManager
+
+def _get_manager():
+    """Get a sharded route manager without loading any routes.
+
+    Returns:
+        Instance of ShardedRouteManager with mocks for the methods that change the workers.
+    """
+
+    manager = ShardedRouteManager()
+    manager.shard_name = 'a'
+    manager.service_class = 'wkd'
+    manager.lease_seconds = 60
+    manager.renew_seconds = 15
+    manager.leased_route_ids = {1}
+    manager.lease_changes = 0
+    manager.leases_expire = 0
+    manager.load_new_schedules = False
+    manager.workers = [unittest.mock.MagicMock()]
+    manager.get_next_day = unittest.mock.MagicMock()
+    manager.update_workers = unittest.mock.MagicMock()
+    manager.stop_workers = unittest.mock.MagicMock()
+
+    return manager
+
+@unittest.mock.patch('worker.sharded_route_manager.RouteManager.get_active_routes',
+                     return_value=[unittest.mock.MagicMock(id=1), unittest.mock.MagicMock(id=2)])
+@unittest.mock.patch('worker.sharded_route_manager.ShardedRouteManager.__init__',
+                     return_value=None)
+class TestRebalance(unittest.TestCase):
+    """Tests for the rebalance method in the ShardedRouteManager class."""
+
+    @unittest.mock.patch('worker.libs.lease.update_leases', return_value={1, 2})
+    def test_workers_updated_when_routes_claimed(self, update_leases, *_):
+        """Test that the workers are updated when the shard claims routes."""
+
+        manager = _get_manager()
+
+        manager.rebalance()
+
+        update_leases.assert_called_once_with(shard_name='a', route_ids=[1, 2], lease_seconds=60)
+        self.assertEquals(manager.leased_route_ids, {1, 2})
+        self.assertEquals(manager.lease_changes, 1)
+        manager.get_next_day.assert_called_once_with(service_class='wkd',
+                                                     load_new_schedules=False,
+                                                     check_schedules=False)
+        manager.update_workers.assert_called_once_with(manager.get_next_day.return_value)
+        self.assertGreater(manager.leases_expire, time.monotonic())
+
+    @unittest.mock.patch('worker.libs.lease.update_leases', return_value={1})
+    def test_workers_unchanged_when_leases_renewed(self, *_):
+        """Test that the workers are left running when the shard holds the same routes."""
+
+        manager = _get_manager()
+
+        manager.rebalance()
+
+        manager.update_workers.assert_not_called()
+        self.assertEquals(manager.lease_changes, 0)
+
+    @unittest.mock.patch('worker.libs.lease.update_leases', side_effect=Exception)
+    def test_workers_kept_until_leases_expire(self, *_):
+        """Test that the workers keep running when the leases cannot be renewed, as long as they
+        have not expired."""
+
+        manager = _get_manager()
+        manager.leases_expire = time.monotonic() + 60
+
+        manager.rebalance()
+
+        manager.stop_workers.assert_not_called()
+        self.assertEquals(manager.leased_route_ids, {1})
+
+    @unittest.mock.patch('worker.libs.lease.update_leases', side_effect=Exception)
+    def test_workers_stopped_when_leases_expire(self, *_):
+        """Test that every worker is stopped when the leases could not be renewed before they may
+        have expired."""
+
+        manager = _get_manager()
+        manager.leases_expire = time.monotonic() + 10
+
+        manager.rebalance()
+
+        manager.stop_workers.assert_called_once_with()
+        self.assertEquals(manager.workers, [])
+        self.assertEquals(manager.leased_route_ids, set())
+
+@unittest.mock.patch('worker.sharded_route_manager.RouteManager.check_for_new_schedules')
+@unittest.mock.patch('worker.libs.lease.get_other_shards_route_tags', return_value={'2'})
+@unittest.mock.patch('worker.libs.lease.get_database_time', return_value=100)
+@unittest.mock.patch('worker.sharded_route_manager.ShardedRouteManager.__init__',
+                     return_value=None)
+class TestCheckForNewSchedules(unittest.TestCase):
+    """Tests for the check_for_new_schedules method in the ShardedRouteManager class."""
+
+    @unittest.mock.patch('worker.libs.lease.get_live_shards', return_value=['a', 'b'])
+    def test_lowest_shard_checks_routes_not_leased_by_others(self, _, __, ___, ____,
+                                                              check_for_new_schedules):
+        """Test that the shard with the lowest name checks every route except the routes leased by
+        the other shards."""
+
+        manager = _get_manager()
+
+        manager.check_for_new_schedules()
+
+        check_for_new_schedules.assert_called_once_with(route_tags=None,
+                                                        excluded_route_tags={'2'})
+
+    @unittest.mock.patch('worker.libs.lease.get_live_shards', return_value=[])
+    def test_first_shard_checks_every_route(self, _, __, ___, get_other_shards_route_tags,
+                                            check_for_new_schedules):
+        """Test that a shard checks every route before its first heartbeat when no other shard is
+        running, so that the schedules of an empty database are loaded."""
+
+        get_other_shards_route_tags.return_value = set()
+        manager = _get_manager()
+        manager.shard_name = 'b'
+
+        manager.check_for_new_schedules()
+
+        check_for_new_schedules.assert_called_once_with(route_tags=None,
+                                                        excluded_route_tags=set())
+
+    @unittest.mock.patch('worker.libs.lease.get_live_shards', return_value=['a', 'b'])
+    @unittest.mock.patch('worker.sharded_route_manager.Route.objects.filter')
+    def test_other_shards_check_leased_routes(self, route_filter, _, __, ___,
+                                              get_other_shards_route_tags,
+                                              check_for_new_schedules):
+        """Test that a shard without the lowest name only checks the routes it holds leases on."""
+
+        route_filter.return_value.values_list.return_value = ['1']
+        manager = _get_manager()
+        manager.shard_name = 'b'
+
+        manager.check_for_new_schedules()
+
+        route_filter.assert_called_once_with(id__in={1})
+        get_other_shards_route_tags.assert_not_called()
+        check_for_new_schedules.assert_called_once_with(route_tags={'1'},
+                                                        excluded_route_tags=None)
@@ -0,0 +1,77 @@
+"""Tests for the VehicleLocationDetector class"""
+
+from django.test import TestCase
+
+from worker.libs import fake_agency, nextbus, schedule
+from worker.libs.fake_agency import AgencyTransport, FakeAgency
+from worker.models import Route
+from worker.vehicle_location_detector import VehicleLocationDetector
+
+class TestVehicleLocationDetector(TestCase):
+    """Tests for the VehicleLocationDetector class."""
+
+    def setUp(self):
+        self.agency = FakeAgency(routes=1, stops_per_direction=4, vehicles_per_route=1,
+                                 seconds_between_stops=60, max_delay_seconds=0)
+        self.now = fake_agency.SERVICE_START_SECONDS
+        self.previous_transport = nextbus.set_transport(
+            AgencyTransport(agency=self.agency, clock=lambda: self.now))
+
+        self.route = Route.objects.create(tag=self.agency.route_tags[0], title='Route')
+        schedule.update_schedule_for_route(self.route)
+
+        self.detector = VehicleLocationDetector(
+            route=self.route,
+            service_class='wkd',
+            nextbus_client=nextbus.NextBusClient(output_format='json', agency='fake'))
+
+    def tearDown(self):
+        nextbus.set_transport(self.previous_transport)
+
+    def test_arrivals_found(self):
+        """Test that the arrivals of a vehicle are found with its block ID, including the stops it
+        passed between requests."""
+
+        first_stop_tag = self.agency.get_stop_tag(0, 0, 0)
+        block_id = self.agency.get_block_id(0, 0)
+
+        first_arrivals = self.detector.get_arrivals()
+
+        self.now += 130
+        second_arrivals = self.detector.get_arrivals()
+
+        self.assertEquals([arrivals for _, arrivals in first_arrivals],
+                          [{first_stop_tag: [block_id]}])
+        self.assertEquals(sorted(stop_tag
+                                 for _, arrivals in second_arrivals
+                                 for stop_tag in arrivals),
+                          [first_stop_tag + 1, first_stop_tag + 2])
+        self.assertGreater(self.detector.last_time, 0)
+
+    def test_vehicles_no_longer_reported_forgotten(self):
+        """Test that the block IDs of vehicles that are no longer reported are forgotten, while the
+        block IDs of vehicles that are still reported are kept."""
+
+        self.detector.get_arrivals()
+        vehicle_blocks = dict(self.detector.vehicle_blocks)
+
+        self.detector.vehicle_blocks['gone'] = 1
+        self.detector.tracker.vehicles['gone'] = (None, None, self.now - 601)
+
+        self.now += 60
+        self.detector.get_arrivals()
+
+        self.assertEquals(self.detector.vehicle_blocks, vehicle_blocks)
+        self.assertNotIn('gone', self.detector.tracker.vehicles)
+
+    def test_untracked_vehicles_forgotten_when_blocks_refreshed(self):
+        """Test that refreshing the block IDs forgets vehicles that have neither predictions nor
+        recent reports."""
+
+        self.detector.vehicle_blocks['gone'] = 1
+
+        self.detector.refresh_blocks(now=self.now)
+
+        self.assertNotIn('gone', self.detector.vehicle_blocks)
+        self.assertEquals(list(self.detector.vehicle_blocks.values()),
+                          [self.agency.get_block_id(0, 0)])
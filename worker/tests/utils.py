@@ -0,0 +1,78 @@
+"""Helpers shared by the worker tests"""
+
+from worker.libs.scheduled_arrival_index import ScheduledArrivalIndex, ScheduledArrivalRecord
+
+def get_stop_predictions(route_tag, stop_tag, block_id=None, seconds=None):
+    """Get a "predictions" object for a stop in the format returned by NextBus.
+
+    Arguments:
+        route_tag: (String) Tag of the route.
+        stop_tag: (Integer) Tag of the stop.
+        block_id: (Integer) Block ID of the single prediction for the stop, or None if the stop has
+            no predictions.
+        seconds: (Integer) Number of seconds until the predicted arrival.
+
+    Returns:
+        Dictionary with the predictions for the stop.
+    """
+
+    stop = {
+        'routeTag': route_tag,
+        'stopTag': str(stop_tag)
+    }
+    if block_id is not None:
+        stop['direction'] = {
+            'prediction': {
+                'block': str(block_id),
+                'tripTag': '5678',
+                'seconds': str(seconds)
+            }
+        }
+
+    return stop
+
+def get_response(route_tag, stop_tag, block_id=None, seconds=None):
+    """Get a response for the "predictionsForMultiStops" command for a single stop.
+
+    Arguments:
+        route_tag: (String) Tag of the route.
+        stop_tag: (Integer) Tag of the stop.
+        block_id: (Integer) Block ID of the single prediction for the stop, or None if the stop has
+            no predictions.
+        seconds: (Integer) Number of seconds until the predicted arrival.
+
+    Returns:
+        Dictionary with the response.
+    """
+
+    return {'predictions': [get_stop_predictions(route_tag, stop_tag, block_id, seconds)]}
+
+def get_route_checkpoint(retrieve_time=12300.5):
+    """Get the state of a route, in the format returned by RouteWorker.get_checkpoint.
+
+    Arguments:
+        retrieve_time: (Float) Unix timestamp of when the predictions were retrieved.
+
+    Returns:
+        Dictionary with the state of the route.
+    """
+
+    scheduled_arrivals = {
+        1234: {
+            5678: [ScheduledArrivalRecord(id=1, stop_id=10, time=3600),
+                   ScheduledArrivalRecord(id=2, stop_id=10, time=600),
+                   ScheduledArrivalRecord(id=3, stop_id=10, time=600)]
+        },
+        2345: {
+            5678: [ScheduledArrivalRecord(id=4, stop_id=11, time=86000)]
+        }
+    }
+
+    return {
+        'service_class': 'wkd',
+        'schedule_key': (1, 'wkd', ('2018T_FALL',)),
+        'retrieve_time': retrieve_time,
+        'predictions': {1234: {5678: {123: 60, 124: 900}}, 2345: {}},
+        'scheduled_arrival_index': ScheduledArrivalIndex(scheduled_arrivals=scheduled_arrivals,
+                                                         single_scheduled_arrival_threshold=1800)
+    }
@@ -0,0 +1,178 @@
+import configparser
+import logging
+import os.path as path
+import time
+
+import how_late_is_muni.settings as settings
+from worker.libs import vehicle_location
+from worker.models import StopScheduleClass
+
+LOG = logging.getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read(path.join(settings.BASE_DIR, 'config.ini'))
+
+class VehicleLocationDetector(object):
+    """Class to find the arrivals of a route from the locations of its vehicles, with a single
+    "vehicleLocations" request each cycle that only returns the vehicles whose location changed
+    since the previous request, instead of requesting the predictions for every stop.
+
+    The locations of vehicles do not include their block IDs, so the block ID of each vehicle is
+    taken from the predictions for the stops of the route, which are only requested when a vehicle
+    whose block ID is not known yet is reported, at most once every block_refresh_seconds. Vehicles
+    that have not been reported for max_gap_seconds are no longer tracked.
+    """
+
+    def __init__(self, route, service_class, nextbus_client):
+        """
+        Arguments:
+            route: (Route) The route to find arrivals for.
+            service_class: (String) The service class of the schedules whose stops are used.
+            nextbus_client: (NextBusClient) Client to make requests to NextBus with.
+        """
+
+        self.route = route
+        self.nextbus_client = nextbus_client
+
+        self.radius_meters = float(config.get('worker', 'vehicle_arrival_radius_meters'))
+        self.max_gap_seconds = float(config.get('worker', 'vehicle_max_gap_seconds'))
+        self.block_refresh_seconds = float(config.get('worker', 'vehicle_block_refresh_seconds'))
+
+        # Time of the latest location of any vehicle returned by NextBus, in milliseconds
+        self.last_time = 0
+
+        self.vehicle_blocks = {}
+        self.blocks_refresh_time = None
+
+        self.stop_tags = []
+        self.tracker = None
+        self.load_stops(service_class=service_class)
+
+    def get_arrivals(self):
+        """Get the locations of the vehicles of the route that changed since the previous request,
+        and find the arrivals in them.
+
+        Returns:
+            List of tuples of an integer Unix timestamp and a dictionary with stop tags as keys and
+            lists of the block IDs of the arrivals at the time as values, sorted by time, in the
+            format returned by worker.libs.vehicle_location.group_arrivals.
+        """
+
+        response = self.nextbus_client.get_vehicle_locations(route_tag=self.route.tag,
+                                                             timestamp=self.last_time)
+        retrieve_time = time.time()
+
+        reports, last_time = vehicle_location.parse_vehicle_locations(response=response,
+                                                                      retrieve_time=retrieve_time)
+        if last_time is not None:
+            self.last_time = last_time
+
+        if any(report.vehicle_id not in self.vehicle_blocks for report in reports):
+            self.refresh_blocks(now=retrieve_time)
+
+        vehicle_arrivals = self.tracker.update(reports)
+        arrivals = vehicle_location.group_arrivals(vehicle_arrivals=vehicle_arrivals,
+                                                   vehicle_blocks=self.vehicle_blocks)
+
+        # Vehicles that are not reported for longer than max_gap_seconds, such as after leaving
+        # service, cannot be considered to have passed any stops, so they are no longer tracked
+        for vehicle_id in self.tracker.remove_vehicles(
+                reported_before=retrieve_time - self.max_gap_seconds):
+            self.vehicle_blocks.pop(vehicle_id, None)
+
+        return arrivals
+
+    def load_stops(self, service_class):
+        """Load the locations and order of the stops of the route in the active schedules for a
+        service class from the database, keeping the last stop that each vehicle arrived at.
+
+        Arguments:
+            service_class: (String) The service class of the schedules.
+        """
+
+        stops, sequences = get_stop_locations(route=self.route, service_class=service_class)
+        self.set_stops(stops=stops, sequences=sequences)
+
+    def refresh_blocks(self, now):
+        """Get the block ID of every vehicle that has predictions for a stop of the route, unless
+        they were retrieved less than block_refresh_seconds ago. Vehicles without predictions, such
+        as at the end of a trip, keep their block IDs while they are still being tracked, and the
+        block IDs of other vehicles are forgotten.
+
+        Arguments:
+            now: (Float) The current Unix timestamp.
+        """
+
+        if not self.stop_tags or (self.blocks_refresh_time is not None and
+                                  now - self.blocks_refresh_time < self.block_refresh_seconds):
+            return
+
+        self.blocks_refresh_time = now
+
+        response = self.nextbus_client.get_predictions_for_multi_stops(
+            [{'route_tag': self.route.tag, 'stop_tag': stop_tag} for stop_tag in self.stop_tags])
+        vehicle_blocks = vehicle_location.get_vehicle_blocks(response['predictions'])
+        for vehicle_id in self.tracker.vehicles:
+            if vehicle_id not in vehicle_blocks and vehicle_id in self.vehicle_blocks:
+                vehicle_blocks[vehicle_id] = self.vehicle_blocks[vehicle_id]
+        self.vehicle_blocks = vehicle_blocks
+
+        LOG.debug('Refreshed block IDs of %d vehicles for route %s', len(self.vehicle_blocks),
+                  self.route.tag)
+
+    def set_stops(self, stops, sequences):
+        """Set the locations and order of the stops of the route, keeping the last stop that each
+        vehicle arrived at.
+
+        Arguments:
+            stops: (Dictionary) Stop tags as keys and tuples of the latitude and longitude of each
+                stop as values, in the format returned by get_stop_locations.
+            sequences: (List of lists) Tags of the stops of each schedule of the route, in stop
+                order, in the format returned by get_stop_locations.
+        """
+
+        self.stop_tags = sorted(set(stop_tag for sequence in sequences for stop_tag in sequence))
+
+        stop_index = vehicle_location.StopIndex(stops=stops,
+                                                sequences=sequences,
+                                                radius_meters=self.radius_meters)
+        if self.tracker is None:
+            self.tracker = vehicle_location.VehicleTracker(stop_index=stop_index,
+                                                           max_gap_seconds=self.max_gap_seconds)
+        else:
+            self.tracker.stop_index = stop_index
+
+        LOG.info('Loaded locations of %d stops in %d schedules for route %s', len(stops),
+                 len(sequences), self.route.tag)
+
+def get_stop_locations(route, service_class):
+    """Get the locations and order of the stops of a route in its active schedules for a service
+    class.
+
+    Arguments:
+        route: (Route) The route to get the stops of.
+        service_class: (String) The service class of the schedules.
+
+    Returns:
+        Tuple of a dictionary with stop tags as keys and tuples of the latitude and longitude of
+        each stop as values, without the stops that do not have a location, and a list of lists of
+        the tags of the stops of each schedule, in stop order.
+    """
+
+    stop_schedule_classes = StopScheduleClass.objects.filter(
+        schedule_class__route=route,
+        schedule_class__service_class=service_class,
+        schedule_class__is_active=True
+    ).order_by('schedule_class_id', 'stop_order').values_list('schedule_class_id',
+                                                              'stop__tag',
+                                                              'stop__latitude',
+                                                              'stop__longitude')
+
+    stops = {}
+    sequences = {}
+    for schedule_class_id, stop_tag, latitude, longitude in stop_schedule_classes:
+        sequences.setdefault(schedule_class_id, []).append(stop_tag)
+        if latitude is not None and longitude is not None:
+            stops[stop_tag] = (float(latitude), float(longitude))
+
+    return stops, list(sequences.values())